@@ -194,6 +194,7 @@ CREATE TABLE IF NOT EXISTS rag_chunks (
 
 CREATE INDEX IF NOT EXISTS rag_chunks_collection_idx ON rag_chunks(collection);
 CREATE INDEX IF NOT EXISTS rag_chunks_document_idx ON rag_chunks(document_id);
+CREATE INDEX IF NOT EXISTS rag_chunks_collection_document_idx ON rag_chunks(collection, document_id);
 
 DO $$ BEGIN
     RAISE NOTICE 'Core tables created successfully';
@@ -2,10 +2,14 @@
 -- Brain Monitoring Tables
 -- ============================================
 
+-- api_metrics y execution_traces se crean particionadas por día (vacías, sin
+-- coste); la API crea las particiones diarias y aplica la retención con DROP
+-- (ver 18-monitoring-partitions.sql y monitoring/partitions.py).
+
 -- Métricas de API (requests, latencia, errores)
 CREATE TABLE IF NOT EXISTS api_metrics (
-    id SERIAL PRIMARY KEY,
-    timestamp TIMESTAMPTZ DEFAULT NOW(),
+    id SERIAL,
+    timestamp TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     endpoint VARCHAR(255),
     method VARCHAR(10),
     status_code INT,
@@ -14,14 +18,17 @@ CREATE TABLE IF NOT EXISTS api_metrics (
     response_size INT,
     user_id VARCHAR(100),
     error_message TEXT,
-    metadata JSONB
-);
+    metadata JSONB,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE IF NOT EXISTS api_metrics_default PARTITION OF api_metrics DEFAULT;
 
 -- Trazas de ejecución (chains, tools, LLM calls)
 CREATE TABLE IF NOT EXISTS execution_traces (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     execution_id VARCHAR(100),
-    timestamp TIMESTAMPTZ DEFAULT NOW(),
+    timestamp TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     chain_id VARCHAR(100),
     event_type VARCHAR(50),  -- 'chain_start', 'tool_call', 'llm_call', 'chain_end'
     node_id VARCHAR(100),
@@ -33,8 +40,11 @@ CREATE TABLE IF NOT EXISTS execution_traces (
     model VARCHAR(100),
     success BOOLEAN,
     error_message TEXT,
-    metadata JSONB
-);
+    metadata JSONB,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE IF NOT EXISTS execution_traces_default PARTITION OF execution_traces DEFAULT;
 
 -- Alertas de monitorización
 CREATE TABLE IF NOT EXISTS monitoring_alerts (
@@ -0,0 +1,16 @@
+-- ===========================================
+-- LLM Response Cache (ChainConfig.response_cache)
+-- ===========================================
+
+CREATE TABLE IF NOT EXISTS llm_response_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    provider VARCHAR(50),
+    model VARCHAR(255),
+    response JSONB NOT NULL,
+    hits INTEGER DEFAULT 0,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS llm_response_cache_expires_idx
+    ON llm_response_cache (expires_at);
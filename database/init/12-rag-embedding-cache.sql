@@ -0,0 +1,12 @@
+-- ===========================================
+-- RAG Embedding Cache (content-addressed)
+-- ===========================================
+-- Clave: (modelo de embedding, sha256 del texto del chunk)
+
+CREATE TABLE IF NOT EXISTS rag_embedding_cache (
+    model VARCHAR(255) NOT NULL,
+    content_hash CHAR(64) NOT NULL,
+    embedding REAL[] NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (model, content_hash)
+);
@@ -0,0 +1,14 @@
+-- ===========================================
+-- RAG ANN index state (rag/index_manager.py)
+-- ===========================================
+-- El índice se construye desde la API (CREATE INDEX CONCURRENTLY) según
+-- RAGConfig; aquí solo se registra la spec y las filas de la última build.
+
+CREATE TABLE IF NOT EXISTS rag_index_state (
+    index_name VARCHAR(255) PRIMARY KEY,
+    spec JSONB NOT NULL,
+    rows_at_build BIGINT DEFAULT 0,
+    lists INTEGER,
+    built_at TIMESTAMPTZ,
+    last_error TEXT
+);
@@ -0,0 +1,17 @@
+-- ===========================================
+-- RAG hybrid search: full-text sobre rag_chunks
+-- ===========================================
+-- Columna tsvector generada con la configuración 'simple' (sin stemming ni
+-- stopwords: identificadores, códigos de error y nombres propios se indexan
+-- tal cual) y su índice GIN. La consulta léxica vive en rag/storage.py.
+--
+-- En una instalación existente el ADD COLUMN reescribe rag_chunks entera con
+-- ACCESS EXCLUSIVE: aplicar en una ventana de mantenimiento. La API no lo hace
+-- en el arranque; mientras falte la columna la búsqueda híbrida usa solo la vía
+-- vectorial. Si falta el índice, la API lo crea con CREATE INDEX CONCURRENTLY.
+
+ALTER TABLE rag_chunks
+    ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED;
+
+CREATE INDEX IF NOT EXISTS rag_chunks_content_tsv_idx ON rag_chunks USING GIN (content_tsv);
@@ -0,0 +1,7 @@
+-- ===========================================
+-- RAG metadata filters (rag/filters.py)
+-- ===========================================
+-- Los filtros de igualdad / IN se compilan a contención (metadata @> ...),
+-- que resuelve este índice GIN dentro de la búsqueda vectorial o léxica.
+
+CREATE INDEX IF NOT EXISTS rag_chunks_metadata_idx ON rag_chunks USING GIN (metadata jsonb_path_ops);
@@ -0,0 +1,8 @@
+-- ===========================================
+-- RAG versioned re-ingestion (rag/storage.py)
+-- ===========================================
+-- sha256 del contenido de cada chunk: al re-ingestar un documento solo se
+-- embeben los chunks nuevos y se borran los que ya no están. Las filas
+-- anteriores (NULL) se comparan calculando el hash al vuelo.
+
+ALTER TABLE rag_chunks ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
@@ -0,0 +1,7 @@
+-- ===========================================
+-- API metrics: time to first byte (middleware/monitoring.py)
+-- ===========================================
+-- latency_ms mide hasta el último byte; en respuestas en streaming (SSE)
+-- ttfb_ms es el tiempo hasta el primer evento.
+
+ALTER TABLE api_metrics ADD COLUMN IF NOT EXISTS ttfb_ms FLOAT;
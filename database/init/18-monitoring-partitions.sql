@@ -0,0 +1,80 @@
+-- ===========================================
+-- Monitoring: daily partitions, rollups and retention
+-- ===========================================
+-- En una instalación nueva api_metrics y execution_traces ya se crean
+-- particionadas por día (02-monitoring.sql). Una BD anterior con datos se
+-- convierte una sola vez, a petición de un administrador (POST /api/v1/
+-- monitoring/partitions/convert, ver monitoring/partitions.py), porque el
+-- cambio de tabla necesita un ACCESS EXCLUSIVE; si la tabla está vacía la API
+-- la convierte sola. El mantenimiento periódico de la API crea las
+-- particiones futuras y elimina con DROP las más antiguas que
+-- MONITORING_RETENTION_DAYS; hasta la conversión, borra con DELETE por lotes.
+-- Los rollups (monitoring/rollups.py) los mantiene MonitoringWriter en cada
+-- lote; aquí solo se crean las tablas.
+
+CREATE TABLE IF NOT EXISTS api_metrics_minute (
+    bucket TIMESTAMPTZ NOT NULL,
+    endpoint VARCHAR(255) NOT NULL,
+    request_count BIGINT NOT NULL DEFAULT 0,
+    error_count BIGINT NOT NULL DEFAULT 0,
+    success_count BIGINT NOT NULL DEFAULT 0,
+    latency_sum_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    ttfb_sum_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    ttfb_count BIGINT NOT NULL DEFAULT 0,
+    latency_max_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, endpoint)
+);
+
+CREATE TABLE IF NOT EXISTS api_metrics_hour (
+    bucket TIMESTAMPTZ NOT NULL,
+    endpoint VARCHAR(255) NOT NULL,
+    request_count BIGINT NOT NULL DEFAULT 0,
+    error_count BIGINT NOT NULL DEFAULT 0,
+    success_count BIGINT NOT NULL DEFAULT 0,
+    latency_sum_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    ttfb_sum_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    ttfb_count BIGINT NOT NULL DEFAULT 0,
+    latency_max_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, endpoint)
+);
+
+CREATE TABLE IF NOT EXISTS api_user_activity_hour (
+    bucket TIMESTAMPTZ NOT NULL,
+    user_id VARCHAR(100) NOT NULL,
+    request_count BIGINT NOT NULL DEFAULT 0,
+    last_active TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (bucket, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_api_user_activity_hour_user ON api_user_activity_hour (user_id, bucket DESC);
+
+CREATE TABLE IF NOT EXISTS execution_traces_hour (
+    bucket TIMESTAMPTZ NOT NULL,
+    chain_id VARCHAR(100) NOT NULL,
+    executions BIGINT NOT NULL DEFAULT 0,
+    completed BIGINT NOT NULL DEFAULT 0,
+    errors BIGINT NOT NULL DEFAULT 0,
+    duration_sum_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    tokens_input BIGINT NOT NULL DEFAULT 0,
+    tokens_output BIGINT NOT NULL DEFAULT 0,
+    cost_usd DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, chain_id)
+);
+
+-- Rollups pendientes de rellenar desde los datos crudos (backfill_rollups)
+CREATE TABLE IF NOT EXISTS monitoring_rollup_backfill (
+    rollup VARCHAR(100) PRIMARY KEY,
+    since TIMESTAMPTZ NOT NULL,
+    until_id BIGINT NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Con las tablas particionadas la API borra por particiones (DROP) y estos
+-- DELETE no encuentran filas; sin convertir, siguen siendo la retención
+CREATE OR REPLACE FUNCTION cleanup_old_metrics() RETURNS void AS $$
+BEGIN
+    DELETE FROM api_metrics WHERE timestamp < NOW() - INTERVAL '30 days';
+    DELETE FROM execution_traces WHERE timestamp < NOW() - INTERVAL '30 days';
+    DELETE FROM monitoring_alerts WHERE timestamp < NOW() - INTERVAL '90 days' AND acknowledged = true;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,12 @@
+-- ===========================================
+-- RAG collection versions (rag/search_cache.py)
+-- ===========================================
+-- Cada escritura en una colección incrementa su versión en la misma
+-- transacción; la caché de resultados de búsqueda de cada réplica la usa
+-- en la clave, así que una escritura en cualquier réplica la invalida.
+
+CREATE TABLE IF NOT EXISTS rag_collection_versions (
+    collection VARCHAR(255) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
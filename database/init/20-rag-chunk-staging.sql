@@ -0,0 +1,20 @@
+-- ===========================================
+-- RAG chunk staging (rag/storage.py)
+-- ===========================================
+-- Cada ingesta carga sus lotes aquí según los embebe, marcados con su
+-- ingest_id, y los publica en rag_chunks al final en una transacción
+-- corta: la memoria de la API no crece con el tamaño del documento y las
+-- búsquedas no ven versiones a medias. UNLOGGED: los datos son transitorios.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS rag_chunk_staging (
+    ingest_id UUID NOT NULL,
+    id INTEGER NOT NULL,
+    reused BOOLEAN NOT NULL DEFAULT FALSE,
+    content TEXT,
+    metadata JSONB,
+    embedding vector(4096),
+    content_hash CHAR(64) NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS rag_chunk_staging_ingest_idx ON rag_chunk_staging (ingest_id);
@@ -3,6 +3,7 @@ Configuración de la aplicación Brain API
 """
 
 from functools import lru_cache
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 
@@ -40,7 +41,67 @@ class Settings(BaseSettings):
     # comprometer el presupuesto total de contexto en conversaciones multi-turno.
     # Ajusta a la baja (ej: 16000) si usas modelos Ollama pequeños con contexto limitado.
     tool_result_max_chars: int = 100_000
-    
+
+    # Presupuesto de tokens del prompt en el bucle del agente. Al superarlo se
+    # compactan los resultados de tools antiguos (ver adaptive/context.py).
+    # None = 75% de la ventana de contexto conocida del modelo (sin compactar
+    # si no se conoce); un valor explícito también se limita a ese 75%.
+    # 0 = sin compactación. También configurable por chain.
+    context_token_budget: Optional[int] = None
+
+    # Transporte HTTP hacia proveedores LLM (clientes persistentes por proveedor).
+    # Timeouts en segundos por fase; el read de streaming es mayor porque el
+    # primer token puede tardar con prompts largos.
+    llm_http2_enabled: bool = True
+    llm_http_max_connections: int = 100
+    llm_http_max_keepalive_connections: int = 20
+    llm_http_keepalive_expiry: float = 60.0
+    llm_http_connect_timeout: float = 10.0
+    llm_http_read_timeout: float = 120.0
+    llm_http_stream_read_timeout: float = 300.0
+    llm_http_write_timeout: float = 30.0
+    llm_http_pool_timeout: float = 30.0
+
+    # Control de admisión por endpoint LLM (ver engine/chains/llm_admission.py).
+    # Ollama en una sola GPU se degrada por encima de ~4 generaciones a la vez.
+    # rpm/tpm y max_concurrency por proveedor se configuran en llm_providers.config.
+    llm_admission_enabled: bool = True
+    llm_admission_max_concurrency: int = 16
+    llm_admission_ollama_max_concurrency: int = 4
+    llm_admission_queue_timeout: float = 300.0
+
+    # Coalescing de chat completions idénticas (ver openai_compat/coalescing.py).
+    # completed_ttl: segundos que un resultado terminado sirve a reintentos
+    # (también a un "regenerar" idéntico; 0 = solo peticiones en vuelo).
+    # orphan_grace: segundos sin clientes antes de cancelar un stream.
+    chat_coalescing_enabled: bool = True
+    chat_coalescing_completed_ttl: float = 15.0
+    chat_coalescing_orphan_grace: float = 10.0
+
+    # Escritura en lote de api_metrics / execution_traces (ver monitoring/writer.py).
+    # Se vuelca con COPY cada flush_interval_ms o al acumular flush_rows filas;
+    # buffer_capacity acota la memoria por tabla (al llenarse se descartan las
+    # filas más antiguas). trace_put_timeout: segundos que una traza espera
+    # hueco en el buffer antes de descartar.
+    monitoring_buffer_capacity: int = 20_000
+    monitoring_flush_interval_ms: int = 1_000
+    monitoring_flush_rows: int = 500
+    monitoring_trace_put_timeout: float = 0.5
+
+    # Particionado diario y retención (ver monitoring/partitions.py). Las
+    # particiones crudas más antiguas que retention_days se eliminan con DROP;
+    # los rollups por minuto y por hora tienen su propia retención.
+    monitoring_retention_days: int = 30
+    monitoring_partition_days_ahead: int = 3
+    monitoring_minute_rollup_retention_hours: int = 48
+    monitoring_hour_rollup_retention_days: int = 90
+
+    # Snapshot del dashboard de monitorización (ver monitoring/dashboard.py):
+    # fresco durante dashboard_ttl segundos; hasta dashboard_stale_ttl se sirve
+    # el anterior mientras se recalcula en background.
+    monitoring_dashboard_ttl: float = 5.0
+    monitoring_dashboard_stale_ttl: float = 60.0
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -5,7 +5,7 @@
 import os
 import asyncpg
 import logging
-from typing import Optional
+from typing import Awaitable, Callable, List, Optional
 from contextlib import asynccontextmanager
 
 logger = logging.getLogger(__name__)
@@ -16,6 +16,7 @@ class Database:
     
     _instance: Optional["Database"] = None
     _pool: Optional[asyncpg.Pool] = None
+    _initializers: List[Callable[[asyncpg.Connection], Awaitable[None]]] = []
     
     def __new__(cls):
         if cls._instance is None:
@@ -28,6 +29,22 @@ class Database:
             raise RuntimeError("Database not initialized. Call await db.connect() first.")
         return self._pool
     
+    def add_connection_initializer(self, initializer: Callable[[asyncpg.Connection], Awaitable[None]]):
+        """
+        Register a coroutine run on every new pool connection (type codecs...).
+        Connections opened before registration keep their state until
+        `await db.pool.expire_connections()`.
+        """
+        if initializer not in self._initializers:
+            self._initializers.append(initializer)
+    
+    async def _init_connection(self, conn: asyncpg.Connection):
+        for initializer in self._initializers:
+            try:
+                await initializer(conn)
+            except Exception as e:
+                logger.warning(f"Connection initializer {getattr(initializer, '__name__', initializer)} failed: {e}")
+    
     async def connect(self):
         """Initialize the connection pool."""
         if self._pool is not None:
@@ -51,6 +68,7 @@ class Database:
             min_size=2,
             max_size=10,
             command_timeout=60,
+            init=self._init_connection,
         )
         
         logger.info("Database connection pool established")
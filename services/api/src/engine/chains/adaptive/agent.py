@@ -138,7 +138,6 @@ async def build_adaptive_agent(
         logger.warning("⚠️ No system prompt in config, using empty")
 
     from .prompts import _date_context
-    system_prompt += _date_context()
 
     from .prompts.base import get_subagents_section
     dynamic_subagents = get_subagents_section()
@@ -153,10 +152,20 @@ async def build_adaptive_agent(
     
     # Inyectar contexto del usuario (briefing + personal_prompt)
     briefing_messages: list[dict] = []
-    system_prompt = await apply_user_context(user_id, briefing_messages, system_prompt)
-
-    # Construir mensajes
-    messages = [{"role": "system", "content": system_prompt}]
+    if config.prompt_caching:
+        # Prefijo estable: system prompt de la cadena (+ subagentes) idéntico
+        # entre usuarios y días, para que el proveedor lo sirva desde caché.
+        # Fecha e instrucciones personales van en un segundo mensaje system.
+        user_context = await apply_user_context(user_id, briefing_messages, _date_context())
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": user_context.strip()},
+        ]
+    else:
+        system_prompt = await apply_user_context(
+            user_id, briefing_messages, system_prompt + _date_context()
+        )
+        messages = [{"role": "system", "content": system_prompt}]
     messages.extend(briefing_messages)
 
     if memory and config.use_memory:
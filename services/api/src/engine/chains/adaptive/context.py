@@ -0,0 +1,192 @@
+"""
+ContextManager - Presupuesto de tokens para la lista de mensajes del agente.
+
+`messages` crece en cada iteración (cada resultado de tool se reenvía en
+todas las llamadas siguientes). Antes de cada llamada al LLM el executor
+pasa la lista por el ContextManager, que:
+
+1. Cuenta los tokens del prompt con el tokenizer del modelo (token_counter).
+2. Si se supera el presupuesto del modelo, compacta los resultados de tools
+   más antiguos a un resumen/referencia (cabecera + cola del contenido).
+3. Nunca toca el system prompt, el primer mensaje del usuario ni los
+   últimos turnos (pinned).
+
+Las decisiones de compactación se devuelven para emitirlas como eventos.
+Sin presupuesto explícito (ChainConfig.context_token_budget o
+settings.context_token_budget) el presupuesto es el 75% de la ventana de
+contexto del modelo; con ventana desconocida, o con presupuesto 0, no se
+compacta nada.
+"""
+
+import json
+from typing import Any, Optional
+
+import structlog
+
+from src.config import get_settings
+from src.engine.chains.token_counter import token_counter
+
+
+logger = structlog.get_logger()
+
+# Marcador de mensajes ya compactados (no se vuelven a compactar)
+COMPACTED_MARKER = "[compacted tool result"
+
+# Ventana de contexto aproximada por familia de modelo (prefijo -> tokens).
+# El presupuesto efectivo nunca supera CONTEXT_WINDOW_FRACTION de la ventana.
+MODEL_CONTEXT_WINDOWS: dict[str, int] = {
+    "gpt-4o": 128_000,
+    "gpt-4.1": 1_000_000,
+    "gpt-5": 400_000,
+    "o3": 200_000,
+    "o4": 200_000,
+    "claude": 200_000,
+    "gemini": 1_000_000,
+    "llama3": 128_000,
+    "qwen": 32_768,
+    "mistral": 32_768,
+}
+
+# Fracción de la ventana usable por el prompt (el resto queda para la respuesta)
+CONTEXT_WINDOW_FRACTION = 0.75
+
+
+def get_model_context_window(model: Optional[str]) -> Optional[int]:
+    """Ventana de contexto conocida para el modelo (match por prefijo más largo)."""
+    if not model:
+        return None
+    name = model.lower().split("/")[-1]
+    best = None
+    for prefix, window in MODEL_CONTEXT_WINDOWS.items():
+        if name.startswith(prefix) and (best is None or len(prefix) > len(best[0])):
+            best = (prefix, window)
+    return best[1] if best else None
+
+
+class ContextManager:
+    """
+    Mantiene la lista de mensajes dentro de un presupuesto de tokens.
+
+    Compacta in-place los mensajes `tool` antiguos; el resultado completo
+    sigue disponible en AdaptiveExecutor.tool_results.
+    """
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        budget: Optional[int] = None,
+        keep_recent: int = 6,
+        summary_chars: int = 800,
+    ):
+        """
+        Args:
+            model: Nombre del modelo (para limitar por su ventana de contexto)
+            budget: Presupuesto en tokens (None = settings.context_token_budget;
+                si ambos son None, CONTEXT_WINDOW_FRACTION de la ventana del
+                modelo; 0 desactiva la compactación)
+            keep_recent: Nº de mensajes finales que nunca se compactan
+            summary_chars: Caracteres del contenido original que se conservan
+        """
+        configured = budget if budget is not None else get_settings().context_token_budget
+        window = get_model_context_window(model)
+        limit = int(window * CONTEXT_WINDOW_FRACTION) if window else None
+        if configured is None:
+            configured = limit
+        elif configured and limit:
+            configured = min(configured, limit)
+        self.budget: Optional[int] = configured or None
+        self.model = model
+        self.keep_recent = keep_recent
+        self.summary_chars = summary_chars
+
+    def count(self, messages: list[dict]) -> int:
+        """Tokens de la lista completa (contenido + tool_calls + overhead)."""
+        return token_counter.count_messages(messages, self.model)
+
+    def _tokens(self, content: Any) -> int:
+        return token_counter.count_text(content, self.model)
+
+    def _pinned_indexes(self, messages: list[dict]) -> set[int]:
+        pinned = {i for i, m in enumerate(messages) if m.get("role") == "system"}
+        first_user = next((i for i, m in enumerate(messages) if m.get("role") == "user"), None)
+        if first_user is not None:
+            pinned.add(first_user)
+        pinned.update(range(max(0, len(messages) - self.keep_recent), len(messages)))
+        return pinned
+
+    def _summarize(self, msg: dict) -> str:
+        content = msg.get("content") or ""
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False, default=str)
+        head = content[: self.summary_chars]
+        tail = content[-200:] if len(content) > self.summary_chars + 200 else ""
+        name = msg.get("name") or "tool"
+        summary = (
+            f"{COMPACTED_MARKER}: {name}, {len(content)} chars (~{self._tokens(content)} tokens) "
+            f"omitted to save context; ask again with the tool if you need the full data]\n{head}"
+        )
+        if tail:
+            summary += f"\n...\n{tail}"
+        return summary
+
+    def fit(self, messages: list[dict]) -> Optional[dict]:
+        """
+        Compacta mensajes hasta quedar dentro del presupuesto.
+
+        Returns:
+            Dict con las decisiones de compactación, o None si no hizo falta.
+        """
+        if self.budget is None:
+            return None
+        tokens_before = self.count(messages)
+        if tokens_before <= self.budget:
+            return None
+
+        pinned = self._pinned_indexes(messages)
+        tokens = tokens_before
+        compacted = []
+
+        # Del más antiguo al más reciente
+        for i, msg in enumerate(messages):
+            if tokens <= self.budget:
+                break
+            if i in pinned or msg.get("role") != "tool":
+                continue
+            content = msg.get("content")
+            if not isinstance(content, str) or content.startswith(COMPACTED_MARKER):
+                continue
+            if len(content) <= self.summary_chars + 400:
+                continue
+
+            summary = self._summarize(msg)
+            content_tokens, summary_tokens = self._tokens(content), self._tokens(summary)
+            msg["content"] = summary
+            tokens -= content_tokens - summary_tokens
+            compacted.append({
+                "index": i,
+                "tool": msg.get("name"),
+                "tokens_before": content_tokens,
+                "tokens_after": summary_tokens,
+            })
+
+        if not compacted:
+            logger.warning(
+                "Context over budget but nothing left to compact",
+                tokens=tokens_before,
+                budget=self.budget,
+            )
+            return None
+
+        logger.info(
+            "🗜️ Context compacted",
+            tokens_before=tokens_before,
+            tokens_after=tokens,
+            budget=self.budget,
+            compacted=len(compacted),
+        )
+        return {
+            "tokens_before": tokens_before,
+            "tokens_after": tokens,
+            "budget": self.budget,
+            "compacted": compacted,
+        }
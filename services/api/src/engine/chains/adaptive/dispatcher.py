@@ -0,0 +1,125 @@
+"""
+Dispatcher concurrente de tool calls.
+
+Cuando el LLM devuelve varios tool_calls en una misma respuesta, las tools
+de solo lectura / independientes (web_fetch, web_search, read_file,
+rag_search, bi_*...) se ejecutan en paralelo con un límite de concurrencia,
+mientras que las que tienen efectos (write_file, edit_file, shell, finish...)
+se ejecutan en orden, de una en una.
+
+Los eventos de cada tool se emiten según llegan (intercalados); los mensajes
+para el LLM se devuelven por separado para que el executor los añada en el
+orden original de tool_call_id.
+"""
+
+import asyncio
+from typing import Any, AsyncGenerator, Awaitable, Callable, List, Set, Tuple
+
+import structlog
+
+
+logger = structlog.get_logger()
+
+
+# Tools sin efectos secundarios que pueden ejecutarse a la vez
+CONCURRENT_SAFE_TOOLS: Set[str] = {
+    # Filesystem (lectura)
+    "read_file", "list_directory", "search_files",
+    # Web
+    "web_search", "web_fetch",
+    # RAG
+    "rag_search", "rag_get_collection_stats",
+    # Utils
+    "calculate", "get_agent_info",
+    # User tasks (lectura)
+    "user_tasks_list", "user_tasks_results",
+}
+
+# Prefijos de tools de consulta (SAP BI)
+CONCURRENT_SAFE_PREFIXES = ("bi_",)
+
+
+def is_concurrent_safe(tool_name: str) -> bool:
+    """True si la tool puede ejecutarse en paralelo con otras del mismo turno."""
+    if not tool_name:
+        return False
+    name = tool_name.lower()
+    return name in CONCURRENT_SAFE_TOOLS or name.startswith(CONCURRENT_SAFE_PREFIXES)
+
+
+def add_concurrent_safe_tool(name: str) -> None:
+    """Marca una tool como segura para ejecución concurrente."""
+    CONCURRENT_SAFE_TOOLS.add(name.lower())
+
+
+def plan_tool_batches(tool_calls: List[Any]) -> List[List[Tuple[int, Any]]]:
+    """
+    Agrupa los tool_calls en lotes respetando el orden original.
+
+    Las tools seguras consecutivas forman un lote concurrente; cada tool con
+    efectos va en su propio lote, así nunca se reordena respecto a las demás.
+    Cada elemento es (posición en tool_calls, tool_call): la posición
+    identifica la llamada en todo el turno (node_id de sus eventos), aunque
+    la misma tool aparezca en varios lotes.
+    """
+    batches: List[List[Tuple[int, Any]]] = []
+    current: List[Tuple[int, Any]] = []
+    for index, tc in enumerate(tool_calls):
+        if is_concurrent_safe(tc.function.get("name", "")):
+            current.append((index, tc))
+            continue
+        if current:
+            batches.append(current)
+            current = []
+        batches.append([(index, tc)])
+    if current:
+        batches.append(current)
+    return batches
+
+
+_DONE = object()
+
+
+async def run_concurrently(
+    runners: List[Callable[[], AsyncGenerator[Any, None]]],
+    max_concurrency: int,
+    on_error: Callable[[int, Exception], Awaitable[None]],
+) -> AsyncGenerator[Any, None]:
+    """
+    Ejecuta varios generadores de eventos en paralelo (máx. max_concurrency
+    a la vez) y emite sus eventos según se producen.
+
+    Args:
+        runners: Factorías de async generators (una por tool call)
+        max_concurrency: Límite de generadores activos simultáneamente
+        on_error: Callback (índice, excepción) si un runner falla
+
+    Yields:
+        Eventos de todos los runners, intercalados
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _drive(index: int, runner: Callable[[], AsyncGenerator[Any, None]]):
+        try:
+            async with semaphore:
+                async for event in runner():
+                    await queue.put(event)
+        except Exception as e:
+            await on_error(index, e)
+        finally:
+            await queue.put(_DONE)
+
+    tasks = [asyncio.create_task(_drive(i, r)) for i, r in enumerate(runners)]
+    pending = len(tasks)
+    try:
+        while pending:
+            event = await queue.get()
+            if event is _DONE:
+                pending -= 1
+                continue
+            yield event
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -127,18 +127,28 @@ class StreamEmitter:
     
     # ========== Eventos de Tools ==========
     
+    @staticmethod
+    def tool_node_id(tool_name: str, iteration: int, call_index: Optional[int] = None) -> str:
+        """
+        ID de nodo de una tool. Con call_index (tools ejecutadas en paralelo
+        en la misma iteración) cada llamada tiene su propio nodo.
+        """
+        node_id = f"tool_{tool_name}_{iteration}"
+        return f"{node_id}_{call_index}" if call_index is not None else node_id
+    
     def tool_start(
         self,
         tool_name: str,
         display_name: str,
         iteration: int,
-        args: dict
+        args: dict,
+        call_index: Optional[int] = None
     ) -> StreamEvent:
         """Evento de inicio de tool."""
         return StreamEvent(
             event_type="node_start",
             execution_id=self.execution_id,
-            node_id=f"tool_{tool_name}_{iteration}",
+            node_id=self.tool_node_id(tool_name, iteration, call_index),
             node_name=display_name,
             data=self._enrich_data({"tool": tool_name, "arguments": args})
         )
@@ -152,7 +162,8 @@ class StreamEmitter:
         thinking: Optional[str] = None,
         done: bool = False,
         html: Optional[str] = None,
-        conversation: Optional[str] = None
+        conversation: Optional[str] = None,
+        call_index: Optional[int] = None
     ) -> StreamEvent:
         """Evento de fin de tool."""
         data: Dict[str, Any] = {
@@ -170,7 +181,7 @@ class StreamEmitter:
         return StreamEvent(
             event_type="node_end",
             execution_id=self.execution_id,
-            node_id=f"tool_{tool_name}_{iteration}",
+            node_id=self.tool_node_id(tool_name, iteration, call_index),
             data=self._enrich_data(data)
         )
     
@@ -253,6 +264,18 @@ class StreamEmitter:
             data=self._enrich_data(data)
         )
     
+    # ========== Eventos de Contexto ==========
+    
+    def context_compacted(self, iteration: int, decision: dict) -> StreamEvent:
+        """Evento de compactación de contexto (presupuesto de tokens superado)."""
+        return StreamEvent(
+            event_type="context_compaction",
+            execution_id=self.execution_id,
+            node_id=f"context_{iteration}",
+            node_name="Compactando contexto",
+            data=self._enrich_data(decision)
+        )
+    
     # ========== Eventos de Error ==========
     
     def error(self, error_message: str, node_id: str = "") -> StreamEvent:
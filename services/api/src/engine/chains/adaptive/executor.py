@@ -26,9 +26,16 @@ from ...reasoning import ComplexityAnalysis
 from ...reasoning.complexity import ComplexityLevel
 from ...reasoning.modes import ReasoningConfig, ReasoningMode, REASONING_CONFIGS
 from ....tools import tool_registry
-from ..llm_utils import call_llm_with_tools, LLMToolResponse
+from ..llm_utils import (
+    call_llm_with_tools,
+    build_prompt_cache_key,
+    LLMToolResponse,
+)
+from ..llm_router import LLMEndpoint, llm_router, resolve_chain_endpoints
 
 from .validators import is_valid_tool_name, LoopDetector, validate_json_args
+from .dispatcher import plan_tool_batches, run_concurrently
+from .context import ContextManager
 from .handlers import get_handler, HANDLER_REGISTRY
 from .handlers.base import DefaultHandler, ToolResult
 from .events import StreamEmitter, BrainEmitter
@@ -129,6 +136,7 @@ class AdaptiveExecutor:
         is_continue_request: bool = False,
         agent_context: Optional[AgentContext] = None,
         user_id: Optional[str] = None,
+        stream_tokens: Optional[bool] = None,
     ):
         self.execution_id = execution_id
         self.llm_url = llm_url
@@ -142,6 +150,11 @@ class AdaptiveExecutor:
         self.is_continue_request = is_continue_request
         self.agent_context = agent_context
         self.user_id = user_id
+        # Emitir deltas de texto del LLM en cuanto llegan (None = según chain_config)
+        self.stream_tokens = (
+            stream_tokens if stream_tokens is not None
+            else getattr(chain_config, "stream_llm_tokens", True)
+        )
         
         # Configurar límite de iteraciones (agent_context puede sobreescribir para child runs)
         base_max = (
@@ -153,6 +166,8 @@ class AdaptiveExecutor:
             base_max = agent_context.max_iterations
         self.max_iterations = base_max * 2 if is_continue_request else base_max
         self.ask_before_continue = getattr(chain_config, 'ask_before_continue', True)
+        # Máximo de tools independientes ejecutadas a la vez en un mismo turno (1 = secuencial)
+        self.max_parallel_tools = max(1, getattr(chain_config, 'max_parallel_tools', 4) or 1)
         
         # Estado de ejecución
         self.iteration = 0
@@ -161,6 +176,7 @@ class AdaptiveExecutor:
         self.execution_complete = False
         self.images: list[dict] = []  # Imágenes generadas durante ejecución
         self.videos: list[dict] = []  # Vídeos generados durante ejecución
+        self._turn_streamed = False  # True si el texto del turno actual ya se emitió como tokens
         
         # Detectores y emitters (runs hijos: session_id/parent_id/agent_type en eventos)
         self.loop_detector = LoopDetector(max_consecutive=3)
@@ -171,6 +187,15 @@ class AdaptiveExecutor:
             agent_type=agent_context.agent_type if agent_context else None,
         )
         self.brain_emitter = BrainEmitter(execution_id, enabled=emit_brain_events)
+        self.context_manager = ContextManager(
+            model=model,
+            budget=getattr(chain_config, "context_token_budget", None),
+        )
+        self.prompt_caching = getattr(chain_config, "prompt_caching", True)
+        self.prompt_cache_key: Optional[str] = None
+        # Endpoints LLM en orden de preferencia (principal + llm_fallbacks)
+        self.endpoints: Optional[list[LLMEndpoint]] = None
+        self.hedge_percentile = getattr(chain_config, "hedge_percentile", None)
         
         # Config LLM para handlers
         self.llm_config = {
@@ -223,6 +248,15 @@ class AdaptiveExecutor:
         Yields:
             StreamEvents durante la ejecución
         """
+        # El prefijo (system + tools) no cambia entre iteraciones
+        if self.prompt_caching and self.prompt_cache_key is None:
+            self.prompt_cache_key = build_prompt_cache_key(messages, tools)
+        if self.endpoints is None:
+            self.endpoints = await resolve_chain_endpoints(
+                LLMEndpoint(self.provider_type, self.llm_url, self.model, self.api_key),
+                getattr(self.chain_config, "llm_fallbacks", None),
+            )
+        
         while self.iteration < self.max_iterations and not self.execution_complete:
             self.iteration += 1
             
@@ -245,16 +279,29 @@ class AdaptiveExecutor:
                     num_messages=len(messages),
                     agent_type=getattr(self.agent_context, "agent_type", None) if self.agent_context else None,
                 )
+                # Mantener el prompt dentro del presupuesto de tokens
+                compaction = self.context_manager.fit(messages)
+                if compaction:
+                    yield self.stream_emitter.context_compacted(self.iteration, compaction)
+                
                 # Llamar al LLM
-                response = await call_llm_with_tools(
-                    llm_url=self.llm_url,
-                    model=self.model,
-                    messages=messages,
-                    tools=tools,
-                    temperature=self.reasoning_config.temperature,
-                    provider_type=self.provider_type,
-                    api_key=self.api_key
-                )
+                self._turn_streamed = False
+                if self.stream_tokens:
+                    response = None
+                    async for item in self._stream_llm_turn(messages, tools):
+                        if isinstance(item, LLMToolResponse):
+                            response = item
+                        else:
+                            yield item
+                else:
+                    response = await llm_router.call_with_tools(
+                        self.endpoints,
+                        messages=messages,
+                        tools=tools,
+                        temperature=self.reasoning_config.temperature,
+                        hedge_percentile=self.hedge_percentile,
+                        prompt_cache_key=self.prompt_cache_key
+                    )
                 
                 # Procesar respuesta
                 async for event in self._process_response(response, messages, tools):
@@ -293,8 +340,51 @@ class AdaptiveExecutor:
                     exc_info=True,
                 )
                 yield self.stream_emitter.error(str(e) or repr(e), f"iteration_{self.iteration}")
+                if self._turn_streamed:
+                    # El cliente ya recibió parte del turno: reintentar duplicaría el texto
+                    break
                 continue
     
+    async def _stream_llm_turn(
+        self,
+        messages: list[dict],
+        tools: list[dict]
+    ) -> AsyncGenerator[Any, None]:
+        """
+        Llama al LLM en streaming y emite los deltas de texto como tokens.
+        
+        Si el texto empieza por "{" se retiene (puede ser un JSON con
+        {"answer": ...} que _process_response debe extraer). El último
+        elemento emitido es el LLMToolResponse ensamblado.
+        
+        Si el turno acaba en tool calls, el texto ya emitido (preámbulo) se
+        guarda en el mensaje assistant para que el modelo vea lo mismo que
+        el usuario (ver _process_response).
+        """
+        pending = ""
+        release: Optional[bool] = None
+        async for item in llm_router.stream_with_tools(
+            self.endpoints,
+            messages=messages,
+            tools=tools,
+            temperature=self.reasoning_config.temperature,
+            hedge_percentile=self.hedge_percentile,
+            prompt_cache_key=self.prompt_cache_key
+        ):
+            if isinstance(item, LLMToolResponse):
+                yield item
+                continue
+            if release is None:
+                pending += item
+                if not pending.strip():
+                    continue
+                release = not pending.lstrip().startswith("{")
+                if release:
+                    self._turn_streamed = True
+                    yield self.stream_emitter.token(pending)
+            elif release:
+                yield self.stream_emitter.token(item)
+    
     def _extract_answer(self, content: str) -> str:
         """
         Extrae el campo 'answer' de un JSON si es posible.
@@ -343,7 +433,8 @@ class AdaptiveExecutor:
             # Extraer answer si es JSON
             answer = self._extract_answer(response.content)
             self.final_answer = answer
-            yield self.stream_emitter.token(answer)
+            if not self._turn_streamed:
+                yield self.stream_emitter.token(answer)
             yield self.stream_emitter.node_end(
                 f"iteration_{self.iteration}",
                 {"direct_response": True}
@@ -352,11 +443,20 @@ class AdaptiveExecutor:
         
         # Caso 2: Tool calls
         if response.tool_calls:
+            # Texto del turno que ya se emitió al usuario (preámbulo de las tools)
+            streamed_text = response.content if self._turn_streamed and response.content else None
+            if streamed_text:
+                # Separar el preámbulo del texto de los turnos siguientes
+                yield self.stream_emitter.token("\n\n")
+            
             # Agregar mensaje del assistant
-            if self.provider_type != "ollama":
+            if self.provider_type == "ollama":
+                if streamed_text:
+                    messages.append({"role": "assistant", "content": streamed_text})
+            else:
                 messages.append({
                     "role": "assistant",
-                    "content": None,
+                    "content": streamed_text,
                     "tool_calls": [{
                         "id": tc.id,
                         "type": "function",
@@ -373,39 +473,100 @@ class AdaptiveExecutor:
                 for t in tools
                 if isinstance(t, dict) and t.get("type") == "function"
             }
-            # Ejecutar cada tool (si falla, añadir tool response de error para no romper la secuencia)
-            for tool_call in response.tool_calls:
-                try:
-                    async for event in self._execute_tool(tool_call, messages, available_tool_names):
+            # Tools independientes consecutivas se agrupan para ejecutarse en paralelo;
+            # las que tienen efectos van solas y en orden.
+            if self.max_parallel_tools > 1:
+                batches = plan_tool_batches(response.tool_calls)
+            else:
+                batches = [[(i, tc)] for i, tc in enumerate(response.tool_calls)]
+            
+            # Ejecutar cada lote (si una tool falla, añadir tool response de error para no romper la secuencia)
+            for batch in batches:
+                if len(batch) > 1:
+                    async for event in self._execute_tool_batch(batch, messages, available_tool_names):
                         yield event
-                except Exception as tool_err:
-                    tc_name = tool_call.function.get("name", "unknown")
-                    logger.error(f"Tool execution error for {tc_name}: {tool_err}", exc_info=True)
-                    error_content = json.dumps({"error": str(tool_err), "success": False}, ensure_ascii=False)
-                    if self.provider_type == "ollama":
-                        messages.append({"role": "tool", "content": error_content})
-                    else:
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "name": tc_name,
-                            "content": error_content,
-                        })
+                else:
+                    _, tool_call = batch[0]
+                    try:
+                        async for event in self._execute_tool(tool_call, messages, available_tool_names):
+                            yield event
+                    except Exception as tool_err:
+                        self._append_tool_error(messages, tool_call, tool_err)
                 
                 # Si terminamos, salir del loop de tools
                 if self.execution_complete or self.final_answer is not None:
                     break
     
+    def _append_tool_error(self, messages: list[dict], tool_call: Any, tool_err: Exception) -> None:
+        """Añade la respuesta de error de una tool fallida a los mensajes."""
+        tc_name = tool_call.function.get("name", "unknown")
+        logger.error(f"Tool execution error for {tc_name}: {tool_err}", exc_info=tool_err)
+        error_content = json.dumps({"error": str(tool_err), "success": False}, ensure_ascii=False)
+        if self.provider_type == "ollama":
+            messages.append({"role": "tool", "content": error_content})
+        else:
+            messages.append({
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "name": tc_name,
+                "content": error_content,
+            })
+    
+    async def _execute_tool_batch(
+        self,
+        batch: list[tuple[int, Any]],
+        messages: list[dict],
+        available_tool_names: Optional[set] = None
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """
+        Ejecuta un lote de tools independientes en paralelo.
+        
+        `batch` son pares (posición en response.tool_calls, tool_call), como
+        los devuelve plan_tool_batches: la posición es el call_index del
+        node_id, único en todo el turno. Los eventos se emiten según llegan;
+        los mensajes de resultado se añaden al final en el orden original
+        de tool_call_id.
+        """
+        logger.info(
+            f"⚡ Executing {len(batch)} tools concurrently",
+            tools=[tc.function.get("name", "") for _, tc in batch],
+            max_parallel=self.max_parallel_tools,
+        )
+        batch_messages: list[list[dict]] = [[] for _ in batch]
+        
+        def _runner(slot: int, call_index: int, tool_call: Any):
+            return lambda: self._execute_tool(
+                tool_call, batch_messages[slot], available_tool_names, call_index=call_index
+            )
+        
+        async def _on_error(slot: int, tool_err: Exception) -> None:
+            self._append_tool_error(batch_messages[slot], batch[slot][1], tool_err)
+        
+        async for event in run_concurrently(
+            [_runner(slot, call_index, tc) for slot, (call_index, tc) in enumerate(batch)],
+            self.max_parallel_tools,
+            _on_error,
+        ):
+            yield event
+        
+        for tool_messages in batch_messages:
+            messages.extend(tool_messages)
+    
     async def _execute_tool(
         self,
         tool_call: Any,
         messages: list[dict],
-        available_tool_names: Optional[set] = None
+        available_tool_names: Optional[set] = None,
+        call_index: Optional[int] = None
     ) -> AsyncGenerator[StreamEvent, None]:
         """
         Ejecuta una tool individual.
+        
+        call_index se indica cuando la tool forma parte de un lote paralelo,
+        para que sus eventos tengan un node_id propio.
         """
         tool_name = tool_call.function.get("name", "")
+        tool_node_id = self.stream_emitter.tool_node_id(tool_name, self.iteration, call_index)
         
         # Validar: válida si está en VALID_TOOL_NAMES O si está en las tools ofrecidas al LLM
         is_valid = is_valid_tool_name(tool_name) or (
@@ -449,7 +610,8 @@ class AdaptiveExecutor:
             tool_name,
             handler.display_name or self._get_display_name(tool_name),
             self.iteration,
-            args
+            args,
+            call_index=call_index
         )
         
         # Brain Event: delegation_start or action_start
@@ -532,7 +694,7 @@ class AdaptiveExecutor:
                     img_url = raw_result["image_url"]
                 
                 result.events.append(self.stream_emitter.image(
-                    node_id=f"tool_{tool_name}_{self.iteration}",
+                    node_id=tool_node_id,
                     url=img_url,
                     base64_data=img_b64,
                     mime_type=raw_result.get("mime_type", "image/png"),
@@ -543,7 +705,7 @@ class AdaptiveExecutor:
             
             if not has_video_event and (raw_result.get("video_url") or raw_result.get("video_base64")):
                 result.events.append(self.stream_emitter.video(
-                    node_id=f"tool_{tool_name}_{self.iteration}",
+                    node_id=tool_node_id,
                     url=raw_result.get("video_url"),
                     base64_data=raw_result.get("video_base64"),
                     mime_type=raw_result.get("mime_type", "video/mp4"),
@@ -650,6 +812,7 @@ class AdaptiveExecutor:
             done=result.is_terminal,
             html=html,
             conversation=conversation,
+            call_index=call_index,
         )
         
         # Agregar resultado a mensajes (SIEMPRE, para no romper la secuencia de tool_call_id para OpenAI)
@@ -701,15 +864,17 @@ IMPORTANT: You MUST call the `finish` tool now with your complete answer."""
         
         messages.append({"role": "user", "content": force_prompt})
         
+        compaction = self.context_manager.fit(messages)
+        if compaction:
+            yield self.stream_emitter.context_compacted(self.iteration, compaction)
+        
         try:
-            response = await call_llm_with_tools(
-                llm_url=self.llm_url,
-                model=self.model,
+            response = await llm_router.call_with_tools(
+                self.endpoints or [LLMEndpoint(self.provider_type, self.llm_url, self.model, self.api_key)],
                 messages=messages,
                 tools=tools,
                 temperature=0.3,
-                provider_type=self.provider_type,
-                api_key=self.api_key
+                prompt_cache_key=self.prompt_cache_key
             )
             
             # Buscar finish en tool_calls
@@ -819,6 +984,7 @@ async def run_session_loop(
         is_continue_request=False,
         agent_context=agent_context,
         user_id=user_id,
+        stream_tokens=False,
     )
     async for _ in executor.execute(messages, tools):
         pass
@@ -332,11 +332,16 @@ class BaseSubAgent:
 
         now = datetime.now()
         date_ctx = (
-            f"\n\n## FECHA ACTUAL\n"
+            f"## FECHA ACTUAL\n"
             f"Hoy es {now.strftime('%A %d de %B de %Y')} ({now.strftime('%Y-%m-%d')}). "
             f"Mes: {now.strftime('%Y%m')}. Ano: {now.year}.\n"
         )
-        messages = [{"role": "system", "content": self.system_prompt + date_ctx + self.get_skills_for_prompt()}]
+        # La fecha va en un mensaje aparte para que el prefijo (prompt + skills)
+        # sea estable entre llamadas y el proveedor pueda cachearlo.
+        messages = [
+            {"role": "system", "content": self.system_prompt + self.get_skills_for_prompt()},
+            {"role": "system", "content": date_ctx},
+        ]
 
         if session_id:
             for msg in self._load_memory(session_id, max_messages=self.MAX_MEMORY_MESSAGES):
@@ -0,0 +1,374 @@
+"""
+LLM Admission - Control de concurrencia y rate limit por endpoint LLM.
+
+Cada (provider, base_url, model) tiene un controlador de admisión:
+
+- Ventana de concurrencia AIMD: crece +1 por ventana de respuestas
+  correctas hasta max_concurrency y se reduce a la mitad ante 429/503,
+  pausando las admisiones durante el Retry-After indicado por el proveedor.
+- Token buckets opcionales de peticiones/minuto (rpm) y tokens/minuto (tpm).
+- Cola FIFO: las peticiones esperan su turno en orden de llegada en lugar
+  de saturar el proveedor (un Ollama con GPU se degrada por encima de ~4
+  generaciones concurrentes). El tiempo en cola se mide por endpoint.
+
+Los límites por defecto salen de Settings (llm_admission_*) y pueden
+sobrescribirse por proveedor con el campo `config` de llm_providers
+(max_concurrency, rpm, tpm).
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+import structlog
+
+from src.config import get_settings
+
+
+logger = structlog.get_logger()
+
+QUEUE_SAMPLES = 500  # muestras de tiempo en cola por endpoint
+SLOW_QUEUE_LOG_MS = 1000
+
+
+@dataclass
+class AdmissionLimits:
+    """Límites de un endpoint (None = sin límite)."""
+    max_concurrency: int
+    rpm: Optional[int] = None
+    tpm: Optional[int] = None
+    min_concurrency: int = 1
+
+
+class AdmissionQueueTimeout(Exception):
+    """La petición no obtuvo turno dentro del tiempo máximo de cola."""
+
+    def __init__(self, key: str, waited_s: float):
+        super().__init__(f"LLM admission queue timeout for {key} after {waited_s:.1f}s")
+        self.status_code = None
+        self.retry_after = None
+        self.retryable = True
+
+
+def estimate_request_tokens(messages: List[Dict], tools: Optional[List[Dict]] = None) -> int:
+    """Estimación barata de tokens de entrada (~4 caracteres por token)."""
+    chars = 0
+    for msg in messages or []:
+        content = msg.get("content")
+        chars += len(content) if isinstance(content, str) else len(json.dumps(content or "", default=str))
+        if msg.get("tool_calls"):
+            chars += len(json.dumps(msg["tool_calls"], default=str))
+    if tools:
+        chars += len(json.dumps(tools, default=str))
+    return chars // 4
+
+
+class _TokenBucket:
+    """Bucket con capacidad `per_minute` que se rellena de forma continua."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos hasta que haya `amount` disponibles (0 si ya los hay)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def adjust(self, delta: float) -> None:
+        """Corrige la estimación con el consumo real (puede quedar negativo)."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class EndpointAdmission:
+    """Controlador de admisión de un endpoint concreto."""
+
+    def __init__(self, key: str, limits: AdmissionLimits):
+        self.key = key
+        self.limits = limits
+        self.window = float(limits.max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._waiters: Deque[Tuple[asyncio.Future, int]] = deque()
+        self._wake_handle: Optional[asyncio.TimerHandle] = None
+        self._rpm = _TokenBucket(limits.rpm) if limits.rpm else None
+        self._tpm = _TokenBucket(limits.tpm) if limits.tpm else None
+        self.queue_times_ms: Deque[float] = deque(maxlen=QUEUE_SAMPLES)
+        self.admitted = 0
+        self.throttled = 0
+        self.timeouts = 0
+
+    def update_limits(self, limits: AdmissionLimits) -> None:
+        self.limits = limits
+        self.window = min(self.window, float(limits.max_concurrency))
+        self._rpm = _TokenBucket(limits.rpm) if limits.rpm else None
+        self._tpm = _TokenBucket(limits.tpm) if limits.tpm else None
+        self._wake()
+
+    # ------------------------------------------------------------------
+    # Admisión
+    # ------------------------------------------------------------------
+
+    def _blocked_for(self, tokens: int) -> float:
+        """0 si se puede admitir ya; >0 segundos de espera por pausa/buckets; -1 si falta ventana."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= max(self.limits.min_concurrency, int(self.window)):
+            return -1.0
+        wait = 0.0
+        if self._rpm:
+            wait = max(wait, self._rpm.wait_time(1))
+        if self._tpm and tokens:
+            wait = max(wait, self._tpm.wait_time(tokens))
+        return wait
+
+    def _admit(self, tokens: int) -> None:
+        self.in_flight += 1
+        self.admitted += 1
+        if self._rpm:
+            self._rpm.take(1)
+        if self._tpm and tokens:
+            self._tpm.take(tokens)
+
+    def _wake(self) -> None:
+        """Admite en orden FIFO a todos los que quepan."""
+        if self._wake_handle is not None:
+            self._wake_handle.cancel()
+            self._wake_handle = None
+        while self._waiters:
+            future, tokens = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            blocked = self._blocked_for(tokens)
+            if blocked == 0:
+                self._waiters.popleft()
+                self._admit(tokens)
+                future.set_result(None)
+                continue
+            if blocked > 0:
+                loop = asyncio.get_running_loop()
+                self._wake_handle = loop.call_later(blocked, self._wake)
+            return
+
+    async def acquire(self, tokens: int, timeout: Optional[float]) -> float:
+        """Espera turno. Devuelve el tiempo en cola (ms)."""
+        t0 = time.perf_counter()
+        if not self._waiters and self._blocked_for(tokens) == 0:
+            self._admit(tokens)
+            self.queue_times_ms.append(0.0)
+            return 0.0
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((future, tokens))
+        self._wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            if future.done() and not future.cancelled():
+                # Admitido justo al expirar: devolver el hueco
+                self.release()
+            future.cancel()
+            self._wake()
+            raise AdmissionQueueTimeout(self.key, time.perf_counter() - t0)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            future.cancel()
+            self._wake()
+            raise
+
+        waited_ms = (time.perf_counter() - t0) * 1000
+        self.queue_times_ms.append(waited_ms)
+        if waited_ms >= SLOW_QUEUE_LOG_MS:
+            logger.info(
+                "LLM request queued",
+                endpoint=self.key,
+                queue_ms=round(waited_ms),
+                in_flight=self.in_flight,
+                window=round(self.window, 2),
+            )
+        return waited_ms
+
+    def release(self) -> None:
+        self.in_flight = max(0, self.in_flight - 1)
+        self._wake()
+
+    # ------------------------------------------------------------------
+    # AIMD
+    # ------------------------------------------------------------------
+
+    def on_success(self, actual_tokens: Optional[int] = None, estimated_tokens: int = 0) -> None:
+        self.window = min(float(self.limits.max_concurrency), self.window + 1.0 / max(self.window, 1.0))
+        if self._tpm and actual_tokens is not None:
+            self._tpm.adjust(actual_tokens - estimated_tokens)
+
+    def on_throttle(self, retry_after: Optional[float]) -> None:
+        self.throttled += 1
+        self.window = max(float(self.limits.min_concurrency), self.window / 2)
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        logger.warning(
+            "LLM endpoint throttled",
+            endpoint=self.key,
+            window=round(self.window, 2),
+            retry_after=retry_after,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        samples = sorted(self.queue_times_ms)
+
+        def pct(q: float) -> Optional[float]:
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(q * (len(samples) - 1)))], 1)
+
+        return {
+            "in_flight": self.in_flight,
+            "queued": sum(1 for f, _ in self._waiters if not f.done()),
+            "window": round(self.window, 2),
+            "max_concurrency": self.limits.max_concurrency,
+            "rpm": self.limits.rpm,
+            "tpm": self.limits.tpm,
+            "paused_for_s": round(max(0.0, self.paused_until - time.monotonic()), 1),
+            "admitted": self.admitted,
+            "throttled": self.throttled,
+            "queue_timeouts": self.timeouts,
+            "queue_ms_p50": pct(0.5),
+            "queue_ms_p95": pct(0.95),
+        }
+
+
+class LLMAdmissionController:
+    """Registro de controladores de admisión por (provider, base_url, model)."""
+
+    def __init__(self):
+        self._endpoints: Dict[str, EndpointAdmission] = {}
+        # Overrides por (provider, base_url) cargados de llm_providers.config
+        self._overrides: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    @staticmethod
+    def _base(provider: str, base_url: Optional[str]) -> Tuple[str, str]:
+        return (provider.lower(), (base_url or "").rstrip("/"))
+
+    def configure(self, provider: str, base_url: Optional[str], **limits: Any) -> None:
+        """Fija límites (max_concurrency, rpm, tpm) para un proveedor y su URL."""
+        base = self._base(provider, base_url)
+        self._overrides[base] = {k: v for k, v in limits.items() if v is not None}
+        for key, admission in self._endpoints.items():
+            if key.startswith(f"{base[0]}|{base[1]}|"):
+                admission.update_limits(self._limits_for(*base))
+
+    def _limits_for(self, provider: str, base_url: str) -> AdmissionLimits:
+        settings = get_settings()
+        override = self._overrides.get((provider, base_url), {})
+        default_concurrency = (
+            settings.llm_admission_ollama_max_concurrency
+            if provider == "ollama"
+            else settings.llm_admission_max_concurrency
+        )
+        return AdmissionLimits(
+            max_concurrency=int(override.get("max_concurrency") or default_concurrency),
+            rpm=override.get("rpm"),
+            tpm=override.get("tpm"),
+        )
+
+    def endpoint(self, provider: str, base_url: Optional[str], model: str) -> EndpointAdmission:
+        base = self._base(provider, base_url)
+        key = f"{base[0]}|{base[1]}|{model}"
+        admission = self._endpoints.get(key)
+        if admission is None:
+            admission = self._endpoints[key] = EndpointAdmission(key, self._limits_for(*base))
+        return admission
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        provider: str,
+        base_url: Optional[str],
+        model: str,
+        estimated_tokens: int = 0,
+    ) -> AsyncIterator["AdmissionTicket"]:
+        """
+        Reserva un hueco en el endpoint durante la llamada.
+
+        Al salir con LLMProviderError 429/503 se reduce la ventana y se
+        respeta Retry-After; al salir sin error la ventana crece.
+        """
+        settings = get_settings()
+        if not settings.llm_admission_enabled:
+            yield AdmissionTicket(0.0)
+            return
+
+        admission = self.endpoint(provider, base_url, model)
+        queue_ms = await admission.acquire(estimated_tokens, settings.llm_admission_queue_timeout)
+        ticket = AdmissionTicket(queue_ms)
+        try:
+            yield ticket
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            if status in (429, 503):
+                admission.on_throttle(getattr(e, "retry_after", None))
+            raise
+        else:
+            admission.on_success(ticket.actual_tokens, estimated_tokens)
+        finally:
+            admission.release()
+
+    async def load_provider_limits(self) -> int:
+        """Carga overrides desde llm_providers.config (arranque de la app)."""
+        from src.db.repositories.llm_providers import LLMProviderRepository
+
+        count = 0
+        for provider in await LLMProviderRepository.get_all(active_only=True):
+            config = provider.config or {}
+            limits = {k: config.get(k) for k in ("max_concurrency", "rpm", "tpm") if config.get(k)}
+            if limits and provider.type:
+                self.configure(provider.type, provider.base_url, **limits)
+                count += 1
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        return {key: admission.stats() for key, admission in self._endpoints.items()}
+
+
+class AdmissionTicket:
+    """Resultado de la admisión; el llamador anota los tokens reales."""
+
+    def __init__(self, queue_ms: float):
+        self.queue_ms = queue_ms
+        self.actual_tokens: Optional[int] = None
+
+    def record_usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        if not usage:
+            return
+        total = usage.get("total_tokens")
+        if total is None:
+            total = (usage.get("prompt_tokens") or usage.get("input_tokens") or 0) + (
+                usage.get("completion_tokens") or usage.get("output_tokens") or 0
+            )
+        self.actual_tokens = total or None
+
+
+llm_admission = LLMAdmissionController()
@@ -0,0 +1,281 @@
+"""
+LLM Response Cache - Caché opcional de respuestas LLM deterministas.
+
+Las tareas programadas y los benchmarks reenvían peticiones casi idénticas
+a temperatura 0 durante todo el día. Con la caché activada en la cadena
+(ChainConfig.response_cache) la respuesta se reutiliza mientras no expire.
+
+Dos niveles:
+1. LRU en memoria acotado (por proceso).
+2. Tabla llm_response_cache en PostgreSQL con expires_at (compartida entre
+   réplicas y reinicios). Las filas caducadas se purgan en background cada
+   PURGE_INTERVAL_SECONDS (start()/stop() desde el lifespan).
+
+La clave es un sha256 canónico de (provider, model, messages, tools,
+temperature, extra). Los aciertos/fallos se registran en
+src.monitoring.cache_stats con el nombre "llm_response".
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import structlog
+
+from src.db.connection import get_db
+from src.monitoring.cache_stats import cache_stats
+
+
+logger = structlog.get_logger()
+
+CACHE_NAME = "llm_response"
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_TTL_SECONDS = 3600
+PURGE_INTERVAL_SECONDS = 900
+# Filas por DELETE al purgar (transacciones cortas aunque se haya acumulado mucho)
+PURGE_BATCH_ROWS = 5000
+
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def make_cache_key(
+    provider: str,
+    model: str,
+    messages: List[Dict],
+    tools: Optional[List[Dict]] = None,
+    temperature: float = 0.0,
+    **extra: Any,
+) -> str:
+    """Hash canónico de la petición (independiente del orden de claves)."""
+    payload = {
+        "provider": (provider or "").lower(),
+        "model": model,
+        "messages": messages,
+        "tools": tools or [],
+        "temperature": round(float(temperature), 4),
+        "extra": extra,
+    }
+    return hashlib.sha256(_canonical(payload).encode("utf-8")).hexdigest()
+
+
+def chain_cache_ttl(config: Any) -> Optional[int]:
+    """TTL de la caché de respuestas para una ChainConfig (None = desactivada)."""
+    if config is None or not getattr(config, "response_cache", False):
+        return None
+    return getattr(config, "response_cache_ttl", None) or DEFAULT_TTL_SECONDS
+
+
+class LLMResponseCache:
+    """
+    Caché de respuestas LLM con LRU en memoria + tier PostgreSQL con TTL.
+
+    Los valores son JSON serializables (el llamador convierte sus tipos).
+    El tier PostgreSQL es best-effort: si la BD no está disponible o falla,
+    la caché sigue funcionando solo en memoria.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._table_ready = False
+        self._purge_task: Optional[asyncio.Task] = None
+
+    # ------------------------------------------------------------------
+    # Memoria
+    # ------------------------------------------------------------------
+
+    def _memory_get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: Any, ttl: int) -> None:
+        self._entries[key] = (time.time() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            cache_stats.incr(CACHE_NAME, "evictions")
+
+    # ------------------------------------------------------------------
+    # PostgreSQL
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _db_available() -> bool:
+        return get_db()._pool is not None
+
+    async def ensure_table(self) -> None:
+        """Crea la tabla si no existe (idempotente, se llama en el arranque)."""
+        if self._table_ready or not self._db_available():
+            return
+        db = get_db()
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS llm_response_cache (
+                cache_key CHAR(64) PRIMARY KEY,
+                provider VARCHAR(50),
+                model VARCHAR(255),
+                response JSONB NOT NULL,
+                hits INTEGER DEFAULT 0,
+                created_at TIMESTAMPTZ DEFAULT NOW(),
+                expires_at TIMESTAMPTZ NOT NULL
+            )
+        """)
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS llm_response_cache_expires_idx ON llm_response_cache (expires_at)"
+        )
+        self._table_ready = True
+
+    async def _db_get(self, key: str) -> Optional[Tuple[Any, float]]:
+        if not self._db_available():
+            return None
+        try:
+            row = await get_db().fetch_one(
+                """
+                UPDATE llm_response_cache SET hits = hits + 1
+                WHERE cache_key = $1 AND expires_at > NOW()
+                RETURNING response, EXTRACT(EPOCH FROM (expires_at - NOW())) AS ttl
+                """,
+                key,
+            )
+        except Exception as e:
+            logger.debug("LLM cache lookup failed", error=str(e))
+            return None
+        if not row:
+            return None
+        value = row["response"]
+        if isinstance(value, str):
+            value = json.loads(value)
+        return value, float(row["ttl"])
+
+    async def _db_set(self, key: str, value: Any, ttl: int, provider: str, model: str) -> None:
+        if not self._db_available():
+            return
+        try:
+            await get_db().execute(
+                """
+                INSERT INTO llm_response_cache (cache_key, provider, model, response, expires_at)
+                VALUES ($1, $2, $3, $4::jsonb, $5)
+                ON CONFLICT (cache_key) DO UPDATE
+                SET response = EXCLUDED.response, expires_at = EXCLUDED.expires_at, created_at = NOW()
+                """,
+                key,
+                provider,
+                model,
+                json.dumps(value, ensure_ascii=False, default=str),
+                datetime.now(timezone.utc) + timedelta(seconds=ttl),
+            )
+        except Exception as e:
+            logger.debug("LLM cache store failed", error=str(e))
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Busca en memoria y después en PostgreSQL (promocionando a memoria)."""
+        value = self._memory_get(key)
+        if value is not None:
+            cache_stats.hit(CACHE_NAME, "memory")
+            return value
+
+        found = await self._db_get(key)
+        if found is not None:
+            value, remaining = found
+            self._memory_set(key, value, max(1, int(remaining)))
+            cache_stats.hit(CACHE_NAME, "postgres")
+            return value
+
+        cache_stats.miss(CACHE_NAME)
+        return None
+
+    async def set(
+        self,
+        key: str,
+        value: Any,
+        ttl: int = DEFAULT_TTL_SECONDS,
+        provider: str = "",
+        model: str = "",
+    ) -> None:
+        """Guarda en ambos tiers."""
+        self._memory_set(key, value, ttl)
+        cache_stats.incr(CACHE_NAME, "stores")
+        await self._db_set(key, value, ttl, provider, model)
+
+    async def purge_expired(self) -> int:
+        """Elimina entradas caducadas (memoria + PostgreSQL). Devuelve las borradas en BD."""
+        now = time.time()
+        for key in [k for k, (exp, _) in self._entries.items() if exp < now]:
+            del self._entries[key]
+        if not self._db_available():
+            return 0
+        purged = 0
+        while True:
+            result = await get_db().execute("""
+                DELETE FROM llm_response_cache
+                WHERE cache_key IN (
+                    SELECT cache_key FROM llm_response_cache
+                    WHERE expires_at <= NOW()
+                    LIMIT $1
+                )
+            """, PURGE_BATCH_ROWS)
+            try:
+                deleted = int(result.split()[-1])
+            except (AttributeError, ValueError, IndexError):
+                deleted = 0
+            purged += deleted
+            if deleted < PURGE_BATCH_ROWS:
+                break
+        if purged:
+            cache_stats.incr(CACHE_NAME, "purged", purged)
+        return purged
+
+    def start(self) -> None:
+        """Purga periódica de filas caducadas en background (idempotente)."""
+        if self._purge_task is None or self._purge_task.done():
+            self._purge_task = asyncio.create_task(self._purge_loop())
+
+    async def stop(self) -> None:
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            try:
+                await self._purge_task
+            except asyncio.CancelledError:
+                pass
+            self._purge_task = None
+
+    async def _purge_loop(self) -> None:
+        while True:
+            try:
+                purged = await self.purge_expired()
+                if purged:
+                    logger.info("LLM response cache purged", rows=purged)
+            except Exception as e:
+                logger.warning(f"LLM response cache purge failed: {e}")
+            await asyncio.sleep(PURGE_INTERVAL_SECONDS)
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        if self._db_available():
+            await get_db().execute("DELETE FROM llm_response_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory_entries": len(self._entries),
+            "max_entries": self.max_entries,
+            **cache_stats.snapshot(CACHE_NAME).get(CACHE_NAME, {}),
+        }
+
+
+llm_response_cache = LLMResponseCache()
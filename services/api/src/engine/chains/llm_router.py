@@ -0,0 +1,547 @@
+"""
+LLM Router - Failover, circuit breakers y hedging entre endpoints LLM.
+
+Una cadena puede declarar una lista ordenada de endpoints de respaldo
+(ChainConfig.llm_fallbacks, resueltos contra la tabla llm_providers). El
+router:
+
+1. Ordena los endpoints: los que tienen el circuito abierto o una
+   puntuación de salud baja pasan al final; el resto respeta el orden
+   configurado.
+2. Ante un error reintentable (timeout, transporte, 429, 5xx) pasa al
+   siguiente endpoint (failover).
+3. Mantiene un circuit breaker por endpoint: tras N fallos consecutivos
+   se deja de usar durante un cooldown; después se permite una prueba
+   (half-open).
+4. Hedging opcional: si el endpoint principal supera su percentil de
+   latencia (p.ej. p95) sin responder, lanza la misma petición al
+   siguiente endpoint y se queda con la primera respuesta.
+
+En streaming el failover/hedge solo es posible antes del primer elemento;
+una vez emitido contenido al cliente el error se propaga.
+"""
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+import httpx
+import structlog
+
+from .llm_utils import (
+    LLMConfigError,
+    LLMProviderError,
+    LLMToolResponse,
+    call_llm_with_tools,
+    call_llm_with_tools_stream,
+)
+
+
+logger = structlog.get_logger()
+
+# Circuit breaker
+FAILURE_THRESHOLD = 5  # fallos consecutivos para abrir el circuito
+BASE_COOLDOWN_SECONDS = 30.0
+MAX_COOLDOWN_SECONDS = 300.0
+
+# Salud
+HEALTH_ALPHA = 0.2  # peso de la última observación en la EWMA
+UNHEALTHY_SCORE = 0.5  # por debajo se degrada al final de la lista
+
+# Familias de proveedor con el mismo formato de historial de tools (las no
+# listadas van por el adaptador de Ollama, ver _dispatch_call_llm_with_tools)
+PROVIDER_FAMILIES = {
+    "openai": "openai",
+    "groq": "openai",
+    "azure": "openai",
+    "anthropic": "anthropic",
+    "gemini": "gemini",
+}
+
+# Hedging
+LATENCY_WINDOW = 200  # muestras de latencia por endpoint
+HEDGE_MIN_SAMPLES = 20  # no se hace hedge sin histórico suficiente
+
+
+def provider_family(provider_type: Optional[str]) -> str:
+    """Familia del proveedor: el executor construye el historial en su formato."""
+    return PROVIDER_FAMILIES.get((provider_type or "ollama").lower(), "ollama")
+
+
+@dataclass(frozen=True)
+class LLMEndpoint:
+    """Proveedor + modelo concreto al que se puede enviar una petición."""
+    provider_type: str
+    llm_url: str
+    model: str
+    api_key: Optional[str] = field(default=None, repr=False, compare=False)
+    name: Optional[str] = field(default=None, compare=False)
+
+    @property
+    def key(self) -> str:
+        return f"{self.provider_type.lower()}|{(self.llm_url or '').rstrip('/')}|{self.model}"
+
+
+class EndpointHealth:
+    """Estado de salud y circuit breaker de un endpoint."""
+
+    def __init__(self):
+        self.success_ewma = 1.0
+        self.latency_ewma_ms: Optional[float] = None
+        self.consecutive_failures = 0
+        self.total_calls = 0
+        self.total_failures = 0
+        self.circuit_open_until = 0.0
+        self.cooldown = BASE_COOLDOWN_SECONDS
+        self.half_open_in_flight = False
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.first_item_latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.last_error: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        if self.circuit_open_until == 0.0:
+            return "closed"
+        if time.monotonic() < self.circuit_open_until:
+            return "open"
+        return "half_open"
+
+    @property
+    def score(self) -> float:
+        return self.success_ewma
+
+    def available(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open":
+            return not self.half_open_in_flight
+        return False
+
+    def percentile(self, q: float, first_item: bool = False) -> Optional[float]:
+        samples = self.first_item_latencies if first_item else self.latencies
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def record_success(self, latency_ms: float, first_item_ms: Optional[float] = None) -> None:
+        self.total_calls += 1
+        self.consecutive_failures = 0
+        self.success_ewma = (1 - HEALTH_ALPHA) * self.success_ewma + HEALTH_ALPHA
+        self.latency_ewma_ms = (
+            latency_ms if self.latency_ewma_ms is None
+            else (1 - HEALTH_ALPHA) * self.latency_ewma_ms + HEALTH_ALPHA * latency_ms
+        )
+        self.latencies.append(latency_ms)
+        if first_item_ms is not None:
+            self.first_item_latencies.append(first_item_ms)
+        self.circuit_open_until = 0.0
+        self.cooldown = BASE_COOLDOWN_SECONDS
+        self.half_open_in_flight = False
+
+    def record_failure(self, error: str, retry_after: Optional[float] = None) -> None:
+        self.total_calls += 1
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        self.success_ewma = (1 - HEALTH_ALPHA) * self.success_ewma
+        self.last_error = error[:300]
+        was_half_open = self.state == "half_open"
+        self.half_open_in_flight = False
+        if was_half_open or self.consecutive_failures >= FAILURE_THRESHOLD:
+            cooldown = max(self.cooldown, retry_after or 0.0)
+            self.circuit_open_until = time.monotonic() + cooldown
+            self.cooldown = min(MAX_COOLDOWN_SECONDS, self.cooldown * 2)
+
+    def to_dict(self) -> Dict[str, Any]:
+        p50 = self.percentile(0.5)
+        p95 = self.percentile(0.95)
+        return {
+            "state": self.state,
+            "score": round(self.score, 3),
+            "latency_ewma_ms": round(self.latency_ewma_ms, 1) if self.latency_ewma_ms else None,
+            "p50_ms": round(p50, 1) if p50 else None,
+            "p95_ms": round(p95, 1) if p95 else None,
+            "calls": self.total_calls,
+            "failures": self.total_failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Errores tras los que tiene sentido probar otro endpoint."""
+    if isinstance(error, LLMProviderError):
+        return error.retryable
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, LLMConfigError):
+        # API key ausente: otro endpoint puede estar bien configurado
+        return True
+    # p.ej. AdmissionQueueTimeout: el endpoint está saturado
+    return bool(getattr(error, "retryable", False))
+
+
+class LLMRouter:
+    """
+    Enrutado de llamadas LLM sobre una lista ordenada de endpoints.
+
+    La salud se comparte a nivel de proceso: todas las ejecuciones que
+    usan el mismo endpoint contribuyen a su puntuación y a su circuito.
+    """
+
+    def __init__(self):
+        self._health: Dict[str, EndpointHealth] = {}
+        self.failovers = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def health(self, endpoint: LLMEndpoint) -> EndpointHealth:
+        health = self._health.get(endpoint.key)
+        if health is None:
+            health = self._health[endpoint.key] = EndpointHealth()
+        return health
+
+    def order(self, endpoints: List[LLMEndpoint]) -> List[LLMEndpoint]:
+        """Orden de intento: disponibles y sanos primero, respetando la configuración."""
+        if len(endpoints) <= 1:
+            return list(endpoints)
+
+        def rank(item: Tuple[int, LLMEndpoint]):
+            index, endpoint = item
+            health = self.health(endpoint)
+            return (not health.available(), health.score < UNHEALTHY_SCORE, index)
+
+        return [endpoint for _, endpoint in sorted(enumerate(endpoints), key=rank)]
+
+    def _begin(self, endpoint: LLMEndpoint) -> None:
+        health = self.health(endpoint)
+        if health.state == "half_open":
+            health.half_open_in_flight = True
+
+    def _record_failure(self, endpoint: LLMEndpoint, error: BaseException) -> None:
+        if not is_retryable_error(error):
+            # Errores de la petición (4xx) no penalizan la salud del endpoint
+            self.health(endpoint).half_open_in_flight = False
+            return
+        retry_after = getattr(error, "retry_after", None)
+        self.health(endpoint).record_failure(str(error) or type(error).__name__, retry_after)
+        logger.warning(
+            "LLM endpoint failed",
+            provider=endpoint.provider_type,
+            model=endpoint.model,
+            error=str(error)[:200],
+            state=self.health(endpoint).state,
+        )
+
+    # ------------------------------------------------------------------
+    # Llamada completa (con hedging)
+    # ------------------------------------------------------------------
+
+    async def _call_endpoint(
+        self, endpoint: LLMEndpoint, call: Callable[[LLMEndpoint], Any]
+    ) -> Any:
+        self._begin(endpoint)
+        t0 = time.perf_counter()
+        try:
+            result = await call(endpoint)
+        except asyncio.CancelledError:
+            self.health(endpoint).half_open_in_flight = False
+            raise
+        except Exception as e:
+            self._record_failure(endpoint, e)
+            raise
+        self.health(endpoint).record_success((time.perf_counter() - t0) * 1000)
+        return result
+
+    async def _hedged(
+        self,
+        primary: LLMEndpoint,
+        backup: LLMEndpoint,
+        delay_s: float,
+        call: Callable[[LLMEndpoint], Any],
+        attempted: List[LLMEndpoint],
+    ) -> Any:
+        """
+        Lanza primary; si tarda más de delay_s lanza backup y gana el primero.
+
+        `attempted` recibe los endpoints realmente lanzados: si primary falla
+        antes de delay_s el backup no se ha probado y el failover debe usarlo.
+        """
+        attempted.append(primary)
+        primary_task = asyncio.create_task(self._call_endpoint(primary, call))
+        done, _ = await asyncio.wait({primary_task}, timeout=delay_s)
+        if done:
+            return primary_task.result()
+
+        self.hedges += 1
+        logger.info(
+            "Hedging LLM request",
+            primary=primary.key,
+            backup=backup.key,
+            after_ms=round(delay_s * 1000),
+        )
+        attempted.append(backup)
+        backup_task = asyncio.create_task(self._call_endpoint(backup, call))
+        pending = {primary_task, backup_task}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup_task:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def call(
+        self,
+        endpoints: List[LLMEndpoint],
+        call: Callable[[LLMEndpoint], Any],
+        hedge_percentile: Optional[float] = None,
+    ) -> Any:
+        """
+        Ejecuta `call(endpoint)` con failover (y hedging si se indica percentil).
+
+        Raises:
+            El último error si todos los endpoints fallan, o el primero no
+            reintentable.
+        """
+        ordered = self.order(endpoints)
+        last_error: Optional[BaseException] = None
+        index = 0
+        while index < len(ordered):
+            endpoint = ordered[index]
+            backup = ordered[index + 1] if index + 1 < len(ordered) else None
+            delay_ms = (
+                self.health(endpoint).percentile(hedge_percentile)
+                if hedge_percentile and backup is not None else None
+            )
+            attempted: List[LLMEndpoint] = []
+            try:
+                if delay_ms is not None and self.health(backup).available():
+                    return await self._hedged(endpoint, backup, delay_ms / 1000, call, attempted)
+                attempted.append(endpoint)
+                return await self._call_endpoint(endpoint, call)
+            except Exception as e:
+                last_error = e
+                if not is_retryable_error(e):
+                    raise
+            # Si el hedge llegó a lanzar el backup, ya se ha probado
+            index += len(attempted)
+            if index < len(ordered):
+                self.failovers += 1
+                logger.info("LLM failover", failed=endpoint.key, next=ordered[index].key)
+        raise last_error or RuntimeError("No LLM endpoints configured")
+
+    async def call_with_tools(
+        self,
+        endpoints: List[LLMEndpoint],
+        messages: List[Dict],
+        tools: List[Dict],
+        temperature: float = 0.7,
+        hedge_percentile: Optional[float] = None,
+        **kwargs: Any,
+    ) -> LLMToolResponse:
+        """call_llm_with_tools con failover/hedging sobre `endpoints`."""
+        async def _call(endpoint: LLMEndpoint) -> LLMToolResponse:
+            return await call_llm_with_tools(
+                llm_url=endpoint.llm_url,
+                model=endpoint.model,
+                messages=messages,
+                tools=tools,
+                temperature=temperature,
+                provider_type=endpoint.provider_type,
+                api_key=endpoint.api_key,
+                **kwargs,
+            )
+        return await self.call(endpoints, _call, hedge_percentile)
+
+    # ------------------------------------------------------------------
+    # Streaming (failover/hedge antes del primer elemento)
+    # ------------------------------------------------------------------
+
+    def _open_stream(self, endpoint: LLMEndpoint, messages, tools, temperature, kwargs):
+        return call_llm_with_tools_stream(
+            llm_url=endpoint.llm_url,
+            model=endpoint.model,
+            messages=messages,
+            tools=tools,
+            temperature=temperature,
+            provider_type=endpoint.provider_type,
+            api_key=endpoint.api_key,
+            **kwargs,
+        )
+
+    async def _first_item(self, endpoint: LLMEndpoint, stream: AsyncGenerator) -> Tuple[Any, float]:
+        self._begin(endpoint)
+        t0 = time.perf_counter()
+        try:
+            item = await stream.__anext__()
+        except asyncio.CancelledError:
+            self.health(endpoint).half_open_in_flight = False
+            raise
+        except StopAsyncIteration:
+            return None, (time.perf_counter() - t0) * 1000
+        except Exception as e:
+            self._record_failure(endpoint, e)
+            raise
+        return item, (time.perf_counter() - t0) * 1000
+
+    async def stream_with_tools(
+        self,
+        endpoints: List[LLMEndpoint],
+        messages: List[Dict],
+        tools: List[Dict],
+        temperature: float = 0.7,
+        hedge_percentile: Optional[float] = None,
+        **kwargs: Any,
+    ) -> AsyncGenerator[Union[str, LLMToolResponse], None]:
+        """call_llm_with_tools_stream con failover/hedging hasta el primer elemento."""
+        ordered = self.order(endpoints)
+        last_error: Optional[BaseException] = None
+        index = 0
+        while index < len(ordered):
+            endpoint = ordered[index]
+            backup = ordered[index + 1] if index + 1 < len(ordered) else None
+            delay_ms = (
+                self.health(endpoint).percentile(hedge_percentile, first_item=True)
+                if hedge_percentile and backup is not None else None
+            )
+            candidates = [(endpoint, self._open_stream(endpoint, messages, tools, temperature, kwargs))]
+            tasks = {asyncio.create_task(self._first_item(*candidates[0])): candidates[0]}
+            winner = None
+            try:
+                if delay_ms is not None and self.health(backup).available():
+                    done, _ = await asyncio.wait(set(tasks), timeout=delay_ms / 1000)
+                    if not done:
+                        self.hedges += 1
+                        logger.info("Hedging LLM stream", primary=endpoint.key, backup=backup.key)
+                        pair = (backup, self._open_stream(backup, messages, tools, temperature, kwargs))
+                        candidates.append(pair)
+                        tasks[asyncio.create_task(self._first_item(*pair))] = pair
+                pending = set(tasks)
+                while pending and winner is None:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is not None:
+                            last_error = task.exception()
+                        elif winner is None:
+                            winner = (tasks[task], task.result())
+            finally:
+                # Cancelar y esperar a los perdedores antes de cerrar sus streams
+                losers = [task for task in tasks if not task.done()]
+                for task in losers:
+                    task.cancel()
+                if losers:
+                    await asyncio.gather(*losers, return_exceptions=True)
+                for pair in candidates:
+                    if winner is None or pair is not winner[0]:
+                        try:
+                            await pair[1].aclose()
+                        except Exception:
+                            pass
+
+            if winner is None:
+                if last_error is not None and not is_retryable_error(last_error):
+                    raise last_error
+                # Si se hizo hedge, el backup ya se ha probado
+                index += len(candidates)
+                if index < len(ordered):
+                    self.failovers += 1
+                    logger.info("LLM stream failover", failed=endpoint.key, next=ordered[index].key)
+                continue
+
+            (chosen, stream), (first, first_ms) = winner
+            if chosen is not endpoint:
+                self.hedge_wins += 1
+            t0 = time.perf_counter() - first_ms / 1000
+            if first is not None:
+                yield first
+            try:
+                async for item in stream:
+                    yield item
+            except Exception as e:
+                self._record_failure(chosen, e)
+                raise
+            self.health(chosen).record_success((time.perf_counter() - t0) * 1000, first_item_ms=first_ms)
+            return
+
+        raise last_error or RuntimeError("No LLM endpoints configured")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "failovers": self.failovers,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "endpoints": {key: health.to_dict() for key, health in self._health.items()},
+        }
+
+
+llm_router = LLMRouter()
+
+
+async def resolve_chain_endpoints(
+    primary: LLMEndpoint,
+    fallbacks: Optional[List[Dict[str, Any]]],
+) -> List[LLMEndpoint]:
+    """
+    Construye la lista ordenada [primary, *fallbacks].
+
+    Cada fallback de ChainConfig.llm_fallbacks es un dict con
+    `provider_id` o `provider_name` (fila de llm_providers) y opcionalmente
+    `model` (por defecto el default_model del proveedor).
+
+    Solo se aceptan fallbacks de la misma familia que el principal: el
+    historial de tools (tool_calls, tool_call_id) se construye en el formato
+    del principal y otra familia lo rechazaría o lo perdería a mitad del bucle.
+    """
+    endpoints = [primary]
+    if not fallbacks:
+        return endpoints
+
+    from src.db.repositories.llm_providers import LLMProviderRepository
+
+    for spec in fallbacks:
+        try:
+            if spec.get("provider_id") is not None:
+                provider = await LLMProviderRepository.get_by_id(int(spec["provider_id"]))
+            elif spec.get("provider_name"):
+                provider = await LLMProviderRepository.get_by_name(spec["provider_name"])
+            else:
+                provider = None
+        except Exception as e:
+            logger.warning("Could not resolve LLM fallback", spec=spec, error=str(e))
+            continue
+        if not provider or not provider.is_active or not provider.base_url:
+            logger.warning("LLM fallback provider not available", spec=spec)
+            continue
+        model = spec.get("model") or provider.default_model
+        if not model:
+            continue
+        endpoint = LLMEndpoint(
+            provider_type=(provider.type or "ollama").lower(),
+            llm_url=provider.base_url,
+            model=model,
+            api_key=provider.api_key,
+            name=provider.name,
+        )
+        if provider_family(endpoint.provider_type) != provider_family(primary.provider_type):
+            logger.warning(
+                "LLM fallback ignored: different provider family than the primary",
+                spec=spec,
+                primary=primary.provider_type,
+                fallback=endpoint.provider_type,
+            )
+            continue
+        if endpoint not in endpoints:
+            endpoints.append(endpoint)
+    return endpoints
@@ -0,0 +1,159 @@
+"""
+LLM Transport - Registro de clientes HTTP persistentes por proveedor.
+
+Mantiene un único httpx.AsyncClient (keep-alive, HTTP/2 si está disponible)
+por (provider, base_url) durante toda la vida del proceso, para que las
+iteraciones del agente reutilicen conexiones TCP+TLS en lugar de abrir una
+nueva en cada llamada al LLM.
+
+Los límites del pool y los timeouts por fase se configuran en Settings
+(llm_http_*). El cierre se hace en el lifespan de FastAPI.
+"""
+
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
+
+import httpx
+import structlog
+
+from src.config import get_settings
+
+logger = structlog.get_logger()
+
+try:
+    import h2  # noqa: F401  (httpx necesita h2 para HTTP/2)
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+
+class ProviderTransportRegistry:
+    """
+    Registro process-wide de clientes HTTP para proveedores LLM.
+
+    Un cliente por (provider, base_url). Los clientes se crean bajo demanda
+    y se recrean si se cerraron o si se usan desde otro event loop; el
+    cliente sustituido se cierra (en su loop si sigue vivo) para no dejar
+    su pool de conexiones abierto.
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str], httpx.AsyncClient] = {}
+        self._loops: Dict[Tuple[str, str], asyncio.AbstractEventLoop] = {}
+        # Clientes sustituidos pendientes de cerrar (sin loop donde hacerlo)
+        self._retired: List[httpx.AsyncClient] = []
+        self._closing: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def _key(provider: str, base_url: str) -> Tuple[str, str]:
+        return (provider.lower(), (base_url or "").rstrip("/"))
+
+    def _limits(self) -> httpx.Limits:
+        settings = get_settings()
+        return httpx.Limits(
+            max_connections=settings.llm_http_max_connections,
+            max_keepalive_connections=settings.llm_http_max_keepalive_connections,
+            keepalive_expiry=settings.llm_http_keepalive_expiry,
+        )
+
+    def timeout(self, stream: bool = False) -> httpx.Timeout:
+        """
+        Timeouts por fase (connect/read/write/pool).
+
+        Las llamadas en streaming usan un read timeout mayor porque el
+        proveedor puede tardar en emitir el primer token con prompts largos.
+        """
+        settings = get_settings()
+        return httpx.Timeout(
+            connect=settings.llm_http_connect_timeout,
+            read=settings.llm_http_stream_read_timeout if stream else settings.llm_http_read_timeout,
+            write=settings.llm_http_write_timeout,
+            pool=settings.llm_http_pool_timeout,
+        )
+
+    def get_client(self, provider: str, base_url: str) -> httpx.AsyncClient:
+        """Devuelve el cliente compartido para (provider, base_url), creándolo si hace falta."""
+        key = self._key(provider, base_url)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        client = self._clients.get(key)
+        if client is not None and not client.is_closed and self._loops.get(key) is loop:
+            return client
+
+        if client is not None:
+            self._retire(client, self._loops.get(key), loop)
+
+        settings = get_settings()
+        client = httpx.AsyncClient(
+            http2=settings.llm_http2_enabled and _HTTP2_AVAILABLE,
+            limits=self._limits(),
+            timeout=self.timeout(),
+        )
+        self._clients[key] = client
+        self._loops[key] = loop
+        logger.debug(
+            "LLM transport client created",
+            provider=key[0],
+            base_url=key[1],
+            http2=settings.llm_http2_enabled and _HTTP2_AVAILABLE,
+        )
+        return client
+
+    def _retire(
+        self,
+        client: httpx.AsyncClient,
+        owner: Optional[asyncio.AbstractEventLoop],
+        current: Optional[asyncio.AbstractEventLoop],
+    ) -> None:
+        """Cerrar un cliente sustituido sin bloquear al llamador."""
+        if client.is_closed:
+            return
+        if owner is not None and owner is not current and owner.is_running() and not owner.is_closed():
+            # Sus conexiones pertenecen a otro loop vivo: cerrarlo allí
+            asyncio.run_coroutine_threadsafe(self._close(client), owner)
+            return
+        if current is not None:
+            # Loop original terminado: best-effort desde el loop actual
+            task = current.create_task(self._close(client))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+            return
+        self._retired.append(client)
+
+    @staticmethod
+    async def _close(client: httpx.AsyncClient) -> None:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.debug("Error closing LLM transport client", error=str(e))
+
+    def stats(self) -> Dict[str, dict]:
+        """Resumen de clientes abiertos (para diagnóstico)."""
+        return {
+            f"{provider}|{base_url}": {"closed": client.is_closed}
+            for (provider, base_url), client in self._clients.items()
+        }
+
+    async def aclose(self) -> None:
+        """Cierra todos los clientes (shutdown de la aplicación)."""
+        clients = list(self._clients.values()) + self._retired
+        self._clients.clear()
+        self._loops.clear()
+        self._retired = []
+        for client in clients:
+            await self._close(client)
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+        if clients:
+            logger.info("LLM transport clients closed", count=len(clients))
+
+
+provider_transport = ProviderTransportRegistry()
+
+
+def get_llm_client(provider: str, base_url: Optional[str]) -> httpx.AsyncClient:
+    """Atajo para obtener el cliente compartido de un proveedor."""
+    return provider_transport.get_client(provider, base_url or "")
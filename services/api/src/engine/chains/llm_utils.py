@@ -4,31 +4,141 @@ Soporta múltiples proveedores: Ollama, OpenAI, Anthropic, Gemini, Groq, Azure.
 Incluye soporte para Web Search nativo de OpenAI.
 """
 
+import hashlib
 import json
 import time
 import asyncio
 from contextvars import ContextVar
-from typing import List, Dict, AsyncGenerator, Optional
+from typing import Any, List, Dict, AsyncGenerator, Optional, Union
 import httpx
 import structlog
 
+from .llm_transport import get_llm_client, provider_transport
+from .llm_cache import llm_response_cache, make_cache_key
+from .llm_admission import llm_admission, estimate_request_tokens
+from .token_counter import UsageAccumulator, token_counter
+
 logger = structlog.get_logger()
 
+ANTHROPIC_BASE_URL = "https://api.anthropic.com/v1"
+
 # Context para propagar execution_id y chain_id a las llamadas LLM
-_execution_context: ContextVar[Optional[Dict[str, str]]] = ContextVar(
+_execution_context: ContextVar[Optional[Dict[str, Any]]] = ContextVar(
     "_execution_context", default=None
 )
 
 
-def set_llm_execution_context(execution_id: str, chain_id: str) -> None:
-    """Establecer contexto de ejecución para que trace_llm se dispare automáticamente."""
-    _execution_context.set({"execution_id": execution_id, "chain_id": chain_id})
+def set_llm_execution_context(
+    execution_id: str,
+    chain_id: str,
+    response_cache_ttl: Optional[int] = None
+) -> None:
+    """
+    Establecer contexto de ejecución para que trace_llm se dispare automáticamente.
+    
+    response_cache_ttl activa la caché de respuestas (llm_cache) para todas
+    las llamadas LLM de la ejecución (ChainConfig.response_cache).
+    """
+    _execution_context.set({
+        "execution_id": execution_id,
+        "chain_id": chain_id,
+        "response_cache_ttl": response_cache_ttl,
+        "usage": UsageAccumulator(),
+    })
 
 
 def clear_llm_execution_context() -> None:
     _execution_context.set(None)
 
 
+def get_llm_usage() -> Optional[UsageAccumulator]:
+    """
+    Uso de tokens acumulado en la ejecución actual.
+    
+    Incluye todas las llamadas LLM hechas bajo el mismo contexto
+    (iteraciones del agente y subagentes delegados).
+    """
+    ctx = _execution_context.get()
+    return ctx.get("usage") if ctx else None
+
+
+class LLMProviderError(Exception):
+    """
+    Error HTTP devuelto por un proveedor LLM.
+    
+    Conserva el status y el Retry-After para que el enrutado (failover,
+    control de concurrencia) pueda decidir si reintentar.
+    """
+    
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+    
+    @property
+    def retryable(self) -> bool:
+        """429, 5xx o sin status (error de transporte)."""
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
+
+
+class LLMConfigError(ValueError):
+    """
+    Endpoint LLM mal configurado (p.ej. sin API key).
+    
+    Es un fallo del endpoint, no de la petición: el enrutado prueba el
+    siguiente endpoint configurado.
+    """
+    
+    retryable = True
+
+
+def _parse_retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        from datetime import datetime, timezone
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _provider_error(label: str, response: httpx.Response, body: Optional[str] = None) -> LLMProviderError:
+    text = body if body is not None else response.text
+    return LLMProviderError(
+        f"Error {label}: {response.status_code} - {text}",
+        status_code=response.status_code,
+        retry_after=_parse_retry_after(response),
+    )
+
+
+def _admission_url(provider: str, llm_url: Optional[str]) -> Optional[str]:
+    """URL con la que se identifica el endpoint en el control de admisión."""
+    return ANTHROPIC_BASE_URL if provider == "anthropic" else llm_url
+
+
+def _response_cache_ttl(response_cache: Optional[bool]) -> Optional[int]:
+    """
+    TTL de la caché de respuestas para esta llamada, o None si no aplica.
+    
+    response_cache=None usa la política del contexto de ejecución;
+    True/False la fuerza para la llamada concreta.
+    """
+    if response_cache is False:
+        return None
+    ctx = _execution_context.get() or {}
+    ttl = ctx.get("response_cache_ttl")
+    if response_cache and not ttl:
+        from .llm_cache import DEFAULT_TTL_SECONDS
+        ttl = DEFAULT_TTL_SECONDS
+    return ttl or None
+
+
 def _content_to_gemini_parts(content) -> list:
     """Convert OpenAI-style content (str or list of parts) to Gemini parts."""
     if isinstance(content, str):
@@ -103,7 +213,8 @@ async def call_llm(
     max_tokens: Optional[int] = None,
     provider_type: str = "ollama",
     api_key: Optional[str] = None,
-    enable_web_search: bool = False
+    enable_web_search: bool = False,
+    response_cache: Optional[bool] = None
 ) -> str:
     """
     Llamar al LLM y obtener respuesta.
@@ -118,28 +229,65 @@ async def call_llm(
         provider_type: Tipo de proveedor ("ollama", "openai", "anthropic", "gemini", "groq", "azure")
         api_key: API key para proveedores que lo requieren
         enable_web_search: Habilitar búsqueda web nativa (solo OpenAI)
+        response_cache: Forzar (True/False) la caché de respuestas; None = según la cadena
     
     Returns:
         Contenido de la respuesta del LLM
     """
+    cache_ttl = _response_cache_ttl(response_cache)
+    cache_key = None
+    if cache_ttl:
+        cache_key = make_cache_key(
+            provider_type, model, messages,
+            temperature=temperature, max_tokens=max_tokens, web_search=enable_web_search,
+        )
+        cached = await llm_response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
+    provider = provider_type.lower()
+    async with llm_admission.slot(
+        provider, _admission_url(provider, llm_url), model, estimate_request_tokens(messages)
+    ):
+        content = await _dispatch_call_llm(
+            llm_url, model, messages, temperature, max_tokens, provider_type, api_key, enable_web_search
+        )
+    # Estas rutas no devuelven usage del proveedor: se cuenta con el tokenizador
+    _account_usage(model, None, messages, completion=content)
+    if cache_key and content:
+        await llm_response_cache.set(cache_key, content, cache_ttl, provider_type, model)
+    return content
+
+
+async def _dispatch_call_llm(
+    llm_url: str,
+    model: str,
+    messages: List[Dict],
+    temperature: float,
+    max_tokens: Optional[int],
+    provider_type: str,
+    api_key: Optional[str],
+    enable_web_search: bool
+) -> str:
+    """Selecciona la implementación de call_llm según el proveedor."""
     provider = provider_type.lower()
     
     if provider == "ollama":
         return await _call_ollama(llm_url, model, messages, temperature, max_tokens)
     elif provider in ["openai", "groq", "azure"]:
         if not api_key:
-            raise ValueError(f"API key requerida para {provider}")
+            raise LLMConfigError(f"API key requerida para {provider}")
         return await _call_openai_compatible(
             llm_url, model, messages, temperature, max_tokens, api_key, 
             enable_web_search=(enable_web_search and provider == "openai")
         )
     elif provider == "anthropic":
         if not api_key:
-            raise ValueError("API key requerida para Anthropic")
+            raise LLMConfigError("API key requerida para Anthropic")
         return await _call_anthropic(model, messages, temperature, max_tokens, api_key)
     elif provider == "gemini":
         if not api_key:
-            raise ValueError("API key requerida para Gemini")
+            raise LLMConfigError("API key requerida para Gemini")
         return await _call_gemini(llm_url, model, messages, temperature, max_tokens, api_key)
     else:
         # Fallback a Ollama para proveedores desconocidos
@@ -171,13 +319,34 @@ async def call_llm_stream(
         Tokens de la respuesta
     """
     provider = provider_type.lower()
-    
+    async with llm_admission.slot(
+        provider, _admission_url(provider, llm_url), model, estimate_request_tokens(messages)
+    ):
+        parts: List[str] = []
+        async for token in _dispatch_call_llm_stream(
+            llm_url, model, messages, temperature, provider, api_key, enable_web_search
+        ):
+            parts.append(token)
+            yield token
+    _account_usage(model, None, messages, completion="".join(parts))
+
+
+async def _dispatch_call_llm_stream(
+    llm_url: str,
+    model: str,
+    messages: List[Dict],
+    temperature: float,
+    provider: str,
+    api_key: Optional[str],
+    enable_web_search: bool
+) -> AsyncGenerator[str, None]:
+    """Selecciona la implementación de call_llm_stream según el proveedor."""
     if provider == "ollama":
         async for token in _stream_ollama(llm_url, model, messages, temperature):
             yield token
     elif provider in ["openai", "groq", "azure"]:
         if not api_key:
-            raise ValueError(f"API key requerida para {provider}")
+            raise LLMConfigError(f"API key requerida para {provider}")
         async for token in _stream_openai_compatible(
             llm_url, model, messages, temperature, api_key,
             enable_web_search=(enable_web_search and provider == "openai")
@@ -185,12 +354,12 @@ async def call_llm_stream(
             yield token
     elif provider == "anthropic":
         if not api_key:
-            raise ValueError("API key requerida para Anthropic")
+            raise LLMConfigError("API key requerida para Anthropic")
         async for token in _stream_anthropic(model, messages, temperature, api_key):
             yield token
     elif provider == "gemini":
         if not api_key:
-            raise ValueError("API key requerida para Gemini")
+            raise LLMConfigError("API key requerida para Gemini")
         async for token in _stream_gemini(llm_url, model, messages, temperature, api_key):
             yield token
     else:
@@ -211,21 +380,23 @@ async def _call_ollama(
     max_tokens: Optional[int]
 ) -> str:
     """Llamar a Ollama API"""
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.post(
-            f"{base_url}/api/chat",
-            json={
-                "model": model,
-                "messages": messages,
-                "stream": False,
-                "options": {
-                    "temperature": temperature,
-                    **({"num_predict": max_tokens} if max_tokens else {})
-                }
+    client = get_llm_client("ollama", base_url)
+    response = await client.post(
+        f"{base_url}/api/chat",
+        json={
+            "model": model,
+            "messages": messages,
+            "stream": False,
+            "options": {
+                "temperature": temperature,
+                **({"num_predict": max_tokens} if max_tokens else {})
             }
-        )
-        data = response.json()
-        return data.get("message", {}).get("content", "")
+        }
+    )
+    if response.status_code != 200:
+        raise _provider_error("Ollama API", response)
+    data = response.json()
+    return data.get("message", {}).get("content", "")
 
 
 async def _call_openai_compatible(
@@ -259,22 +430,22 @@ async def _call_openai_compatible(
         else:
             logger.warning(f"Web search no soportado por {model}, ignorando flag")
     
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.post(
-            url,
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json=payload
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Error OpenAI API: {response.text}")
-        
-        data = response.json()
-        choice = data.get("choices", [{}])[0]
-        return choice.get("message", {}).get("content", "")
+    client = get_llm_client("openai", base_url)
+    response = await client.post(
+        url,
+        headers={
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        },
+        json=payload
+    )
+
+    if response.status_code != 200:
+        raise _provider_error("OpenAI API", response)
+
+    data = response.json()
+    choice = data.get("choices", [{}])[0]
+    return choice.get("message", {}).get("content", "")
 
 
 async def _call_anthropic(
@@ -285,18 +456,9 @@ async def _call_anthropic(
     api_key: str
 ) -> str:
     """Llamar a Anthropic Claude API"""
-    system_content = ""
-    chat_messages = []
-    
-    for msg in messages:
-        if msg["role"] == "system":
-            system_content = _extract_text(msg["content"])
-        else:
-            content = msg["content"]
-            if isinstance(content, list):
-                chat_messages.append({"role": msg["role"], "content": _content_to_anthropic(content)})
-            else:
-                chat_messages.append(msg)
+    # Todas las partes system (prompt estable + fecha...), no solo la última
+    system_parts, chat_messages = _to_anthropic_messages(messages)
+    system_content = _anthropic_system(system_parts)
     
     payload = {
         "model": model,
@@ -308,22 +470,22 @@ async def _call_anthropic(
     if system_content:
         payload["system"] = system_content
     
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.post(
-            "https://api.anthropic.com/v1/messages",
-            headers={
-                "x-api-key": api_key,
-                "anthropic-version": "2023-06-01",
-                "Content-Type": "application/json"
-            },
-            json=payload
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Error Anthropic: {response.text}")
-        
-        data = response.json()
-        return data.get("content", [{}])[0].get("text", "")
+    client = get_llm_client("anthropic", ANTHROPIC_BASE_URL)
+    response = await client.post(
+        f"{ANTHROPIC_BASE_URL}/messages",
+        headers={
+            "x-api-key": api_key,
+            "anthropic-version": "2023-06-01",
+            "Content-Type": "application/json"
+        },
+        json=payload
+    )
+
+    if response.status_code != 200:
+        raise _provider_error("Anthropic", response)
+
+    data = response.json()
+    return data.get("content", [{}])[0].get("text", "")
 
 
 async def _stream_ollama(
@@ -333,26 +495,27 @@ async def _stream_ollama(
     temperature: float
 ) -> AsyncGenerator[str, None]:
     """Streaming desde Ollama"""
-    async with httpx.AsyncClient(timeout=300.0) as client:
-        async with client.stream(
-            "POST",
-            f"{base_url}/api/chat",
-            json={
-                "model": model,
-                "messages": messages,
-                "stream": True,
-                "options": {"temperature": temperature}
-            }
-        ) as response:
-            async for line in response.aiter_lines():
-                if line:
-                    try:
-                        data = json.loads(line)
-                        content = data.get("message", {}).get("content", "")
-                        if content:
-                            yield content
-                    except json.JSONDecodeError:
-                        continue
+    client = get_llm_client("ollama", base_url)
+    async with client.stream(
+        "POST",
+        f"{base_url}/api/chat",
+        json={
+            "model": model,
+            "messages": messages,
+            "stream": True,
+            "options": {"temperature": temperature}
+        },
+        timeout=provider_transport.timeout(stream=True),
+    ) as response:
+        async for line in response.aiter_lines():
+            if line:
+                try:
+                    data = json.loads(line)
+                    content = data.get("message", {}).get("content", "")
+                    if content:
+                        yield content
+                except json.JSONDecodeError:
+                    continue
 
 
 async def _stream_openai_compatible(
@@ -380,29 +543,30 @@ async def _stream_openai_compatible(
             payload["tools"] = [{"type": "web_search"}]
             logger.info(f"Web search nativo habilitado para {model} (streaming)")
     
-    async with httpx.AsyncClient(timeout=300.0) as client:
-        async with client.stream(
-            "POST",
-            url,
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json=payload
-        ) as response:
-            async for line in response.aiter_lines():
-                if line.startswith("data: "):
-                    data_str = line[6:]
-                    if data_str.strip() == "[DONE]":
-                        break
-                    try:
-                        data = json.loads(data_str)
-                        delta = data.get("choices", [{}])[0].get("delta", {})
-                        content = delta.get("content", "")
-                        if content:
-                            yield content
-                    except json.JSONDecodeError:
-                        continue
+    client = get_llm_client("openai", base_url)
+    async with client.stream(
+        "POST",
+        url,
+        headers={
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        },
+        json=payload,
+        timeout=provider_transport.timeout(stream=True),
+    ) as response:
+        async for line in response.aiter_lines():
+            if line.startswith("data: "):
+                data_str = line[6:]
+                if data_str.strip() == "[DONE]":
+                    break
+                try:
+                    data = json.loads(data_str)
+                    delta = data.get("choices", [{}])[0].get("delta", {})
+                    content = delta.get("content", "")
+                    if content:
+                        yield content
+                except json.JSONDecodeError:
+                    continue
 
 
 async def _stream_anthropic(
@@ -412,18 +576,9 @@ async def _stream_anthropic(
     api_key: str
 ) -> AsyncGenerator[str, None]:
     """Streaming desde Anthropic"""
-    system_content = ""
-    chat_messages = []
-    
-    for msg in messages:
-        if msg["role"] == "system":
-            system_content = _extract_text(msg["content"])
-        else:
-            content = msg["content"]
-            if isinstance(content, list):
-                chat_messages.append({"role": msg["role"], "content": _content_to_anthropic(content)})
-            else:
-                chat_messages.append(msg)
+    # Todas las partes system (prompt estable + fecha...), no solo la última
+    system_parts, chat_messages = _to_anthropic_messages(messages)
+    system_content = _anthropic_system(system_parts)
     
     payload = {
         "model": model,
@@ -436,33 +591,34 @@ async def _stream_anthropic(
     if system_content:
         payload["system"] = system_content
     
-    async with httpx.AsyncClient(timeout=300.0) as client:
-        async with client.stream(
-            "POST",
-            "https://api.anthropic.com/v1/messages",
-            headers={
-                "x-api-key": api_key,
-                "anthropic-version": "2023-06-01",
-                "Content-Type": "application/json"
-            },
-            json=payload
-        ) as response:
-            async for line in response.aiter_lines():
-                if line.startswith("data: "):
-                    data_str = line[6:]
-                    try:
-                        data = json.loads(data_str)
-                        event_type = data.get("type", "")
-                        
-                        if event_type == "content_block_delta":
-                            delta = data.get("delta", {})
-                            text = delta.get("text", "")
-                            if text:
-                                yield text
-                        elif event_type == "message_stop":
-                            break
-                    except json.JSONDecodeError:
-                        continue
+    client = get_llm_client("anthropic", ANTHROPIC_BASE_URL)
+    async with client.stream(
+        "POST",
+        f"{ANTHROPIC_BASE_URL}/messages",
+        headers={
+            "x-api-key": api_key,
+            "anthropic-version": "2023-06-01",
+            "Content-Type": "application/json"
+        },
+        json=payload,
+        timeout=provider_transport.timeout(stream=True),
+    ) as response:
+        async for line in response.aiter_lines():
+            if line.startswith("data: "):
+                data_str = line[6:]
+                try:
+                    data = json.loads(data_str)
+                    event_type = data.get("type", "")
+
+                    if event_type == "content_block_delta":
+                        delta = data.get("delta", {})
+                        text = delta.get("text", "")
+                        if text:
+                            yield text
+                    elif event_type == "message_stop":
+                        break
+                except json.JSONDecodeError:
+                    continue
 
 
 async def _call_gemini(
@@ -480,25 +636,8 @@ async def _call_gemini(
     - URL: {base_url}/models/{model}:generateContent?key={api_key}
     - Format: {"contents": [{"role": "user", "parts": [{"text": "..."}]}]}
     """
-    gemini_contents = []
-    system_instruction = None
-    
-    for msg in messages:
-        role = msg["role"]
-        content = msg["content"]
-        
-        if role == "system":
-            system_instruction = _extract_text(content)
-        elif role == "user":
-            gemini_contents.append({
-                "role": "user",
-                "parts": _content_to_gemini_parts(content),
-            })
-        elif role == "assistant":
-            gemini_contents.append({
-                "role": "model",
-                "parts": _content_to_gemini_parts(content),
-            })
+    # Todas las partes system (prompt estable + fecha...), no solo la última
+    system_instruction, gemini_contents = _to_gemini_contents(messages)
     
     payload = {
         "contents": gemini_contents,
@@ -519,26 +658,26 @@ async def _call_gemini(
     
     url = f"{base_url}/models/{model}:generateContent?key={api_key}"
     
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.post(
-            url,
-            headers={"Content-Type": "application/json"},
-            json=payload
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Error Gemini API: {response.text}")
-        
-        data = response.json()
-        candidates = data.get("candidates", [])
-        if not candidates:
-            return ""
-        
-        content_parts = candidates[0].get("content", {}).get("parts", [])
-        if not content_parts:
-            return ""
-        
-        return content_parts[0].get("text", "")
+    client = get_llm_client("gemini", base_url)
+    response = await client.post(
+        url,
+        headers={"Content-Type": "application/json"},
+        json=payload
+    )
+
+    if response.status_code != 200:
+        raise _provider_error("Gemini API", response)
+
+    data = response.json()
+    candidates = data.get("candidates", [])
+    if not candidates:
+        return ""
+
+    content_parts = candidates[0].get("content", {}).get("parts", [])
+    if not content_parts:
+        return ""
+
+    return content_parts[0].get("text", "")
 
 
 async def _stream_gemini(
@@ -553,25 +692,8 @@ async def _stream_gemini(
     
     URL: {base_url}/models/{model}:streamGenerateContent?key={api_key}
     """
-    gemini_contents = []
-    system_instruction = None
-    
-    for msg in messages:
-        role = msg["role"]
-        content = msg["content"]
-        
-        if role == "system":
-            system_instruction = _extract_text(content)
-        elif role == "user":
-            gemini_contents.append({
-                "role": "user",
-                "parts": _content_to_gemini_parts(content),
-            })
-        elif role == "assistant":
-            gemini_contents.append({
-                "role": "model",
-                "parts": _content_to_gemini_parts(content),
-            })
+    # Todas las partes system (prompt estable + fecha...), no solo la última
+    system_instruction, gemini_contents = _to_gemini_contents(messages)
     
     payload = {
         "contents": gemini_contents,
@@ -589,27 +711,28 @@ async def _stream_gemini(
     
     url = f"{base_url}/models/{model}:streamGenerateContent?key={api_key}"
     
-    async with httpx.AsyncClient(timeout=300.0) as client:
-        async with client.stream(
-            "POST",
-            url,
-            headers={"Content-Type": "application/json"},
-            json=payload
-        ) as response:
-            async for line in response.aiter_lines():
-                if line.strip():
-                    try:
-                        # Gemini devuelve múltiples JSON objects separados por newlines
-                        data = json.loads(line)
-                        candidates = data.get("candidates", [])
-                        if candidates:
-                            content_parts = candidates[0].get("content", {}).get("parts", [])
-                            if content_parts:
-                                text = content_parts[0].get("text", "")
-                                if text:
-                                    yield text
-                    except json.JSONDecodeError:
-                        continue
+    client = get_llm_client("gemini", base_url)
+    async with client.stream(
+        "POST",
+        url,
+        headers={"Content-Type": "application/json"},
+        json=payload,
+        timeout=provider_transport.timeout(stream=True),
+    ) as response:
+        async for line in response.aiter_lines():
+            if line.strip():
+                try:
+                    # Gemini devuelve múltiples JSON objects separados por newlines
+                    data = json.loads(line)
+                    candidates = data.get("candidates", [])
+                    if candidates:
+                        content_parts = candidates[0].get("content", {}).get("parts", [])
+                        if content_parts:
+                            text = content_parts[0].get("text", "")
+                            if text:
+                                yield text
+                except json.JSONDecodeError:
+                    continue
 
 
 # ===========================================
@@ -635,6 +758,35 @@ class LLMToolResponse:
     tool_calls: List[ToolCall] = field(default_factory=list)
     finish_reason: str = "stop"
     usage: Optional[Dict[str, int]] = None
+    cached: bool = False  # Servida desde llm_response_cache (sin llamada al proveedor)
+
+
+def _tool_response_to_cache(response: LLMToolResponse) -> Dict[str, Any]:
+    return {
+        "content": response.content,
+        "tool_calls": [
+            {"id": tc.id, "type": tc.type, "function": tc.function}
+            for tc in response.tool_calls
+        ],
+        "finish_reason": response.finish_reason,
+        "usage": response.usage,
+    }
+
+
+def _tool_response_from_cache(data: Dict[str, Any]) -> LLMToolResponse:
+    return LLMToolResponse(
+        content=data.get("content"),
+        tool_calls=[ToolCall(**tc) for tc in data.get("tool_calls") or []],
+        finish_reason=data.get("finish_reason") or "stop",
+        usage=data.get("usage"),
+        cached=True,
+    )
+
+
+def _tool_cache_key(
+    provider_type: str, model: str, messages: List[Dict], tools: List[Dict], temperature: float
+) -> str:
+    return make_cache_key(provider_type, model, messages, tools, temperature, kind="tools")
 
 
 async def call_llm_with_tools(
@@ -644,7 +796,9 @@ async def call_llm_with_tools(
     tools: List[Dict],
     temperature: float = 0.7,
     provider_type: str = "ollama",
-    api_key: Optional[str] = None
+    api_key: Optional[str] = None,
+    prompt_cache_key: Optional[str] = None,
+    response_cache: Optional[bool] = None
 ) -> LLMToolResponse:
     """
     Llamada LLM con tools - API UNIFICADA.
@@ -659,34 +813,161 @@ async def call_llm_with_tools(
     Registra automáticamente métricas de tokens y coste en el sistema
     de monitorización si hay un contexto de ejecución activo
     (via set_llm_execution_context).
+    
+    prompt_cache_key activa el prompt caching del proveedor cuando el
+    prefijo (system prompt + tools) es estable: breakpoints cache_control
+    en Anthropic y prompt_cache_key en OpenAI.
+    
+    Con la caché de respuestas activa (response_cache o ChainConfig de la
+    ejecución) una petición idéntica se sirve desde llm_response_cache.
     """
     provider = provider_type.lower()
     
-    t0 = time.perf_counter()
+    cache_ttl = _response_cache_ttl(response_cache)
+    cache_key = None
+    if cache_ttl:
+        cache_key = _tool_cache_key(provider, model, messages, tools, temperature)
+        cached = await llm_response_cache.get(cache_key)
+        if cached is not None:
+            return _tool_response_from_cache(cached)
+    
+    async with llm_admission.slot(
+        provider, _admission_url(provider, llm_url), model, estimate_request_tokens(messages, tools)
+    ) as ticket:
+        t0 = time.perf_counter()
+        response = await _dispatch_call_llm_with_tools(
+            llm_url, model, messages, tools, temperature, provider, api_key, prompt_cache_key
+        )
+        duration_ms = (time.perf_counter() - t0) * 1000
+        ticket.record_usage(response.usage)
+    
+    # Registrar métricas en monitorización (fire-and-forget)
+    _trace_llm_monitoring(provider_type, model, response, duration_ms, messages, tools)
+    
+    if cache_key and (response.content or response.tool_calls):
+        await llm_response_cache.set(
+            cache_key, _tool_response_to_cache(response), cache_ttl, provider, model
+        )
     
+    return response
+
+
+async def _dispatch_call_llm_with_tools(
+    llm_url: str,
+    model: str,
+    messages: List[Dict],
+    tools: List[Dict],
+    temperature: float,
+    provider: str,
+    api_key: Optional[str],
+    prompt_cache_key: Optional[str]
+) -> LLMToolResponse:
+    """Selecciona la implementación de call_llm_with_tools según el proveedor."""
     if provider == "ollama":
-        response = await _call_ollama_with_tools(llm_url, model, messages, tools, temperature)
+        return await _call_ollama_with_tools(llm_url, model, messages, tools, temperature)
     elif provider in ["openai", "groq", "azure"]:
         if not api_key:
-            raise ValueError(f"API key requerida para {provider}")
-        response = await _call_openai_with_tools(llm_url, model, messages, tools, temperature, api_key)
+            raise LLMConfigError(f"API key requerida para {provider}")
+        return await _call_openai_with_tools(
+            llm_url, model, messages, tools, temperature, api_key,
+            prompt_cache_key=prompt_cache_key if provider == "openai" else None,
+        )
     elif provider == "anthropic":
         if not api_key:
-            raise ValueError("API key requerida para Anthropic")
-        response = await _call_anthropic_with_tools(model, messages, tools, temperature, api_key)
+            raise LLMConfigError("API key requerida para Anthropic")
+        return await _call_anthropic_with_tools(
+            model, messages, tools, temperature, api_key, cache=bool(prompt_cache_key)
+        )
     elif provider == "gemini":
         if not api_key:
-            raise ValueError("API key requerida para Gemini")
-        response = await _call_gemini_with_tools(llm_url, model, messages, tools, temperature, api_key)
+            raise LLMConfigError("API key requerida para Gemini")
+        return await _call_gemini_with_tools(llm_url, model, messages, tools, temperature, api_key)
     else:
-        response = await _call_ollama_with_tools(llm_url, model, messages, tools, temperature)
+        return await _call_ollama_with_tools(llm_url, model, messages, tools, temperature)
+
+
+def build_prompt_cache_key(messages: List[Dict], tools: List[Dict]) -> Optional[str]:
+    """
+    Clave estable del prefijo del prompt (primer mensaje system + tools).
     
-    duration_ms = (time.perf_counter() - t0) * 1000
+    Dos ejecuciones con el mismo system prompt y el mismo set de tools
+    obtienen la misma clave, lo que permite al proveedor enrutar ambas
+    peticiones al mismo nodo de caché.
+    """
+    if not messages or messages[0].get("role") != "system":
+        return None
+    digest = hashlib.sha256()
+    digest.update(str(messages[0].get("content") or "").encode("utf-8"))
+    digest.update(json.dumps(tools or [], sort_keys=True, default=str).encode("utf-8"))
+    return f"brain-{digest.hexdigest()[:32]}"
+
+
+def get_cached_tokens(usage: Optional[Dict[str, Any]]) -> int:
+    """
+    Tokens de prompt servidos desde la caché del proveedor.
     
-    # Registrar métricas en monitorización (fire-and-forget)
-    _trace_llm_monitoring(provider_type, model, response, duration_ms)
+    - OpenAI: usage.prompt_tokens_details.cached_tokens
+    - Anthropic: usage.cache_read_input_tokens
+    - Gemini: usageMetadata.cachedContentTokenCount (normalizado a cached_tokens)
+    """
+    if not usage:
+        return 0
+    details = usage.get("prompt_tokens_details") or {}
+    return (
+        details.get("cached_tokens")
+        or usage.get("cache_read_input_tokens")
+        or usage.get("cached_tokens")
+        or 0
+    )
+
+
+def normalize_usage(usage: Optional[Dict[str, Any]]) -> tuple:
+    """
+    (prompt_tokens, completion_tokens, cached_tokens) del usage de cualquier proveedor.
     
-    return response
+    En Anthropic input_tokens no incluye los tokens leídos/escritos en
+    caché; se suman para que prompt_tokens sea comparable con OpenAI.
+    """
+    if not usage:
+        return 0, 0, 0
+    prompt = usage.get("prompt_tokens")
+    if prompt is None:
+        prompt = (
+            (usage.get("input_tokens") or 0)
+            + (usage.get("cache_read_input_tokens") or 0)
+            + (usage.get("cache_creation_input_tokens") or 0)
+        )
+    completion = usage.get("completion_tokens")
+    if completion is None:
+        completion = usage.get("output_tokens") or 0
+    return prompt or 0, completion or 0, get_cached_tokens(usage)
+
+
+def _account_usage(
+    model: str,
+    usage: Optional[Dict[str, Any]],
+    messages: Optional[List[Dict]] = None,
+    tools: Optional[List[Dict]] = None,
+    completion: Any = None,
+) -> tuple:
+    """
+    Suma el uso de una llamada al acumulador de la ejecución.
+    
+    Si el proveedor no devolvió usage se cuenta con el tokenizador.
+    
+    Returns:
+        (prompt_tokens, completion_tokens, cached_tokens, estimated)
+    """
+    prompt, output, cached = normalize_usage(usage)
+    estimated = prompt == 0 and output == 0
+    if estimated:
+        prompt = token_counter.count_messages(messages or [], model, tools)
+        output = token_counter.count_text(completion, model)
+    
+    accumulator = get_llm_usage()
+    if accumulator is not None:
+        accumulator.add(model, prompt, output, cached, estimated=estimated)
+    return prompt, output, cached, estimated
 
 
 def _trace_llm_monitoring(
@@ -694,15 +975,21 @@ def _trace_llm_monitoring(
     model: str,
     response: "LLMToolResponse",
     duration_ms: float,
+    messages: Optional[List[Dict]] = None,
+    tools: Optional[List[Dict]] = None,
 ) -> None:
-    """Registra la llamada LLM en monitorización (fire-and-forget)."""
+    """Acumula el uso de la llamada y la registra en monitorización (fire-and-forget)."""
     ctx = _execution_context.get()
     if not ctx:
         return
 
     usage = response.usage or {}
-    tokens_input = usage.get("prompt_tokens") or usage.get("input_tokens", 0)
-    tokens_output = usage.get("completion_tokens") or usage.get("output_tokens", 0)
+    completion = response.content or ""
+    if response.tool_calls:
+        completion = [completion, [tc.function for tc in response.tool_calls]]
+    tokens_input, tokens_output, tokens_cached, estimated = _account_usage(
+        model, usage, messages, tools, completion
+    )
 
     if tokens_input == 0 and tokens_output == 0:
         return
@@ -718,6 +1005,9 @@ def _trace_llm_monitoring(
                 tokens_input=tokens_input,
                 tokens_output=tokens_output,
                 duration_ms=duration_ms,
+                tokens_cached=tokens_cached,
+                cache_creation_tokens=usage.get("cache_creation_input_tokens") or 0,
+                metadata={"usage_estimated": True} if estimated else None,
             )
         except Exception as e:
             logger.debug("trace_llm failed", error=str(e))
@@ -728,21 +1018,16 @@ def _trace_llm_monitoring(
         pass
 
 
-async def _call_ollama_with_tools(
-    base_url: str,
-    model: str,
-    messages: List[Dict],
-    tools: List[Dict],
-    temperature: float
-) -> LLMToolResponse:
+# ===========================================
+# Conversión de mensajes/tools por proveedor
+# (compartida entre llamadas normales y streaming)
+# ===========================================
+
+def _to_ollama_tools(tools: List[Dict]) -> List[Dict]:
     """
-    Ollama con tool calling NATIVO.
-    API: POST /api/chat con field 'tools'
-    
-    IMPORTANTE: Ollama espera tools en formato específico:
+    Ollama espera tools en formato específico:
     {"type": "function", "function": {"name": "...", "description": "...", "parameters": {...}}}
     """
-    # Convertir tools de formato OpenAI a formato Ollama
     ollama_tools = []
     for tool in tools:
         # Si ya está en formato Ollama, usar tal cual
@@ -758,239 +1043,98 @@ async def _call_ollama_with_tools(
                     "parameters": tool.get("parameters", {})
                 }
             })
-    
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.post(
-            f"{base_url}/api/chat",
-            json={
-                "model": model,
-                "messages": messages,
-                "tools": ollama_tools,
-                "stream": False,
-                "options": {
-                    "temperature": temperature
-                }
-            }
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Error Ollama API: {response.status_code} - {response.text}")
-        
-        data = response.json()
-        message = data.get("message", {})
-        
-        # Convertir tool_calls de Ollama a formato estándar
-        tool_calls = []
-        if "tool_calls" in message and message["tool_calls"]:
-            for idx, tc in enumerate(message["tool_calls"]):
-                # Ollama retorna: {"function": {"name": "...", "arguments": {...}}}
-                function_data = tc.get("function", {})
-                arguments = function_data.get("arguments", {})
-                
-                # Asegurar que arguments es string (algunos modelos lo retornan como dict)
-                if isinstance(arguments, dict):
-                    arguments_str = json.dumps(arguments)
-                else:
-                    arguments_str = arguments
-                
-                tool_calls.append(ToolCall(
-                    id=f"call_{idx}",  # Ollama no siempre retorna ID
-                    type="function",
-                    function={
-                        "name": function_data.get("name", ""),
-                        "arguments": arguments_str
-                    }
-                ))
-        
-        ollama_usage = None
-        if data.get("prompt_eval_count") or data.get("eval_count"):
-            ollama_usage = {
-                "prompt_tokens": data.get("prompt_eval_count", 0),
-                "completion_tokens": data.get("eval_count", 0),
-            }
-
-        return LLMToolResponse(
-            content=message.get("content"),
-            tool_calls=tool_calls,
-            finish_reason=data.get("done_reason", "stop"),
-            usage=ollama_usage,
-        )
+    return ollama_tools
 
 
-async def _call_openai_with_tools(
-    base_url: str,
-    model: str,
-    messages: List[Dict],
-    tools: List[Dict],
-    temperature: float,
-    api_key: str
-) -> LLMToolResponse:
-    """OpenAI native function calling"""
-    url = f"{base_url}/chat/completions"
-    
-    # Normalizar formato de tools: si ya vienen con "type"/"function", usar tal cual
-    # Si vienen como dict plano {name, description, parameters}, wrappear
+def _to_openai_tools(tools: List[Dict]) -> List[Dict]:
+    """
+    Normalizar formato de tools: si ya vienen con "type"/"function", usar tal cual.
+    Si vienen como dict plano {name, description, parameters}, wrappear.
+    """
     normalized_tools = []
     for tool in tools:
         if "type" in tool and tool["type"] == "function" and "function" in tool:
-            # Ya está en formato OpenAI correcto
             normalized_tools.append(tool)
         else:
-            # Wrappear en formato OpenAI
             normalized_tools.append({"type": "function", "function": tool})
-    
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.post(
-            url,
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": model,
-                "messages": messages,
-                "tools": normalized_tools,
-                "temperature": temperature,
-                "stream": False
-            }
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Error OpenAI API: {response.status_code} - {response.text}")
-        
-        data = response.json()
-        choice = data["choices"][0]
-        message = choice["message"]
-        
-        # Convertir tool_calls
-        tool_calls = []
-        if "tool_calls" in message and message["tool_calls"]:
-            for tc in message["tool_calls"]:
-                tool_calls.append(ToolCall(
-                    id=tc["id"],
-                    type=tc["type"],
-                    function=tc["function"]
-                ))
-        
-        return LLMToolResponse(
-            content=message.get("content"),
-            tool_calls=tool_calls,
-            finish_reason=choice.get("finish_reason", "stop"),
-            usage=data.get("usage")
-        )
+    return normalized_tools
 
 
-async def _call_anthropic_with_tools(
-    model: str,
-    messages: List[Dict],
-    tools: List[Dict],
-    temperature: float,
-    api_key: str
-) -> LLMToolResponse:
-    """Anthropic tool use API"""
-    system_content = ""
+def _tool_signature(tool: Dict) -> tuple:
+    """Normaliza una tool ({type, function} o {name, description, parameters}) a (name, description, parameters)."""
+    if "function" in tool:
+        func = tool["function"]
+        return func.get("name", ""), func.get("description", ""), func.get("parameters", {})
+    return tool.get("name", ""), tool.get("description", ""), tool.get("parameters", {})
+
+
+def _to_anthropic_messages(messages: List[Dict]) -> tuple:
+    """
+    Separa los mensajes system (en orden) y convierte el resto al formato Anthropic.
+    
+    Anthropic solo admite un system; se devuelven todas las partes para que
+    el caller las combine (el primero es el prefijo estable cacheable).
+    """
+    system_parts: List[str] = []
     chat_messages = []
     
     for msg in messages:
         if msg["role"] == "system":
-            system_content = _extract_text(msg["content"])
+            text = _extract_text(msg["content"])
+            if text:
+                system_parts.append(text)
         else:
             content = msg["content"]
             if isinstance(content, list):
                 chat_messages.append({"role": msg["role"], "content": _content_to_anthropic(content)})
             else:
                 chat_messages.append(msg)
-    
-    # Convertir tools a formato Anthropic
+    return system_parts, chat_messages
+
+
+def _to_anthropic_tools(tools: List[Dict], cache: bool = False) -> List[Dict]:
     anthropic_tools = []
     for tool in tools:
-        # Normalizar: puede venir como {type, function} o como {name, description, parameters}
-        if "function" in tool:
-            func = tool["function"]
-            name = func.get("name", "")
-            description = func.get("description", "")
-            parameters = func.get("parameters", {})
-        else:
-            name = tool.get("name", "")
-            description = tool.get("description", "")
-            parameters = tool.get("parameters", {})
-        
+        name, description, parameters = _tool_signature(tool)
         anthropic_tools.append({
             "name": name,
             "description": description,
             "input_schema": parameters
         })
-    
-    payload = {
-        "model": model,
-        "messages": chat_messages,
-        "tools": anthropic_tools,
-        "max_tokens": 4096,
-        "temperature": temperature
-    }
-    
-    if system_content:
-        payload["system"] = system_content
-    
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.post(
-            "https://api.anthropic.com/v1/messages",
-            headers={
-                "x-api-key": api_key,
-                "anthropic-version": "2023-06-01",
-                "Content-Type": "application/json"
-            },
-            json=payload
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Error Anthropic: {response.status_code} - {response.text}")
-        
-        data = response.json()
-        
-        # Procesar contenido y tool calls
-        content_text = ""
-        tool_calls = []
-        
-        for idx, block in enumerate(data.get("content", [])):
-            if block["type"] == "text":
-                content_text += block["text"]
-            elif block["type"] == "tool_use":
-                tool_calls.append(ToolCall(
-                    id=block["id"],
-                    type="function",
-                    function={
-                        "name": block["name"],
-                        "arguments": json.dumps(block["input"])
-                    }
-                ))
-        
-        return LLMToolResponse(
-            content=content_text if content_text else None,
-            tool_calls=tool_calls,
-            finish_reason=data.get("stop_reason", "end_turn"),
-            usage=data.get("usage")
-        )
+    if cache and anthropic_tools:
+        # Breakpoint tras la última tool: cachea todo el bloque de tools
+        anthropic_tools[-1] = {**anthropic_tools[-1], "cache_control": {"type": "ephemeral"}}
+    return anthropic_tools
 
 
-async def _call_gemini_with_tools(
-    base_url: str,
-    model: str,
-    messages: List[Dict],
-    tools: List[Dict],
-    temperature: float,
-    api_key: str
-) -> LLMToolResponse:
-    """Gemini function calling"""
+def _anthropic_system(system_parts: List[str], cache: bool = False):
+    """
+    System de Anthropic. Con caché, se envía como bloques y el primero
+    (system prompt estable) lleva un breakpoint cache_control; las partes
+    volátiles (fecha, instrucciones personales...) van detrás, fuera del prefijo.
+    """
+    if not system_parts:
+        return None
+    if not cache:
+        return "\n\n".join(system_parts)
+    blocks = [{"type": "text", "text": text} for text in system_parts]
+    blocks[0]["cache_control"] = {"type": "ephemeral"}
+    return blocks
+
+
+def _to_gemini_contents(messages: List[Dict]) -> tuple:
+    """Separa la system instruction y convierte el resto de mensajes al formato Gemini."""
     gemini_contents = []
-    system_instruction = None
+    system_parts: List[str] = []
     
     for msg in messages:
         role = msg["role"]
         content = msg["content"]
         
         if role == "system":
-            system_instruction = _extract_text(content)
+            text = _extract_text(content)
+            if text:
+                system_parts.append(text)
         elif role == "user":
             gemini_contents.append({
                 "role": "user",
@@ -1001,21 +1145,13 @@ async def _call_gemini_with_tools(
                 "role": "model",
                 "parts": _content_to_gemini_parts(content),
             })
-    
-    # Convertir tools a formato Gemini
+    return "\n\n".join(system_parts) or None, gemini_contents
+
+
+def _to_gemini_tools(tools: List[Dict]) -> List[Dict]:
     gemini_tools = []
     for tool in tools:
-        # Normalizar: puede venir como {type, function} o como {name, description, parameters}
-        if "function" in tool:
-            func = tool["function"]
-            name = func.get("name", "")
-            description = func.get("description", "")
-            parameters = func.get("parameters", {})
-        else:
-            name = tool.get("name", "")
-            description = tool.get("description", "")
-            parameters = tool.get("parameters", {})
-        
+        name, description, parameters = _tool_signature(tool)
         gemini_tools.append({
             "function_declarations": [{
                 "name": name,
@@ -1023,10 +1159,14 @@ async def _call_gemini_with_tools(
                 "parameters": parameters
             }]
         })
-    
+    return gemini_tools
+
+
+def _gemini_tools_payload(messages: List[Dict], tools: List[Dict], temperature: float) -> Dict:
+    system_instruction, gemini_contents = _to_gemini_contents(messages)
     payload = {
         "contents": gemini_contents,
-        "tools": gemini_tools,
+        "tools": _to_gemini_tools(tools),
         "generationConfig": {
             "temperature": temperature,
             "topK": 40,
@@ -1038,56 +1178,679 @@ async def _call_gemini_with_tools(
         payload["systemInstruction"] = {
             "parts": [{"text": system_instruction}]
         }
+    return payload
+
+
+def _anthropic_tools_payload(
+    model: str,
+    messages: List[Dict],
+    tools: List[Dict],
+    temperature: float,
+    cache: bool = False
+) -> Dict:
+    system_parts, chat_messages = _to_anthropic_messages(messages)
+    payload = {
+        "model": model,
+        "messages": chat_messages,
+        "tools": _to_anthropic_tools(tools, cache=cache),
+        "max_tokens": 4096,
+        "temperature": temperature
+    }
     
-    url = f"{base_url}/models/{model}:generateContent?key={api_key}"
+    system = _anthropic_system(system_parts, cache=cache)
+    if system:
+        payload["system"] = system
+    return payload
+
+
+def _anthropic_headers(api_key: str) -> Dict[str, str]:
+    return {
+        "x-api-key": api_key,
+        "anthropic-version": "2023-06-01",
+        "Content-Type": "application/json"
+    }
+
+
+def _openai_headers(api_key: str) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+async def _call_ollama_with_tools(
+    base_url: str,
+    model: str,
+    messages: List[Dict],
+    tools: List[Dict],
+    temperature: float
+) -> LLMToolResponse:
+    """
+    Ollama con tool calling NATIVO.
+    API: POST /api/chat con field 'tools'
+    """
+    client = get_llm_client("ollama", base_url)
+    response = await client.post(
+        f"{base_url}/api/chat",
+        json={
+            "model": model,
+            "messages": messages,
+            "tools": _to_ollama_tools(tools),
+            "stream": False,
+            "options": {
+                "temperature": temperature
+            }
+        }
+    )
     
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.post(
-            url,
-            headers={"Content-Type": "application/json"},
-            json=payload
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Error Gemini API: {response.status_code} - {response.text}")
-        
-        data = response.json()
-        candidates = data.get("candidates", [])
-        if not candidates:
-            return LLMToolResponse(content=None, tool_calls=[])
-        
-        content_parts = candidates[0].get("content", {}).get("parts", [])
-        
-        # Procesar contenido y function calls
-        content_text = ""
-        tool_calls = []
+    if response.status_code != 200:
+        raise _provider_error("Ollama API", response)
+    
+    data = response.json()
+    message = data.get("message", {})
+    
+    return LLMToolResponse(
+        content=message.get("content"),
+        tool_calls=_ollama_tool_calls(message.get("tool_calls")),
+        finish_reason=data.get("done_reason", "stop"),
+        usage=_ollama_usage(data),
+    )
+
+
+def _ollama_tool_calls(raw_tool_calls: Optional[List[Dict]], offset: int = 0) -> List[ToolCall]:
+    """Convertir tool_calls de Ollama a formato estándar."""
+    tool_calls = []
+    for idx, tc in enumerate(raw_tool_calls or [], start=offset):
+        # Ollama retorna: {"function": {"name": "...", "arguments": {...}}}
+        function_data = tc.get("function", {})
+        arguments = function_data.get("arguments", {})
         
-        for idx, part in enumerate(content_parts):
-            if "text" in part:
-                content_text += part["text"]
-            elif "functionCall" in part:
-                fc = part["functionCall"]
-                tool_calls.append(ToolCall(
-                    id=f"call_{idx}",
-                    type="function",
-                    function={
-                        "name": fc["name"],
-                        "arguments": json.dumps(fc.get("args", {}))
-                    }
-                ))
+        # Asegurar que arguments es string (algunos modelos lo retornan como dict)
+        if isinstance(arguments, dict):
+            arguments_str = json.dumps(arguments)
+        else:
+            arguments_str = arguments
         
-        gemini_usage = None
-        usage_meta = data.get("usageMetadata")
-        if usage_meta:
-            gemini_usage = {
-                "prompt_tokens": usage_meta.get("promptTokenCount", 0),
-                "completion_tokens": usage_meta.get("candidatesTokenCount", 0),
+        tool_calls.append(ToolCall(
+            id=f"call_{idx}",  # Ollama no siempre retorna ID
+            type="function",
+            function={
+                "name": function_data.get("name", ""),
+                "arguments": arguments_str
             }
+        ))
+    return tool_calls
+
+
+def _ollama_usage(data: Dict) -> Optional[Dict[str, int]]:
+    if data.get("prompt_eval_count") or data.get("eval_count"):
+        return {
+            "prompt_tokens": data.get("prompt_eval_count", 0),
+            "completion_tokens": data.get("eval_count", 0),
+        }
+    return None
 
-        return LLMToolResponse(
-            content=content_text if content_text else None,
-            tool_calls=tool_calls,
-            finish_reason="stop",
-            usage=gemini_usage,
+
+def _gemini_usage(data: Dict) -> Optional[Dict[str, int]]:
+    usage_meta = data.get("usageMetadata")
+    if usage_meta:
+        return {
+            "prompt_tokens": usage_meta.get("promptTokenCount", 0),
+            "completion_tokens": usage_meta.get("candidatesTokenCount", 0),
+            "cached_tokens": usage_meta.get("cachedContentTokenCount", 0),
+        }
+    return None
+
+
+async def _call_openai_with_tools(
+    base_url: str,
+    model: str,
+    messages: List[Dict],
+    tools: List[Dict],
+    temperature: float,
+    api_key: str,
+    prompt_cache_key: Optional[str] = None
+) -> LLMToolResponse:
+    """OpenAI native function calling"""
+    payload = {
+        "model": model,
+        "messages": messages,
+        "tools": _to_openai_tools(tools),
+        "temperature": temperature,
+        "stream": False
+    }
+    if prompt_cache_key:
+        payload["prompt_cache_key"] = prompt_cache_key
+    
+    client = get_llm_client("openai", base_url)
+    response = await client.post(
+        f"{base_url}/chat/completions",
+        headers=_openai_headers(api_key),
+        json=payload
+    )
+    
+    if response.status_code != 200:
+        raise _provider_error("OpenAI API", response)
+    
+    data = response.json()
+    choice = data["choices"][0]
+    message = choice["message"]
+    
+    # Convertir tool_calls
+    tool_calls = []
+    if "tool_calls" in message and message["tool_calls"]:
+        for tc in message["tool_calls"]:
+            tool_calls.append(ToolCall(
+                id=tc["id"],
+                type=tc["type"],
+                function=tc["function"]
+            ))
+    
+    return LLMToolResponse(
+        content=message.get("content"),
+        tool_calls=tool_calls,
+        finish_reason=choice.get("finish_reason", "stop"),
+        usage=data.get("usage")
+    )
+
+
+async def _call_anthropic_with_tools(
+    model: str,
+    messages: List[Dict],
+    tools: List[Dict],
+    temperature: float,
+    api_key: str,
+    cache: bool = False
+) -> LLMToolResponse:
+    """Anthropic tool use API"""
+    client = get_llm_client("anthropic", ANTHROPIC_BASE_URL)
+    response = await client.post(
+        f"{ANTHROPIC_BASE_URL}/messages",
+        headers=_anthropic_headers(api_key),
+        json=_anthropic_tools_payload(model, messages, tools, temperature, cache=cache)
+    )
+    
+    if response.status_code != 200:
+        raise _provider_error("Anthropic", response)
+    
+    data = response.json()
+    
+    # Procesar contenido y tool calls
+    content_text = ""
+    tool_calls = []
+    
+    for block in data.get("content", []):
+        if block["type"] == "text":
+            content_text += block["text"]
+        elif block["type"] == "tool_use":
+            tool_calls.append(ToolCall(
+                id=block["id"],
+                type="function",
+                function={
+                    "name": block["name"],
+                    "arguments": json.dumps(block["input"])
+                }
+            ))
+    
+    return LLMToolResponse(
+        content=content_text if content_text else None,
+        tool_calls=tool_calls,
+        finish_reason=data.get("stop_reason", "end_turn"),
+        usage=data.get("usage")
+    )
+
+
+async def _call_gemini_with_tools(
+    base_url: str,
+    model: str,
+    messages: List[Dict],
+    tools: List[Dict],
+    temperature: float,
+    api_key: str
+) -> LLMToolResponse:
+    """Gemini function calling"""
+    url = f"{base_url}/models/{model}:generateContent?key={api_key}"
+    
+    client = get_llm_client("gemini", base_url)
+    response = await client.post(
+        url,
+        headers={"Content-Type": "application/json"},
+        json=_gemini_tools_payload(messages, tools, temperature)
+    )
+    
+    if response.status_code != 200:
+        raise _provider_error("Gemini API", response)
+    
+    data = response.json()
+    candidates = data.get("candidates", [])
+    if not candidates:
+        return LLMToolResponse(content=None, tool_calls=[])
+    
+    content_parts = candidates[0].get("content", {}).get("parts", [])
+    
+    # Procesar contenido y function calls
+    content_text = ""
+    tool_calls = []
+    
+    for idx, part in enumerate(content_parts):
+        if "text" in part:
+            content_text += part["text"]
+        elif "functionCall" in part:
+            fc = part["functionCall"]
+            tool_calls.append(ToolCall(
+                id=f"call_{idx}",
+                type="function",
+                function={
+                    "name": fc["name"],
+                    "arguments": json.dumps(fc.get("args", {}))
+                }
+            ))
+    
+    return LLMToolResponse(
+        content=content_text if content_text else None,
+        tool_calls=tool_calls,
+        finish_reason="stop",
+        usage=_gemini_usage(data),
+    )
+
+
+# ===========================================
+# Tool Calling con Streaming
+# ===========================================
+
+class _ToolCallAssembler:
+    """
+    Ensambla tool calls a partir de fragmentos de streaming.
+    
+    OpenAI envía los argumentos troceados por índice; Anthropic los envía
+    como partial_json por bloque. Ambos se acumulan aquí y se convierten
+    en ToolCall al terminar el stream.
+    """
+    
+    def __init__(self):
+        self._calls: Dict[int, Dict[str, Any]] = {}
+    
+    def start(self, index: int, call_id: Optional[str] = None, name: Optional[str] = None) -> None:
+        entry = self._calls.setdefault(index, {"id": None, "name": "", "arguments": []})
+        if call_id:
+            entry["id"] = call_id
+        if name:
+            entry["name"] += name
+    
+    def add_arguments(self, index: int, fragment: str) -> None:
+        if fragment:
+            self._calls.setdefault(index, {"id": None, "name": "", "arguments": []})["arguments"].append(fragment)
+    
+    def __bool__(self) -> bool:
+        return bool(self._calls)
+    
+    def build(self) -> List[ToolCall]:
+        tool_calls = []
+        for index in sorted(self._calls):
+            entry = self._calls[index]
+            tool_calls.append(ToolCall(
+                id=entry["id"] or f"call_{index}",
+                type="function",
+                function={
+                    "name": entry["name"],
+                    "arguments": "".join(entry["arguments"]) or "{}"
+                }
+            ))
+        return tool_calls
+
+
+async def call_llm_with_tools_stream(
+    llm_url: str,
+    model: str,
+    messages: List[Dict],
+    tools: List[Dict],
+    temperature: float = 0.7,
+    provider_type: str = "ollama",
+    api_key: Optional[str] = None,
+    prompt_cache_key: Optional[str] = None,
+    response_cache: Optional[bool] = None
+) -> AsyncGenerator[Union[str, LLMToolResponse], None]:
+    """
+    Variante streaming de call_llm_with_tools.
+    
+    Yields:
+        str con cada delta de texto en cuanto llega del proveedor, y como
+        último elemento el LLMToolResponse ensamblado (contenido completo,
+        tool calls con argumentos completos, finish_reason y usage).
+    
+    Registra métricas en monitorización igual que call_llm_with_tools.
+    Un acierto de la caché de respuestas emite el contenido en un solo delta.
+    """
+    provider = provider_type.lower()
+    
+    cache_ttl = _response_cache_ttl(response_cache)
+    cache_key = None
+    if cache_ttl:
+        cache_key = _tool_cache_key(provider, model, messages, tools, temperature)
+        cached = await llm_response_cache.get(cache_key)
+        if cached is not None:
+            cached_response = _tool_response_from_cache(cached)
+            if cached_response.content:
+                yield cached_response.content
+            yield cached_response
+            return
+    
+    if provider in ["openai", "groq", "azure"]:
+        if not api_key:
+            raise LLMConfigError(f"API key requerida para {provider}")
+        stream = _stream_openai_with_tools(
+            llm_url, model, messages, tools, temperature, api_key,
+            include_usage=(provider == "openai"),
+            prompt_cache_key=prompt_cache_key if provider == "openai" else None,
+        )
+    elif provider == "anthropic":
+        if not api_key:
+            raise LLMConfigError("API key requerida para Anthropic")
+        stream = _stream_anthropic_with_tools(
+            model, messages, tools, temperature, api_key, cache=bool(prompt_cache_key)
+        )
+    elif provider == "gemini":
+        if not api_key:
+            raise LLMConfigError("API key requerida para Gemini")
+        stream = _stream_gemini_with_tools(llm_url, model, messages, tools, temperature, api_key)
+    else:
+        stream = _stream_ollama_with_tools(llm_url, model, messages, tools, temperature)
+    
+    # El hueco de admisión se mantiene mientras dura el stream
+    response: Optional[LLMToolResponse] = None
+    async with llm_admission.slot(
+        provider, _admission_url(provider, llm_url), model, estimate_request_tokens(messages, tools)
+    ) as ticket:
+        t0 = time.perf_counter()
+        async for item in stream:
+            if isinstance(item, LLMToolResponse):
+                response = item
+            else:
+                yield item
+        
+        if response is None:
+            response = LLMToolResponse()
+        duration_ms = (time.perf_counter() - t0) * 1000
+        ticket.record_usage(response.usage)
+    
+    _trace_llm_monitoring(provider_type, model, response, duration_ms, messages, tools)
+    
+    if cache_key and (response.content or response.tool_calls):
+        await llm_response_cache.set(
+            cache_key, _tool_response_to_cache(response), cache_ttl, provider, model
         )
+    
+    yield response
+
+
+async def _raise_for_stream_status(response: httpx.Response, label: str) -> None:
+    if response.status_code != 200:
+        body = await response.aread()
+        raise _provider_error(label, response, body.decode(errors='replace'))
+
+
+async def _stream_ollama_with_tools(
+    base_url: str,
+    model: str,
+    messages: List[Dict],
+    tools: List[Dict],
+    temperature: float
+) -> AsyncGenerator[Union[str, LLMToolResponse], None]:
+    """
+    Ollama streaming con tools.
+    Los tool_calls llegan completos en un chunk; el texto llega troceado.
+    """
+    content_parts: List[str] = []
+    tool_calls: List[ToolCall] = []
+    finish_reason = "stop"
+    usage = None
+    
+    client = get_llm_client("ollama", base_url)
+    async with client.stream(
+        "POST",
+        f"{base_url}/api/chat",
+        json={
+            "model": model,
+            "messages": messages,
+            "tools": _to_ollama_tools(tools),
+            "stream": True,
+            "options": {"temperature": temperature}
+        },
+        timeout=provider_transport.timeout(stream=True),
+    ) as response:
+        await _raise_for_stream_status(response, "Ollama API")
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            message = data.get("message", {})
+            content = message.get("content", "")
+            if content:
+                content_parts.append(content)
+                yield content
+            if message.get("tool_calls"):
+                tool_calls.extend(_ollama_tool_calls(message["tool_calls"], offset=len(tool_calls)))
+            if data.get("done"):
+                finish_reason = data.get("done_reason", "stop")
+                usage = _ollama_usage(data)
+                break
+    
+    yield LLMToolResponse(
+        content="".join(content_parts) or None,
+        tool_calls=tool_calls,
+        finish_reason=finish_reason,
+        usage=usage,
+    )
+
+
+async def _stream_openai_with_tools(
+    base_url: str,
+    model: str,
+    messages: List[Dict],
+    tools: List[Dict],
+    temperature: float,
+    api_key: str,
+    include_usage: bool = False,
+    prompt_cache_key: Optional[str] = None
+) -> AsyncGenerator[Union[str, LLMToolResponse], None]:
+    """OpenAI-compatible streaming con function calling (delta.tool_calls por índice)."""
+    payload = {
+        "model": model,
+        "messages": messages,
+        "tools": _to_openai_tools(tools),
+        "temperature": temperature,
+        "stream": True
+    }
+    if include_usage:
+        payload["stream_options"] = {"include_usage": True}
+    if prompt_cache_key:
+        payload["prompt_cache_key"] = prompt_cache_key
+    
+    content_parts: List[str] = []
+    assembler = _ToolCallAssembler()
+    finish_reason = "stop"
+    usage = None
+    
+    client = get_llm_client("openai", base_url)
+    async with client.stream(
+        "POST",
+        f"{base_url}/chat/completions",
+        headers=_openai_headers(api_key),
+        json=payload,
+        timeout=provider_transport.timeout(stream=True),
+    ) as response:
+        await _raise_for_stream_status(response, "OpenAI API")
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data_str = line[6:]
+            if data_str.strip() == "[DONE]":
+                break
+            try:
+                data = json.loads(data_str)
+            except json.JSONDecodeError:
+                continue
+            
+            if data.get("usage"):
+                usage = data["usage"]
+            choices = data.get("choices") or []
+            if not choices:
+                continue
+            choice = choices[0]
+            delta = choice.get("delta") or {}
+            
+            content = delta.get("content")
+            if content:
+                content_parts.append(content)
+                yield content
+            
+            for tc in delta.get("tool_calls") or []:
+                index = tc.get("index", 0)
+                function = tc.get("function") or {}
+                assembler.start(index, call_id=tc.get("id"), name=function.get("name"))
+                assembler.add_arguments(index, function.get("arguments", ""))
+            
+            if choice.get("finish_reason"):
+                finish_reason = choice["finish_reason"]
+    
+    yield LLMToolResponse(
+        content="".join(content_parts) or None,
+        tool_calls=assembler.build(),
+        finish_reason=finish_reason,
+        usage=usage,
+    )
+
+
+async def _stream_anthropic_with_tools(
+    model: str,
+    messages: List[Dict],
+    tools: List[Dict],
+    temperature: float,
+    api_key: str,
+    cache: bool = False
+) -> AsyncGenerator[Union[str, LLMToolResponse], None]:
+    """Anthropic streaming con tool use (content_block_* + input_json_delta)."""
+    payload = _anthropic_tools_payload(model, messages, tools, temperature, cache=cache)
+    payload["stream"] = True
+    
+    content_parts: List[str] = []
+    assembler = _ToolCallAssembler()
+    finish_reason = "end_turn"
+    usage: Dict[str, int] = {}
+    
+    client = get_llm_client("anthropic", ANTHROPIC_BASE_URL)
+    async with client.stream(
+        "POST",
+        f"{ANTHROPIC_BASE_URL}/messages",
+        headers=_anthropic_headers(api_key),
+        json=payload,
+        timeout=provider_transport.timeout(stream=True),
+    ) as response:
+        await _raise_for_stream_status(response, "Anthropic")
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            try:
+                data = json.loads(line[6:])
+            except json.JSONDecodeError:
+                continue
+            event_type = data.get("type", "")
+            
+            if event_type == "message_start":
+                usage.update((data.get("message") or {}).get("usage") or {})
+            elif event_type == "content_block_start":
+                block = data.get("content_block") or {}
+                if block.get("type") == "tool_use":
+                    assembler.start(data.get("index", 0), call_id=block.get("id"), name=block.get("name"))
+            elif event_type == "content_block_delta":
+                delta = data.get("delta") or {}
+                if delta.get("type") == "input_json_delta":
+                    assembler.add_arguments(data.get("index", 0), delta.get("partial_json", ""))
+                else:
+                    text = delta.get("text", "")
+                    if text:
+                        content_parts.append(text)
+                        yield text
+            elif event_type == "message_delta":
+                delta = data.get("delta") or {}
+                if delta.get("stop_reason"):
+                    finish_reason = delta["stop_reason"]
+                usage.update(data.get("usage") or {})
+            elif event_type == "message_stop":
+                break
+            elif event_type == "error":
+                raise Exception(f"Error Anthropic: {data.get('error')}")
+    
+    yield LLMToolResponse(
+        content="".join(content_parts) or None,
+        tool_calls=assembler.build(),
+        finish_reason=finish_reason,
+        usage=usage or None,
+    )
+
 
+async def _stream_gemini_with_tools(
+    base_url: str,
+    model: str,
+    messages: List[Dict],
+    tools: List[Dict],
+    temperature: float,
+    api_key: str
+) -> AsyncGenerator[Union[str, LLMToolResponse], None]:
+    """
+    Gemini streaming con function calling.
+    
+    Usa alt=sse para recibir un chunk JSON por línea "data: ...".
+    Los functionCall llegan completos dentro de un chunk.
+    """
+    url = f"{base_url}/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
+    
+    content_parts: List[str] = []
+    tool_calls: List[ToolCall] = []
+    usage = None
+    
+    client = get_llm_client("gemini", base_url)
+    async with client.stream(
+        "POST",
+        url,
+        headers={"Content-Type": "application/json"},
+        json=_gemini_tools_payload(messages, tools, temperature),
+        timeout=provider_transport.timeout(stream=True),
+    ) as response:
+        await _raise_for_stream_status(response, "Gemini API")
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            try:
+                data = json.loads(line[6:])
+            except json.JSONDecodeError:
+                continue
+            
+            usage = _gemini_usage(data) or usage
+            candidates = data.get("candidates", [])
+            if not candidates:
+                continue
+            for part in candidates[0].get("content", {}).get("parts", []):
+                if part.get("text"):
+                    content_parts.append(part["text"])
+                    yield part["text"]
+                elif "functionCall" in part:
+                    fc = part["functionCall"]
+                    tool_calls.append(ToolCall(
+                        id=f"call_{len(tool_calls)}",
+                        type="function",
+                        function={
+                            "name": fc["name"],
+                            "arguments": json.dumps(fc.get("args", {}))
+                        }
+                    ))
+    
+    yield LLMToolResponse(
+        content="".join(content_parts) or None,
+        tool_calls=tool_calls,
+        finish_reason="stop",
+        usage=usage,
+    )
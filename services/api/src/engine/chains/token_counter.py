@@ -0,0 +1,182 @@
+"""
+Token Counter - Conteo de tokens por modelo y contabilidad de uso.
+
+- TokenCounter: tokenizadores BPE (tiktoken) cargados una sola vez por
+  encoding y reutilizados; si tiktoken no está disponible o el modelo no
+  es de la familia OpenAI se usa un estimador por caracteres.
+- UsageAccumulator: suma el `usage` real que devuelven los proveedores en
+  todas las llamadas LLM de una ejecución (iteraciones + subagentes). Las
+  llamadas sin usage reportado se estiman con el TokenCounter y se marcan.
+"""
+
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import structlog
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+logger = structlog.get_logger()
+
+# Overhead por mensaje del formato chat (role + separadores)
+TOKENS_PER_MESSAGE = 3
+TOKENS_REPLY_PRIMING = 3
+
+# Encoding por prefijo de modelo. Para modelos no OpenAI se usa la
+# aproximación más cercana (o200k/cl100k) o el estimador por caracteres.
+MODEL_ENCODINGS: Dict[str, str] = {
+    "gpt-4o": "o200k_base",
+    "gpt-4.1": "o200k_base",
+    "gpt-5": "o200k_base",
+    "o1": "o200k_base",
+    "o3": "o200k_base",
+    "o4": "o200k_base",
+    "gpt-4": "cl100k_base",
+    "gpt-3.5": "cl100k_base",
+    "text-embedding": "cl100k_base",
+}
+DEFAULT_ENCODING = "cl100k_base"
+
+# Caracteres por token del estimador de respaldo
+FALLBACK_CHARS_PER_TOKEN = 4
+
+
+class TokenCounter:
+    """Cuenta tokens con el tokenizador del modelo (cacheado por encoding)."""
+
+    def __init__(self):
+        self._encodings: Dict[str, Any] = {}
+        self._model_encoding: Dict[str, Optional[str]] = {}
+        self._failed: set = set()
+
+    def _encoding_name(self, model: Optional[str]) -> Optional[str]:
+        if not model:
+            return DEFAULT_ENCODING
+        cached = self._model_encoding.get(model)
+        if cached is not None or model in self._model_encoding:
+            return cached
+        name = model.lower().split("/")[-1]
+        best = None
+        for prefix, encoding in MODEL_ENCODINGS.items():
+            if name.startswith(prefix) and (best is None or len(prefix) > len(best[0])):
+                best = (prefix, encoding)
+        encoding_name = best[1] if best else DEFAULT_ENCODING
+        self._model_encoding[model] = encoding_name
+        return encoding_name
+
+    def _get_encoding(self, model: Optional[str]):
+        if tiktoken is None:
+            return None
+        name = self._encoding_name(model)
+        if not name or name in self._failed:
+            return None
+        encoding = self._encodings.get(name)
+        if encoding is None:
+            try:
+                encoding = tiktoken.get_encoding(name)
+            except Exception as e:
+                # Sin acceso a la descarga del BPE: usar el estimador
+                logger.warning("Tokenizer not available, using estimator", encoding=name, error=str(e))
+                self._failed.add(name)
+                return None
+            self._encodings[name] = encoding
+        return encoding
+
+    @staticmethod
+    def estimate(text: str) -> int:
+        """Estimador de respaldo (~4 caracteres por token)."""
+        if not text:
+            return 0
+        return max(1, len(text) // FALLBACK_CHARS_PER_TOKEN)
+
+    def count_text(self, text: Any, model: Optional[str] = None) -> int:
+        if text is None:
+            return 0
+        if not isinstance(text, str):
+            text = json.dumps(text, ensure_ascii=False, default=str)
+        if not text:
+            return 0
+        encoding = self._get_encoding(model)
+        if encoding is None:
+            return self.estimate(text)
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def count_messages(
+        self,
+        messages: List[Dict],
+        model: Optional[str] = None,
+        tools: Optional[List[Dict]] = None,
+    ) -> int:
+        """Tokens de entrada de una petición chat (mensajes + tools)."""
+        total = TOKENS_REPLY_PRIMING
+        for msg in messages or []:
+            total += TOKENS_PER_MESSAGE
+            content = msg.get("content")
+            if isinstance(content, list):
+                # Multimodal: solo cuenta el texto
+                content = " ".join(
+                    p.get("text", "") for p in content if isinstance(p, dict) and p.get("type") == "text"
+                )
+            total += self.count_text(content, model)
+            if msg.get("tool_calls"):
+                total += self.count_text(msg["tool_calls"], model)
+            if msg.get("name"):
+                total += 1
+        if tools:
+            total += self.count_text(tools, model)
+        return total
+
+
+token_counter = TokenCounter()
+
+
+@dataclass
+class UsageAccumulator:
+    """Uso de tokens acumulado de una ejecución (todas las llamadas LLM)."""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    calls: int = 0
+    estimated_calls: int = 0
+    by_model: Dict[str, Dict[str, int]] = field(default_factory=dict)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(
+        self,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        cached_tokens: int = 0,
+        estimated: bool = False,
+    ) -> None:
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += cached_tokens
+        self.calls += 1
+        if estimated:
+            self.estimated_calls += 1
+        entry = self.by_model.setdefault(
+            model or "unknown", {"prompt_tokens": 0, "completion_tokens": 0, "calls": 0}
+        )
+        entry["prompt_tokens"] += prompt_tokens
+        entry["completion_tokens"] += completion_tokens
+        entry["calls"] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "cached_tokens": self.cached_tokens,
+            "calls": self.calls,
+            "estimated_calls": self.estimated_calls,
+            "by_model": self.by_model,
+        }
@@ -25,6 +25,7 @@ from .models import (
 )
 from .registry import chain_registry
 from .chains.llm_utils import set_llm_execution_context, clear_llm_execution_context
+from .chains.llm_cache import chain_cache_ttl
 from src.providers import get_active_llm_provider
 
 logger = structlog.get_logger()
@@ -151,7 +152,9 @@ class ChainExecutor:
         
         # Trazar inicio de ejecución
         start_time = time.perf_counter()
-        set_llm_execution_context(execution_state.execution_id, chain_id)
+        set_llm_execution_context(
+            execution_state.execution_id, chain_id, chain_cache_ttl(definition.config)
+        )
         asyncio.create_task(_trace_execution(
             execution_id=execution_state.execution_id,
             chain_id=chain_id,
@@ -293,7 +296,7 @@ class ChainExecutor:
         start_time = time.perf_counter()
         
         # Establecer contexto para que call_llm_with_tools registre métricas
-        set_llm_execution_context(execution_id, chain_id)
+        set_llm_execution_context(execution_id, chain_id, chain_cache_ttl(definition.config))
         
         # Trazar inicio de ejecución
         asyncio.create_task(_trace_execution(
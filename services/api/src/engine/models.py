@@ -84,6 +84,14 @@ class ChainConfig(BaseModel):
     # Agent iteration config
     max_iterations: int = 15  # Límite de iteraciones del agente (configurable)
     ask_before_continue: bool = True  # Preguntar al usuario antes de superar el límite
+    stream_llm_tokens: bool = True  # Emitir el texto del LLM token a token (tool calling en streaming)
+    max_parallel_tools: int = 4  # Tools independientes ejecutadas a la vez en un turno (1 = secuencial)
+    context_token_budget: Optional[int] = None  # Presupuesto de tokens del prompt (None = settings; ambos None = 75% de la ventana del modelo; 0 = sin compactar)
+    prompt_caching: bool = True  # Prefijo estable (system + tools) cacheable por el proveedor
+    response_cache: bool = False  # Reutilizar respuestas LLM idénticas (llm_cache); para tareas deterministas
+    response_cache_ttl: int = 3600  # segundos
+    llm_fallbacks: list[dict[str, Any]] = Field(default_factory=list)  # [{"provider_id"|"provider_name", "model"}] en orden de preferencia, misma familia de proveedor que el principal
+    hedge_percentile: Optional[float] = None  # p.ej. 0.95: duplicar la petición al backup si el principal supera su p95
     
     # Otros
     timeout: int = 300  # segundos
@@ -90,6 +90,41 @@ async def lifespan(app: FastAPI):
         await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS chain_versions_chain_version_idx ON chain_versions (brain_chain_id, version_number)")
     except Exception:
         pass
+
+    try:
+        await db.execute("ALTER TABLE api_metrics ADD COLUMN IF NOT EXISTS ttfb_ms FLOAT")
+    except Exception:
+        pass
+
+    try:
+        from src.monitoring.partitions import monitoring_partitions
+        # Particiones del día; el relleno de rollups y la retención con DELETE
+        # de tablas sin convertir van en la tarea de background
+        await monitoring_partitions.maintain()
+        monitoring_partitions.start()
+    except Exception as e:
+        logger.warning(f"No se pudo mantener el particionado de monitorización: {e}")
+
+    try:
+        from src.engine.chains.llm_cache import llm_response_cache
+        await llm_response_cache.ensure_table()
+        llm_response_cache.start()
+    except Exception as e:
+        logger.warning(f"No se pudo preparar llm_response_cache: {e}")
+
+    try:
+        from src.engine.chains.llm_admission import llm_admission
+        configured = await llm_admission.load_provider_limits()
+        if configured:
+            logger.info(f"Límites de admisión LLM cargados para {configured} proveedores")
+    except Exception as e:
+        logger.warning(f"No se pudieron cargar límites de admisión LLM: {e}")
+
+    try:
+        from src.rag.storage import rag_storage
+        await rag_storage.ensure_schema()
+    except Exception as e:
+        logger.warning(f"No se pudo preparar el esquema RAG: {e}")
     
     # Cargar TODOS los asistentes desde BD
     try:
@@ -168,6 +203,12 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.warning(f"Could not schedule pricing preload: {e}")
 
+    # Escritura en lote de métricas y trazas de monitorización
+    from src.monitoring.writer import monitoring_writer
+    from src.monitoring import monitoring_service
+    monitoring_writer.start()
+    monitoring_service.start_alert_evaluation()
+
     # Sandbox cleanup background task
     async def _sandbox_cleanup_loop():
         import asyncio as _aio
@@ -199,11 +240,34 @@ async def lifespan(app: FastAPI):
     await browser_service.shutdown()
     logger.info("Servicio de navegador cerrado")
     
+    # Cerrar procesos de extracción de la ingesta RAG
+    from src.rag.pipeline import extraction_pool
+    extraction_pool.shutdown()
+
+    # Cerrar clientes HTTP persistentes hacia proveedores LLM
+    from src.engine.chains.llm_transport import provider_transport
+    await provider_transport.aclose()
+    logger.info("Clientes HTTP de proveedores LLM cerrados")
+
     # Cerrar conexiones SQLite per-user
     from src.db.user_db import user_db
     await user_db.close_all()
     logger.info("Conexiones SQLite de usuario cerradas")
 
+    # Volcar métricas y trazas pendientes antes de cerrar el pool
+    await monitoring_service.stop_alert_evaluation()
+    await monitoring_writer.stop()
+    from src.monitoring.partitions import monitoring_partitions
+    await monitoring_partitions.stop()
+    logger.info("Métricas de monitorización volcadas")
+
+    # Builds de índices RAG en segundo plano (usan conexiones del pool)
+    from src.rag.storage import rag_storage
+    await rag_storage.stop()
+
+    from src.engine.chains.llm_cache import llm_response_cache
+    await llm_response_cache.stop()
+
     # Cerrar conexión a base de datos
     await db.disconnect()
     logger.info("Conexión a PostgreSQL cerrada")
@@ -1,30 +1,94 @@
 """
 Monitoring Middleware - Captura métricas de todas las requests HTTP
+
+Middleware ASGI puro: no usa BaseHTTPMiddleware, así que no envuelve el
+iterador de las StreamingResponse (/v1/chat/completions, /invoke/stream...).
+Solo observa los mensajes que la aplicación envía por `send`:
+
+- http.response.start  -> status code y content-length
+- http.response.body   -> bytes enviados; el primer cuerpo no vacío marca el
+                          TTFB y el último (more_body=False) la latencia total
+
+En SSE el TTFB es el tiempo hasta el primer evento, que es lo que percibe el
+usuario; latency_ms es hasta el último byte.
 """
 
+import os
 import time
-import asyncio
-from typing import Callable
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
+from collections import OrderedDict
+from typing import Optional, Tuple
+from urllib.parse import parse_qs
+
 import structlog
 
 logger = structlog.get_logger()
 
+JWT_SECRET = os.environ.get("JWT_SECRET", "brain-secret-key-change-in-production")
+JWT_ALGORITHM = "HS256"
+
+
+class _IdentityCache:
+    """
+    user_id por token JWT, válido hasta el `exp` del token.
+
+    Evita decodificar (y verificar la firma de) el mismo token en cada
+    request. Los tokens inválidos se recuerdan poco tiempo para no repetir el
+    intento en cada llamada.
+    """
+
+    MAX_ENTRIES = 4096
+    NO_EXP_TTL = 300.0
+    INVALID_TTL = 60.0
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+
+    def user_id(self, token: str) -> Optional[str]:
+        now = time.time()
+        entry = self._entries.get(token)
+        if entry is not None:
+            user_id, expires_at = entry
+            if expires_at > now:
+                self._entries.move_to_end(token)
+                return user_id
+            del self._entries[token]
+
+        user_id, expires_at = self._decode(token, now)
+        self._entries[token] = (user_id, expires_at)
+        while len(self._entries) > self.MAX_ENTRIES:
+            self._entries.popitem(last=False)
+        return user_id
+
+    def _decode(self, token: str, now: float) -> Tuple[Optional[str], float]:
+        try:
+            import jwt as pyjwt
+            payload = pyjwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        except Exception:
+            return None, now + self.INVALID_TTL
+        user_id = payload.get("email") or payload.get("sub")
+        exp = payload.get("exp")
+        expires_at = float(exp) if isinstance(exp, (int, float)) else now + self.NO_EXP_TTL
+        return user_id, expires_at
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+identity_cache = _IdentityCache()
+
 
-class MonitoringMiddleware(BaseHTTPMiddleware):
+class MonitoringMiddleware:
     """
     Middleware para capturar métricas de todas las requests HTTP.
-    
+
     Captura:
     - Endpoint y método
     - Status code
-    - Latencia
-    - Tamaño de request/response
+    - Latencia hasta el primer byte (TTFB) y hasta el último
+    - Tamaño de request/response (bytes realmente enviados en streaming)
     - Errores
     """
-    
+
     # Endpoints a excluir del tracking (health checks, etc.)
     EXCLUDED_PATHS = {
         "/health",
@@ -32,108 +96,128 @@ class MonitoringMiddleware(BaseHTTPMiddleware):
         "/api/v1/monitoring/health",
         "/favicon.ico"
     }
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # Excluir ciertos paths
-        if request.url.path in self.EXCLUDED_PATHS:
-            return await call_next(request)
-        
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.EXCLUDED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
         # Medir tiempo
         start_time = time.perf_counter()
-        
+        headers = dict(scope.get("headers") or [])
+
         # Obtener tamaño de request
         request_size = 0
-        if request.headers.get("content-length"):
+        content_length = headers.get(b"content-length")
+        if content_length:
             try:
-                request_size = int(request.headers.get("content-length", 0))
+                request_size = int(content_length)
             except ValueError:
                 pass
-        
-        # Extraer user_id del JWT token (Authorization header) o fallback a X-User-ID
-        user_id = None
-        auth_header = request.headers.get("authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            try:
-                import jwt as pyjwt
-                import os
-                secret = os.environ.get("JWT_SECRET", "brain-secret-key-change-in-production")
-                token = auth_header.split(" ", 1)[1]
-                payload = pyjwt.decode(token, secret, algorithms=["HS256"])
-                user_id = payload.get("email") or payload.get("sub")
-            except Exception:
-                pass
-        if not user_id:
-            user_id = request.headers.get("X-User-ID") or request.query_params.get("user_id")
-        
-        # Ejecutar request
+
+        state = {
+            "status_code": 500,
+            "response_size": 0,
+            "body_messages": 0,
+            "ttfb": None,
+            "last_byte": None,
+        }
+
+        async def send_wrapper(message):
+            message_type = message["type"]
+            if message_type == "http.response.start":
+                state["status_code"] = message["status"]
+            elif message_type == "http.response.body":
+                body = message.get("body", b"")
+                state["response_size"] += len(body)
+                state["body_messages"] += 1
+                more_body = message.get("more_body", False)
+                if state["ttfb"] is None and (body or not more_body):
+                    state["ttfb"] = time.perf_counter()
+                if not more_body:
+                    state["last_byte"] = time.perf_counter()
+            await send(message)
+
         error_message = None
-        status_code = 500
-        response_size = 0
-        
         try:
-            response = await call_next(request)
-            status_code = response.status_code
-            
-            # Intentar obtener tamaño de response
-            if hasattr(response, "headers"):
-                content_length = response.headers.get("content-length")
-                if content_length:
-                    try:
-                        response_size = int(content_length)
-                    except ValueError:
-                        pass
-            
+            await self.app(scope, receive, send_wrapper)
         except Exception as e:
             error_message = str(e)
-            logger.error(f"Request error: {e}", path=request.url.path)
+            logger.error(f"Request error: {e}", path=scope["path"])
             raise
-        
         finally:
-            # Calcular latencia
-            latency_ms = (time.perf_counter() - start_time) * 1000
-            
-            # Guardar métrica (async, no bloquea la response)
-            asyncio.create_task(
-                self._save_metric(
-                    endpoint=request.url.path,
-                    method=request.method,
-                    status_code=status_code,
-                    latency_ms=latency_ms,
-                    request_size=request_size,
-                    response_size=response_size,
-                    user_id=user_id,
-                    error_message=error_message
-                )
+            end_time = state["last_byte"] or time.perf_counter()
+            ttfb_ms = (state["ttfb"] - start_time) * 1000 if state["ttfb"] is not None else None
+
+            metadata = None
+            if state["body_messages"] > 1:
+                metadata = {"streaming": True, "chunks": state["body_messages"]}
+
+            # Encolar métrica (el volcado a BD es en lote, ver monitoring/writer.py)
+            self._record_metric(
+                endpoint=scope["path"],
+                method=scope["method"],
+                status_code=state["status_code"],
+                latency_ms=(end_time - start_time) * 1000,
+                ttfb_ms=ttfb_ms,
+                request_size=request_size,
+                response_size=state["response_size"],
+                user_id=self._user_id(scope, headers),
+                error_message=error_message,
+                metadata=metadata
             )
-        
-        return response
-    
-    async def _save_metric(
+
+    @staticmethod
+    def _user_id(scope, headers: dict) -> Optional[str]:
+        """user_id del JWT (Authorization) o fallback a X-User-ID / ?user_id="""
+        auth_header = headers.get(b"authorization", b"").decode("latin-1")
+        if auth_header.startswith("Bearer "):
+            user_id = identity_cache.user_id(auth_header[7:].strip())
+            if user_id:
+                return user_id
+        user_id = headers.get(b"x-user-id")
+        if user_id:
+            return user_id.decode("latin-1")
+        query_string = scope.get("query_string") or b""
+        if b"user_id=" in query_string:
+            values = parse_qs(query_string.decode("latin-1")).get("user_id")
+            if values:
+                return values[0]
+        return None
+
+    def _record_metric(
         self,
         endpoint: str,
         method: str,
         status_code: int,
         latency_ms: float,
+        ttfb_ms: Optional[float],
         request_size: int,
         response_size: int,
         user_id: str = None,
-        error_message: str = None
+        error_message: str = None,
+        metadata: dict = None
     ) -> None:
-        """Guardar métrica en la base de datos"""
+        """Encolar métrica para la escritura en lote"""
         try:
             from ..monitoring import monitoring_service
-            
-            await monitoring_service.record_request(
+
+            monitoring_service.record_request(
                 endpoint=endpoint,
                 method=method,
                 status_code=status_code,
                 latency_ms=latency_ms,
+                ttfb_ms=ttfb_ms,
                 request_size=request_size,
                 response_size=response_size,
                 user_id=user_id,
-                error_message=error_message
+                error_message=error_message,
+                metadata=metadata
             )
-            
+
         except Exception as e:
             # No fallar si hay error guardando métrica
             logger.warning(f"Error saving metric: {e}")
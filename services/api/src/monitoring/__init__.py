@@ -7,7 +7,12 @@ Incluye cálculo dinámico de costes LLM via models.dev.
 
 from .service import MonitoringService, monitoring_service
 from .repository import MonitoringRepository
+from .writer import MonitoringWriter, monitoring_writer
+from .aggregates import MonitoringAggregates, monitoring_aggregates
+from .partitions import MonitoringPartitionManager, monitoring_partitions
+from .dashboard import DashboardSnapshotService, dashboard_snapshots
 from .pricing import PricingService, pricing_service
+from .cache_stats import CacheStatsRegistry, cache_stats
 from .models import (
     ApiMetric,
     ExecutionTrace,
@@ -20,8 +25,18 @@ __all__ = [
     "MonitoringService",
     "monitoring_service",
     "MonitoringRepository",
+    "MonitoringWriter",
+    "monitoring_writer",
+    "MonitoringAggregates",
+    "monitoring_aggregates",
+    "MonitoringPartitionManager",
+    "monitoring_partitions",
+    "DashboardSnapshotService",
+    "dashboard_snapshots",
     "PricingService",
     "pricing_service",
+    "CacheStatsRegistry",
+    "cache_stats",
     "ApiMetric",
     "ExecutionTrace",
     "MonitoringAlert",
@@ -0,0 +1,246 @@
+"""
+Monitoring Aggregates - Agregados en memoria para evaluar alertas
+
+Las reglas de ALERT_RULES se evalúan con un timer (MonitoringService) sobre
+agregados del propio proceso, sin consultar api_metrics/execution_traces en
+cada 5xx o en cada llamada LLM:
+
+- RollingWindow: contadores por buckets de tiempo (BUCKET_SECONDS) con
+  requests, errores 5xx e histogramas de latencia y TTFB; una ventana de N
+  minutos es la fusión de sus buckets.
+- LatencyHistogram: sketch de cuantiles con buckets logarítmicos (estilo HDR,
+  error relativo ~1%). Es fusionable: sumar dos histogramas da el de la unión.
+- DailyCost: coste LLM acumulado del día UTC. El total sale de BD (seed, que
+  incluye a todos los workers) al arrancar, al cambiar de día y cada
+  SEED_MAX_AGE_SECONDS; entre seeds se suma en memoria lo de este proceso.
+
+Los agregados son por proceso: con varios workers cada uno evalúa su tráfico.
+"""
+
+import math
+import time
+from collections import deque
+from datetime import date, datetime, timezone
+from typing import Any, Deque, Dict, Iterable, Optional, Tuple
+
+BUCKET_SECONDS = 10
+# Ventana máxima consultable (la de las reglas es de 5 minutos)
+MAX_WINDOW_SECONDS = 15 * 60
+# Error relativo de los cuantiles
+HISTOGRAM_PRECISION = 0.01
+# Antigüedad máxima del total de BD del coste diario (gasto de otros workers)
+SEED_MAX_AGE_SECONDS = 300
+
+
+class LatencyHistogram:
+    """Histograma con buckets logarítmicos para cuantiles aproximados."""
+
+    _GAMMA = 1 + 2 * HISTOGRAM_PRECISION
+    _LOG_GAMMA = math.log(_GAMMA)
+
+    def __init__(self):
+        self._counts: Dict[int, int] = {}
+        self._zero = 0  # valores <= 1 µs
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value_ms: float) -> None:
+        if value_ms is None or value_ms < 0:
+            return
+        if value_ms <= 0.001:
+            self._zero += 1
+        else:
+            index = math.ceil(math.log(value_ms) / self._LOG_GAMMA)
+            self._counts[index] = self._counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        for index, count in other._counts.items():
+            self._counts[index] = self._counts.get(index, 0) + count
+        self._zero += other._zero
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self._zero
+        if seen > rank:
+            return 0.0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen > rank:
+                # Punto medio del bucket (γ^(i-1), γ^i]
+                value = 2 * self._GAMMA ** index / (self._GAMMA + 1)
+                return min(value, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+
+class _Bucket:
+    __slots__ = ("start", "requests", "errors", "latency", "ttfb")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.requests = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+        self.ttfb = LatencyHistogram()
+
+
+class RollingWindow:
+    """Buckets de BUCKET_SECONDS con las requests HTTP de los últimos minutos."""
+
+    def __init__(self, bucket_seconds: int = BUCKET_SECONDS, max_window_seconds: int = MAX_WINDOW_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.max_buckets = max(1, max_window_seconds // bucket_seconds)
+        self._buckets: Deque[_Bucket] = deque()
+
+    def _bucket(self, now: float) -> _Bucket:
+        start = int(now // self.bucket_seconds) * self.bucket_seconds
+        if not self._buckets or self._buckets[-1].start != start:
+            self._buckets.append(_Bucket(start))
+            self._expire(now)
+        return self._buckets[-1]
+
+    def _expire(self, now: float) -> None:
+        oldest = now - self.max_buckets * self.bucket_seconds
+        while self._buckets and self._buckets[0].start < oldest:
+            self._buckets.popleft()
+
+    def record(self, status_code: int, latency_ms: float, ttfb_ms: Optional[float] = None,
+               now: Optional[float] = None) -> None:
+        bucket = self._bucket(time.time() if now is None else now)
+        bucket.requests += 1
+        if status_code >= 500:
+            bucket.errors += 1
+        bucket.latency.record(latency_ms)
+        if ttfb_ms is not None:
+            bucket.ttfb.record(ttfb_ms)
+
+    def _window(self, minutes: float, now: float) -> Iterable[_Bucket]:
+        since = now - minutes * 60
+        return [b for b in self._buckets if b.start + self.bucket_seconds > since]
+
+    def summary(self, minutes: float, now: Optional[float] = None) -> Dict[str, Any]:
+        """Agregado de los últimos `minutes` minutos."""
+        now = time.time() if now is None else now
+        requests = errors = 0
+        latency, ttfb = LatencyHistogram(), LatencyHistogram()
+        for bucket in self._window(minutes, now):
+            requests += bucket.requests
+            errors += bucket.errors
+            latency.merge(bucket.latency)
+            ttfb.merge(bucket.ttfb)
+        return {
+            "window_minutes": minutes,
+            "request_count": requests,
+            "error_count": errors,
+            "error_rate": errors / requests if requests else 0.0,
+            "avg_latency_ms": latency.mean,
+            "p50_latency_ms": latency.quantile(0.50),
+            "p95_latency_ms": latency.quantile(0.95),
+            "p99_latency_ms": latency.quantile(0.99),
+            "max_latency_ms": latency.max if latency.count else None,
+            "p95_ttfb_ms": ttfb.quantile(0.95),
+        }
+
+
+class DailyCost:
+    """Coste LLM del día UTC en curso."""
+
+    def __init__(self):
+        self.day = self._today()
+        self.total_usd = 0.0
+        self.calls = 0
+        self.seeded = False
+        self.seeded_at: Optional[float] = None
+        # Coste sumado en este proceso desde el inicio del día (solo crece)
+        self._local_usd = 0.0
+
+    @staticmethod
+    def _today() -> date:
+        return datetime.now(timezone.utc).date()
+
+    def _roll(self) -> None:
+        today = self._today()
+        if today != self.day:
+            # Día nuevo: el gasto de los demás workers solo está en BD, volver a hacer seed
+            self.day, self.total_usd, self.calls = today, 0.0, 0
+            self._local_usd = 0.0
+            self.seeded, self.seeded_at = False, None
+
+    def add(self, cost_usd: Optional[float]) -> None:
+        self._roll()
+        self.calls += 1
+        if cost_usd:
+            self.total_usd += cost_usd
+            self._local_usd += cost_usd
+
+    def needs_seed(self, max_age: float = SEED_MAX_AGE_SECONDS) -> bool:
+        self._roll()
+        return not self.seeded or time.monotonic() - self.seeded_at > max_age
+
+    def begin_seed(self) -> Tuple[date, float]:
+        """Marca tomada justo antes de consultar el total de BD (ver seed)."""
+        self._roll()
+        return self.day, self._local_usd
+
+    def seed(self, total_usd: float, mark: Tuple[date, float]) -> None:
+        """
+        Sustituir el total por el de BD (todos los workers, incluido este).
+
+        Solo se suma lo registrado aquí desde `mark`: puede no estar aún en la
+        consulta. Un seed que empezó el día anterior se descarta.
+        """
+        day, local_at_mark = mark
+        self._roll()
+        if day != self.day:
+            return
+        self.total_usd = total_usd + (self._local_usd - local_at_mark)
+        self.seeded, self.seeded_at = True, time.monotonic()
+
+    @property
+    def today_usd(self) -> float:
+        self._roll()
+        return self.total_usd
+
+
+class MonitoringAggregates:
+    """Agregados del proceso: ventana de requests HTTP + coste diario."""
+
+    def __init__(self):
+        self.requests = RollingWindow()
+        self.cost = DailyCost()
+
+    def record_request(self, status_code: int, latency_ms: float, ttfb_ms: Optional[float] = None) -> None:
+        self.requests.record(status_code, latency_ms, ttfb_ms)
+
+    def record_llm_cost(self, cost_usd: Optional[float]) -> None:
+        self.cost.add(cost_usd)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "last_minute": self.requests.summary(1),
+            "last_5_minutes": self.requests.summary(5),
+            "daily_cost": {
+                "day": self.cost.day.isoformat(),
+                "total_usd": round(self.cost.today_usd, 6),
+                "llm_calls": self.cost.calls,
+                "seeded_from_db": self.cost.seeded,
+            },
+        }
+
+
+# Instancia global
+monitoring_aggregates = MonitoringAggregates()
@@ -0,0 +1,69 @@
+"""
+Cache Stats - Contadores en memoria de las cachés de la API
+
+Las cachés del motor (respuestas LLM, embeddings, búsquedas RAG...) registran
+aquí sus aciertos/fallos por nombre y tier. Los contadores se consultan desde
+el router de monitorización (/monitoring/caches).
+"""
+
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+
+class CacheStatsRegistry:
+    """
+    Registro process-wide de contadores de caché.
+
+    Cada caché se identifica por nombre ("llm_response", "embeddings"...).
+    Los aciertos se desglosan por tier ("memory", "postgres"...).
+    """
+
+    def __init__(self):
+        self._hits: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._misses: Dict[str, int] = defaultdict(int)
+        self._extra: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._since = time.time()
+
+    def hit(self, cache: str, tier: str = "memory", amount: int = 1) -> None:
+        self._hits[cache][tier] += amount
+
+    def miss(self, cache: str, amount: int = 1) -> None:
+        self._misses[cache] += amount
+
+    def incr(self, cache: str, counter: str, amount: int = 1) -> None:
+        """Contador adicional (stores, evictions, invalidations...)."""
+        self._extra[cache][counter] += amount
+
+    def snapshot(self, cache: Optional[str] = None) -> Dict[str, dict]:
+        """Contadores por caché con su hit rate."""
+        names = set(self._hits) | set(self._misses) | set(self._extra)
+        if cache:
+            names &= {cache}
+        result = {}
+        for name in sorted(names):
+            hits_by_tier = dict(self._hits.get(name, {}))
+            hits = sum(hits_by_tier.values())
+            misses = self._misses.get(name, 0)
+            total = hits + misses
+            result[name] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "hits_by_tier": hits_by_tier,
+                **dict(self._extra.get(name, {})),
+            }
+        return result
+
+    @property
+    def since(self) -> float:
+        return self._since
+
+    def reset(self) -> None:
+        self._hits.clear()
+        self._misses.clear()
+        self._extra.clear()
+        self._since = time.time()
+
+
+cache_stats = CacheStatsRegistry()
@@ -0,0 +1,153 @@
+"""
+Dashboard Snapshots - DashboardStats compartido entre todos los viewers
+
+Cada refresco del dashboard de cada admin lanzaba seis consultas en serie.
+Ahora hay un único snapshot por proceso:
+
+- Los seis agregados se calculan en paralelo (MonitoringService.compute_dashboard_stats).
+- Fresco durante `monitoring_dashboard_ttl` segundos.
+- Stale-while-revalidate: hasta `monitoring_dashboard_stale_ttl` se sirve el
+  snapshot anterior y se refresca en background.
+- Single-flight: las peticiones concurrentes esperan al mismo cálculo.
+- stream(): eventos SSE con el snapshot inicial y después solo los campos que
+  cambian, en vez de que cada cliente haga polling.
+
+Los aciertos/fallos se registran en cache_stats con el nombre "monitoring_dashboard".
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+import structlog
+
+from ..config import get_settings
+from .cache_stats import cache_stats
+from .models import DashboardStats
+
+logger = structlog.get_logger()
+
+CACHE_NAME = "monitoring_dashboard"
+# Comentario SSE para mantener viva la conexión cuando no hay cambios
+KEEPALIVE_SECONDS = 15.0
+
+
+class DashboardSnapshotService:
+    """Caché TTL + stale-while-revalidate + single-flight de DashboardStats."""
+
+    def __init__(self, compute: Callable[[], Awaitable[DashboardStats]]):
+        self._compute = compute
+        self._snapshot: Optional[DashboardStats] = None
+        self._computed_at = 0.0
+        self._version = 0
+        self._inflight: Optional[asyncio.Task] = None
+
+    @property
+    def ttl(self) -> float:
+        return get_settings().monitoring_dashboard_ttl
+
+    @property
+    def stale_ttl(self) -> float:
+        return max(self.ttl, get_settings().monitoring_dashboard_stale_ttl)
+
+    async def get(self) -> DashboardStats:
+        """Snapshot vigente (o el anterior mientras se recalcula)."""
+        snapshot, _ = await self.get_versioned()
+        return snapshot
+
+    async def get_versioned(self) -> Tuple[DashboardStats, int]:
+        age = time.monotonic() - self._computed_at
+        if self._snapshot is not None and age < self.ttl:
+            cache_stats.hit(CACHE_NAME, "memory")
+            return self._snapshot, self._version
+
+        if self._snapshot is not None and age < self.stale_ttl:
+            cache_stats.hit(CACHE_NAME, "stale")
+            self._refresh()
+            return self._snapshot, self._version
+
+        cache_stats.miss(CACHE_NAME)
+        try:
+            # shield: si este cliente se va, el cálculo sigue para los demás
+            await asyncio.shield(self._refresh())
+        except Exception:
+            if self._snapshot is None:
+                raise
+            cache_stats.incr(CACHE_NAME, "stale_on_error")
+        return self._snapshot, self._version
+
+    def _refresh(self) -> asyncio.Task:
+        """Lanzar (o reutilizar) el cálculo en curso."""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._recompute())
+            # Los refrescos en background pueden fallar sin nadie esperándolos
+            self._inflight.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return self._inflight
+
+    async def _recompute(self) -> None:
+        started = time.perf_counter()
+        try:
+            snapshot = await self._compute()
+        except Exception as e:
+            cache_stats.incr(CACHE_NAME, "errors")
+            logger.warning(f"Dashboard snapshot failed: {e}")
+            raise
+        if self._snapshot is None or snapshot.model_dump() != self._snapshot.model_dump():
+            self._version += 1
+        self._snapshot = snapshot
+        self._computed_at = time.monotonic()
+        cache_stats.incr(CACHE_NAME, "refreshes")
+        logger.debug("Dashboard snapshot computed", ms=round((time.perf_counter() - started) * 1000, 1))
+
+    def invalidate(self) -> None:
+        """Forzar el recálculo en la siguiente lectura (p.ej. tras reconocer una alerta)."""
+        self._computed_at = 0.0
+
+    async def stream(self, is_disconnected: Callable[[], Awaitable[bool]]) -> AsyncIterator[str]:
+        """
+        Eventos SSE: "snapshot" con el DashboardStats completo y después
+        "delta" con los campos de primer nivel que cambian.
+        """
+        snapshot, version = await self.get_versioned()
+        last = snapshot.model_dump(mode="json")
+        yield f"data: {json.dumps({'event': 'snapshot', 'version': version, 'stats': last})}\n\n"
+
+        quiet = 0.0
+        interval = max(1.0, self.ttl)
+        while not await is_disconnected():
+            await asyncio.sleep(interval)
+            try:
+                snapshot, new_version = await self.get_versioned()
+            except Exception as e:
+                yield f"data: {json.dumps({'event': 'error', 'error': str(e)})}\n\n"
+                continue
+            if new_version == version:
+                quiet += interval
+                if quiet >= KEEPALIVE_SECONDS:
+                    quiet = 0.0
+                    yield ": keep-alive\n\n"
+                continue
+            current = snapshot.model_dump(mode="json")
+            changes: Dict[str, Any] = {k: v for k, v in current.items() if last.get(k) != v}
+            version, last, quiet = new_version, current, 0.0
+            yield f"data: {json.dumps({'event': 'delta', 'version': version, 'changes': changes})}\n\n"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self._version,
+            "age_seconds": round(time.monotonic() - self._computed_at, 2) if self._snapshot else None,
+            "ttl_seconds": self.ttl,
+            "stale_ttl_seconds": self.stale_ttl,
+            "refreshing": self._inflight is not None and not self._inflight.done(),
+            **cache_stats.snapshot(CACHE_NAME).get(CACHE_NAME, {}),
+        }
+
+
+def _compute_dashboard_stats() -> Awaitable[DashboardStats]:
+    from .service import monitoring_service
+    return monitoring_service.compute_dashboard_stats()
+
+
+# Instancia global
+dashboard_snapshots = DashboardSnapshotService(_compute_dashboard_stats)
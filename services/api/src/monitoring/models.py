@@ -15,6 +15,7 @@ class ApiMetric(BaseModel):
     method: str
     status_code: int
     latency_ms: float
+    ttfb_ms: Optional[float] = None  # tiempo hasta el primer byte del cuerpo
     request_size: Optional[int] = None
     response_size: Optional[int] = None
     user_id: Optional[str] = None
@@ -0,0 +1,483 @@
+"""
+Monitoring Partitions - Particionado diario, rollups y retención
+
+api_metrics y execution_traces pasan a ser tablas particionadas por rango
+diario de `timestamp` (UTC), gestionadas por la API:
+
+- Las instalaciones nuevas ya crean las tablas particionadas
+  (database/init/02-monitoring.sql) y maintain() convierte sola una tabla
+  sin particionar que esté vacía.
+- convert(): convierte las tablas existentes con datos (una vez). Es una
+  operación de administrador (POST /monitoring/partitions/convert), no se
+  ejecuta al arrancar. Los pasos largos (CHECK NOT VALID + VALIDATE,
+  índice de la nueva PK con CREATE INDEX CONCURRENTLY) no bloquean las
+  inserciones; después, en una transacción corta con lock_timeout, la tabla
+  original se conserva como partición `<tabla>_legacy` que cubre hasta el
+  día siguiente al actual y se crea la partición DEFAULT.
+- maintain(): crea las tablas de rollup (ver rollups.py) que falten, crea
+  las particiones de los próximos días y aplica la retención: DROP de las
+  particiones enteras más antiguas que `monitoring_retention_days` (sin
+  DELETE ni VACUUM) y purga de los rollups. Se ejecuta al arrancar y cada
+  MAINTENANCE_INTERVAL_SECONDS.
+- purge_unpartitioned(): mientras una tabla con datos no esté convertida, su
+  retención es con DELETE por lotes, en la tarea de background.
+- backfill_rollups(): relleno desde los datos crudos de los rollups recién
+  creados, en la tarea de background (no en el arranque). Lo pendiente queda
+  en monitoring_rollup_backfill, así que un relleno interrumpido se repite.
+
+Cada paso toma un advisory lock de transacción: con varios workers solo uno
+migra o mantiene a la vez.
+"""
+
+import asyncio
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import structlog
+
+from ..config import get_settings
+from ..db.connection import get_db
+from .rollups import ROLLUP_BACKFILL, ROLLUP_DDL
+
+logger = structlog.get_logger()
+
+PARTITIONED_TABLES = ("api_metrics", "execution_traces")
+MAINTENANCE_INTERVAL_SECONDS = 3600
+_LOCK_KEY = "monitoring_partitions"
+_CONVERT_LOCK_KEY = "monitoring_partitions_convert"
+CONVERT_LOCK_TIMEOUT = "5s"
+# Filas por DELETE de la retención de tablas sin particionar
+RETENTION_DELETE_BATCH = 5000
+_BOUND_TO = re.compile(r"TO \('([^']+)'\)")
+
+# Índices de las tablas padre (se propagan a todas las particiones)
+_INDEXES = {
+    "api_metrics": [
+        "CREATE INDEX IF NOT EXISTS idx_api_metrics_timestamp ON api_metrics (timestamp DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_api_metrics_endpoint ON api_metrics (endpoint)",
+        "CREATE INDEX IF NOT EXISTS idx_api_metrics_status ON api_metrics (status_code)",
+    ],
+    "execution_traces": [
+        "CREATE INDEX IF NOT EXISTS idx_execution_traces_execution_id ON execution_traces (execution_id)",
+        "CREATE INDEX IF NOT EXISTS idx_execution_traces_timestamp ON execution_traces (timestamp DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_execution_traces_chain_id ON execution_traces (chain_id)",
+        "CREATE INDEX IF NOT EXISTS idx_execution_traces_event_type ON execution_traces (event_type)",
+    ],
+}
+
+# Rollups pendientes de rellenar desde los datos crudos (backfill_rollups)
+_BACKFILL_DDL = """
+    CREATE TABLE IF NOT EXISTS monitoring_rollup_backfill (
+        rollup VARCHAR(100) PRIMARY KEY,
+        since TIMESTAMPTZ NOT NULL,
+        until_id BIGINT NOT NULL,
+        created_at TIMESTAMPTZ DEFAULT NOW()
+    )
+"""
+
+# Las vistas de 02-monitoring.sql siguen a la tabla renombrada: se recrean sobre la nueva
+_VIEWS = [
+    """
+    CREATE OR REPLACE VIEW hourly_metrics AS
+    SELECT
+        date_trunc('hour', timestamp) as hour,
+        endpoint,
+        COUNT(*) as request_count,
+        AVG(latency_ms) as avg_latency_ms,
+        PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY latency_ms) as p95_latency_ms,
+        COUNT(*) FILTER (WHERE status_code >= 500) as error_count,
+        COUNT(*) FILTER (WHERE status_code >= 200 AND status_code < 300) as success_count
+    FROM api_metrics
+    WHERE timestamp > NOW() - INTERVAL '7 days'
+    GROUP BY date_trunc('hour', timestamp), endpoint
+    ORDER BY hour DESC
+    """,
+    """
+    CREATE OR REPLACE VIEW chain_stats AS
+    SELECT
+        chain_id,
+        date_trunc('day', timestamp) as day,
+        COUNT(DISTINCT execution_id) as executions,
+        AVG(duration_ms) FILTER (WHERE event_type = 'chain_end') as avg_duration_ms,
+        SUM(tokens_input) as total_tokens_input,
+        SUM(tokens_output) as total_tokens_output,
+        SUM(cost_usd) as total_cost_usd,
+        COUNT(*) FILTER (WHERE success = false) as error_count
+    FROM execution_traces
+    WHERE timestamp > NOW() - INTERVAL '30 days'
+    GROUP BY chain_id, date_trunc('day', timestamp)
+    ORDER BY day DESC, chain_id
+    """,
+]
+
+
+def _utc_day(moment: datetime) -> datetime:
+    return moment.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _partition_name(table: str, day: datetime) -> str:
+    return f"{table}_p{day:%Y%m%d}"
+
+
+class MonitoringPartitionManager:
+    """Particiones diarias + rollups + retención de las tablas de monitorización."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.last_maintenance: Optional[Dict[str, Any]] = None
+        self.last_purge: Optional[Dict[str, Any]] = None
+
+    # ============================================
+    # Esquema
+    # ============================================
+
+    async def convert(self) -> Dict[str, Any]:
+        """Convertir a particionadas las tablas que aún no lo son (operación de administrador)."""
+        converted = [table for table in PARTITIONED_TABLES if await self._convert_table(table)]
+        report = await self.maintain()
+        return {**report, "converted": converted + report["converted"]}
+
+    async def _convert_table(self, table: str, only_if_empty: bool = False) -> bool:
+        """Convertir una tabla sin particionar. False si ya lo está o (only_if_empty) tiene filas."""
+        db = get_db()
+        async with db.pool.acquire() as conn:
+            if await self._relkind(conn, table) != "r":
+                return False
+            if only_if_empty and await conn.fetchval(f"SELECT EXISTS (SELECT 1 FROM {table})"):
+                return False
+            # Una sola réplica prepara y convierte a la vez
+            if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", _CONVERT_LOCK_KEY):
+                return False
+            try:
+                upper = await self._prepare(conn, table)
+                async with conn.transaction():
+                    await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", _LOCK_KEY)
+                    # Mejor fallar y reintentar que encolar las inserciones tras el ACCESS EXCLUSIVE
+                    await conn.execute(f"SET LOCAL lock_timeout = '{CONVERT_LOCK_TIMEOUT}'")
+                    if await self._relkind(conn, table) != "r":
+                        return False
+                    await self._convert(conn, table, upper)
+                    for statement in _INDEXES[table]:
+                        await conn.execute(statement)
+                    await conn.execute(
+                        f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"
+                    )
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", _CONVERT_LOCK_KEY)
+        return True
+
+    @staticmethod
+    async def _relkind(conn, table: str) -> Optional[str]:
+        return await conn.fetchval(
+            "SELECT relkind::text FROM pg_class WHERE oid = to_regclass($1)", table
+        )
+
+    async def _prepare(self, conn, table: str) -> datetime:
+        """
+        Pasos largos de la conversión, fuera de la transacción que renombra.
+
+        ADD CONSTRAINT ... NOT VALID solo toma el lock un instante, VALIDATE
+        recorre la tabla con SHARE UPDATE EXCLUSIVE (las inserciones siguen) y el
+        índice único de la futura PK se construye CONCURRENTLY. Con la CHECK
+        validada, SET NOT NULL y ATTACH PARTITION no vuelven a recorrer la tabla.
+        """
+        latest = await conn.fetchval(f"SELECT MAX(timestamp) FROM {table}")
+        # Un día de margen: las filas que lleguen hasta el ATTACH deben cumplir la CHECK
+        upper = _utc_day(datetime.now(timezone.utc)) + timedelta(days=2)
+        if latest is not None:
+            upper = max(upper, _utc_day(latest) + timedelta(days=1))
+
+        # La clave de partición no admite NULL (la columna tiene DEFAULT NOW())
+        await conn.execute(f"UPDATE {table} SET timestamp = 'epoch' WHERE timestamp IS NULL")
+        await conn.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_partition_bound")
+        await conn.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {table}_partition_bound "
+            f"CHECK (timestamp IS NOT NULL AND timestamp < '{upper.isoformat()}') NOT VALID"
+        )
+        await conn.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {table}_partition_bound")
+
+        # Un CREATE INDEX CONCURRENTLY interrumpido deja el índice inválido
+        index = f"{table}_legacy_pkey"
+        valid = await conn.fetchval(
+            "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", index
+        )
+        if valid is False:
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+        await conn.execute(
+            f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {table} (id, timestamp)"
+        )
+        return upper
+
+    async def _convert(self, conn, table: str, upper: datetime) -> None:
+        """Tabla normal -> particionada; los datos existentes quedan en <tabla>_legacy."""
+        legacy = f"{table}_legacy"
+        await conn.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        # Los índices existentes se renombran y CREATE INDEX en la padre los adopta (sin reconstruir)
+        for statement in _INDEXES[table]:
+            index_name = statement.split(" ON ")[0].rsplit(" ", 1)[-1]
+            await conn.execute(
+                f"ALTER INDEX IF EXISTS {index_name} RENAME TO {index_name.replace(table, legacy, 1)}"
+            )
+        # Sin recorrer la tabla: la CHECK validada ya garantiza NOT NULL
+        await conn.execute(f"ALTER TABLE {legacy} ALTER COLUMN timestamp SET NOT NULL")
+        # La PK pasa a ser (id, timestamp) sobre el índice construido en _prepare
+        await conn.execute(f"ALTER TABLE {legacy} DROP CONSTRAINT IF EXISTS {table}_pkey")
+        await conn.execute(
+            f"ALTER TABLE {legacy} ADD CONSTRAINT {legacy}_pkey PRIMARY KEY USING INDEX {legacy}_pkey"
+        )
+
+        await conn.execute(
+            f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)"
+        )
+        await conn.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id, timestamp)")
+        # La secuencia del SERIAL pasa a la tabla padre: DROP de la legacy no la borra
+        await conn.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+        # La CHECK implica el rango de la partición: ATTACH no recorre la tabla
+        await conn.execute(
+            f"ALTER TABLE {table} ATTACH PARTITION {legacy} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{upper.isoformat()}')"
+        )
+        await conn.execute(f"ALTER TABLE {legacy} DROP CONSTRAINT {table}_partition_bound")
+        for view in _VIEWS:
+            if f"FROM {table}" in view:
+                await conn.execute(view)
+        logger.info(f"{table} convertida a tabla particionada", legacy_until=upper.isoformat())
+
+    async def _ensure_rollups(self, conn) -> None:
+        """Crear los rollups que falten; su relleno queda pendiente para backfill_rollups()."""
+        settings = get_settings()
+        await conn.execute(_BACKFILL_DDL)
+        existing = {
+            row["relname"]
+            for row in await conn.fetch(
+                "SELECT relname FROM pg_class WHERE relname = ANY($1::text[]) AND relkind = 'r'",
+                list(ROLLUP_BACKFILL),
+            )
+        }
+        for statement in ROLLUP_DDL:
+            await conn.execute(statement)
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_api_user_activity_hour_user ON api_user_activity_hour (user_id, bucket DESC)"
+        )
+        now = datetime.now(timezone.utc)
+        for name, (source, _) in ROLLUP_BACKFILL.items():
+            if name in existing:
+                continue
+            since = now - (
+                timedelta(hours=settings.monitoring_minute_rollup_retention_hours)
+                if name == "api_metrics_minute"
+                else timedelta(days=settings.monitoring_hour_rollup_retention_days)
+            )
+            # Lo que se escriba desde ahora lo suma MonitoringWriter
+            until_id = await conn.fetchval(f"SELECT COALESCE(MAX(id), 0) FROM {source}")
+            await conn.execute(
+                "INSERT INTO monitoring_rollup_backfill (rollup, since, until_id) VALUES ($1, $2, $3) "
+                "ON CONFLICT (rollup) DO NOTHING",
+                name, since, until_id,
+            )
+            logger.info(f"Rollup {name} creado; relleno desde datos crudos pendiente")
+
+    async def backfill_rollups(self) -> List[str]:
+        """
+        Rellenar desde los datos crudos los rollups pendientes. Cada uno en su
+        transacción (relleno + borrado de la marca); otra réplica que ya lo
+        esté rellenando se salta con SKIP LOCKED.
+        """
+        done = []
+        db = get_db()
+        async with db.pool.acquire() as conn:
+            if await self._relkind(conn, "monitoring_rollup_backfill") is None:
+                return done
+            names = [row["rollup"] for row in await conn.fetch("SELECT rollup FROM monitoring_rollup_backfill")]
+            for name in names:
+                if name not in ROLLUP_BACKFILL:
+                    continue
+                async with conn.transaction():
+                    row = await conn.fetchrow(
+                        "SELECT since, until_id FROM monitoring_rollup_backfill "
+                        "WHERE rollup = $1 FOR UPDATE SKIP LOCKED",
+                        name,
+                    )
+                    if row is None:
+                        continue
+                    await conn.execute(ROLLUP_BACKFILL[name][1], row["since"], row["until_id"])
+                    await conn.execute("DELETE FROM monitoring_rollup_backfill WHERE rollup = $1", name)
+                done.append(name)
+                logger.info(f"Rollup {name} rellenado desde datos crudos")
+        return done
+
+    async def purge_unpartitioned(self) -> Dict[str, int]:
+        """
+        Retención con DELETE por lotes de las tablas que aún no están
+        particionadas (hasta que un administrador las convierta). Corre en la
+        tarea de background: la primera purga de una tabla grande es larga.
+        """
+        settings = get_settings()
+        cutoff = _utc_day(datetime.now(timezone.utc)) - timedelta(days=settings.monitoring_retention_days)
+        deleted: Dict[str, int] = {}
+        db = get_db()
+        async with db.pool.acquire() as conn:
+            for table in PARTITIONED_TABLES:
+                if await self._relkind(conn, table) == "r":
+                    deleted[table] = await self._delete_expired(conn, table, cutoff)
+        if any(deleted.values()):
+            logger.info("Retención de monitorización con DELETE (tablas sin particionar)", **deleted)
+        self.last_purge = {"at": datetime.now(timezone.utc).isoformat(), "deleted": deleted}
+        return deleted
+
+    async def _delete_expired(self, conn, table: str, cutoff: datetime) -> int:
+        total = 0
+        while True:
+            status = await conn.execute(
+                f"DELETE FROM {table} WHERE id IN "
+                f"(SELECT id FROM {table} WHERE timestamp < $1 LIMIT {RETENTION_DELETE_BATCH})",
+                cutoff,
+            )
+            deleted = int(status.split()[-1]) if status else 0
+            total += deleted
+            if deleted < RETENTION_DELETE_BATCH:
+                return total
+
+    # ============================================
+    # Mantenimiento
+    # ============================================
+
+    async def _partitions(self, conn, table: str) -> List[Tuple[str, Optional[datetime]]]:
+        """(nombre, límite superior) de cada partición; None para la DEFAULT."""
+        rows = await conn.fetch(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass($1)
+            """,
+            table,
+        )
+        partitions = []
+        for row in rows:
+            match = _BOUND_TO.search(row["bound"] or "")
+            upper = datetime.fromisoformat(match.group(1)) if match else None
+            partitions.append((row["relname"], upper))
+        return partitions
+
+    async def maintain(self) -> Dict[str, Any]:
+        """Crear particiones futuras, borrar las caducadas y purgar rollups."""
+        settings = get_settings()
+        today = _utc_day(datetime.now(timezone.utc))
+        cutoff = today - timedelta(days=settings.monitoring_retention_days)
+        report: Dict[str, Any] = {"created": [], "dropped": [], "failed": [], "converted": []}
+
+        # Una tabla vacía se convierte sin coste (p.ej. BD creada antes del particionado)
+        for table in PARTITIONED_TABLES:
+            try:
+                if await self._convert_table(table, only_if_empty=True):
+                    report["converted"].append(table)
+            except Exception as e:
+                logger.warning(f"No se pudo convertir {table} a particionada: {e}")
+
+        db = get_db()
+        async with db.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", _LOCK_KEY)
+                await self._ensure_rollups(conn)
+                for table in PARTITIONED_TABLES:
+                    if await self._relkind(conn, table) != "p":
+                        continue
+                    partitions = await self._partitions(conn, table)
+                    names = {name for name, _ in partitions}
+                    covered_until = max((u for _, u in partitions if u is not None), default=None)
+
+                    for offset in range(settings.monitoring_partition_days_ahead + 1):
+                        day = today + timedelta(days=offset)
+                        name = _partition_name(table, day)
+                        if name in names or (covered_until is not None and day < covered_until):
+                            continue
+                        try:
+                            async with conn.transaction():
+                                await conn.execute(
+                                    f"CREATE TABLE {name} PARTITION OF {table} "
+                                    f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+                                )
+                            report["created"].append(name)
+                        except Exception as e:
+                            # p.ej. la partición DEFAULT ya tiene filas de ese día
+                            report["failed"].append(name)
+                            logger.warning(f"No se pudo crear la partición {name}: {e}")
+
+                    for name, upper in partitions:
+                        if upper is not None and upper <= cutoff:
+                            await conn.execute(f"DROP TABLE {name}")
+                            report["dropped"].append(name)
+                    # Filas que cayeron en DEFAULT (días sin partición)
+                    await conn.execute(f"DELETE FROM {table}_default WHERE timestamp < $1", cutoff)
+
+                await conn.execute(
+                    "DELETE FROM api_metrics_minute WHERE bucket < $1",
+                    datetime.now(timezone.utc) - timedelta(hours=settings.monitoring_minute_rollup_retention_hours),
+                )
+                hour_cutoff = today - timedelta(days=settings.monitoring_hour_rollup_retention_days)
+                for rollup in ("api_metrics_hour", "api_user_activity_hour", "execution_traces_hour"):
+                    await conn.execute(f"DELETE FROM {rollup} WHERE bucket < $1", hour_cutoff)
+
+        if report["created"] or report["dropped"] or report["converted"]:
+            logger.info("Mantenimiento de particiones de monitorización", **report)
+        self.last_maintenance = {"at": datetime.now(timezone.utc).isoformat(), **report}
+        return report
+
+    def start(self) -> None:
+        """Mantenimiento periódico en background (idempotente)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.backfill_rollups()
+            except Exception as e:
+                logger.warning(f"Monitoring rollup backfill failed: {e}")
+            try:
+                await self.purge_unpartitioned()
+            except Exception as e:
+                logger.warning(f"Monitoring retention purge failed: {e}")
+            await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.warning(f"Monitoring partition maintenance failed: {e}")
+
+    async def stats(self) -> Dict[str, Any]:
+        db = get_db()
+        async with db.pool.acquire() as conn:
+            tables = {}
+            pending = []
+            for table in PARTITIONED_TABLES:
+                if await self._relkind(conn, table) == "r":
+                    pending.append(table)
+                partitions = await self._partitions(conn, table)
+                tables[table] = [
+                    {"name": name, "until": upper.isoformat() if upper else None}
+                    for name, upper in sorted(partitions, key=lambda p: p[1] or datetime.max.replace(tzinfo=timezone.utc))
+                ]
+        settings = get_settings()
+        return {
+            "retention_days": settings.monitoring_retention_days,
+            "partition_days_ahead": settings.monitoring_partition_days_ahead,
+            "last_maintenance": self.last_maintenance,
+            "last_purge": self.last_purge,
+            # Tablas con datos sin convertir (retención con DELETE): POST /monitoring/partitions/convert
+            "pending_conversion": pending,
+            "partitions": tables,
+        }
+
+
+# Instancia global
+monitoring_partitions = MonitoringPartitionManager()
@@ -4,7 +4,7 @@ Monitoring Repository - Database access for monitoring tables
 
 import json
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import structlog
 
 from ..db.connection import get_db
@@ -19,9 +19,96 @@ from .models import (
 logger = structlog.get_logger()
 
 
+# Columnas de las escrituras en lote (COPY) de monitoring/writer.py
+API_METRIC_COLUMNS = (
+    "timestamp", "endpoint", "method", "status_code", "latency_ms", "ttfb_ms",
+    "request_size", "response_size", "user_id", "error_message", "metadata",
+)
+EXECUTION_TRACE_COLUMNS = (
+    "execution_id", "timestamp", "chain_id", "event_type", "node_id",
+    "duration_ms", "tokens_input", "tokens_output", "cost_usd",
+    "provider", "model", "success", "error_message", "metadata",
+)
+
+# Anchura de las columnas VARCHAR (database/init/02-monitoring.sql): en COPY
+# una sola fila demasiado larga hace fallar todo el lote
+API_METRIC_WIDTHS = {"endpoint": 255, "method": 10, "user_id": 100}
+EXECUTION_TRACE_WIDTHS = {
+    "execution_id": 100, "chain_id": 100, "event_type": 50,
+    "node_id": 100, "provider": 50, "model": 100,
+}
+
+
+def _clip(value: Optional[str], width: int) -> Optional[str]:
+    return value[:width] if isinstance(value, str) and len(value) > width else value
+
+
 class MonitoringRepository:
     """Repository para acceso a tablas de monitorización"""
     
+    # ============================================
+    # Bulk writes
+    # ============================================
+    
+    @staticmethod
+    def metric_record(metric: ApiMetric) -> tuple:
+        """Fila de api_metrics en el orden de API_METRIC_COLUMNS (textos recortados a su columna)"""
+        widths = API_METRIC_WIDTHS
+        return (
+            metric.timestamp,
+            _clip(metric.endpoint, widths["endpoint"]),
+            _clip(metric.method, widths["method"]),
+            metric.status_code,
+            metric.latency_ms,
+            metric.ttfb_ms,
+            metric.request_size,
+            metric.response_size,
+            _clip(metric.user_id, widths["user_id"]),
+            metric.error_message,
+            json.dumps(metric.metadata) if metric.metadata else None,
+        )
+    
+    @staticmethod
+    def trace_record(trace: ExecutionTrace) -> tuple:
+        """Fila de execution_traces en el orden de EXECUTION_TRACE_COLUMNS (textos recortados a su columna)"""
+        widths = EXECUTION_TRACE_WIDTHS
+        return (
+            _clip(trace.execution_id, widths["execution_id"]),
+            trace.timestamp,
+            _clip(trace.chain_id, widths["chain_id"]),
+            _clip(trace.event_type, widths["event_type"]),
+            _clip(trace.node_id, widths["node_id"]),
+            trace.duration_ms,
+            trace.tokens_input,
+            trace.tokens_output,
+            trace.cost_usd,
+            _clip(trace.provider, widths["provider"]),
+            _clip(trace.model, widths["model"]),
+            trace.success,
+            trace.error_message,
+            json.dumps(trace.metadata) if trace.metadata else None,
+        )
+    
+    @staticmethod
+    async def copy_records(
+        table: str,
+        columns: tuple,
+        records: List[tuple],
+        rollups: Optional[List[Tuple[str, List[tuple]]]] = None
+    ) -> int:
+        """
+        Insertar un lote de filas con COPY y sumar sus rollups (upserts
+        de monitoring/rollups.py) en la misma transacción
+        """
+        db = get_db()
+        async with db.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.copy_records_to_table(table, records=records, columns=list(columns))
+                for query, rows in rollups or []:
+                    if rows:
+                        await conn.executemany(query, rows)
+        return len(records)
+    
     # ============================================
     # API Metrics
     # ============================================
@@ -262,7 +349,10 @@ class MonitoringRepository:
         start_time: Optional[datetime] = None,
         end_time: Optional[datetime] = None
     ) -> List[ChainStats]:
-        """Obtener estadísticas por chain"""
+        """
+        Obtener estadísticas por chain (rollup execution_traces_hour, con
+        granularidad horaria; ejecuciones = eventos chain_start)
+        """
         db = get_db()
         
         if not start_time:
@@ -273,14 +363,15 @@ class MonitoringRepository:
         query = """
             SELECT 
                 chain_id,
-                COUNT(DISTINCT execution_id) as execution_count,
-                AVG(duration_ms) FILTER (WHERE event_type = 'chain_end') as avg_duration_ms,
+                SUM(executions) as execution_count,
+                SUM(completed) as completed,
+                SUM(duration_sum_ms) as duration_sum_ms,
                 SUM(tokens_input) as total_tokens_input,
                 SUM(tokens_output) as total_tokens_output,
                 SUM(cost_usd) as total_cost_usd,
-                COUNT(*) FILTER (WHERE success = false AND event_type = 'chain_end') as error_count
-            FROM execution_traces
-            WHERE timestamp >= $1 AND timestamp <= $2 AND chain_id IS NOT NULL
+                SUM(errors) as error_count
+            FROM execution_traces_hour
+            WHERE bucket >= date_trunc('hour', $1::timestamptz) AND bucket <= $2
             GROUP BY chain_id
             ORDER BY execution_count DESC
         """
@@ -291,11 +382,12 @@ class MonitoringRepository:
         for row in rows:
             exec_count = row['execution_count'] or 0
             error_count = row['error_count'] or 0
+            completed = row['completed'] or 0
             
             stats.append(ChainStats(
                 chain_id=row['chain_id'],
                 execution_count=exec_count,
-                avg_duration_ms=row['avg_duration_ms'] or 0.0,
+                avg_duration_ms=(row['duration_sum_ms'] or 0.0) / completed if completed else 0.0,
                 total_tokens_input=row['total_tokens_input'] or 0,
                 total_tokens_output=row['total_tokens_output'] or 0,
                 total_cost_usd=row['total_cost_usd'] or 0.0,
@@ -434,44 +526,64 @@ class MonitoringRepository:
     
     @staticmethod
     async def get_realtime_stats() -> Dict[str, Any]:
-        """Obtener estadísticas en tiempo real (último minuto)"""
+        """Obtener estadísticas en tiempo real (último minuto, rollup por minuto)"""
         db = get_db()
         
-        one_minute_ago = datetime.utcnow() - timedelta(minutes=1)
-        
+        # Minuto anterior completo + minuto en curso, normalizado a 1 minuto
         query = """
             SELECT 
-                COUNT(*) as request_count,
-                AVG(latency_ms) as avg_latency_ms,
-                COUNT(*) FILTER (WHERE status_code >= 500) as error_count
-            FROM api_metrics
-            WHERE timestamp >= $1
+                COALESCE(SUM(request_count), 0) as request_count,
+                COALESCE(SUM(error_count), 0) as error_count,
+                COALESCE(SUM(latency_sum_ms), 0) as latency_sum_ms,
+                EXTRACT(EPOCH FROM NOW() - date_trunc('minute', NOW() - INTERVAL '1 minute')) / 60 as minutes
+            FROM api_metrics_minute
+            WHERE bucket >= date_trunc('minute', NOW() - INTERVAL '1 minute')
         """
         
-        row = await db.fetch_one(query, one_minute_ago)
+        row = await db.fetch_one(query)
         
         request_count = row['request_count'] or 0
         error_count = row['error_count'] or 0
+        minutes = float(row['minutes'] or 1.0)
         
         return {
-            "requests_per_minute": request_count,
-            "avg_latency_ms": row['avg_latency_ms'] or 0.0,
+            "requests_per_minute": request_count / minutes if minutes > 0 else request_count,
+            "avg_latency_ms": (row['latency_sum_ms'] or 0.0) / request_count if request_count > 0 else 0.0,
             "error_rate": error_count / request_count if request_count > 0 else 0.0
         }
     
+    @staticmethod
+    async def get_request_totals(start_time: datetime) -> Dict[str, int]:
+        """Requests y errores desde start_time (rollup por hora, start_time alineado a la hora)"""
+        db = get_db()
+        
+        query = """
+            SELECT 
+                COALESCE(SUM(request_count), 0) as request_count,
+                COALESCE(SUM(error_count), 0) as error_count
+            FROM api_metrics_hour
+            WHERE bucket >= date_trunc('hour', $1::timestamptz)
+        """
+        
+        row = await db.fetch_one(query, start_time)
+        return {
+            "request_count": row['request_count'] or 0,
+            "error_count": row['error_count'] or 0
+        }
+    
     @staticmethod
     async def get_top_endpoints(limit: int = 10) -> List[Dict[str, Any]]:
-        """Obtener endpoints más usados (últimas 24h)"""
+        """Obtener endpoints más usados (últimas 24h, rollup por hora)"""
         db = get_db()
         
         query = """
             SELECT 
                 endpoint,
-                COUNT(*) as request_count,
-                AVG(latency_ms) as avg_latency_ms,
-                COUNT(*) FILTER (WHERE status_code >= 500) as error_count
-            FROM api_metrics
-            WHERE timestamp >= NOW() - INTERVAL '24 hours'
+                SUM(request_count) as request_count,
+                SUM(latency_sum_ms) as latency_sum_ms,
+                SUM(error_count) as error_count
+            FROM api_metrics_hour
+            WHERE bucket >= date_trunc('hour', NOW() - INTERVAL '24 hours')
             GROUP BY endpoint
             ORDER BY request_count DESC
             LIMIT $1
@@ -483,7 +595,7 @@ class MonitoringRepository:
             {
                 "endpoint": row['endpoint'],
                 "request_count": row['request_count'],
-                "avg_latency_ms": row['avg_latency_ms'] or 0.0,
+                "avg_latency_ms": (row['latency_sum_ms'] or 0.0) / row['request_count'] if row['request_count'] else 0.0,
                 "error_count": row['error_count'] or 0
             }
             for row in rows
@@ -491,28 +603,28 @@ class MonitoringRepository:
     
     @staticmethod
     async def get_hourly_data(hours: int = 24) -> List[Dict[str, Any]]:
-        """Obtener datos por hora"""
+        """Obtener datos por hora (rollup por hora)"""
         db = get_db()
         
         query = """
             SELECT 
-                date_trunc('hour', timestamp) as hour,
-                COUNT(*) as request_count,
-                AVG(latency_ms) as avg_latency_ms,
-                COUNT(*) FILTER (WHERE status_code >= 500) as error_count
-            FROM api_metrics
-            WHERE timestamp >= NOW() - ($1 || ' hours')::interval
-            GROUP BY date_trunc('hour', timestamp)
+                bucket as hour,
+                SUM(request_count) as request_count,
+                SUM(latency_sum_ms) as latency_sum_ms,
+                SUM(error_count) as error_count
+            FROM api_metrics_hour
+            WHERE bucket >= date_trunc('hour', NOW() - make_interval(hours => $1))
+            GROUP BY bucket
             ORDER BY hour ASC
         """
         
-        rows = await db.fetch_all(query, str(hours))
+        rows = await db.fetch_all(query, hours)
         
         return [
             {
                 "hour": row['hour'].isoformat() if row['hour'] else None,
                 "request_count": row['request_count'] or 0,
-                "avg_latency_ms": row['avg_latency_ms'] or 0.0,
+                "avg_latency_ms": (row['latency_sum_ms'] or 0.0) / row['request_count'] if row['request_count'] else 0.0,
                 "error_count": row['error_count'] or 0
             }
             for row in rows
@@ -524,7 +636,7 @@ class MonitoringRepository:
     
     @staticmethod
     async def get_user_activity_stats() -> Dict[str, Any]:
-        """Obtener estadísticas de actividad por usuario"""
+        """Obtener estadísticas de actividad por usuario (rollup api_user_activity_hour)"""
         db = get_db()
         
         now = datetime.utcnow()
@@ -534,11 +646,11 @@ class MonitoringRepository:
         
         query = """
             SELECT
-                COUNT(DISTINCT user_id) FILTER (WHERE timestamp >= $1) as active_today,
-                COUNT(DISTINCT user_id) FILTER (WHERE timestamp >= $2) as active_7d,
-                COUNT(DISTINCT user_id) FILTER (WHERE timestamp >= $3) as active_30d
-            FROM api_metrics
-            WHERE user_id IS NOT NULL
+                COUNT(DISTINCT user_id) FILTER (WHERE bucket >= date_trunc('hour', $1::timestamptz)) as active_today,
+                COUNT(DISTINCT user_id) FILTER (WHERE bucket >= date_trunc('hour', $2::timestamptz)) as active_7d,
+                COUNT(DISTINCT user_id) as active_30d
+            FROM api_user_activity_hour
+            WHERE bucket >= date_trunc('hour', $3::timestamptz)
         """
         
         row = await db.fetch_one(query, today_start, seven_days_ago, thirty_days_ago)
@@ -546,11 +658,10 @@ class MonitoringRepository:
         top_users_query = """
             SELECT
                 user_id,
-                COUNT(*) as request_count,
-                MAX(timestamp) as last_active
-            FROM api_metrics
-            WHERE timestamp >= NOW() - INTERVAL '24 hours'
-              AND user_id IS NOT NULL
+                SUM(request_count) as request_count,
+                MAX(last_active) as last_active
+            FROM api_user_activity_hour
+            WHERE bucket >= date_trunc('hour', NOW() - INTERVAL '24 hours')
             GROUP BY user_id
             ORDER BY request_count DESC
             LIMIT 10
@@ -558,14 +669,14 @@ class MonitoringRepository:
         
         top_rows = await db.fetch_all(top_users_query)
         
+        # Una fila por (hora, usuario): COUNT(*) = usuarios distintos
         hourly_query = """
             SELECT
-                date_trunc('hour', timestamp) as hour,
-                COUNT(DISTINCT user_id) as active_users
-            FROM api_metrics
-            WHERE timestamp >= NOW() - INTERVAL '24 hours'
-              AND user_id IS NOT NULL
-            GROUP BY date_trunc('hour', timestamp)
+                bucket as hour,
+                COUNT(*) as active_users
+            FROM api_user_activity_hour
+            WHERE bucket >= date_trunc('hour', NOW() - INTERVAL '24 hours')
+            GROUP BY bucket
             ORDER BY hour ASC
         """
         
@@ -605,6 +716,7 @@ class MonitoringRepository:
             method=row['method'],
             status_code=row['status_code'],
             latency_ms=row['latency_ms'],
+            ttfb_ms=row.get('ttfb_ms'),
             request_size=row.get('request_size'),
             response_size=row.get('response_size'),
             user_id=row.get('user_id'),
@@ -0,0 +1,245 @@
+"""
+Monitoring Rollups - Agregados por minuto y por hora de las tablas crudas
+
+El dashboard leía api_metrics/execution_traces con date_trunc + GROUP BY
+sobre millones de filas. Ahora lee tablas de rollup pequeñas que se mantienen
+de forma incremental: cada lote que MonitoringWriter vuelca con COPY se
+agrega en memoria y se suma con INSERT ... ON CONFLICT DO UPDATE en la misma
+transacción, así que crudo y rollups nunca divergen.
+
+    api_metrics_minute       (bucket, endpoint)   últimas horas (realtime)
+    api_metrics_hour         (bucket, endpoint)   gráficas y top endpoints
+    api_user_activity_hour   (bucket, user_id)    usuarios activos
+    execution_traces_hour    (bucket, chain_id)   stats de chains y coste
+
+Solo se guardan sumas, conteos y máximos (fusionables). Las ejecuciones de
+una chain se cuentan por eventos chain_start.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from .repository import API_METRIC_COLUMNS, EXECUTION_TRACE_COLUMNS
+
+
+@dataclass(frozen=True)
+class RollupTable:
+    """Tabla de rollup: claves + columnas que se suman o se maximizan."""
+    name: str
+    keys: Tuple[str, ...]
+    sums: Tuple[str, ...]
+    maxes: Tuple[str, ...] = ()
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        return self.keys + self.sums + self.maxes
+
+    def merge_sql(self) -> str:
+        """ON CONFLICT que suma (o maximiza) sobre el bucket existente."""
+        updates = [f"{c} = {self.name}.{c} + EXCLUDED.{c}" for c in self.sums]
+        updates += [f"{c} = GREATEST({self.name}.{c}, EXCLUDED.{c})" for c in self.maxes]
+        return f"ON CONFLICT ({', '.join(self.keys)}) DO UPDATE SET {', '.join(updates)}"
+
+    def upsert_sql(self) -> str:
+        placeholders = ", ".join(f"${i}" for i in range(1, len(self.columns) + 1))
+        return (
+            f"INSERT INTO {self.name} ({', '.join(self.columns)}) VALUES ({placeholders}) "
+            f"{self.merge_sql()}"
+        )
+
+
+_REQUEST_SUMS = (
+    "request_count", "error_count", "success_count",
+    "latency_sum_ms", "ttfb_sum_ms", "ttfb_count",
+)
+
+API_METRICS_MINUTE = RollupTable("api_metrics_minute", ("bucket", "endpoint"), _REQUEST_SUMS, ("latency_max_ms",))
+API_METRICS_HOUR = RollupTable("api_metrics_hour", ("bucket", "endpoint"), _REQUEST_SUMS, ("latency_max_ms",))
+USER_ACTIVITY_HOUR = RollupTable("api_user_activity_hour", ("bucket", "user_id"), ("request_count",), ("last_active",))
+TRACES_HOUR = RollupTable(
+    "execution_traces_hour",
+    ("bucket", "chain_id"),
+    ("executions", "completed", "errors", "duration_sum_ms", "tokens_input", "tokens_output", "cost_usd"),
+)
+
+ROLLUP_TABLES = (API_METRICS_MINUTE, API_METRICS_HOUR, USER_ACTIVITY_HOUR, TRACES_HOUR)
+
+ROLLUP_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS api_metrics_minute (
+        bucket TIMESTAMPTZ NOT NULL,
+        endpoint VARCHAR(255) NOT NULL,
+        request_count BIGINT NOT NULL DEFAULT 0,
+        error_count BIGINT NOT NULL DEFAULT 0,
+        success_count BIGINT NOT NULL DEFAULT 0,
+        latency_sum_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+        ttfb_sum_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+        ttfb_count BIGINT NOT NULL DEFAULT 0,
+        latency_max_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, endpoint)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS api_metrics_hour (
+        bucket TIMESTAMPTZ NOT NULL,
+        endpoint VARCHAR(255) NOT NULL,
+        request_count BIGINT NOT NULL DEFAULT 0,
+        error_count BIGINT NOT NULL DEFAULT 0,
+        success_count BIGINT NOT NULL DEFAULT 0,
+        latency_sum_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+        ttfb_sum_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+        ttfb_count BIGINT NOT NULL DEFAULT 0,
+        latency_max_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, endpoint)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS api_user_activity_hour (
+        bucket TIMESTAMPTZ NOT NULL,
+        user_id VARCHAR(100) NOT NULL,
+        request_count BIGINT NOT NULL DEFAULT 0,
+        last_active TIMESTAMPTZ NOT NULL,
+        PRIMARY KEY (bucket, user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS execution_traces_hour (
+        bucket TIMESTAMPTZ NOT NULL,
+        chain_id VARCHAR(100) NOT NULL,
+        executions BIGINT NOT NULL DEFAULT 0,
+        completed BIGINT NOT NULL DEFAULT 0,
+        errors BIGINT NOT NULL DEFAULT 0,
+        duration_sum_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+        tokens_input BIGINT NOT NULL DEFAULT 0,
+        tokens_output BIGINT NOT NULL DEFAULT 0,
+        cost_usd DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, chain_id)
+    )
+    """,
+]
+
+# Relleno inicial desde las tablas crudas al crear un rollup en una BD con
+# datos: (tabla cruda, SQL con $1 = desde, $2 = último id existente al crear el
+# rollup). Las filas posteriores las suma MonitoringWriter, así que el relleno
+# se fusiona con los buckets que ya haya en lugar de ignorarlos.
+ROLLUP_BACKFILL = {
+    "api_metrics_minute": ("api_metrics", f"""
+        INSERT INTO api_metrics_minute
+        SELECT date_trunc('minute', timestamp), COALESCE(endpoint, ''),
+               COUNT(*), COUNT(*) FILTER (WHERE status_code >= 500),
+               COUNT(*) FILTER (WHERE status_code >= 200 AND status_code < 300),
+               COALESCE(SUM(latency_ms), 0), COALESCE(SUM(ttfb_ms), 0), COUNT(ttfb_ms),
+               COALESCE(MAX(latency_ms), 0)
+        FROM api_metrics
+        WHERE timestamp >= $1 AND id <= $2
+        GROUP BY 1, 2
+        {API_METRICS_MINUTE.merge_sql()}
+    """),
+    "api_metrics_hour": ("api_metrics", f"""
+        INSERT INTO api_metrics_hour
+        SELECT date_trunc('hour', timestamp), COALESCE(endpoint, ''),
+               COUNT(*), COUNT(*) FILTER (WHERE status_code >= 500),
+               COUNT(*) FILTER (WHERE status_code >= 200 AND status_code < 300),
+               COALESCE(SUM(latency_ms), 0), COALESCE(SUM(ttfb_ms), 0), COUNT(ttfb_ms),
+               COALESCE(MAX(latency_ms), 0)
+        FROM api_metrics
+        WHERE timestamp >= $1 AND id <= $2
+        GROUP BY 1, 2
+        {API_METRICS_HOUR.merge_sql()}
+    """),
+    "api_user_activity_hour": ("api_metrics", f"""
+        INSERT INTO api_user_activity_hour
+        SELECT date_trunc('hour', timestamp), user_id, COUNT(*), MAX(timestamp)
+        FROM api_metrics
+        WHERE timestamp >= $1 AND id <= $2 AND user_id IS NOT NULL
+        GROUP BY 1, 2
+        {USER_ACTIVITY_HOUR.merge_sql()}
+    """),
+    "execution_traces_hour": ("execution_traces", f"""
+        INSERT INTO execution_traces_hour
+        SELECT date_trunc('hour', timestamp), chain_id,
+               COUNT(*) FILTER (WHERE event_type = 'chain_start'),
+               COUNT(*) FILTER (WHERE event_type = 'chain_end'),
+               COUNT(*) FILTER (WHERE event_type = 'chain_end' AND success = false),
+               COALESCE(SUM(duration_ms) FILTER (WHERE event_type = 'chain_end'), 0),
+               COALESCE(SUM(tokens_input), 0), COALESCE(SUM(tokens_output), 0),
+               COALESCE(SUM(cost_usd), 0)
+        FROM execution_traces
+        WHERE timestamp >= $1 AND id <= $2 AND chain_id IS NOT NULL
+        GROUP BY 1, 2
+        {TRACES_HOUR.merge_sql()}
+    """),
+}
+
+_M = {name: i for i, name in enumerate(API_METRIC_COLUMNS)}
+_T = {name: i for i, name in enumerate(EXECUTION_TRACE_COLUMNS)}
+
+Rollups = List[Tuple[str, List[tuple]]]
+
+
+def _minute(ts: datetime) -> datetime:
+    return ts.replace(second=0, microsecond=0)
+
+
+def _hour(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _rows(table: RollupTable, groups: Dict[tuple, list]) -> Tuple[str, List[tuple]]:
+    # Orden estable de claves: dos procesos que suman las mismas filas no se bloquean mutuamente
+    return table.upsert_sql(), [key + tuple(values) for key, values in sorted(groups.items())]
+
+
+def metric_rollups(records: List[tuple]) -> Rollups:
+    """Upserts de rollup para un lote de filas de api_metrics."""
+    minute: Dict[tuple, list] = {}
+    hour: Dict[tuple, list] = {}
+    users: Dict[tuple, list] = {}
+    for record in records:
+        ts = record[_M["timestamp"]]
+        status = record[_M["status_code"]] or 0
+        latency = record[_M["latency_ms"]] or 0.0
+        ttfb = record[_M["ttfb_ms"]]
+        endpoint = record[_M["endpoint"]] or ""
+        for groups, bucket in ((minute, _minute(ts)), (hour, _hour(ts))):
+            acc = groups.setdefault((bucket, endpoint), [0, 0, 0, 0.0, 0.0, 0, 0.0])
+            acc[0] += 1
+            acc[1] += status >= 500
+            acc[2] += 200 <= status < 300
+            acc[3] += latency
+            if ttfb is not None:
+                acc[4] += ttfb
+                acc[5] += 1
+            acc[6] = max(acc[6], latency)
+        user_id = record[_M["user_id"]]
+        if user_id:
+            acc = users.setdefault((_hour(ts), user_id), [0, ts])
+            acc[0] += 1
+            acc[1] = max(acc[1], ts)
+    rollups = [_rows(API_METRICS_MINUTE, minute), _rows(API_METRICS_HOUR, hour)]
+    if users:
+        rollups.append(_rows(USER_ACTIVITY_HOUR, users))
+    return rollups
+
+
+def trace_rollups(records: List[tuple]) -> Rollups:
+    """Upserts de rollup para un lote de filas de execution_traces."""
+    hour: Dict[tuple, list] = {}
+    for record in records:
+        chain_id = record[_T["chain_id"]]
+        if not chain_id:
+            continue
+        event_type = record[_T["event_type"]]
+        acc = hour.setdefault((_hour(record[_T["timestamp"]]), chain_id), [0, 0, 0, 0.0, 0, 0, 0.0])
+        if event_type == "chain_start":
+            acc[0] += 1
+        elif event_type == "chain_end":
+            acc[1] += 1
+            acc[2] += record[_T["success"]] is False
+            acc[3] += record[_T["duration_ms"]] or 0.0
+        acc[4] += record[_T["tokens_input"]] or 0
+        acc[5] += record[_T["tokens_output"]] or 0
+        acc[6] += record[_T["cost_usd"]] or 0.0
+    return [_rows(TRACES_HOUR, hour)] if hour else []
+
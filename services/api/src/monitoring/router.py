@@ -4,9 +4,11 @@ Monitoring Router - API endpoints for monitoring
 
 from datetime import datetime, timedelta
 from typing import Optional, List
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from ..auth import require_role
 from .service import monitoring_service
 from .models import (
     ApiMetric,
@@ -65,6 +67,26 @@ async def get_dashboard():
     return await monitoring_service.get_dashboard_stats()
 
 
+@router.get("/dashboard/stream")
+async def stream_dashboard(request: Request):
+    """
+    Dashboard por SSE: un evento "snapshot" inicial y después eventos
+    "delta" solo con los campos que cambian (todos los clientes comparten
+    el mismo snapshot).
+    """
+    from .dashboard import dashboard_snapshots
+
+    return StreamingResponse(
+        dashboard_snapshots.stream(request.is_disconnected),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
 @router.get("/user-activity", response_model=UserActivityStats)
 async def get_user_activity():
     """
@@ -354,6 +376,51 @@ async def monitoring_health():
         }
 
 
+@router.get("/ingest")
+async def monitoring_ingest_status():
+    """Buffers de escritura en lote de métricas y trazas (pendientes, descartadas, errores)."""
+    from .writer import monitoring_writer
+
+    return monitoring_writer.stats()
+
+
+@router.get("/partitions")
+async def monitoring_partitions_status():
+    """Particiones diarias de api_metrics/execution_traces, retención y último mantenimiento."""
+    from .partitions import monitoring_partitions
+
+    return await monitoring_partitions.stats()
+
+
+@router.post("/partitions/convert", dependencies=[Depends(require_role("admin"))])
+async def monitoring_partitions_convert():
+    """
+    Convertir api_metrics/execution_traces a tablas particionadas por día.
+
+    Operación única de administrador: valida el rango y construye la nueva PK
+    sin bloquear inserciones y termina con un ACCESS EXCLUSIVE corto. Si no
+    consigue el lock en CONVERT_LOCK_TIMEOUT falla y se puede reintentar.
+    """
+    from .partitions import monitoring_partitions
+
+    try:
+        return await monitoring_partitions.convert()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/aggregates")
+async def monitoring_aggregates_status():
+    """Agregados en memoria de este proceso (ventanas de requests y coste del día) que evalúan las alertas."""
+    from .aggregates import monitoring_aggregates
+    from .service import ALERT_RULES
+
+    return {
+        **monitoring_aggregates.snapshot(),
+        "rules": ALERT_RULES,
+    }
+
+
 # ============================================
 # Pricing
 # ============================================
@@ -415,3 +482,81 @@ async def pricing_refresh():
         "providers": pricing_service.cached_providers,
         "models": pricing_service.cached_models,
     }
+
+
+# ============================================
+# Caches
+# ============================================
+
+@router.get("/caches")
+async def cache_status():
+    """Aciertos/fallos de las cachés internas (respuestas LLM, embeddings...)."""
+    from .cache_stats import cache_stats
+    from datetime import timezone
+
+    return {
+        "since": datetime.fromtimestamp(cache_stats.since, tz=timezone.utc).isoformat(),
+        "caches": cache_stats.snapshot(),
+    }
+
+
+@router.get("/caches/dashboard")
+async def dashboard_cache_status():
+    """Estado del snapshot del dashboard (versión, antigüedad, refrescos)."""
+    from .dashboard import dashboard_snapshots
+
+    return dashboard_snapshots.stats()
+
+
+@router.get("/caches/llm-response")
+async def llm_response_cache_status():
+    """Estado de la caché de respuestas LLM (entradas en memoria + contadores)."""
+    from ..engine.chains.llm_cache import llm_response_cache
+
+    return llm_response_cache.stats()
+
+
+@router.get("/caches/rag")
+async def rag_cache_status():
+    """Cachés de RAG: embeddings de chunks y queries, y resultados de búsqueda."""
+    from ..rag.embedding_cache import embedding_cache
+    from ..rag.search_cache import search_cache
+
+    return {
+        "embeddings": embedding_cache.stats(),
+        "search_results": search_cache.stats(),
+    }
+
+
+@router.delete("/caches/llm-response", dependencies=[Depends(require_role("admin"))])
+async def llm_response_cache_clear(
+    expired_only: bool = Query(True, description="Borrar solo entradas caducadas")
+):
+    """Vaciar la caché de respuestas LLM (o solo purgar las caducadas). Afecta a todas las réplicas."""
+    from ..engine.chains.llm_cache import llm_response_cache
+
+    if expired_only:
+        deleted = await llm_response_cache.purge_expired()
+        return {"status": "ok", "purged": deleted}
+    await llm_response_cache.clear()
+    return {"status": "ok", "cleared": True}
+
+
+# ============================================
+# LLM Endpoints
+# ============================================
+
+@router.get("/llm-endpoints")
+async def llm_endpoints_status():
+    """Salud, circuit breakers y contadores de failover/hedging de los endpoints LLM."""
+    from ..engine.chains.llm_router import llm_router
+
+    return llm_router.stats()
+
+
+@router.get("/llm-admission")
+async def llm_admission_status():
+    """Concurrencia, ventana AIMD, rate limits y tiempos de cola por endpoint LLM."""
+    from ..engine.chains.llm_admission import llm_admission
+
+    return llm_admission.stats()
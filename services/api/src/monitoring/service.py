@@ -8,6 +8,8 @@ from typing import Optional, Dict, Any, List
 import structlog
 
 from .repository import MonitoringRepository
+from .writer import monitoring_writer
+from .aggregates import monitoring_aggregates
 from .models import (
     ApiMetric,
     ExecutionTrace,
@@ -24,21 +26,31 @@ logger = structlog.get_logger()
 # Alert Rules Configuration
 # ============================================
 
+# Las reglas se evalúan cada ALERT_EVALUATION_SECONDS sobre los agregados en
+# memoria del proceso (monitoring/aggregates.py). cooldown_minutes evita
+# repetir la misma alerta; min_requests, evaluar ventanas con poco tráfico.
+ALERT_EVALUATION_SECONDS = 15
+
 ALERT_RULES = {
     "error_rate": {
         "threshold": 0.05,  # 5% error rate
         "window_minutes": 5,
+        "min_requests": 10,
+        "cooldown_minutes": 1,
         "severity": "critical",
         "message": "Error rate exceeded {value:.1%} (threshold: {threshold:.1%})"
     },
     "latency_p95": {
         "threshold_ms": 5000,  # 5 seconds
         "window_minutes": 5,
+        "min_requests": 10,
+        "cooldown_minutes": 5,
         "severity": "warning",
         "message": "P95 latency exceeded {value:.0f}ms (threshold: {threshold:.0f}ms)"
     },
     "daily_cost": {
         "threshold_usd": 10.0,
+        "cooldown_minutes": 10,
         "severity": "warning",
         "message": "Daily LLM cost exceeded ${value:.2f} (threshold: ${threshold:.2f})"
     }
@@ -58,31 +70,34 @@ class MonitoringService:
     
     def __init__(self):
         self._initialized = False
-        self._last_alert_check: Dict[str, datetime] = {}
+        self._last_alert: Dict[str, datetime] = {}
         self._pricing_loaded = False
+        self._alert_task: Optional[asyncio.Task] = None
     
     # ============================================
     # API Metrics
     # ============================================
     
-    async def record_request(
+    def record_request(
         self,
         endpoint: str,
         method: str,
         status_code: int,
         latency_ms: float,
+        ttfb_ms: Optional[float] = None,
         request_size: Optional[int] = None,
         response_size: Optional[int] = None,
         user_id: Optional[str] = None,
         error_message: Optional[str] = None,
         metadata: Optional[Dict[str, Any]] = None
     ) -> None:
-        """Registrar una métrica de request"""
+        """Registrar una métrica de request (se encola; ver monitoring/writer.py)"""
         metric = ApiMetric(
             endpoint=endpoint,
             method=method,
             status_code=status_code,
             latency_ms=latency_ms,
+            ttfb_ms=ttfb_ms,
             request_size=request_size,
             response_size=response_size,
             user_id=user_id,
@@ -90,11 +105,8 @@ class MonitoringService:
             metadata=metadata
         )
         
-        await MonitoringRepository.save_metric(metric)
-        
-        # Verificar alertas si hay error
-        if status_code >= 500:
-            asyncio.create_task(self._check_error_rate_alert())
+        monitoring_writer.submit_metric(metric)
+        monitoring_aggregates.record_request(status_code, latency_ms, ttfb_ms)
     
     async def get_metrics(
         self,
@@ -132,7 +144,7 @@ class MonitoringService:
             event_type="chain_start",
             metadata=metadata
         )
-        await MonitoringRepository.save_trace(trace)
+        await monitoring_writer.submit_trace(trace)
     
     async def trace_tool(
         self,
@@ -155,7 +167,7 @@ class MonitoringService:
             error_message=error_message,
             metadata=metadata
         )
-        await MonitoringRepository.save_trace(trace)
+        await monitoring_writer.submit_trace(trace)
     
     async def trace_llm(
         self,
@@ -169,12 +181,25 @@ class MonitoringService:
         cost_usd: Optional[float] = None,
         success: bool = True,
         error_message: Optional[str] = None,
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        tokens_cached: int = 0,
+        cache_creation_tokens: int = 0
     ) -> None:
-        """Registrar llamada a LLM"""
+        """
+        Registrar llamada a LLM.
+        
+        tokens_cached / cache_creation_tokens (prompt caching del proveedor)
+        se guardan en metadata junto con el ratio de acierto de caché.
+        """
         if cost_usd is None:
             cost_usd = await self._estimate_cost(provider, model, tokens_input, tokens_output)
         
+        if tokens_cached or cache_creation_tokens:
+            metadata = dict(metadata or {})
+            metadata["tokens_cached"] = tokens_cached
+            metadata["cache_creation_tokens"] = cache_creation_tokens
+            metadata["cache_hit_ratio"] = round(tokens_cached / tokens_input, 4) if tokens_input else 0.0
+        
         trace = ExecutionTrace(
             execution_id=execution_id,
             chain_id=chain_id,
@@ -189,10 +214,8 @@ class MonitoringService:
             error_message=error_message,
             metadata=metadata
         )
-        await MonitoringRepository.save_trace(trace)
-        
-        # Verificar coste diario
-        asyncio.create_task(self._check_daily_cost_alert())
+        await monitoring_writer.submit_trace(trace)
+        monitoring_aggregates.record_llm_cost(cost_usd)
     
     async def trace_end(
         self,
@@ -213,7 +236,7 @@ class MonitoringService:
             error_message=error_message,
             metadata=metadata
         )
-        await MonitoringRepository.save_trace(trace)
+        await monitoring_writer.submit_trace(trace)
     
     async def get_execution_trace(self, execution_id: str) -> List[ExecutionTrace]:
         """Obtener traza completa de una ejecución"""
@@ -263,7 +286,10 @@ class MonitoringService:
     
     async def acknowledge_alert(self, alert_id: int, acknowledged_by: str) -> bool:
         """Marcar alerta como reconocida"""
-        return await MonitoringRepository.acknowledge_alert(alert_id, acknowledged_by)
+        from .dashboard import dashboard_snapshots
+        acknowledged = await MonitoringRepository.acknowledge_alert(alert_id, acknowledged_by)
+        dashboard_snapshots.invalidate()
+        return acknowledged
     
     async def create_alert(
         self,
@@ -279,43 +305,41 @@ class MonitoringService:
             message=message,
             metadata=metadata
         )
-        return await MonitoringRepository.save_alert(alert)
+        from .dashboard import dashboard_snapshots
+        alert_id = await MonitoringRepository.save_alert(alert)
+        dashboard_snapshots.invalidate()
+        return alert_id
     
     # ============================================
     # Dashboard
     # ============================================
     
     async def get_dashboard_stats(self) -> DashboardStats:
-        """Obtener estadísticas para el dashboard"""
-        
-        # Stats en tiempo real
-        realtime = await MonitoringRepository.get_realtime_stats()
-        
-        # Alertas activas
-        alerts_count = await MonitoringRepository.get_active_alerts_count()
-        
-        # Top endpoints
-        top_endpoints = await MonitoringRepository.get_top_endpoints(10)
-        
-        # Datos por hora (últimas 24h)
-        hourly_data = await MonitoringRepository.get_hourly_data(24)
-        
-        # Stats de chains (últimos 7 días)
-        chain_stats = await MonitoringRepository.get_chain_stats()
-        
-        # Totales del día
+        """Obtener estadísticas para el dashboard (snapshot compartido, ver monitoring/dashboard.py)"""
+        from .dashboard import dashboard_snapshots
+        return await dashboard_snapshots.get()
+    
+    async def compute_dashboard_stats(self) -> DashboardStats:
+        """Calcular las estadísticas del dashboard (consultas en paralelo)"""
         today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_metrics = await MonitoringRepository.get_metrics_aggregation(
-            start_time=today_start,
-            end_time=datetime.utcnow(),
-            group_by='day'
-        )
         
-        total_requests = 0
-        total_errors = 0
-        if today_metrics:
-            total_requests = today_metrics[0].request_count
-            total_errors = today_metrics[0].error_count
+        (
+            realtime,       # Stats en tiempo real
+            alerts_count,   # Alertas activas
+            top_endpoints,  # Top endpoints
+            hourly_data,    # Datos por hora (últimas 24h)
+            chain_stats,    # Stats de chains (últimos 7 días)
+            today_totals,   # Totales del día
+        ) = await asyncio.gather(
+            MonitoringRepository.get_realtime_stats(),
+            MonitoringRepository.get_active_alerts_count(),
+            MonitoringRepository.get_top_endpoints(10),
+            MonitoringRepository.get_hourly_data(24),
+            MonitoringRepository.get_chain_stats(),
+            MonitoringRepository.get_request_totals(today_start),
+        )
+        total_requests = today_totals['request_count']
+        total_errors = today_totals['error_count']
         
         # Tokens y coste del día
         total_tokens = 0
@@ -376,80 +400,130 @@ class MonitoringService:
     # Alert Evaluation
     # ============================================
     
+    def start_alert_evaluation(self) -> None:
+        """Arrancar la evaluación periódica de ALERT_RULES (idempotente)."""
+        if self._alert_task is None or self._alert_task.done():
+            self._alert_task = asyncio.create_task(self._alert_loop())
+    
+    async def stop_alert_evaluation(self) -> None:
+        if self._alert_task is not None:
+            self._alert_task.cancel()
+            try:
+                await self._alert_task
+            except asyncio.CancelledError:
+                pass
+            self._alert_task = None
+    
+    async def _alert_loop(self) -> None:
+        try:
+            await self._seed_daily_cost()
+        except Exception as e:
+            logger.warning(f"Could not seed daily cost: {e}")
+        while True:
+            await asyncio.sleep(ALERT_EVALUATION_SECONDS)
+            try:
+                await self.evaluate_alerts()
+            except Exception as e:
+                logger.warning(f"Alert evaluation failed: {e}")
+    
+    async def evaluate_alerts(self) -> None:
+        """Evaluar todas las reglas sobre los agregados en memoria"""
+        await self._check_error_rate_alert()
+        await self._check_latency_alert()
+        await self._check_daily_cost_alert()
+    
+    def _in_cooldown(self, rule_name: str) -> bool:
+        last = self._last_alert.get(rule_name)
+        cooldown = timedelta(minutes=ALERT_RULES[rule_name]["cooldown_minutes"])
+        return last is not None and datetime.utcnow() - last < cooldown
+    
+    async def _raise_alert(self, rule_name: str, message: str, metadata: Dict[str, Any]) -> None:
+        self._last_alert[rule_name] = datetime.utcnow()
+        await self.create_alert(
+            alert_type=rule_name,
+            severity=ALERT_RULES[rule_name]["severity"],
+            message=message,
+            metadata=metadata
+        )
+        logger.warning(f"Alert created: {message}")
+    
+    async def _seed_daily_cost(self) -> None:
+        """Tomar de BD el coste de hoy de todos los workers (una consulta)"""
+        mark = monitoring_aggregates.cost.begin_seed()
+        today_start = datetime.combine(mark[0], datetime.min.time())
+        chain_stats = await MonitoringRepository.get_chain_stats(
+            start_time=today_start,
+            end_time=datetime.utcnow()
+        )
+        monitoring_aggregates.cost.seed(sum(stat.total_cost_usd for stat in chain_stats), mark)
+    
     async def _check_error_rate_alert(self) -> None:
         """Verificar alerta de error rate"""
         rule = ALERT_RULES["error_rate"]
-        
-        # Evitar spam de alertas
-        last_check = self._last_alert_check.get("error_rate")
-        if last_check and datetime.utcnow() - last_check < timedelta(minutes=1):
+        if self._in_cooldown("error_rate"):
             return
         
-        self._last_alert_check["error_rate"] = datetime.utcnow()
-        
-        # Calcular error rate
-        window_start = datetime.utcnow() - timedelta(minutes=rule["window_minutes"])
-        metrics = await MonitoringRepository.get_metrics(start_time=window_start)
-        
-        if len(metrics) < 10:  # Mínimo de requests para calcular
+        window = monitoring_aggregates.requests.summary(rule["window_minutes"])
+        if window["request_count"] < rule["min_requests"]:
             return
         
-        error_count = sum(1 for m in metrics if m.status_code >= 500)
-        error_rate = error_count / len(metrics)
-        
+        error_rate = window["error_rate"]
         if error_rate > rule["threshold"]:
             message = rule["message"].format(
                 value=error_rate,
                 threshold=rule["threshold"]
             )
-            await self.create_alert(
-                alert_type="error_rate",
-                severity=rule["severity"],
-                message=message,
-                metadata={
-                    "error_rate": error_rate,
-                    "error_count": error_count,
-                    "total_requests": len(metrics),
-                    "window_minutes": rule["window_minutes"]
-                }
+            await self._raise_alert("error_rate", message, {
+                "error_rate": error_rate,
+                "error_count": window["error_count"],
+                "total_requests": window["request_count"],
+                "window_minutes": rule["window_minutes"]
+            })
+    
+    async def _check_latency_alert(self) -> None:
+        """Verificar alerta de latencia P95"""
+        rule = ALERT_RULES["latency_p95"]
+        if self._in_cooldown("latency_p95"):
+            return
+        
+        window = monitoring_aggregates.requests.summary(rule["window_minutes"])
+        p95 = window["p95_latency_ms"]
+        if window["request_count"] < rule["min_requests"] or p95 is None:
+            return
+        
+        if p95 > rule["threshold_ms"]:
+            message = rule["message"].format(
+                value=p95,
+                threshold=rule["threshold_ms"]
             )
-            logger.warning(f"Alert created: {message}")
+            await self._raise_alert("latency_p95", message, {
+                "p95_latency_ms": p95,
+                "p99_latency_ms": window["p99_latency_ms"],
+                "total_requests": window["request_count"],
+                "window_minutes": rule["window_minutes"]
+            })
     
     async def _check_daily_cost_alert(self) -> None:
         """Verificar alerta de coste diario"""
         rule = ALERT_RULES["daily_cost"]
         
-        # Evitar spam de alertas
-        last_check = self._last_alert_check.get("daily_cost")
-        if last_check and datetime.utcnow() - last_check < timedelta(minutes=10):
-            return
+        # Al cambiar de día UTC y cada SEED_MAX_AGE_SECONDS (gasto de otros workers)
+        if monitoring_aggregates.cost.needs_seed():
+            await self._seed_daily_cost()
         
-        self._last_alert_check["daily_cost"] = datetime.utcnow()
-        
-        # Calcular coste del día
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        chain_stats = await MonitoringRepository.get_chain_stats(
-            start_time=today_start,
-            end_time=datetime.utcnow()
-        )
-        
-        total_cost = sum(stat.total_cost_usd for stat in chain_stats)
+        if self._in_cooldown("daily_cost"):
+            return
         
+        total_cost = monitoring_aggregates.cost.today_usd
         if total_cost > rule["threshold_usd"]:
             message = rule["message"].format(
                 value=total_cost,
                 threshold=rule["threshold_usd"]
             )
-            await self.create_alert(
-                alert_type="daily_cost",
-                severity=rule["severity"],
-                message=message,
-                metadata={
-                    "total_cost_usd": total_cost,
-                    "threshold_usd": rule["threshold_usd"]
-                }
-            )
-            logger.warning(f"Alert created: {message}")
+            await self._raise_alert("daily_cost", message, {
+                "total_cost_usd": total_cost,
+                "threshold_usd": rule["threshold_usd"]
+            })
     
     # ============================================
     # Cost Estimation
@@ -0,0 +1,279 @@
+"""
+Monitoring Writer - Escritura en lote de api_metrics y execution_traces
+
+Cada request HTTP y cada traza (chain_start, tool_call, llm_call...) dejaba
+una tarea con un INSERT de una fila: con tráfico alto eso son cientos de
+idas y vueltas por segundo compitiendo por el pool de conexiones.
+
+Ahora las filas se encolan en un buffer circular acotado por tabla y un único
+flusher en background las vuelca con COPY cada `monitoring_flush_interval_ms`
+o en cuanto se acumulan `monitoring_flush_rows`:
+
+- Memoria acotada: al llenarse el buffer se descartan las filas más antiguas
+  (contador "dropped").
+- Backpressure: hay como máximo un COPY en curso (una conexión del pool). Si
+  PostgreSQL va lento el buffer crece en vez de abrir más conexiones; las
+  trazas esperan hasta `monitoring_trace_put_timeout` a que haya hueco antes
+  de descartar, las métricas HTTP nunca bloquean la request.
+- Si un COPY falla, el lote vuelve al buffer (lo que quepa) y el flusher
+  espera con backoff exponencial. Si lo que falla es una fila (DataError o
+  violación de restricción) el lote se parte en mitades hasta aislarla: solo
+  esa fila se descarta ("dropped") y el resto se escribe.
+- Cada lote actualiza los rollups por minuto/hora en la misma transacción
+  que el COPY (ver rollups.py).
+- `stop()` deja terminar el volcado en curso y hace un último volcado al
+  cerrar la aplicación.
+
+Los contadores se consultan en /monitoring/ingest.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import asyncpg
+import structlog
+
+from ..config import get_settings
+from .models import ApiMetric, ExecutionTrace
+from .repository import API_METRIC_COLUMNS, EXECUTION_TRACE_COLUMNS, MonitoringRepository
+from .rollups import Rollups, metric_rollups, trace_rollups
+
+logger = structlog.get_logger()
+
+# Espera máxima entre reintentos de un volcado fallido
+MAX_BACKOFF_SECONDS = 30.0
+# Tiempo máximo del volcado final en el shutdown
+FINAL_FLUSH_TIMEOUT = 10.0
+# Errores de una fila concreta: reintentar el lote no sirve de nada
+_BAD_ROW_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+
+
+class _TableBuffer:
+    """Buffer circular de filas pendientes de una tabla."""
+
+    def __init__(self, table: str, columns: tuple, capacity: int, rollup: Callable[[List[tuple]], Rollups]):
+        self.table = table
+        self.columns = columns
+        self.rollup = rollup
+        self.capacity = max(1, capacity)
+        self.rows: Deque[tuple] = deque()
+        self.space = asyncio.Event()
+        self.space.set()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.last_flush_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def push(self, record: tuple) -> None:
+        if len(self.rows) >= self.capacity:
+            self.rows.popleft()
+            self.dropped += 1
+        self.rows.append(record)
+        self.enqueued += 1
+        if len(self.rows) >= self.capacity:
+            self.space.clear()
+
+    def take(self, limit: int) -> List[tuple]:
+        batch = [self.rows.popleft() for _ in range(min(limit, len(self.rows)))]
+        if batch:
+            self.space.set()
+        return batch
+
+    def restore(self, batch: List[tuple]) -> None:
+        """Devolver al frente un lote no escrito (se descarta lo que no quepa)."""
+        room = self.capacity - len(self.rows)
+        keep = batch[-room:] if room > 0 else []
+        self.dropped += len(batch) - len(keep)
+        self.rows.extendleft(reversed(keep))
+        if len(self.rows) >= self.capacity:
+            self.space.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self.rows),
+            "capacity": self.capacity,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": self.last_flush_ms,
+            "last_error": self.last_error,
+        }
+
+
+class MonitoringWriter:
+    """Buffer + flusher en background para las tablas de monitorización."""
+
+    def __init__(self):
+        settings = get_settings()
+        self.flush_interval = max(0.05, settings.monitoring_flush_interval_ms / 1000)
+        self.flush_rows = max(1, settings.monitoring_flush_rows)
+        self.trace_put_timeout = settings.monitoring_trace_put_timeout
+        capacity = settings.monitoring_buffer_capacity
+        self._metrics = _TableBuffer("api_metrics", API_METRIC_COLUMNS, capacity, metric_rollups)
+        self._traces = _TableBuffer("execution_traces", EXECUTION_TRACE_COLUMNS, capacity, trace_rollups)
+        self._wake = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+
+    @property
+    def _buffers(self) -> List[_TableBuffer]:
+        return [self._metrics, self._traces]
+
+    # ============================================
+    # Encolado
+    # ============================================
+
+    def submit_metric(self, metric: ApiMetric) -> None:
+        """Encolar una métrica HTTP (nunca bloquea)."""
+        self._push(self._metrics, MonitoringRepository.metric_record(metric))
+
+    async def submit_trace(self, trace: ExecutionTrace) -> None:
+        """Encolar una traza; si el buffer está lleno espera un poco a que se vacíe."""
+        buffer = self._traces
+        if len(buffer.rows) >= buffer.capacity and self.trace_put_timeout > 0 and self.running:
+            try:
+                await asyncio.wait_for(buffer.space.wait(), timeout=self.trace_put_timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._push(buffer, MonitoringRepository.trace_record(trace))
+
+    def _push(self, buffer: _TableBuffer, record: tuple) -> None:
+        buffer.push(record)
+        if len(buffer.rows) >= self.flush_rows:
+            self._wake.set()
+        if not self.running and not self._stopping:
+            self.start()
+
+    # ============================================
+    # Ciclo de vida
+    # ============================================
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Arrancar el flusher (idempotente; requiere un event loop en marcha)."""
+        if self.running:
+            return
+        try:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        except RuntimeError:
+            return
+        self._stopping = False
+        self._stop.clear()
+
+    async def stop(self) -> None:
+        """Detener el flusher (dejando terminar el volcado en curso) y volcar lo pendiente."""
+        self._stopping = True
+        self._stop.set()
+        self._wake.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout=FINAL_FLUSH_TIMEOUT)
+            except asyncio.TimeoutError:
+                # El lote en curso vuelve al buffer (ver _copy)
+                self._task.cancel()
+                await asyncio.gather(self._task, return_exceptions=True)
+            except Exception as e:
+                logger.warning(f"Monitoring flusher failed: {e}")
+            self._task = None
+        try:
+            await asyncio.wait_for(self.flush(), timeout=FINAL_FLUSH_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Final monitoring flush failed: {e}")
+        pending = sum(len(buffer.rows) for buffer in self._buffers)
+        if pending:
+            logger.warning("Monitoring rows lost on shutdown", pending=pending)
+
+    # ============================================
+    # Volcado
+    # ============================================
+
+    async def _run(self) -> None:
+        backoff = self.flush_interval
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stop.is_set():
+                # stop() hace el volcado final
+                return
+            if await self.flush():
+                backoff = self.flush_interval
+            else:
+                # PostgreSQL caído o lento: no insistir en cada tick
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=backoff)
+                except asyncio.TimeoutError:
+                    pass
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+    async def flush(self) -> bool:
+        """Volcar todas las filas pendientes en lotes de flush_rows. False si algún COPY falla."""
+        async with self._flush_lock:
+            ok = True
+            for buffer in self._buffers:
+                while buffer.rows:
+                    batch = buffer.take(self.flush_rows)
+                    if not await self._copy(buffer, batch):
+                        ok = False
+                        break
+            return ok
+
+    async def _copy(self, buffer: _TableBuffer, batch: List[tuple]) -> bool:
+        started = time.perf_counter()
+        # Partes pendientes del lote: una fila inválida se aísla por mitades
+        parts = [batch]
+        while parts:
+            part = parts.pop(0)
+            try:
+                await MonitoringRepository.copy_records(
+                    buffer.table, buffer.columns, part, rollups=buffer.rollup(part)
+                )
+            except asyncio.CancelledError:
+                # Cancelado a mitad (p.ej. timeout del volcado final): el lote no se pierde
+                buffer.restore([row for pending in [part, *parts] for row in pending])
+                raise
+            except _BAD_ROW_ERRORS as e:
+                buffer.last_error = str(e)
+                if len(part) == 1:
+                    buffer.dropped += 1
+                    logger.warning(f"Dropping invalid {buffer.table} row: {e}")
+                else:
+                    middle = len(part) // 2
+                    parts[:0] = [part[:middle], part[middle:]]
+                continue
+            except Exception as e:
+                buffer.flush_errors += 1
+                buffer.last_error = str(e)
+                buffer.restore([row for pending in [part, *parts] for row in pending])
+                logger.warning(f"Error flushing {buffer.table}: {e}", rows=len(part))
+                return False
+            buffer.written += len(part)
+        buffer.flushes += 1
+        buffer.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "flush_interval_ms": int(self.flush_interval * 1000),
+            "flush_rows": self.flush_rows,
+            "tables": {buffer.table: buffer.stats() for buffer in self._buffers},
+        }
+
+
+# Instancia global
+monitoring_writer = MonitoringWriter()
@@ -0,0 +1,288 @@
+"""
+Coalescing de chat completions idénticas (single-flight)
+
+Cuando Open WebUI reintenta, o varios dashboards preguntan lo mismo al mismo
+modelo a la vez, cada petición ejecutaba el agente completo. El coalescer
+agrupa las peticiones por clave (modelo, mensajes normalizados, ámbito del
+usuario, parámetros de generación):
+
+- La primera petición (líder) lanza la ejecución en una tarea de fondo.
+- Las duplicadas en vuelo se adjuntan: en streaming reciben todos los chunks
+  SSE ya emitidos y después los nuevos (fan-out); sin streaming esperan el
+  mismo resultado.
+- Al terminar, el resultado se conserva unos segundos (ventana de
+  completados) para servir los reintentos que llegan justo después. Solo se
+  conservan las ejecuciones correctas: un stream que termina con un chunk de
+  error (stream_chat_completion captura sus excepciones y emite
+  `{"error": ...}` + [DONE]) no se reutiliza.
+
+Dentro de la ventana de completados un "regenerar" con exactamente los mismos
+mensajes es indistinguible de un reintento y recibe la misma respuesta. Con
+chat_coalescing_completed_ttl=0 solo se agrupan las peticiones en vuelo.
+
+Si todos los clientes de un stream se desconectan, la ejecución se cancela
+tras un periodo de gracia (para no perderla si el reintento llega enseguida).
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import structlog
+
+from ..config import get_settings
+from ..monitoring.cache_stats import cache_stats
+from .models import ChatCompletionRequest
+
+
+logger = structlog.get_logger()
+
+CACHE_NAME = "chat_coalescing"
+
+_END = object()
+
+
+def _is_error_chunk(chunk: str) -> bool:
+    """Chunk SSE `data: {"error": ...}` emitido por el productor al fallar."""
+    if '"error"' not in chunk:
+        return False
+    for line in chunk.splitlines():
+        if not line.startswith("data: "):
+            continue
+        try:
+            payload = json.loads(line[6:])
+        except ValueError:
+            continue
+        if isinstance(payload, dict) and "error" in payload:
+            return True
+    return False
+
+
+class _Flight:
+    """Una ejecución en curso y sus suscriptores."""
+
+    def __init__(self, stream: bool):
+        self.stream = stream
+        self.chunks: List[str] = []
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.done = False
+        self.succeeded = False
+        self.errored = False
+        self.task: Optional[asyncio.Task] = None
+        self.result: Optional[asyncio.Future] = None
+        self.orphan_handle: Optional[asyncio.TimerHandle] = None
+
+    def publish(self, chunk: str) -> None:
+        if _is_error_chunk(chunk):
+            self.errored = True
+        self.chunks.append(chunk)
+        for queue in self.subscribers:
+            queue.put_nowait(chunk)
+
+    def close(self) -> None:
+        self.done = True
+        for queue in self.subscribers:
+            queue.put_nowait(_END)
+
+
+class ChatCoalescer:
+    """Registro de ejecuciones en vuelo y completadas recientemente."""
+
+    def __init__(self):
+        self._inflight: Dict[str, _Flight] = {}
+        self._completed: Dict[str, Tuple[float, _Flight]] = {}
+
+    # ------------------------------------------------------------------
+    # Clave
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _normalize_content(content: Any) -> Any:
+        if isinstance(content, str):
+            return " ".join(content.split())
+        return content
+
+    def key_for(self, request: ChatCompletionRequest, scope: Optional[str]) -> Optional[str]:
+        """Clave de coalescing, o None si está desactivado para esta petición."""
+        if not get_settings().chat_coalescing_enabled:
+            return None
+        payload = {
+            "model": request.model,
+            "stream": bool(request.stream),
+            "include_usage": bool(request.stream_options and request.stream_options.include_usage),
+            "scope": scope or "",
+            "conversation": getattr(request, "chat_id", None),
+            "messages": [
+                {
+                    "role": m.role,
+                    "content": self._normalize_content(m.content),
+                    "name": m.name,
+                    "tool_call_id": m.tool_call_id,
+                }
+                for m in request.messages
+            ],
+            "temperature": request.temperature,
+            "top_p": request.top_p,
+            "max_tokens": request.max_tokens or request.max_completion_tokens,
+            "seed": request.seed,
+            "tools": [t.model_dump() for t in request.tools] if request.tools else None,
+            "response_format": request.response_format.model_dump() if request.response_format else None,
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # ------------------------------------------------------------------
+    # Ventana de completados
+    # ------------------------------------------------------------------
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._completed.items() if expires <= now]:
+            del self._completed[key]
+
+    def _finish(self, key: str, flight: _Flight) -> None:
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        ttl = get_settings().chat_coalescing_completed_ttl
+        if flight.succeeded and ttl > 0:
+            self._completed[key] = (time.monotonic() + ttl, flight)
+
+    def _lookup(self, key: str) -> Tuple[Optional[_Flight], str]:
+        self._prune()
+        flight = self._inflight.get(key)
+        if flight is not None:
+            return flight, "inflight"
+        entry = self._completed.get(key)
+        if entry is not None:
+            return entry[1], "completed"
+        return None, ""
+
+    # ------------------------------------------------------------------
+    # Streaming
+    # ------------------------------------------------------------------
+
+    async def _pump(self, key: str, flight: _Flight, producer: AsyncGenerator[str, None]) -> None:
+        try:
+            async for chunk in producer:
+                flight.publish(chunk)
+            # Un error publicado como chunk no debe servirse a los reintentos
+            flight.succeeded = not flight.errored
+        except asyncio.CancelledError:
+            logger.info("Coalesced stream cancelled (no subscribers left)", key=key[:12])
+        except Exception as e:
+            logger.error("Coalesced stream failed", key=key[:12], error=str(e))
+        finally:
+            await producer.aclose()
+            flight.close()
+            self._finish(key, flight)
+
+    def _on_unsubscribe(self, key: str, flight: _Flight) -> None:
+        if flight.done or flight.subscribers:
+            return
+        grace = get_settings().chat_coalescing_orphan_grace
+        loop = asyncio.get_running_loop()
+
+        def _cancel_if_orphan():
+            flight.orphan_handle = None
+            if not flight.done and not flight.subscribers and flight.task:
+                flight.task.cancel()
+
+        if flight.orphan_handle is None:
+            flight.orphan_handle = loop.call_later(grace, _cancel_if_orphan)
+
+    async def _subscribe(self, key: str, flight: _Flight) -> AsyncGenerator[str, None]:
+        queue: asyncio.Queue = asyncio.Queue()
+        # Snapshot + alta sin awaits entre medias: no se pierde ningún chunk
+        history = list(flight.chunks)
+        finished = flight.done
+        if not finished:
+            flight.subscribers.add(queue)
+            if flight.orphan_handle is not None:
+                flight.orphan_handle.cancel()
+                flight.orphan_handle = None
+        try:
+            for chunk in history:
+                yield chunk
+            if finished:
+                return
+            while True:
+                chunk = await queue.get()
+                if chunk is _END:
+                    return
+                yield chunk
+        finally:
+            flight.subscribers.discard(queue)
+            self._on_unsubscribe(key, flight)
+
+    def stream(
+        self,
+        key: Optional[str],
+        producer_factory: Callable[[], AsyncGenerator[str, None]],
+    ) -> AsyncGenerator[str, None]:
+        """Generador SSE: ejecuta o se adjunta a la ejecución con la misma clave."""
+        if key is None:
+            return producer_factory()
+
+        flight, source = self._lookup(key)
+        if flight is not None and flight.stream:
+            cache_stats.hit(CACHE_NAME, source)
+            logger.info("Chat completion coalesced", key=key[:12], source=source, stream=True)
+            return self._subscribe(key, flight)
+
+        cache_stats.miss(CACHE_NAME)
+        flight = _Flight(stream=True)
+        self._inflight[key] = flight
+        flight.task = asyncio.create_task(self._pump(key, flight, producer_factory()))
+        return self._subscribe(key, flight)
+
+    # ------------------------------------------------------------------
+    # Sin streaming
+    # ------------------------------------------------------------------
+
+    async def _run_leader(self, key: str, flight: _Flight, factory: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            result = await factory()
+        except BaseException as e:
+            if not flight.result.done():
+                flight.result.set_exception(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        else:
+            flight.succeeded = True
+            flight.result.set_result(result)
+        finally:
+            flight.done = True
+            self._finish(key, flight)
+
+    async def run(self, key: Optional[str], factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Ejecuta `factory()` o espera al resultado de la ejecución idéntica en curso."""
+        if key is None:
+            return await factory()
+
+        flight, source = self._lookup(key)
+        if flight is not None and not flight.stream:
+            cache_stats.hit(CACHE_NAME, source)
+            logger.info("Chat completion coalesced", key=key[:12], source=source, stream=False)
+            return await asyncio.shield(flight.result)
+
+        cache_stats.miss(CACHE_NAME)
+        flight = _Flight(stream=False)
+        flight.result = asyncio.get_running_loop().create_future()
+        self._inflight[key] = flight
+        # La ejecución sigue aunque el cliente líder se desconecte
+        flight.task = asyncio.create_task(self._run_leader(key, flight, factory))
+        return await asyncio.shield(flight.result)
+
+    def stats(self) -> Dict[str, Any]:
+        self._prune()
+        return {
+            "inflight": len(self._inflight),
+            "completed_window": len(self._completed),
+            "subscribers": sum(len(f.subscribers) for f in self._inflight.values()),
+            **cache_stats.snapshot(CACHE_NAME).get(CACHE_NAME, {}),
+        }
+
+
+chat_coalescer = ChatCoalescer()
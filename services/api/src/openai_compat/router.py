@@ -38,7 +38,14 @@ from .config import config_loader, BackendLLM
 
 from ..engine.registry import chain_registry
 from ..engine.models import ChainConfig
-from ..engine.chains.llm_utils import set_llm_execution_context, clear_llm_execution_context
+from ..engine.chains.llm_utils import (
+    set_llm_execution_context,
+    clear_llm_execution_context,
+    get_llm_usage,
+)
+from ..engine.chains.token_counter import token_counter
+from ..engine.chains.llm_cache import chain_cache_ttl
+from .coalescing import chat_coalescer
 
 logger = structlog.get_logger()
 
@@ -268,17 +275,24 @@ async def create_chat_completion(
     # Resolve conversation_id from chat_id (sent by OpenWebUI)
     conversation_id = getattr(request, "chat_id", None) or None
     
+    # Peticiones idénticas concurrentes (reintentos, varios dashboards) comparten ejecución
+    scope = user_id or (key_data.get("id") if key_data else None) or api_key
+    coalesce_key = chat_coalescer.key_for(request, str(scope) if scope else None)
+
     if request.stream:
         return StreamingResponse(
-            stream_chat_completion(
-                request=request,
-                completion_id=completion_id,
-                model_config=model_config,
-                backend_config=config.backend_llm,
-                api_key=api_key,
-                key_data=key_data,
-                user_id=user_id,
-                conversation_id=conversation_id,
+            chat_coalescer.stream(
+                coalesce_key,
+                lambda: stream_chat_completion(
+                    request=request,
+                    completion_id=completion_id,
+                    model_config=model_config,
+                    backend_config=config.backend_llm,
+                    api_key=api_key,
+                    key_data=key_data,
+                    user_id=user_id,
+                    conversation_id=conversation_id,
+                ),
             ),
             media_type="text/event-stream",
             headers={
@@ -288,15 +302,18 @@ async def create_chat_completion(
             }
         )
     
-    return await execute_chat_completion(
-        request=request,
-        completion_id=completion_id,
-        model_config=model_config,
-        backend_config=config.backend_llm,
-        api_key=api_key,
-        key_data=key_data,
-        user_id=user_id,
-        conversation_id=conversation_id,
+    return await chat_coalescer.run(
+        coalesce_key,
+        lambda: execute_chat_completion(
+            request=request,
+            completion_id=completion_id,
+            model_config=model_config,
+            backend_config=config.backend_llm,
+            api_key=api_key,
+            key_data=key_data,
+            user_id=user_id,
+            conversation_id=conversation_id,
+        ),
     )
 
 
@@ -353,7 +370,7 @@ async def execute_chat_completion(
     if isinstance(last_user_content, list):
         chain_input["_last_user_content"] = last_user_content
     
-    set_llm_execution_context(completion_id, chain_id)
+    set_llm_execution_context(completion_id, chain_id, chain_cache_ttl(definition.config))
     try:
         full_response = ""
         tools_used = []
@@ -385,10 +402,8 @@ async def execute_chat_completion(
                 elif event.event_type == "response_complete" and event.content:
                     full_response = event.content
         
-        # Calcular tokens (aproximación)
-        prompt_tokens = sum(len(m.content or "") // 4 for m in request.messages)
-        completion_tokens = len(full_response) // 4
-        total_tokens = prompt_tokens + completion_tokens
+        usage = _execution_usage(request, backend_config.model, full_response)
+        total_tokens = usage.total_tokens
         
         if api_key:
             await api_key_validator.update_usage(api_key, total_tokens)
@@ -415,11 +430,7 @@ async def execute_chat_completion(
                     finish_reason="stop"
                 )
             ],
-            usage=CompletionUsage(
-                prompt_tokens=prompt_tokens,
-                completion_tokens=completion_tokens,
-                total_tokens=total_tokens
-            )
+            usage=usage
         )
         
     except Exception as e:
@@ -438,6 +449,36 @@ async def execute_chat_completion(
         clear_llm_execution_context()
 
 
+def _execution_usage(
+    request: ChatCompletionRequest,
+    model: Optional[str],
+    full_response: str,
+) -> CompletionUsage:
+    """
+    Uso real de la ejecución: suma del usage de todas las llamadas LLM
+    (iteraciones + subagentes). Si no hubo llamadas con contexto, se cuenta
+    la conversación con el tokenizador del modelo.
+    """
+    accumulated = get_llm_usage()
+    if accumulated is not None and accumulated.calls:
+        return CompletionUsage(
+            prompt_tokens=accumulated.prompt_tokens,
+            completion_tokens=accumulated.completion_tokens,
+            total_tokens=accumulated.total_tokens,
+            prompt_tokens_details={"cached_tokens": accumulated.cached_tokens},
+        )
+    
+    prompt_tokens = token_counter.count_messages(
+        [{"role": m.role, "content": m.content} for m in request.messages], model
+    )
+    completion_tokens = token_counter.count_text(full_response, model)
+    return CompletionUsage(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+    )
+
+
 async def stream_chat_completion(
     request: ChatCompletionRequest,
     completion_id: str,
@@ -505,12 +546,12 @@ async def stream_chat_completion(
     if isinstance(last_user_content, list):
         chain_input["_last_user_content"] = last_user_content
     
-    total_tokens = 0
+    full_response = ""
     
     # Activar Brain Events para modelos brain-* (Open WebUI)
     emit_brain_events = request.model.startswith("brain-")
     
-    set_llm_execution_context(completion_id, chain_id)
+    set_llm_execution_context(completion_id, chain_id, chain_cache_ttl(definition.config))
     try:
         async for event in builder(
             config=definition.config,
@@ -541,7 +582,7 @@ async def stream_chat_completion(
                     ]
                 )
                 yield f"data: {content_chunk.model_dump_json()}\n\n"
-                total_tokens += 1
+                full_response += event.content
         
         # Chunk final
         final_chunk = ChatCompletionChunk(
@@ -557,10 +598,21 @@ async def stream_chat_completion(
             ]
         )
         yield f"data: {final_chunk.model_dump_json()}\n\n"
+        
+        usage = _execution_usage(request, backend_config.model, full_response)
+        if request.stream_options and request.stream_options.include_usage:
+            usage_chunk = ChatCompletionChunk(
+                id=completion_id,
+                created=int(time.time()),
+                model=request.model,
+                choices=[],
+                usage=usage
+            )
+            yield f"data: {usage_chunk.model_dump_json()}\n\n"
         yield "data: [DONE]\n\n"
         
         if api_key:
-            await api_key_validator.update_usage(api_key, total_tokens)
+            await api_key_validator.update_usage(api_key, usage.total_tokens)
         
         elapsed_ms = int((time.time() - start_time) * 1000)
         logger.info(
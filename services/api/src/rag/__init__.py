@@ -5,9 +5,19 @@ RAG Module - Retrieval Augmented Generation con LangChain + pgvector
 from .vectorstore import RAGVectorStore
 from .ingestor import DocumentIngestor
 from .searcher import RAGSearcher
+from .storage import RAGStorage, RAGCollection, rag_storage
+from .embedding_cache import EmbeddingCache, embedding_cache
+from .search_cache import SearchResultCache, search_cache
 
 __all__ = [
     "RAGVectorStore",
     "DocumentIngestor",
-    "RAGSearcher"
+    "RAGSearcher",
+    "RAGStorage",
+    "RAGCollection",
+    "rag_storage",
+    "EmbeddingCache",
+    "embedding_cache",
+    "SearchResultCache",
+    "search_cache"
 ]
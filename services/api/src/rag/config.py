@@ -2,7 +2,7 @@
 Configuración del módulo RAG
 """
 
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from pydantic import BaseModel
 from src.config import get_settings
 
@@ -17,6 +17,20 @@ class RAGConfig(BaseModel):
     embedding_base_url: str = "http://host.docker.internal:11434"
     embedding_dimensions: int = 4096
     
+    # Generación de embeddings por lotes (/api/embed acepta una lista en `input`)
+    embedding_batch_size: int = 32
+    embedding_max_concurrency: int = 4  # lotes en vuelo a la vez
+    embedding_max_retries: int = 3
+    embedding_timeout: float = 120.0
+    
+    # Escritura en bloque (COPY binario): chunks por lote embebido y escrito
+    write_batch_size: int = 256
+    
+    # Ingesta en streaming (ver rag/pipeline.py)
+    ingest_workers: int = 2  # procesos de extracción (pypdf, openpyxl...)
+    ingest_segment_queue: int = 8  # páginas/bloques extraídos pendientes de trocear
+    ingest_write_queue: int = 2  # lotes embebidos pendientes de escribir
+    
     # Chunking
     chunk_size: int = 500
     chunk_overlap: int = 50
@@ -27,6 +41,54 @@ class RAGConfig(BaseModel):
     # Search
     default_top_k: int = 5
     similarity_threshold: float = 0.5  # Más permisivo
+    # Caché de resultados (rag/search_cache.py): TTL corto, 0 = desactivada.
+    # Se invalida al escribir en la colección desde cualquier réplica (versión
+    # por colección en la BD); el TTL solo acota la memoria
+    search_cache_ttl: float = 30.0
+    
+    # Búsqueda híbrida: léxica (full-text) + vectorial, fusionadas con RRF.
+    # Opt-in: en hybrid/lexical min_score solo filtra los resultados que llegan
+    # únicamente por la vía vectorial (ver RAGSearcher.search)
+    search_mode: str = "vector"  # vector | lexical | hybrid
+    rrf_k: int = 60
+    hybrid_candidates_factor: int = 3  # candidatos por vía = top_k * factor
+    hybrid_lexical_weight: float = 1.0
+    hybrid_vector_weight: float = 1.0
+    # Pesos por colección, p.ej. {"sap": {"lexical": 2.0, "vector": 1.0}}
+    hybrid_collection_weights: Dict[str, Dict[str, float]] = {}
+    # Queries cortas (códigos, referencias) con suficientes coincidencias de
+    # todos los términos se resuelven solo con la vía léxica (0 = nunca)
+    lexical_short_circuit_max_terms: int = 3
+    lexical_short_circuit_min_hits: int = 3
+    
+    # Índice ANN (ver rag/index_manager.py)
+    # HNSW/IVFFlat sobre `vector` admiten hasta 2000 dims y sobre `halfvec`
+    # hasta 4000; por encima se indexa una versión reducida del embedding.
+    index_method: str = "hnsw"  # hnsw | ivfflat | none
+    index_storage: str = "auto"  # auto | vector | halfvec | binary
+    index_dimensions: Optional[int] = None  # primeras N dims (modelos Matryoshka) en halfvec
+    hnsw_m: int = 16
+    hnsw_ef_construction: int = 64
+    hnsw_ef_search: Optional[int] = None  # None = según top_k
+    ivfflat_probes: Optional[int] = None  # None = sqrt(lists)
+    ivfflat_min_rows: int = 1000  # IVFFlat necesita datos para entrenar los centroides
+    rerank_factor: int = 8  # candidatos ANN por resultado con índices aproximados
+    # Búsquedas con filtro de metadata (ver rag/filters.py): escaneo iterativo
+    # del índice (pgvector >= 0.8) para seguir devolviendo top_k filas
+    filter_iterative_scan: bool = True
+    hnsw_max_scan_tuples: Optional[int] = None  # None = default de pgvector (20000)
+    ivfflat_max_probes: Optional[int] = None  # None = todas las listas
+    index_rebuild_growth: float = 2.0  # REINDEX cuando las filas se multiplican por este factor
+    index_maintenance_work_mem: str = "512MB"
+    index_build_timeout: float = 6 * 3600
+    
+    def hybrid_weights(self, collection: str) -> Tuple[float, float]:
+        """Pesos (léxico, vectorial) de RRF para una colección"""
+        weights = self.hybrid_collection_weights.get(collection, {})
+        return (
+            weights.get("lexical", self.hybrid_lexical_weight),
+            weights.get("vector", self.hybrid_vector_weight),
+        )
 
 
 async def get_rag_config_from_strapi() -> RAGConfig:
@@ -0,0 +1,221 @@
+"""
+Caché de embeddings direccionada por contenido
+
+Clave: (modelo de embedding, sha256 del texto del chunk). Es independiente de
+la colección y del documento, así que re-ingestar el mismo fichero, indexar
+documentos solapados en varias colecciones o repetir ingest_from_strapi
+reutiliza los vectores ya calculados.
+
+Dos niveles:
+1. LRU en memoria acotado (vectores como array('f') para no inflar memoria).
+2. Tabla rag_embedding_cache en PostgreSQL (duradera, compartida entre réplicas).
+
+Los aciertos/fallos se registran en src.monitoring.cache_stats con el nombre
+"rag_embedding" (un acierto o fallo por texto).
+
+Las queries de búsqueda tienen su propio LRU ("rag_query_embedding"),
+indexado por (modelo, query normalizada) y sin tier PostgreSQL: la misma
+pregunta se repite entre el agente RAG y la tool rag_search dentro de una
+ejecución y entre usuarios, y no merece ocupar la tabla de chunks. Las
+peticiones concurrentes de la misma query comparten un único embedding.
+"""
+
+import asyncio
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import structlog
+
+from src.monitoring.cache_stats import cache_stats
+from .embeddings import OllamaEmbeddings
+from .storage import content_hash, rag_storage
+
+logger = structlog.get_logger()
+
+CACHE_NAME = "rag_embedding"
+QUERY_CACHE_NAME = "rag_query_embedding"
+# 4096 dims * 4 bytes = 16 KB por entrada -> ~32 MB con 2048 entradas
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_QUERY_MAX_ENTRIES = 1024
+
+
+def normalize_query(text: str) -> str:
+    """
+    Unicode NFKC y espacios colapsados. Las mayúsculas se conservan: los
+    modelos de embedding las distinguen (códigos, siglas).
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class EmbeddingCache:
+    """LRU en memoria + tier PostgreSQL para embeddings por (modelo, hash)."""
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_query_entries: int = DEFAULT_QUERY_MAX_ENTRIES
+    ):
+        self.max_entries = max_entries
+        self.max_query_entries = max_query_entries
+        self._entries: "OrderedDict[Tuple[str, str], array]" = OrderedDict()
+        self._queries: "OrderedDict[Tuple[str, str], array]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    # ------------------------------------------------------------------
+    # Memoria
+    # ------------------------------------------------------------------
+
+    def _memory_get(self, key: Tuple[str, str]) -> Optional[List[float]]:
+        vector = self._entries.get(key)
+        if vector is None:
+            return None
+        self._entries.move_to_end(key)
+        return vector.tolist()
+
+    def _memory_set(self, key: Tuple[str, str], embedding: List[float]) -> None:
+        self._entries[key] = array("f", embedding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            cache_stats.incr(CACHE_NAME, "evictions")
+
+    # ------------------------------------------------------------------
+    # PostgreSQL (best-effort: si falla, solo memoria)
+    # ------------------------------------------------------------------
+
+    async def _db_get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        if not hashes:
+            return {}
+        try:
+            async with rag_storage.acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT content_hash, embedding
+                    FROM rag_embedding_cache
+                    WHERE model = $1 AND content_hash = ANY($2::bpchar[])
+                """, model, hashes)
+        except Exception as e:
+            logger.debug("Embedding cache lookup failed", error=str(e))
+            return {}
+        return {row["content_hash"]: list(row["embedding"]) for row in rows}
+
+    async def _db_set_many(self, model: str, items: List[Tuple[str, List[float]]]) -> None:
+        if not items:
+            return
+        try:
+            async with rag_storage.acquire() as conn:
+                await conn.executemany("""
+                    INSERT INTO rag_embedding_cache (model, content_hash, embedding)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (model, content_hash) DO NOTHING
+                """, [(model, digest, embedding) for digest, embedding in items])
+        except Exception as e:
+            logger.debug("Embedding cache store failed", error=str(e))
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    async def embed_documents(self, embeddings: OllamaEmbeddings, texts: List[str]) -> List[List[float]]:
+        """
+        Embeddings de `texts` en orden, calculando con Ollama solo los que no
+        están en caché (y una sola vez por texto repetido).
+        """
+        if not texts:
+            return []
+        await rag_storage.ensure_schema()
+
+        model = embeddings.model
+        hashes = [content_hash(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+
+        pending = []
+        for digest in dict.fromkeys(hashes):
+            vector = self._memory_get((model, digest))
+            if vector is not None:
+                found[digest] = vector
+            else:
+                pending.append(digest)
+        memory_hits = len(found)
+
+        from_db = await self._db_get_many(model, pending)
+        for digest, vector in from_db.items():
+            found[digest] = vector
+            self._memory_set((model, digest), vector)
+
+        missing = [digest for digest in pending if digest not in found]
+        if missing:
+            text_by_hash = dict(zip(hashes, texts))
+            computed = await embeddings.aembed_documents([text_by_hash[d] for d in missing])
+            for digest, vector in zip(missing, computed):
+                found[digest] = vector
+                self._memory_set((model, digest), vector)
+            await self._db_set_many(model, list(zip(missing, computed)))
+            cache_stats.incr(CACHE_NAME, "stores", len(missing))
+
+        if memory_hits:
+            cache_stats.hit(CACHE_NAME, "memory", memory_hits)
+        if from_db:
+            cache_stats.hit(CACHE_NAME, "postgres", len(from_db))
+        if missing:
+            cache_stats.miss(CACHE_NAME, len(missing))
+
+        if len(found) > len(missing):
+            logger.info(
+                "Embeddings reutilizados de caché",
+                model=model,
+                total=len(texts),
+                cached=len(found) - len(missing),
+                computed=len(missing)
+            )
+        return [found[digest] for digest in hashes]
+
+    async def embed_query(self, embeddings: OllamaEmbeddings, text: str) -> List[float]:
+        """Embedding de una query de búsqueda (LRU propio + single-flight)."""
+        key = (embeddings.model, normalize_query(text))
+        vector = self._queries.get(key)
+        if vector is not None:
+            self._queries.move_to_end(key)
+            cache_stats.hit(QUERY_CACHE_NAME, "memory")
+            return vector.tolist()
+
+        task = self._inflight.get(key)
+        if task is None:
+            cache_stats.miss(QUERY_CACHE_NAME)
+            task = asyncio.ensure_future(self._compute_query(embeddings, key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+        else:
+            cache_stats.hit(QUERY_CACHE_NAME, "inflight")
+        # shield: si un llamador se cancela, el resto sigue esperando el resultado
+        return list(await asyncio.shield(task))
+
+    async def _compute_query(self, embeddings: OllamaEmbeddings, key: Tuple[str, str]) -> List[float]:
+        embedding = await embeddings.aembed_query(key[1])
+        self._queries[key] = array("f", embedding)
+        self._queries.move_to_end(key)
+        while len(self._queries) > self.max_query_entries:
+            self._queries.popitem(last=False)
+            cache_stats.incr(QUERY_CACHE_NAME, "evictions")
+        return embedding
+
+    def clear_memory(self) -> None:
+        self._entries.clear()
+        self._queries.clear()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "memory_entries": len(self._entries),
+            "max_entries": self.max_entries,
+            **cache_stats.snapshot(CACHE_NAME).get(CACHE_NAME, {}),
+            "queries": {
+                "memory_entries": len(self._queries),
+                "max_entries": self.max_query_entries,
+                "inflight": len(self._inflight),
+                **cache_stats.snapshot(QUERY_CACHE_NAME).get(QUERY_CACHE_NAME, {}),
+            },
+        }
+
+
+embedding_cache = EmbeddingCache()
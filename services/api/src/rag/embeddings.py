@@ -1,97 +1,190 @@
 """
 Embeddings con Ollama
+
+Los textos se envían por lotes a /api/embed (que acepta una lista en
+`input`), con varios lotes en vuelo bajo un semáforo, reintentos con
+backoff ante errores transitorios y reensamblado en el orden original.
+La ruta síncrona usa el mismo motor.
 """
 
-from typing import List
+import asyncio
+import random
+import threading
+from typing import List, Optional
+
 import httpx
 import structlog
 from langchain_core.embeddings import Embeddings
 
+from .config import get_rag_config
+
 logger = structlog.get_logger()
 
+# Códigos HTTP tras los que tiene sentido reintentar
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+
+
+def _is_transient(error: Exception) -> bool:
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS
+    return False
+
 
 class OllamaEmbeddings(Embeddings):
     """Embeddings usando Ollama API directamente"""
-    
+
     def __init__(
         self,
         base_url: str = "http://host.docker.internal:11434",
-        model: str = "qwen3-embedding:8b"
+        model: str = "qwen3-embedding:8b",
+        batch_size: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        timeout: Optional[float] = None
     ):
+        config = get_rag_config()
         self.base_url = base_url.rstrip("/")
         self.model = model
-    
+        self.batch_size = max(1, batch_size or config.embedding_batch_size)
+        self.max_concurrency = max(1, max_concurrency or config.embedding_max_concurrency)
+        self.max_retries = config.embedding_max_retries if max_retries is None else max_retries
+        self.timeout = timeout or config.embedding_timeout
+
+    # ------------------------------------------------------------------
+    # API síncrona (LangChain)
+    # ------------------------------------------------------------------
+
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """Generar embeddings para múltiples textos"""
-        embeddings = []
-        for text in texts:
-            embedding = self._embed_single(text)
-            embeddings.append(embedding)
-        return embeddings
-    
+        return self._run_sync(texts)
+
     def embed_query(self, text: str) -> List[float]:
         """Generar embedding para una query"""
-        return self._embed_single(text)
-    
-    def _embed_single(self, text: str) -> List[float]:
-        """Generar embedding para un texto"""
+        return self._run_sync([text])[0]
+
+    def _run_sync(self, texts: List[str]) -> List[List[float]]:
+        """
+        Ejecuta el motor async con un cliente propio. Si ya hay un event loop
+        en este hilo (p.ej. llamado desde código async), se usa otro hilo.
+        """
+        async def _run() -> List[List[float]]:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                return await self._embed_texts(client, texts)
+
         try:
-            with httpx.Client(timeout=60.0) as client:
-                response = client.post(
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(_run())
+
+        result: dict = {}
+
+        def _target():
+            try:
+                result["value"] = asyncio.run(_run())
+            except Exception as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=_target, name="ollama-embeddings")
+        thread.start()
+        thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["value"]
+
+    # ------------------------------------------------------------------
+    # API async
+    # ------------------------------------------------------------------
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Versión async de embed_documents"""
+        return await self._embed_texts(self._client(), texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Versión async de embed_query"""
+        return (await self._embed_texts(self._client(), [text]))[0]
+
+    def _client(self) -> httpx.AsyncClient:
+        """Cliente keep-alive compartido del proceso para este servidor Ollama"""
+        from src.engine.chains.llm_transport import get_llm_client
+        return get_llm_client("ollama", self.base_url)
+
+    # ------------------------------------------------------------------
+    # Motor de lotes
+    # ------------------------------------------------------------------
+
+    async def _embed_texts(self, client: httpx.AsyncClient, texts: List[str]) -> List[List[float]]:
+        """Divide en lotes, los lanza en paralelo (acotado) y reensambla en orden"""
+        if not texts:
+            return []
+
+        batches = [
+            texts[start:start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _run_batch(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await self._embed_batch(client, batch)
+
+        results = await asyncio.gather(*(_run_batch(batch) for batch in batches))
+
+        embeddings: List[List[float]] = []
+        for batch_embeddings in results:
+            embeddings.extend(batch_embeddings)
+
+        if len(batches) > 1:
+            logger.debug(
+                "Embeddings generados por lotes",
+                texts=len(texts),
+                batches=len(batches),
+                batch_size=self.batch_size
+            )
+        return embeddings
+
+    async def _embed_batch(self, client: httpx.AsyncClient, batch: List[str]) -> List[List[float]]:
+        """Un lote en una sola petición, con reintentos y backoff exponencial"""
+        attempt = 0
+        while True:
+            try:
+                response = await client.post(
                     f"{self.base_url}/api/embed",
                     json={
                         "model": self.model,
-                        "input": text
-                    }
+                        "input": batch
+                    },
+                    timeout=self.timeout
                 )
                 response.raise_for_status()
-                data = response.json()
-                
-                # Ollama devuelve embeddings en data["embeddings"][0]
-                embeddings = data.get("embeddings", [[]])
-                if embeddings and len(embeddings) > 0:
-                    return embeddings[0]
-                
-                # Fallback para versiones antiguas de Ollama
-                return data.get("embedding", [])
-                
-        except Exception as e:
-            logger.error(f"Error generando embedding: {e}")
-            raise
-    
-    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Versión async de embed_documents"""
-        embeddings = []
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            for text in texts:
-                embedding = await self._aembed_single(client, text)
-                embeddings.append(embedding)
-        return embeddings
-    
-    async def aembed_query(self, text: str) -> List[float]:
-        """Versión async de embed_query"""
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            return await self._aembed_single(client, text)
-    
-    async def _aembed_single(self, client: httpx.AsyncClient, text: str) -> List[float]:
-        """Generar embedding async para un texto"""
-        try:
-            response = await client.post(
-                f"{self.base_url}/api/embed",
-                json={
-                    "model": self.model,
-                    "input": text
-                }
+                return self._parse_embeddings(response.json(), len(batch))
+
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_transient(e):
+                    logger.error(f"Error generando embeddings ({len(batch)} textos): {e}")
+                    raise
+                delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+                delay *= random.uniform(0.5, 1.0)
+                attempt += 1
+                logger.warning(
+                    f"Error transitorio generando embeddings, reintentando: {e}",
+                    attempt=attempt,
+                    delay=round(delay, 2)
+                )
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _parse_embeddings(data: dict, expected: int) -> List[List[float]]:
+        # Ollama devuelve un embedding por entrada en data["embeddings"]
+        embeddings = data.get("embeddings")
+        if not embeddings and expected == 1 and data.get("embedding"):
+            # Fallback para versiones antiguas de Ollama
+            embeddings = [data["embedding"]]
+        if not embeddings or len(embeddings) != expected:
+            raise ValueError(
+                f"Ollama devolvió {len(embeddings or [])} embeddings para {expected} textos"
             )
-            response.raise_for_status()
-            data = response.json()
-            
-            embeddings = data.get("embeddings", [[]])
-            if embeddings and len(embeddings) > 0:
-                return embeddings[0]
-            
-            return data.get("embedding", [])
-            
-        except Exception as e:
-            logger.error(f"Error generando embedding async: {e}")
-            raise
+        return embeddings
@@ -0,0 +1,183 @@
+"""
+Extracción de texto por segmentos (página, hoja, bloque de filas)
+
+Se ejecuta en los procesos de extracción (ver rag/pipeline.py): pypdf,
+openpyxl o python-docx son CPU puro y bloquearían el event loop. Cada
+extractor es un generador de segmentos (texto, metadata del segmento) que no
+materializa el documento completo; `pump_segments` los publica en una cola
+acotada, así que el worker se detiene si el resto del pipeline va por detrás.
+
+Este módulo solo usa la librería estándar (y las de cada formato, importadas
+bajo demanda): se importa en los procesos worker.
+"""
+
+import csv
+import queue as queue_module
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+# (texto, metadata del segmento, p.ej. {"page": 3} o {"sheet": "Ventas"})
+Segment = Tuple[str, Dict[str, Any]]
+
+# Filas por segmento en hojas de cálculo y CSV
+SEGMENT_ROWS = 500
+# Caracteres aproximados por segmento en texto plano y DOCX
+TEXT_BLOCK_CHARS = 64 * 1024
+# Espera máxima de cada put antes de comprobar la cancelación
+PUT_TIMEOUT_SECONDS = 0.5
+
+
+def _pdf(path: Path) -> Iterator[Segment]:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ImportError("pypdf no instalado. Ejecuta: pip install pypdf")
+    reader = PdfReader(str(path))
+    for number, page in enumerate(reader.pages, start=1):
+        yield page.extract_text() or "", {"page": number}
+
+
+def _docx(path: Path) -> Iterator[Segment]:
+    try:
+        from docx import Document as DocxDocument
+    except ImportError:
+        raise ImportError("python-docx no instalado")
+    doc = DocxDocument(str(path))
+    block: List[str] = []
+    size = 0
+    for paragraph in doc.paragraphs:
+        if not paragraph.text.strip():
+            continue
+        block.append(paragraph.text)
+        size += len(paragraph.text)
+        if size >= TEXT_BLOCK_CHARS:
+            yield "\n\n".join(block), {}
+            block, size = [], 0
+    if block:
+        yield "\n\n".join(block), {}
+
+
+def _html(path: Path) -> Iterator[Segment]:
+    html = path.read_text(encoding="utf-8")
+    try:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, "html.parser")
+        # Eliminar scripts y estilos
+        for tag in soup(["script", "style", "nav", "footer", "header"]):
+            tag.decompose()
+        yield soup.get_text(separator="\n", strip=True), {}
+    except ImportError:
+        # Fallback simple sin BeautifulSoup
+        import re
+        text = re.sub(r'<[^>]+>', ' ', html)
+        yield re.sub(r'\s+', ' ', text).strip(), {}
+
+
+def _text(path: Path) -> Iterator[Segment]:
+    """Texto plano por bloques, cortando en el último salto de línea."""
+    carry = ""
+    with open(path, encoding="utf-8") as f:
+        while True:
+            block = f.read(TEXT_BLOCK_CHARS)
+            if not block:
+                break
+            block = carry + block
+            cut = block.rfind("\n")
+            if cut <= 0:
+                if len(block) < TEXT_BLOCK_CHARS * 4:
+                    carry = block
+                    continue
+                # Sin saltos de línea: cortar igualmente para acotar memoria
+                cut = len(block)
+            carry = block[cut + 1:]
+            yield block[:cut], {}
+    if carry:
+        yield carry, {}
+
+
+def _csv(path: Path) -> Iterator[Segment]:
+    """CSV preservando estructura tabular, por bloques de filas."""
+    rows: List[str] = []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.reader(f):
+            rows.append(" | ".join(row))
+            if len(rows) >= SEGMENT_ROWS:
+                yield "\n".join(rows), {}
+                rows = []
+    if rows:
+        yield "\n".join(rows), {}
+
+
+def _excel(path: Path) -> Iterator[Segment]:
+    """Excel preservando estructura tabular: hoja a hoja, por bloques de filas."""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportError("openpyxl no instalado. Ejecuta: pip install openpyxl")
+    wb = load_workbook(str(path), read_only=True, data_only=True)
+    try:
+        for sheet_name in wb.sheetnames:
+            ws = wb[sheet_name]
+            header = f"## Hoja: {sheet_name}\n\n"
+            rows: List[str] = []
+            for row in ws.iter_rows(values_only=True):
+                cells = [str(c) if c is not None else "" for c in row]
+                rows.append(" | ".join(cells))
+                if len(rows) >= SEGMENT_ROWS:
+                    yield header + "\n".join(rows), {"sheet": sheet_name}
+                    header, rows = "", []
+            if rows:
+                yield header + "\n".join(rows), {"sheet": sheet_name}
+    finally:
+        wb.close()
+
+
+_EXTRACTORS = {
+    ".pdf": _pdf,
+    ".docx": _docx,
+    ".html": _html,
+    ".txt": _text,
+    ".md": _text,
+    ".csv": _csv,
+    ".xlsx": _excel,
+    ".xls": _excel,
+}
+
+
+def iter_segments(path: str, extension: str) -> Iterator[Segment]:
+    """Segmentos de texto de un fichero, en orden."""
+    extractor = _EXTRACTORS.get(extension)
+    if extractor is None:
+        raise ValueError(f"Extractor no implementado para {extension}")
+    return extractor(Path(path))
+
+
+def pump_segments(path: str, extension: str, queue, cancel) -> int:
+    """
+    Punto de entrada del worker: publica en `queue` mensajes
+    ("segment", texto, metadata), y al final ("done", total, None) o
+    ("error", excepción, None). Se detiene si `cancel` se activa.
+    """
+    def _put(item: tuple) -> bool:
+        while not cancel.is_set():
+            try:
+                queue.put(item, timeout=PUT_TIMEOUT_SECONDS)
+                return True
+            except queue_module.Full:
+                continue
+        return False
+
+    count = 0
+    try:
+        for text, metadata in iter_segments(path, extension):
+            if not _put(("segment", text, metadata)):
+                return count
+            count += 1
+        _put(("done", count, None))
+    except Exception as e:
+        try:
+            _put(("error", e, None))
+        except Exception:
+            # La excepción original no se puede serializar
+            _put(("error", RuntimeError(f"{type(e).__name__}: {e}"), None))
+    return count
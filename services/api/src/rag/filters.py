@@ -0,0 +1,188 @@
+"""
+Filtros de metadata para las búsquedas RAG
+
+Mini-DSL que se compila a predicados SQL sobre rag_chunks.metadata (JSONB),
+de modo que el filtrado ocurre dentro de la búsqueda en PostgreSQL y no en
+Python sobre un top_k sobredimensionado:
+
+    {"source": "manual.pdf"}                                  igualdad
+    {"department": {"$eq": "legal"}}                          igualdad (explícita)
+    {"file_type": [".pdf", ".docx"]}                          IN
+    {"file_type": {"$in": ["pdf", "docx"]}}                   IN (explícita)
+    {"ingested_at": {"$gte": "2024-01-01", "$lt": "2024-07-01"}}   rango
+    {"chunk_index": {"$lte": 3}}                              rango numérico
+
+Las claves se combinan con AND. Igualdades e IN se compilan a contención
+(`metadata @> ...`), que resuelve el índice GIN rag_chunks_metadata_idx. Los
+rangos de fechas comparan cadenas ISO-8601 (orden lexicográfico =
+cronológico) y los numéricos comparan como float8. `file_type` se normaliza
+al formato de la ingesta (".pdf").
+
+Todos los valores y claves viajan como parámetros: nada se interpola en el SQL.
+"""
+
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+MAX_IN_VALUES = 100
+MAX_KEY_LENGTH = 128
+
+_RANGE_OPERATORS = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+_SCALAR_TYPES = (str, int, float, bool)
+
+
+class FilterError(ValueError):
+    """Filtro de metadata mal formado."""
+
+
+@dataclass
+class CompiledFilter:
+    """Predicado SQL (sin AND inicial) y sus parámetros, numerados desde first_param."""
+    sql: str = ""
+    args: List[Any] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.sql)
+
+    def clause(self) -> str:
+        """Fragmento listo para añadir a un WHERE existente."""
+        return f" AND {self.sql}" if self.sql else ""
+
+
+def _normalize_value(key: str, value: Any) -> Any:
+    if not isinstance(value, _SCALAR_TYPES):
+        raise FilterError(f"Valor no soportado para '{key}': {value!r}")
+    if key == "file_type" and isinstance(value, str):
+        value = value.strip().lower()
+        if value and not value.startswith("."):
+            value = f".{value}"
+    return value
+
+
+def _range_bound(key: str, op: str, value: Any) -> Any:
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise FilterError(f"'{op}' en '{key}' requiere una fecha ISO-8601 o un número")
+    if isinstance(value, str):
+        try:
+            datetime.fromisoformat(value)
+        except ValueError:
+            raise FilterError(f"'{op}' en '{key}': fecha ISO-8601 no válida: {value!r}")
+    return value
+
+
+class _Compiler:
+    def __init__(self, first_param: int):
+        self.next_param = first_param
+        self.args: List[Any] = []
+
+    def param(self, value: Any, cast: str) -> str:
+        self.args.append(value)
+        placeholder = f"${self.next_param}::{cast}"
+        self.next_param += 1
+        return placeholder
+
+    def contains(self, document: Dict[str, Any]) -> str:
+        return f"metadata @> {self.param(json.dumps(document), 'jsonb')}"
+
+    def range(self, key: str, op: str, value: Any) -> str:
+        key_param = self.param(key, "text")
+        if isinstance(value, str):
+            return f"metadata->>{key_param} {_RANGE_OPERATORS[op]} {self.param(value, 'text')}"
+        # Solo valores numéricos: evita errores de cast con datos heterogéneos
+        return (
+            f"(CASE WHEN jsonb_typeof(metadata->{key_param}) = 'number' "
+            f"THEN (metadata->>{key_param})::float8 END) "
+            f"{_RANGE_OPERATORS[op]} {self.param(float(value), 'float8')}"
+        )
+
+
+def compile_metadata_filter(filters: Optional[Dict[str, Any]], first_param: int) -> CompiledFilter:
+    """
+    Compilar un filtro del DSL a SQL.
+
+    Args:
+        filters: Diccionario clave -> valor | lista | {operador: valor}
+        first_param: Número del primer placeholder ($N) libre en la consulta
+
+    Raises:
+        FilterError: Si el filtro no es válido
+    """
+    if not filters:
+        return CompiledFilter()
+    if not isinstance(filters, dict):
+        raise FilterError("El filtro de metadata debe ser un objeto")
+
+    compiler = _Compiler(first_param)
+    equalities: Dict[str, Any] = {}
+    predicates: List[str] = []
+
+    for key, condition in filters.items():
+        if not isinstance(key, str) or not key or len(key) > MAX_KEY_LENGTH:
+            raise FilterError(f"Clave de metadata no válida: {key!r}")
+
+        if isinstance(condition, list):
+            condition = {"$in": condition}
+        if not isinstance(condition, dict):
+            equalities[key] = _normalize_value(key, condition)
+            continue
+        if not condition:
+            raise FilterError(f"Condición vacía para '{key}'")
+
+        for op, value in condition.items():
+            if op == "$eq":
+                equalities[key] = _normalize_value(key, value)
+            elif op == "$in":
+                if not isinstance(value, list) or not value:
+                    raise FilterError(f"'$in' en '{key}' requiere una lista no vacía")
+                if len(value) > MAX_IN_VALUES:
+                    raise FilterError(f"'$in' en '{key}' admite como máximo {MAX_IN_VALUES} valores")
+                values = list(dict.fromkeys(_normalize_value(key, v) for v in value))
+                if len(values) == 1:
+                    equalities[key] = values[0]
+                else:
+                    # OR de contenciones: cada rama usa el índice GIN (BitmapOr)
+                    predicates.append(
+                        "(" + " OR ".join(compiler.contains({key: v}) for v in values) + ")"
+                    )
+            elif op in _RANGE_OPERATORS:
+                predicates.append(compiler.range(key, op, _range_bound(key, op, value)))
+            else:
+                raise FilterError(
+                    f"Operador no soportado en '{key}': {op}. "
+                    f"Opciones: $eq, $in, {', '.join(_RANGE_OPERATORS)}"
+                )
+
+    if equalities:
+        predicates.insert(0, compiler.contains(equalities))
+
+    return CompiledFilter(sql=" AND ".join(predicates), args=compiler.args)
+
+
+def build_metadata_filter(
+    filters: Optional[Dict[str, Any]] = None,
+    source: Optional[str] = None,
+    file_type: Optional[List[str]] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    date_field: str = "ingested_at",
+) -> Optional[Dict[str, Any]]:
+    """
+    Combinar un filtro del DSL con los atajos habituales (fuente, tipo de
+    fichero y rango de fechas, date_to exclusivo). None si no hay filtro.
+    """
+    combined: Dict[str, Any] = dict(filters or {})
+    if source:
+        combined["source"] = source
+    if file_type:
+        combined["file_type"] = {"$in": list(file_type)}
+    if date_from or date_to:
+        existing = combined.get(date_field)
+        bounds = dict(existing) if isinstance(existing, dict) else {}
+        if date_from:
+            bounds["$gte"] = date_from
+        if date_to:
+            bounds["$lt"] = date_to
+        combined[date_field] = bounds
+    return combined or None
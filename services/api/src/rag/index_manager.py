@@ -0,0 +1,530 @@
+"""
+Gestión del índice ANN de rag_chunks
+
+pgvector solo indexa (HNSW/IVFFlat) `vector` de hasta 2000 dimensiones y
+`halfvec` de hasta 4000. Con embeddings de 4096 dims (qwen3-embedding:8b) el
+índice IVFFlat "clásico" no llega a crearse y todas las búsquedas hacen
+sequential scan. Este módulo:
+
+- Elige qué se indexa (IndexSpec): el embedding completo, su versión
+  `halfvec`, las primeras N dimensiones (modelos Matryoshka) o su
+  cuantización binaria (`bit`, distancia Hamming). La columna sigue siendo
+  vector(4096): con índices aproximados se recuperan más candidatos y se
+  reordenan con la distancia coseno exacta.
+- Dimensiona `lists` (IVFFlat) a partir del número de filas y ajusta
+  `ivfflat.probes` / `hnsw.ef_search` por consulta según RAGConfig.
+- Construye el índice en segundo plano (CREATE INDEX CONCURRENTLY) y lo
+  reconstruye con REINDEX CONCURRENTLY cuando la tabla crece por encima de
+  RAGConfig.index_rebuild_growth.
+- Expone el estado (health) para el endpoint de administración.
+
+El estado de la última construcción se guarda en rag_index_state.
+"""
+
+import asyncio
+import json
+import math
+import re
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import asyncpg
+import structlog
+
+from .config import RAGConfig, get_rag_config
+from .filters import compile_metadata_filter
+
+if TYPE_CHECKING:
+    from .storage import RAGStorage
+
+logger = structlog.get_logger()
+
+INDEX_NAME = "rag_chunks_embedding_ann_idx"
+LEGACY_INDEX_NAME = "rag_chunks_embedding_idx"
+
+# Límites de pgvector para índices
+VECTOR_MAX_DIMS = 2000
+HALFVEC_MAX_DIMS = 4000
+BIT_MAX_DIMS = 64000
+
+# Filas insertadas entre comprobaciones de crecimiento
+GROWTH_CHECK_ROWS = 1000
+
+# hnsw.iterative_scan / ivfflat.iterative_scan (filtros sin perder resultados)
+ITERATIVE_SCAN_MIN_VERSION = (0, 8, 0)
+
+_MEMORY_SETTING = re.compile(r"^\d+\s*(kB|MB|GB)$")
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    """Qué se indexa y cómo."""
+    method: str  # hnsw | ivfflat
+    storage: str  # vector | halfvec | binary
+    dimensions: int  # dimensiones indexadas
+    full_dimensions: int
+    m: int = 16
+    ef_construction: int = 64
+
+    @property
+    def reduced(self) -> bool:
+        return self.dimensions < self.full_dimensions
+
+    @property
+    def approximate(self) -> bool:
+        """El orden del índice no es el coseno exacto: hay que reordenar."""
+        return self.storage == "binary" or self.reduced
+
+    @property
+    def operator(self) -> str:
+        return "<~>" if self.storage == "binary" else "<=>"
+
+    @property
+    def opclass(self) -> str:
+        return {
+            "vector": "vector_cosine_ops",
+            "halfvec": "halfvec_cosine_ops",
+            "binary": "bit_hamming_ops",
+        }[self.storage]
+
+    def expression(self, source: str) -> str:
+        """Expresión indexada aplicada a `source` (columna o parámetro)."""
+        d = self.dimensions
+        if self.storage == "binary":
+            return f"(binary_quantize({source})::bit({d}))"
+        if self.reduced:
+            source = f"subvector({source}, 1, {d})"
+        if self.storage == "halfvec":
+            return f"({source}::halfvec({d}))"
+        return f"({source}::vector({d}))" if self.reduced else source
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass
+class SearchPlan:
+    """SQL de búsqueda para el índice activo."""
+    sql: str
+    candidates: Optional[int] = None  # filas ANN a reordenar ($4)
+    filter_args: List[Any] = field(default_factory=list)  # parámetros del filtro de metadata
+
+    def args(self, query_embedding: Any, collection: str, top_k: int) -> List[Any]:
+        args = [query_embedding, collection, top_k]
+        if self.candidates is not None:
+            args.append(self.candidates)
+        return args + self.filter_args
+
+
+def resolve_index_spec(config: RAGConfig) -> Optional[IndexSpec]:
+    """Spec deseada según RAGConfig (None = sin índice ANN)."""
+    method = (config.index_method or "none").lower()
+    if method not in ("hnsw", "ivfflat"):
+        return None
+
+    full = config.embedding_dimensions
+    storage = (config.index_storage or "auto").lower()
+    if storage == "auto":
+        if config.index_dimensions:
+            storage = "vector" if config.index_dimensions <= VECTOR_MAX_DIMS else "halfvec"
+        elif full <= VECTOR_MAX_DIMS:
+            storage = "vector"
+        elif full <= HALFVEC_MAX_DIMS:
+            storage = "halfvec"
+        else:
+            storage = "binary"
+
+    limit = {"vector": VECTOR_MAX_DIMS, "halfvec": HALFVEC_MAX_DIMS, "binary": BIT_MAX_DIMS}.get(storage)
+    if limit is None:
+        logger.warning(f"index_storage desconocido: {storage}")
+        return None
+    dimensions = full if storage == "binary" else min(config.index_dimensions or full, full, limit)
+
+    return IndexSpec(
+        method=method,
+        storage=storage,
+        dimensions=dimensions,
+        full_dimensions=full,
+        m=config.hnsw_m,
+        ef_construction=config.hnsw_ef_construction,
+    )
+
+
+def ivfflat_lists(rows: int) -> int:
+    """Recomendación de pgvector: filas/1000 hasta 1M, sqrt(filas) por encima."""
+    if rows <= 1_000_000:
+        return max(10, rows // 1000)
+    return int(math.sqrt(rows))
+
+
+def ivfflat_probes(lists: int) -> int:
+    return max(1, int(math.sqrt(lists)))
+
+
+def hnsw_ef_search(candidates: int) -> int:
+    return min(1000, max(40, candidates * 2))
+
+
+def build_search_sql(
+    spec: Optional[IndexSpec],
+    candidates: Optional[int] = None,
+    where: str = "",
+) -> SearchPlan:
+    """
+    Parámetros: $1 embedding de la query, $2 colección, $3 top_k y, con
+    índices aproximados, $4 candidatos a reordenar. `where` es un predicado
+    adicional (filtro de metadata) con sus placeholders a continuación.
+    """
+    filter_clause = f" AND {where}" if where else ""
+    if spec is None or not spec.approximate:
+        order = "embedding <=> $1::vector" if spec is None else (
+            f"{spec.expression('embedding')} {spec.operator} {spec.expression('$1::vector')}"
+        )
+        sql = f"""
+            SELECT
+                id,
+                content,
+                metadata,
+                1 - (embedding <=> $1::vector) as score
+            FROM rag_chunks
+            WHERE collection = $2{filter_clause}
+            ORDER BY {order}
+            LIMIT $3
+        """
+        if where and spec is not None:
+            # El escaneo iterativo (relaxed_order) puede devolver las filas
+            # ligeramente desordenadas: se reordenan los top_k por distancia exacta
+            sql = f"SELECT * FROM ({sql}) filtered ORDER BY score DESC"
+        return SearchPlan(sql=sql)
+
+    return SearchPlan(sql=f"""
+        SELECT id, content, metadata, 1 - (embedding <=> $1::vector) as score
+        FROM (
+            SELECT id, content, metadata, embedding
+            FROM rag_chunks
+            WHERE collection = $2{filter_clause}
+            ORDER BY {spec.expression('embedding')} {spec.operator} {spec.expression('$1::vector')}
+            LIMIT $4
+        ) candidates
+        ORDER BY embedding <=> $1::vector
+        LIMIT $3
+    """, candidates=candidates)
+
+
+class IndexManager:
+    """Construcción, mantenimiento y uso del índice ANN de rag_chunks."""
+
+    def __init__(self, storage: "RAGStorage"):
+        self.storage = storage
+        self.active_spec: Optional[IndexSpec] = None
+        self.lists: Optional[int] = None
+        self.building = False
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inserted_since_check = 0
+        self.pgvector_version: Optional[str] = None
+
+    @property
+    def iterative_scan_supported(self) -> bool:
+        if not self.pgvector_version:
+            return False
+        try:
+            version = tuple(int(part) for part in self.pgvector_version.split(".")[:3])
+        except ValueError:
+            return False
+        return version >= ITERATIVE_SCAN_MIN_VERSION
+
+    # ------------------------------------------------------------------
+    # Estado
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    async def _row_estimate(conn: asyncpg.Connection) -> int:
+        """Filas aproximadas sin COUNT(*) (estadísticas del catálogo)."""
+        estimate = await conn.fetchval("""
+            SELECT GREATEST(c.reltuples, COALESCE(s.n_live_tup, 0))::bigint
+            FROM pg_class c
+            LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+            WHERE c.oid = 'rag_chunks'::regclass
+        """)
+        return max(0, int(estimate or 0))
+
+    @staticmethod
+    async def _index_valid(conn: asyncpg.Connection) -> Optional[bool]:
+        """True/False según pg_index.indisvalid, None si no existe."""
+        return await conn.fetchval("""
+            SELECT i.indisvalid
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = $1
+        """, INDEX_NAME)
+
+    @staticmethod
+    async def _load_state(conn: asyncpg.Connection) -> Optional[Dict[str, Any]]:
+        row = await conn.fetchrow(
+            "SELECT spec, rows_at_build, lists, built_at, last_error FROM rag_index_state WHERE index_name = $1",
+            INDEX_NAME,
+        )
+        if not row:
+            return None
+        state = dict(row)
+        if isinstance(state["spec"], str):
+            state["spec"] = json.loads(state["spec"])
+        return state
+
+    @staticmethod
+    async def _save_state(
+        conn: asyncpg.Connection,
+        spec: IndexSpec,
+        rows: int,
+        lists: Optional[int],
+    ) -> None:
+        await conn.execute("""
+            INSERT INTO rag_index_state (index_name, spec, rows_at_build, lists, built_at, last_error)
+            VALUES ($1, $2::jsonb, $3, $4, NOW(), NULL)
+            ON CONFLICT (index_name) DO UPDATE
+            SET spec = EXCLUDED.spec, rows_at_build = EXCLUDED.rows_at_build,
+                lists = EXCLUDED.lists, built_at = EXCLUDED.built_at, last_error = EXCLUDED.last_error
+        """, INDEX_NAME, json.dumps(spec.to_dict()), rows, lists)
+
+    async def load(self) -> None:
+        """Activar el índice para las búsquedas si existe, es válido y coincide con la config."""
+        spec = resolve_index_spec(get_rag_config())
+        async with self.storage.acquire() as conn:
+            valid = await self._index_valid(conn)
+            state = await self._load_state(conn)
+            self.pgvector_version = await conn.fetchval(
+                "SELECT extversion FROM pg_extension WHERE extname = 'vector'"
+            )
+        if spec is not None and valid and state and state["spec"] == spec.to_dict():
+            self.active_spec = spec
+            self.lists = state["lists"]
+        else:
+            self.active_spec = None
+
+    # ------------------------------------------------------------------
+    # Mantenimiento en segundo plano
+    # ------------------------------------------------------------------
+
+    def schedule(self, force: bool = False) -> Optional[asyncio.Task]:
+        """Lanzar una pasada de mantenimiento si no hay otra en curso."""
+        if self._task is not None and not self._task.done():
+            return self._task
+        self._task = asyncio.create_task(self._maintain(force=force))
+        return self._task
+
+    async def stop(self) -> None:
+        """Cancelar la pasada en curso (al apagar, antes de cerrar el pool)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def note_inserted(self, rows: int) -> None:
+        """Llamado tras cada carga: comprueba el crecimiento cada GROWTH_CHECK_ROWS."""
+        self._inserted_since_check += rows
+        if self.active_spec is None or self._inserted_since_check >= GROWTH_CHECK_ROWS:
+            self._inserted_since_check = 0
+            self.schedule()
+
+    async def _maintain(self, force: bool = False) -> None:
+        config = get_rag_config()
+        spec = resolve_index_spec(config)
+        if spec is None:
+            self.active_spec = None
+            return
+
+        async with self.storage.acquire() as conn:
+            # Una sola réplica construye a la vez
+            if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", INDEX_NAME):
+                return
+            try:
+                rows = await self._row_estimate(conn)
+                if spec.method == "ivfflat" and rows < config.ivfflat_min_rows:
+                    return
+
+                valid = await self._index_valid(conn)
+                state = await self._load_state(conn)
+                if valid is False or (valid and (not state or state["spec"] != spec.to_dict())):
+                    # Índice inválido (build interrumpido) o de otra configuración
+                    self.active_spec = None
+                    await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}")
+                    valid = None
+
+                lists = ivfflat_lists(rows) if spec.method == "ivfflat" else None
+                if valid is None:
+                    await self._build(conn, spec, lists, config)
+                elif force or (
+                    state and state["rows_at_build"]
+                    and rows >= state["rows_at_build"] * config.index_rebuild_growth
+                ):
+                    await self._reindex(conn, spec, lists, config)
+                else:
+                    self.active_spec = spec
+                    self.lists = state["lists"] if state else lists
+                    return
+
+                await self._save_state(conn, spec, rows, lists)
+                self.active_spec = spec
+                self.lists = lists
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning(f"Mantenimiento del índice RAG fallido: {e}")
+                try:
+                    await conn.execute(
+                        "UPDATE rag_index_state SET last_error = $2 WHERE index_name = $1",
+                        INDEX_NAME, str(e)[:1000],
+                    )
+                except Exception:
+                    pass
+            finally:
+                self.building = False
+                await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", INDEX_NAME)
+
+    async def _prepare_build(self, conn: asyncpg.Connection, config: RAGConfig) -> None:
+        self.building = True
+        if _MEMORY_SETTING.match(config.index_maintenance_work_mem or ""):
+            await conn.execute(f"SET maintenance_work_mem = '{config.index_maintenance_work_mem}'")
+
+    async def _build(
+        self, conn: asyncpg.Connection, spec: IndexSpec, lists: Optional[int], config: RAGConfig
+    ) -> None:
+        await self._prepare_build(conn, config)
+        if spec.method == "hnsw":
+            options = f"m = {spec.m}, ef_construction = {spec.ef_construction}"
+        else:
+            options = f"lists = {lists}"
+        logger.info("Construyendo índice ANN RAG", spec=spec.to_dict(), lists=lists)
+        await conn.execute(f"""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME}
+            ON rag_chunks
+            USING {spec.method} ({spec.expression('embedding')} {spec.opclass})
+            WITH ({options})
+        """, timeout=config.index_build_timeout)
+        # El índice IVFFlat sobre vector(4096) de versiones anteriores nunca llegó a ser útil
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {LEGACY_INDEX_NAME}")
+        logger.info("Índice ANN RAG construido", index=INDEX_NAME)
+
+    async def _reindex(
+        self, conn: asyncpg.Connection, spec: IndexSpec, lists: Optional[int], config: RAGConfig
+    ) -> None:
+        await self._prepare_build(conn, config)
+        if lists is not None:
+            await conn.execute(f"ALTER INDEX {INDEX_NAME} SET (lists = {lists})")
+        logger.info("Reconstruyendo índice ANN RAG", lists=lists)
+        await conn.execute(f"REINDEX INDEX CONCURRENTLY {INDEX_NAME}", timeout=config.index_build_timeout)
+        logger.info("Índice ANN RAG reconstruido", index=INDEX_NAME)
+
+    # ------------------------------------------------------------------
+    # Búsqueda
+    # ------------------------------------------------------------------
+
+    async def prepare_search(
+        self,
+        conn: asyncpg.Connection,
+        top_k: int,
+        filter_metadata: Optional[Dict[str, Any]] = None,
+    ) -> SearchPlan:
+        """
+        SQL de búsqueda y parámetros de la sesión (SET LOCAL: llamar dentro
+        de una transacción).
+
+        Con filtro de metadata y pgvector >= 0.8 se activa el escaneo
+        iterativo del índice: si el filtro descarta los primeros vecinos, el
+        índice sigue recorriendo el grafo/listas hasta completar el LIMIT en
+        lugar de devolver menos de top_k filas.
+        """
+        spec = self.active_spec
+        config = get_rag_config()
+        if spec is None:
+            compiled = compile_metadata_filter(filter_metadata, first_param=4)
+            plan = build_search_sql(None, where=compiled.sql)
+            plan.filter_args = compiled.args
+            return plan
+
+        candidates = top_k * max(1, config.rerank_factor) if spec.approximate else top_k
+        compiled = compile_metadata_filter(filter_metadata, first_param=5 if spec.approximate else 4)
+        plan = build_search_sql(spec, candidates, where=compiled.sql)
+        plan.filter_args = compiled.args
+        iterative = bool(compiled) and config.filter_iterative_scan and self.iterative_scan_supported
+        if spec.method == "hnsw":
+            ef_search = config.hnsw_ef_search or hnsw_ef_search(candidates)
+            await conn.execute(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+            if iterative:
+                await conn.execute("SET LOCAL hnsw.iterative_scan = relaxed_order")
+                if config.hnsw_max_scan_tuples:
+                    await conn.execute(f"SET LOCAL hnsw.max_scan_tuples = {int(config.hnsw_max_scan_tuples)}")
+        else:
+            probes = config.ivfflat_probes or ivfflat_probes(self.lists or 100)
+            await conn.execute(f"SET LOCAL ivfflat.probes = {int(probes)}")
+            if iterative:
+                await conn.execute("SET LOCAL ivfflat.iterative_scan = relaxed_order")
+                if config.ivfflat_max_probes:
+                    await conn.execute(f"SET LOCAL ivfflat.max_probes = {int(config.ivfflat_max_probes)}")
+        return plan
+
+    # ------------------------------------------------------------------
+    # Health
+    # ------------------------------------------------------------------
+
+    async def health(self, explain: bool = True) -> Dict[str, Any]:
+        config = get_rag_config()
+        desired = resolve_index_spec(config)
+        async with self.storage.acquire() as conn:
+            rows = await self._row_estimate(conn)
+            valid = await self._index_valid(conn)
+            state = await self._load_state(conn)
+            size = await conn.fetchval(
+                "SELECT pg_size_pretty(pg_relation_size(to_regclass($1)))", INDEX_NAME
+            ) if valid is not None else None
+
+            uses_index = None
+            if explain and self.active_spec is not None:
+                uses_index = await self._explain_uses_index(conn)
+
+        rows_at_build = state["rows_at_build"] if state else None
+        growth = round(rows / rows_at_build, 2) if rows_at_build else None
+        built_at = state["built_at"] if state else None
+        return {
+            "index": INDEX_NAME,
+            "exists": valid is not None,
+            "valid": bool(valid),
+            "active": self.active_spec is not None,
+            "building": self.building,
+            "size": size,
+            "desired_spec": desired.to_dict() if desired else None,
+            "active_spec": self.active_spec.to_dict() if self.active_spec else None,
+            "rows_estimate": rows,
+            "rows_at_build": rows_at_build,
+            "growth": growth,
+            "rebuild_due": bool(growth and growth >= config.index_rebuild_growth),
+            "lists": self.lists,
+            "search": {
+                "hnsw_ef_search": config.hnsw_ef_search or "auto",
+                "ivfflat_probes": config.ivfflat_probes or (ivfflat_probes(self.lists) if self.lists else None),
+                "rerank_factor": config.rerank_factor if self.active_spec and self.active_spec.approximate else None,
+            },
+            "uses_index": uses_index,
+            "pgvector_version": self.pgvector_version,
+            "iterative_scan": self.iterative_scan_supported and config.filter_iterative_scan,
+            "built_at": built_at.isoformat() if isinstance(built_at, datetime) else built_at,
+            "last_error": self.last_error or (state["last_error"] if state else None),
+        }
+
+    async def _explain_uses_index(self, conn: asyncpg.Connection) -> Optional[bool]:
+        """EXPLAIN de una búsqueda real (con un embedding existente como query)."""
+        sample = await conn.fetchrow(
+            "SELECT collection, embedding FROM rag_chunks WHERE embedding IS NOT NULL LIMIT 1"
+        )
+        if not sample:
+            return None
+        async with conn.transaction():
+            plan = await self.prepare_search(conn, 5)
+            args = plan.args(sample["embedding"], sample["collection"], 5)
+            result = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {plan.sql}", *args)
+        return INDEX_NAME in (result if isinstance(result, str) else json.dumps(result))
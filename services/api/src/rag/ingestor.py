@@ -3,8 +3,10 @@ Ingestor de documentos para RAG
 """
 
 import os
-import io
-from typing import List, Optional, Dict, Any
+import tempfile
+from contextlib import aclosing
+from datetime import datetime, timezone
+from typing import List, Optional, Dict, Any, Tuple
 from pathlib import Path
 import httpx
 import structlog
@@ -13,10 +15,26 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
 from .vectorstore import RAGVectorStore
+from .storage import DocumentWriteStats
 from .config import get_rag_config
+from .pipeline import (
+    IngestProgress,
+    ProgressCallback,
+    StreamingSplitter,
+    describe_segment,
+    extraction_pool,
+)
 
 logger = structlog.get_logger()
 
+# Bloques de descarga de ingest_from_url (directos a un fichero temporal)
+DOWNLOAD_BLOCK_BYTES = 1024 * 1024
+
+
+def _now_iso() -> str:
+    """Fecha de ingesta en metadata (filtrable por rango, ver rag/filters.py)"""
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
 
 class DocumentIngestor:
     """Ingestor de documentos con soporte para múltiples formatos"""
@@ -54,9 +72,16 @@ class DocumentIngestor:
         self,
         file_path: str,
         document_id: str = None,
-        metadata: Dict[str, Any] = None
+        metadata: Dict[str, Any] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        source: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Ingestar un archivo local"""
+        """
+        Ingestar un archivo local (en streaming, ver rag/pipeline.py)
+
+        `source` es el nombre original cuando file_path es un temporal (subidas):
+        entonces no se guarda la ruta, que cambia en cada re-ingesta.
+        """
         path = Path(file_path)
         
         if not path.exists():
@@ -66,103 +91,161 @@ class DocumentIngestor:
         if extension not in self.SUPPORTED_EXTENSIONS:
             raise ValueError(f"Formato no soportado: {extension}")
         
-        # Extraer texto según el formato
-        text = await self._extract_text(path, extension)
-        
-        if not text.strip():
-            raise ValueError("El documento está vacío o no se pudo extraer texto")
-        
         # Preparar metadatos
         doc_metadata = {
-            "source": path.name,
-            "file_path": str(path),
+            "source": source or path.name,
+            **({} if source else {"file_path": str(path)}),
             "file_type": extension,
             "file_size": path.stat().st_size,
+            "ingested_at": _now_iso(),
             **(metadata or {})
         }
         
-        # Dividir en chunks
-        chunks = self.text_splitter.split_text(text)
-        
-        # Preparar metadatos para cada chunk
-        chunk_metadatas = [
-            {**doc_metadata, "chunk_index": i, "total_chunks": len(chunks)}
-            for i in range(len(chunks))
-        ]
-        
-        # Añadir al vector store
-        doc_id = document_id or path.stem
-        chunk_ids = await self.vectorstore.add_documents(
-            texts=chunks,
-            metadatas=chunk_metadatas,
-            document_id=doc_id
+        doc_id = document_id or Path(source or path.name).stem
+        stats, progress = await self._ingest_stream(
+            path, extension, doc_id, doc_metadata, on_progress
         )
         
         return {
             "document_id": doc_id,
-            "file_name": path.name,
-            "chunks_created": len(chunks),
-            "chunk_ids": chunk_ids
+            "file_name": source or path.name,
+            "chunks_created": len(stats.chunk_ids),
+            "segments": progress.segments,
+            **stats.to_dict(),
+            "chunk_ids": stats.chunk_ids
         }
     
     async def ingest_from_url(
         self,
         url: str,
         document_id: str = None,
-        metadata: Dict[str, Any] = None
+        metadata: Dict[str, Any] = None,
+        on_progress: Optional[ProgressCallback] = None
     ) -> Dict[str, Any]:
         """Ingestar documento desde URL (Strapi u otra fuente)"""
         logger.info(f"Descargando documento desde {url}")
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            content = response.content
-        
-        # Detectar tipo de archivo
-        content_type = response.headers.get("content-type", "")
         file_name = url.split("/")[-1].split("?")[0]
-        
-        extension = self._detect_extension(content_type, file_name)
-        
-        # Extraer texto
-        text = await self._extract_text_from_bytes(content, extension)
-        
-        if not text.strip():
-            raise ValueError("El documento está vacío o no se pudo extraer texto")
+        size = 0
+        # Descarga a disco por bloques: el documento nunca está entero en memoria
+        async with httpx.AsyncClient(timeout=120.0) as client:
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                
+                # Detectar tipo de archivo
+                content_type = response.headers.get("content-type", "")
+                extension = self._detect_extension(content_type, file_name)
+                
+                with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as tmp:
+                    tmp_path = tmp.name
+                    try:
+                        async for block in response.aiter_bytes(DOWNLOAD_BLOCK_BYTES):
+                            tmp.write(block)
+                            size += len(block)
+                    except BaseException:
+                        os.unlink(tmp_path)
+                        raise
         
         # Preparar metadatos
         doc_metadata = {
             "source": file_name,
             "source_url": url,
             "file_type": extension,
-            "file_size": len(content),
+            "file_size": size,
+            "ingested_at": _now_iso(),
             **(metadata or {})
         }
         
-        # Dividir en chunks
-        chunks = self.text_splitter.split_text(text)
-        
-        chunk_metadatas = [
-            {**doc_metadata, "chunk_index": i, "total_chunks": len(chunks)}
-            for i in range(len(chunks))
-        ]
-        
-        # Añadir al vector store
         doc_id = document_id or file_name.rsplit(".", 1)[0]
-        chunk_ids = await self.vectorstore.add_documents(
-            texts=chunks,
-            metadatas=chunk_metadatas,
-            document_id=doc_id
-        )
+        try:
+            stats, progress = await self._ingest_stream(
+                Path(tmp_path), extension, doc_id, doc_metadata, on_progress
+            )
+        finally:
+            os.unlink(tmp_path)
         
         return {
             "document_id": doc_id,
             "file_name": file_name,
-            "chunks_created": len(chunks),
-            "chunk_ids": chunk_ids
+            "chunks_created": len(stats.chunk_ids),
+            "segments": progress.segments,
+            **stats.to_dict(),
+            "chunk_ids": stats.chunk_ids
         }
     
+    async def _ingest_stream(
+        self,
+        path: Path,
+        extension: str,
+        document_id: str,
+        doc_metadata: Dict[str, Any],
+        on_progress: Optional[ProgressCallback] = None
+    ) -> Tuple[DocumentWriteStats, IngestProgress]:
+        """
+        Extracción por segmentos en el pool de procesos, troceado incremental
+        y embeddings/escritura encadenados con colas acotadas.
+        
+        Es una nueva versión de document_id: solo se embeben los chunks cuyo
+        contenido no estaba ya indexado, y los que desaparecen se borran en la
+        transacción que publica la versión.
+        """
+        progress = IngestProgress(document_id=document_id)
+        splitter = StreamingSplitter(self.text_splitter)
+        
+        def _emit(stage: str) -> None:
+            progress.stage = stage
+            if on_progress is not None:
+                try:
+                    on_progress(progress)
+                except Exception as e:
+                    logger.debug(f"Callback de progreso fallido: {e}")
+        
+        def _chunk_metadata(segment_metadata: Dict[str, Any]) -> Dict[str, Any]:
+            chunk_metadata = {**doc_metadata, **segment_metadata, "chunk_index": progress.chunks}
+            progress.chunks += 1
+            return chunk_metadata
+        
+        async def _chunks():
+            async with aclosing(extraction_pool.segments(str(path), extension)) as segments:
+                async for text, segment_metadata in segments:
+                    progress.segments += 1
+                    progress.current = describe_segment(segment_metadata)
+                    _emit("extracting")
+                    for chunk, chunk_metadata in splitter.feed(text, segment_metadata):
+                        yield chunk, _chunk_metadata(chunk_metadata)
+            for chunk, chunk_metadata in splitter.flush():
+                yield chunk, _chunk_metadata(chunk_metadata)
+        
+        def _on_batch(stage: str, count: int) -> None:
+            if stage == "embedded":
+                progress.embedded += count
+                _emit("embedding")
+            elif stage == "unchanged":
+                progress.unchanged += count
+            else:
+                progress.written += count
+                _emit("writing")
+        
+        try:
+            stats = await self.vectorstore.add_document_stream(
+                _chunks(), document_id=document_id, on_progress=_on_batch, replace=True
+            )
+        except Exception:
+            _emit("error")
+            raise
+        
+        _emit("done")
+        logger.info(
+            "Documento ingerido",
+            document_id=document_id,
+            collection=self.collection,
+            segments=progress.segments,
+            chunks=len(stats.chunk_ids),
+            **stats.to_dict(),
+            elapsed_ms=progress.to_dict()["elapsed_ms"]
+        )
+        return stats, progress
+    
     async def ingest_text(
         self,
         text: str,
@@ -176,6 +259,7 @@ class DocumentIngestor:
         doc_metadata = {
             "source": "direct_text",
             "file_type": ".txt",
+            "ingested_at": _now_iso(),
             **(metadata or {})
         }
         
@@ -186,183 +270,26 @@ class DocumentIngestor:
             for i in range(len(chunks))
         ]
         
-        chunk_ids = await self.vectorstore.add_documents(
-            texts=chunks,
-            metadatas=chunk_metadatas,
-            document_id=document_id
+        async def _chunks():
+            for item in zip(chunks, chunk_metadatas):
+                yield item
+        
+        # Nueva versión del documento: solo se embeben los chunks cambiados
+        stats = await self.vectorstore.add_document_stream(
+            _chunks(), document_id=document_id, replace=True
         )
         
         return {
             "document_id": document_id,
             "chunks_created": len(chunks),
-            "chunk_ids": chunk_ids
+            **stats.to_dict(),
+            "chunk_ids": stats.chunk_ids
         }
     
     async def delete_document(self, document_id: str) -> int:
         """Eliminar un documento del índice"""
         return await self.vectorstore.delete_by_document(document_id)
     
-    async def _extract_text(self, path: Path, extension: str) -> str:
-        """Extraer texto de un archivo"""
-        if extension == ".txt" or extension == ".md":
-            return path.read_text(encoding="utf-8")
-        
-        elif extension == ".pdf":
-            return await self._extract_pdf(path)
-        
-        elif extension == ".docx":
-            return await self._extract_docx(path)
-        
-        elif extension == ".html":
-            return await self._extract_html(path.read_text(encoding="utf-8"))
-        
-        elif extension == ".csv":
-            return await self._extract_csv(path)
-        
-        elif extension in (".xlsx", ".xls"):
-            return await self._extract_excel(path)
-        
-        else:
-            raise ValueError(f"Extractor no implementado para {extension}")
-    
-    async def _extract_text_from_bytes(self, content: bytes, extension: str) -> str:
-        """Extraer texto de bytes"""
-        if extension in [".txt", ".md"]:
-            return content.decode("utf-8")
-        
-        elif extension == ".pdf":
-            return await self._extract_pdf_bytes(content)
-        
-        elif extension == ".docx":
-            return await self._extract_docx_bytes(content)
-        
-        elif extension == ".html":
-            return await self._extract_html(content.decode("utf-8"))
-        
-        elif extension == ".csv":
-            return await self._extract_csv_bytes(content)
-        
-        elif extension in (".xlsx", ".xls"):
-            return await self._extract_excel_bytes(content)
-        
-        else:
-            raise ValueError(f"Extractor no implementado para {extension}")
-    
-    async def _extract_pdf(self, path: Path) -> str:
-        """Extraer texto de PDF"""
-        try:
-            from pypdf import PdfReader
-            reader = PdfReader(str(path))
-            text_parts = []
-            for page in reader.pages:
-                text_parts.append(page.extract_text() or "")
-            return "\n\n".join(text_parts)
-        except ImportError:
-            raise ImportError("pypdf no instalado. Ejecuta: pip install pypdf")
-    
-    async def _extract_pdf_bytes(self, content: bytes) -> str:
-        """Extraer texto de PDF desde bytes"""
-        try:
-            from pypdf import PdfReader
-            reader = PdfReader(io.BytesIO(content))
-            text_parts = []
-            for page in reader.pages:
-                text_parts.append(page.extract_text() or "")
-            return "\n\n".join(text_parts)
-        except ImportError:
-            raise ImportError("pypdf no instalado")
-    
-    async def _extract_docx(self, path: Path) -> str:
-        """Extraer texto de DOCX"""
-        try:
-            from docx import Document as DocxDocument
-            doc = DocxDocument(str(path))
-            return "\n\n".join([p.text for p in doc.paragraphs if p.text.strip()])
-        except ImportError:
-            raise ImportError("python-docx no instalado")
-    
-    async def _extract_docx_bytes(self, content: bytes) -> str:
-        """Extraer texto de DOCX desde bytes"""
-        try:
-            from docx import Document as DocxDocument
-            doc = DocxDocument(io.BytesIO(content))
-            return "\n\n".join([p.text for p in doc.paragraphs if p.text.strip()])
-        except ImportError:
-            raise ImportError("python-docx no instalado")
-    
-    async def _extract_html(self, html: str) -> str:
-        """Extraer texto de HTML"""
-        try:
-            from bs4 import BeautifulSoup
-            soup = BeautifulSoup(html, "html.parser")
-            # Eliminar scripts y estilos
-            for tag in soup(["script", "style", "nav", "footer", "header"]):
-                tag.decompose()
-            return soup.get_text(separator="\n", strip=True)
-        except ImportError:
-            # Fallback simple sin BeautifulSoup
-            import re
-            text = re.sub(r'<[^>]+>', ' ', html)
-            return re.sub(r'\s+', ' ', text).strip()
-    
-    async def _extract_csv(self, path: Path) -> str:
-        """Extraer texto de CSV preservando estructura tabular"""
-        import csv
-        rows = []
-        with open(path, newline='', encoding='utf-8-sig') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                rows.append(" | ".join(row))
-        return "\n".join(rows)
-
-    async def _extract_csv_bytes(self, content: bytes) -> str:
-        """Extraer texto de CSV desde bytes"""
-        import csv
-        text = content.decode("utf-8-sig")
-        rows = []
-        reader = csv.reader(io.StringIO(text))
-        for row in reader:
-            rows.append(" | ".join(row))
-        return "\n".join(rows)
-
-    async def _extract_excel(self, path: Path) -> str:
-        """Extraer texto de Excel preservando estructura tabular"""
-        try:
-            from openpyxl import load_workbook
-            wb = load_workbook(str(path), read_only=True, data_only=True)
-            sheets_text = []
-            for sheet_name in wb.sheetnames:
-                ws = wb[sheet_name]
-                rows = []
-                for row in ws.iter_rows(values_only=True):
-                    cells = [str(c) if c is not None else "" for c in row]
-                    rows.append(" | ".join(cells))
-                if rows:
-                    sheets_text.append(f"## Hoja: {sheet_name}\n\n" + "\n".join(rows))
-            wb.close()
-            return "\n\n".join(sheets_text)
-        except ImportError:
-            raise ImportError("openpyxl no instalado. Ejecuta: pip install openpyxl")
-
-    async def _extract_excel_bytes(self, content: bytes) -> str:
-        """Extraer texto de Excel desde bytes"""
-        try:
-            from openpyxl import load_workbook
-            wb = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
-            sheets_text = []
-            for sheet_name in wb.sheetnames:
-                ws = wb[sheet_name]
-                rows = []
-                for row in ws.iter_rows(values_only=True):
-                    cells = [str(c) if c is not None else "" for c in row]
-                    rows.append(" | ".join(cells))
-                if rows:
-                    sheets_text.append(f"## Hoja: {sheet_name}\n\n" + "\n".join(rows))
-            wb.close()
-            return "\n\n".join(sheets_text)
-        except ImportError:
-            raise ImportError("openpyxl no instalado")
-
     def _detect_extension(self, content_type: str, file_name: str) -> str:
         """Detectar extensión del archivo"""
         # Por content-type
@@ -0,0 +1,53 @@
+"""
+Codec binario de pgvector para asyncpg
+
+Sin codec, los vectores viajan como texto ("[0.1, 0.2, ...]"): con 4096
+dimensiones son ~80 KB por fila que Postgres tiene que volver a parsear.
+El formato binario de `vector` es:
+
+    uint16 dim | uint16 unused (0) | dim x float32 (big-endian)
+
+El codec se registra en cada conexión del pool principal (ver
+Database.add_connection_initializer). El encoder acepta listas/tuplas/arrays
+y también la representación de texto, para que las consultas que todavía
+pasan `str(embedding)` sigan funcionando.
+"""
+
+import json
+import struct
+from typing import Any, List
+
+import asyncpg
+
+_HEADER = struct.Struct(">HH")
+
+
+def encode_vector(value: Any) -> bytes:
+    if isinstance(value, str):
+        value = json.loads(value)
+    dim = len(value)
+    return _HEADER.pack(dim, 0) + struct.pack(f">{dim}f", *value)
+
+
+def decode_vector(data: bytes) -> List[float]:
+    dim, _ = _HEADER.unpack_from(data)
+    return list(struct.unpack_from(f">{dim}f", data, _HEADER.size))
+
+
+async def register_vector_codec(conn: asyncpg.Connection) -> None:
+    """Registrar el codec binario de `vector` en una conexión."""
+    schema = await conn.fetchval(
+        "SELECT n.nspname FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace "
+        "WHERE t.typname = 'vector'"
+    )
+    if schema is None:
+        # Extensión aún no instalada: RAGStorage renueva las conexiones tras crearla
+        return
+    await conn.set_type_codec(
+        "vector",
+        schema=schema,
+        encoder=encode_vector,
+        decoder=decode_vector,
+        format="binary",
+    )
+
@@ -0,0 +1,169 @@
+"""
+Pipeline de ingesta en streaming
+
+    extracción (procesos worker) -> troceado -> embeddings -> escritura (COPY)
+
+- La extracción (pypdf, openpyxl, python-docx...) corre en un pool de
+  procesos: el event loop del worker de la API no se bloquea con un Excel de
+  200 MB. Los segmentos (páginas, bloques de filas por hoja) llegan por una
+  cola acotada (RAGConfig.ingest_segment_queue): si el resto del pipeline va
+  por detrás, el proceso de extracción espera.
+- El troceado es incremental (StreamingSplitter): cada segmento se parte en
+  cuanto llega, arrastrando solo el último chunk incompleto.
+- Embeddings y escritura los encadena RAGVectorStore.add_document_stream,
+  con otra cola acotada entre ambas etapas (RAGConfig.ingest_write_queue).
+  Cada lote se carga en staging en cuanto está embebido y el documento se
+  publica al final en una transacción corta.
+- IngestProgress acumula contadores por etapa y se emite en cada segmento y
+  cada lote (callback opcional; el router los sirve como SSE).
+
+La memoria queda acotada por el tamaño de las colas, no por el del fichero:
+de la versión anterior del documento solo se retiene hash -> id.
+"""
+
+import asyncio
+import multiprocessing
+import queue as queue_module
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import structlog
+
+from .config import get_rag_config
+from .extractors import Segment, pump_segments
+
+logger = structlog.get_logger()
+
+# Espera máxima de cada lectura de la cola antes de comprobar el worker
+POLL_SECONDS = 1.0
+
+
+class ExtractionPool:
+    """Pool de procesos de extracción compartido por el proceso de la API."""
+
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._lock = threading.Lock()
+
+    def _start(self) -> Tuple[ProcessPoolExecutor, Any]:
+        with self._lock:
+            if self._executor is None:
+                # spawn: no se hereda el estado del event loop ni de los hilos
+                context = multiprocessing.get_context("spawn")
+                self._manager = context.Manager()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=max(1, get_rag_config().ingest_workers),
+                    mp_context=context,
+                )
+                logger.info("Pool de extracción RAG iniciado", workers=get_rag_config().ingest_workers)
+            return self._executor, self._manager
+
+    async def segments(self, path: str, extension: str) -> AsyncIterator[Segment]:
+        """Segmentos del fichero en orden, extraídos en un proceso worker."""
+        loop = asyncio.get_running_loop()
+        executor, manager = await asyncio.to_thread(self._start)
+        segment_queue = manager.Queue(maxsize=max(1, get_rag_config().ingest_segment_queue))
+        cancel = manager.Event()
+        future = loop.run_in_executor(executor, pump_segments, path, extension, segment_queue, cancel)
+        try:
+            while True:
+                try:
+                    kind, payload, metadata = await asyncio.to_thread(
+                        segment_queue.get, True, POLL_SECONDS
+                    )
+                except queue_module.Empty:
+                    if future.done():
+                        future.result()  # BrokenProcessPool, etc.
+                        raise RuntimeError("El proceso de extracción terminó sin completar el documento")
+                    continue
+                if kind == "segment":
+                    yield payload, metadata
+                elif kind == "error":
+                    raise payload
+                else:
+                    return
+        finally:
+            if not future.done():
+                # Consumidor cancelado o con error: liberar el worker
+                cancel.set()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if self._manager is not None:
+                self._manager.shutdown()
+                self._manager = None
+
+
+class StreamingSplitter:
+    """
+    Troceado incremental: cada segmento se parte al llegar y solo se retiene
+    el último chunk (puede continuar en el siguiente segmento).
+    """
+
+    SEPARATOR = "\n\n"
+
+    def __init__(self, splitter):
+        self.splitter = splitter
+        self._carry = ""
+        self._carry_metadata: Dict[str, Any] = {}
+
+    def feed(self, text: str, metadata: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        if not text.strip():
+            return []
+        if self._carry:
+            buffer = f"{self._carry}{self.SEPARATOR}{text}"
+            first_metadata = self._carry_metadata
+        else:
+            buffer = text
+            first_metadata = metadata
+        chunks = self.splitter.split_text(buffer)
+        if not chunks:
+            return []
+        # El chunk hereda la metadata del segmento en el que empieza
+        metadatas = [first_metadata] + [metadata] * (len(chunks) - 1)
+        self._carry, self._carry_metadata = chunks[-1], metadatas[-1]
+        return list(zip(chunks[:-1], metadatas[:-1]))
+
+    def flush(self) -> List[Tuple[str, Dict[str, Any]]]:
+        carry, self._carry = self._carry, ""
+        return [(carry, self._carry_metadata)] if carry.strip() else []
+
+
+@dataclass
+class IngestProgress:
+    """Progreso de la ingesta de un documento."""
+    document_id: str
+    stage: str = "extracting"  # extracting | embedding | writing | done | error
+    segments: int = 0
+    chunks: int = 0
+    embedded: int = 0
+    unchanged: int = 0  # reutilizados de la versión anterior del documento
+    written: int = 0
+    current: Optional[str] = None  # "página 12", "hoja Ventas"...
+    started_at: float = field(default_factory=time.monotonic)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["elapsed_ms"] = int((time.monotonic() - data.pop("started_at")) * 1000)
+        return data
+
+
+ProgressCallback = Callable[[IngestProgress], None]
+
+
+def describe_segment(metadata: Dict[str, Any]) -> Optional[str]:
+    if "page" in metadata:
+        return f"página {metadata['page']}"
+    if "sheet" in metadata:
+        return f"hoja {metadata['sheet']}"
+    return None
+
+
+extraction_pool = ExtractionPool()
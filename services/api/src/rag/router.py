@@ -2,9 +2,13 @@
 Router de la API para RAG
 """
 
-from typing import Optional, List
+from typing import Any, Dict, Optional, List, Literal
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+import asyncio
+import json
+import shutil
 import tempfile
 import os
 import structlog
@@ -12,6 +16,8 @@ import structlog
 from .ingestor import DocumentIngestor
 from .searcher import RAGSearcher
 from .vectorstore import RAGVectorStore
+from .storage import rag_storage
+from .filters import FilterError, build_metadata_filter
 from .config import get_rag_config_from_strapi
 from src.config import get_settings
 from src.providers import get_active_llm_provider
@@ -20,6 +26,8 @@ logger = structlog.get_logger()
 settings = get_settings()
 router = APIRouter(prefix="/rag", tags=["RAG"])
 
+UPLOAD_COPY_BLOCK_BYTES = 1024 * 1024
+
 
 async def get_embedding_config() -> tuple[str, str]:
     """Obtener URL y modelo de embeddings desde Strapi o fallback"""
@@ -66,6 +74,14 @@ class SearchRequest(BaseModel):
     collection: str = "default"
     top_k: int = 5
     min_score: Optional[float] = None
+    # vector | lexical | hybrid (por defecto RAGConfig.search_mode)
+    mode: Optional[Literal["vector", "lexical", "hybrid"]] = None
+    # Filtro de metadata (DSL de rag/filters.py) y atajos habituales
+    filters: Optional[Dict[str, Any]] = None
+    source: Optional[str] = None
+    file_type: Optional[List[str]] = None
+    date_from: Optional[str] = None  # ISO-8601, sobre metadata.ingested_at
+    date_to: Optional[str] = None  # exclusivo
     # Parámetros opcionales para override de config
     embedding_url: Optional[str] = None
     embedding_model: Optional[str] = None
@@ -98,12 +114,16 @@ class CollectionStats(BaseModel):
 async def ingest_file(
     file: UploadFile = File(...),
     collection: str = Form("default"),
-    document_id: Optional[str] = Form(None)
+    document_id: Optional[str] = Form(None),
+    stream_progress: bool = Form(False)
 ):
     """
     Ingestar un archivo subido directamente
     
     Formatos soportados: PDF, TXT, MD, DOCX, HTML, XLSX, XLS, CSV
+    
+    Con stream_progress=true la respuesta es SSE: eventos "progress" por
+    página/bloque y lote escrito, y un evento final "done" o "error".
     """
     # Verificar extensión
     allowed_extensions = {".pdf", ".txt", ".md", ".docx", ".html", ".xlsx", ".xls", ".csv"}
@@ -115,36 +135,76 @@ async def ingest_file(
             detail=f"Formato no soportado: {file_ext}. Permitidos: {allowed_extensions}"
         )
     
-    # Guardar temporalmente
+    # Guardar temporalmente (copia por bloques fuera del event loop)
     with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-        content = await file.read()
-        tmp.write(content)
+        await asyncio.to_thread(shutil.copyfileobj, file.file, tmp, UPLOAD_COPY_BLOCK_BYTES)
         tmp_path = tmp.name
     
-    try:
-        base_url, embed_model = await get_embedding_config()
-        
-        ingestor = DocumentIngestor(
-            collection=collection,
-            embedding_base_url=base_url,
-            embedding_model=embed_model
-        )
-        
-        result = await ingestor.ingest_file(
-            file_path=tmp_path,
-            document_id=document_id or file.filename.rsplit(".", 1)[0],
-            metadata={"original_filename": file.filename}
-        )
+    async def _ingest(on_progress=None) -> dict:
+        try:
+            base_url, embed_model = await get_embedding_config()
+            
+            ingestor = DocumentIngestor(
+                collection=collection,
+                embedding_base_url=base_url,
+                embedding_model=embed_model
+            )
+            
+            result = await ingestor.ingest_file(
+                file_path=tmp_path,
+                document_id=document_id or file.filename.rsplit(".", 1)[0],
+                metadata={"original_filename": file.filename},
+                on_progress=on_progress,
+                source=file.filename
+            )
+            
+            return {
+                "status": "success",
+                "message": f"Documento indexado correctamente",
+                **result
+            }
         
-        return {
-            "status": "success",
-            "message": f"Documento indexado correctamente",
-            **result
-        }
+        finally:
+            # Limpiar archivo temporal
+            os.unlink(tmp_path)
+    
+    if not stream_progress:
+        return await _ingest()
+    
+    events: asyncio.Queue = asyncio.Queue()
+    
+    def _on_progress(progress) -> None:
+        events.put_nowait({"event": "progress", **progress.to_dict()})
+    
+    async def _run():
+        try:
+            result = await _ingest(_on_progress)
+            result.pop("chunk_ids", None)
+            events.put_nowait({"event": "done", **result})
+        except Exception as e:
+            logger.error(f"Error ingesting file: {e}")
+            events.put_nowait({"event": "error", "error": str(e)})
+    
+    # La ingesta sigue aunque el cliente se desconecte
+    task = asyncio.create_task(_run())
+    
+    async def event_generator():
+        while True:
+            event = await events.get()
+            yield f"data: {json.dumps(event, default=str)}\n\n"
+            if event["event"] != "progress":
+                break
+        await task
     
-    finally:
-        # Limpiar archivo temporal
-        os.unlink(tmp_path)
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
 
 
 @router.post("/ingest/url")
@@ -305,7 +365,7 @@ async def ingest_from_strapi(
 @router.post("/search", response_model=SearchResponse)
 async def search_documents(request: SearchRequest):
     """
-    Buscar documentos por similitud semántica
+    Buscar documentos por similitud semántica, coincidencia de términos o ambas (híbrida)
     """
     try:
         base_url, embed_model = await get_embedding_config()
@@ -325,7 +385,15 @@ async def search_documents(request: SearchRequest):
         results = await searcher.search(
             query=request.query,
             top_k=request.top_k,
-            min_score=request.min_score
+            min_score=request.min_score,
+            mode=request.mode,
+            filters=build_metadata_filter(
+                request.filters,
+                source=request.source,
+                file_type=request.file_type,
+                date_from=request.date_from,
+                date_to=request.date_to
+            )
         )
         
         return SearchResponse(
@@ -335,6 +403,8 @@ async def search_documents(request: SearchRequest):
             total=len(results)
         )
     
+    except FilterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error searching: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -344,7 +414,12 @@ async def search_documents(request: SearchRequest):
 async def search_documents_get(
     query: str,
     collection: str = "default",
-    top_k: int = 5
+    top_k: int = 5,
+    mode: Optional[Literal["vector", "lexical", "hybrid"]] = None,
+    source: Optional[str] = None,
+    file_type: Optional[List[str]] = Query(None),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
 ):
     """
     Buscar documentos (GET para pruebas rápidas)
@@ -352,7 +427,12 @@ async def search_documents_get(
     return await search_documents(SearchRequest(
         query=query,
         collection=collection,
-        top_k=top_k
+        top_k=top_k,
+        mode=mode,
+        source=source,
+        file_type=file_type,
+        date_from=date_from,
+        date_to=date_to
     ))
 
 
@@ -366,37 +446,7 @@ async def list_collections():
     Listar colecciones disponibles con estadísticas
     """
     try:
-        import asyncpg
-        
-        pool = await asyncpg.create_pool(
-            settings.database_url.replace("+psycopg2", ""),
-            min_size=1,
-            max_size=5
-        )
-        
-        async with pool.acquire() as conn:
-            collections = await conn.fetch("""
-                SELECT 
-                    collection,
-                    COUNT(*) as total_chunks,
-                    COUNT(DISTINCT document_id) as total_documents
-                FROM rag_chunks
-                GROUP BY collection
-                ORDER BY collection
-            """)
-        
-        await pool.close()
-        
-        return {
-            "collections": [
-                {
-                    "name": row["collection"],
-                    "total_chunks": row["total_chunks"],
-                    "total_documents": row["total_documents"]
-                }
-                for row in collections
-            ]
-        }
+        return {"collections": await rag_storage.list_collections()}
     
     except Exception as e:
         logger.error(f"Error listing collections: {e}")
@@ -478,3 +528,38 @@ async def delete_document(
     except Exception as e:
         logger.error(f"Error deleting document: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+# ============================================
+# Endpoints - Administración del índice ANN
+# ============================================
+
+@router.get("/admin/index")
+async def get_index_health(explain: bool = Query(True)):
+    """
+    Estado del índice ANN de rag_chunks
+    
+    Incluye la spec deseada y la activa, filas actuales frente a las de la
+    última construcción, parámetros de búsqueda y si el planner usa el
+    índice (EXPLAIN de una búsqueda real).
+    """
+    try:
+        await rag_storage.ensure_schema()
+        return await rag_storage.index.health(explain=explain)
+    
+    except Exception as e:
+        logger.error(f"Error getting index health: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/admin/index/rebuild")
+async def rebuild_index():
+    """
+    Forzar la reconstrucción del índice ANN (REINDEX CONCURRENTLY en segundo plano)
+    """
+    await rag_storage.ensure_schema()
+    rag_storage.index.schedule(force=True)
+    return {
+        "status": "scheduled",
+        "message": "Reconstrucción del índice programada"
+    }
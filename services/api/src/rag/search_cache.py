@@ -0,0 +1,106 @@
+"""
+Caché de resultados de búsqueda RAG
+
+El agente RAG y la tool rag_search repiten las mismas búsquedas dentro de
+una ejecución y entre usuarios. Los resultados se guardan en un LRU en
+memoria con TTL corto (RAGConfig.search_cache_ttl).
+
+La clave incluye la generación de la colección (RAGStorage.generation): la
+fila de rag_collection_versions que incrementan todas las escrituras
+(add_documents, re-ingestas, delete_by_document, delete_collection) en su
+misma transacción. Al estar en la BD, una escritura hecha en cualquier réplica
+invalida la caché de todas en cuanto se confirma (una lectura por PK por
+búsqueda); las entradas anteriores dejan de casar y se van expulsando por
+LRU/TTL. La generación se lee antes de buscar, así que un resultado calculado
+durante una escritura nunca queda asociado a la versión nueva.
+
+Los aciertos/fallos se registran en src.monitoring.cache_stats con el
+nombre "rag_search_results".
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.monitoring.cache_stats import cache_stats
+from .config import get_rag_config
+from .embedding_cache import normalize_query
+
+CACHE_NAME = "rag_search_results"
+DEFAULT_MAX_ENTRIES = 512
+
+
+class SearchResultCache:
+    """LRU en memoria con TTL para resultados de RAGVectorStore.retrieve."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, List[Any]]]" = OrderedDict()
+
+    @staticmethod
+    def make_key(
+        collection: str,
+        generation: int,
+        model: str,
+        mode: str,
+        query: str,
+        top_k: int,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        payload = {
+            "collection": collection,
+            "generation": generation,
+            "model": model,
+            "mode": mode,
+            "query": normalize_query(query),
+            "top_k": top_k,
+            "filters": filters or {},
+        }
+        canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            cache_stats.miss(CACHE_NAME)
+            return None
+        expires_at, results = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            cache_stats.incr(CACHE_NAME, "expired")
+            cache_stats.miss(CACHE_NAME)
+            return None
+        self._entries.move_to_end(key)
+        cache_stats.hit(CACHE_NAME, "memory")
+        # Copias: el llamador puede modificar score/metadata
+        return [replace(result, metadata=dict(result.metadata)) for result in results]
+
+    def set(self, key: str, results: List[Any], ttl: Optional[float] = None) -> None:
+        ttl = get_rag_config().search_cache_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        self._entries[key] = (
+            time.monotonic() + ttl,
+            [replace(result, metadata=dict(result.metadata)) for result in results],
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            cache_stats.incr(CACHE_NAME, "evictions")
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "memory_entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": get_rag_config().search_cache_ttl,
+            **cache_stats.snapshot(CACHE_NAME).get(CACHE_NAME, {}),
+        }
+
+
+search_cache = SearchResultCache()
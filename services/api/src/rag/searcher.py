@@ -31,7 +31,9 @@ class RAGSearcher:
         self,
         query: str,
         top_k: int = 5,
-        min_score: float = None
+        min_score: float = None,
+        mode: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None
     ) -> List[Dict[str, Any]]:
         """
         Buscar documentos relevantes para una query
@@ -39,15 +41,21 @@ class RAGSearcher:
         Args:
             query: Texto de búsqueda
             top_k: Número máximo de resultados
-            min_score: Score mínimo para incluir resultados
+            min_score: Similitud vectorial mínima. Solo filtra los resultados
+                que llegan únicamente por la vía vectorial: los que casan
+                léxicamente (modos hybrid/lexical) se conservan, y su score
+                es el de la fusión RRF, no una similitud
+            mode: "vector", "lexical" o "hybrid" (por defecto RAGConfig.search_mode)
+            filters: Filtro de metadata (ver rag/filters.py), aplicado en la consulta
             
         Returns:
             Lista de documentos con content, metadata y score
         """
         config = get_rag_config()
         min_score = min_score or config.similarity_threshold
+        mode = mode or config.search_mode
         
-        results = await self.vectorstore.search(query, top_k=top_k)
+        results = await self.vectorstore.retrieve(query, top_k=top_k, mode=mode, filter_metadata=filters)
         
         # Filtrar por score mínimo
         filtered = [
@@ -55,16 +63,20 @@ class RAGSearcher:
                 "content": r.content,
                 "metadata": r.metadata,
                 "score": r.score,
-                "chunk_id": r.chunk_id
+                "chunk_id": r.chunk_id,
+                "vector_score": r.vector_score,
+                "lexical_score": r.lexical_score
             }
             for r in results
-            if r.score >= min_score
+            if r.lexical_score is not None or (r.vector_score or 0.0) >= min_score
         ]
         
         logger.info(
             f"Búsqueda RAG completada",
             collection=self.collection,
             query=query[:50],
+            mode=mode,
+            filtered_by=list(filters) if filters else None,
             results=len(filtered),
             top_score=filtered[0]["score"] if filtered else 0
         )
@@ -75,7 +87,9 @@ class RAGSearcher:
         self,
         query: str,
         top_k: int = 5,
-        include_sources: bool = True
+        include_sources: bool = True,
+        mode: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """
         Buscar y formatear contexto para LLM
@@ -83,7 +97,7 @@ class RAGSearcher:
         Returns:
             Dict con context (texto formateado) y sources (lista de fuentes)
         """
-        results = await self.search(query, top_k=top_k)
+        results = await self.search(query, top_k=top_k, mode=mode, filters=filters)
         
         if not results:
             return {
@@ -122,7 +136,9 @@ async def quick_search(
     query: str,
     collection: str = "default",
     top_k: int = 5,
-    embedding_base_url: str = None
+    embedding_base_url: str = None,
+    mode: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None
 ) -> List[Dict[str, Any]]:
     """
     Búsqueda rápida sin crear instancia
@@ -134,4 +150,4 @@ async def quick_search(
         collection=collection,
         embedding_base_url=embedding_base_url
     )
-    return await searcher.search(query, top_k=top_k)
+    return await searcher.search(query, top_k=top_k, mode=mode, filters=filters)
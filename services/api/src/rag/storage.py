@@ -0,0 +1,689 @@
+"""
+Almacenamiento RAG compartido (pgvector)
+
+Un único servicio por proceso que:
+- Reutiliza el pool de la base de datos principal (src.db.connection).
+- Prepara el esquema (extensión, tabla e índices) una sola vez en el arranque.
+- Entrega handles ligeros por colección para insertar, buscar y borrar.
+- Escribe los chunks con COPY binario (codec pgvector registrado en el pool).
+- Escribe cada documento por lotes en rag_chunk_staging (invisible para las
+  búsquedas) y lo publica al final en una transacción corta.
+- Re-ingesta por versiones: diff por hash de chunk antes de embeber; solo se
+  cargan los chunks nuevos y los que sobran se borran al publicar.
+
+RAGVectorStore (embeddings + almacenamiento) delega aquí todo el SQL.
+"""
+
+import asyncio
+import hashlib
+import json
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import asyncpg
+import structlog
+
+from src.db.connection import get_db
+from .config import get_rag_config
+from .pgvector_codec import register_vector_codec
+from .index_manager import IndexManager
+from .filters import compile_metadata_filter
+
+logger = structlog.get_logger()
+
+
+# Configuración de full-text de la columna generada content_tsv
+TS_CONFIG = "simple"
+
+# (contenido, metadata, embedding)
+ChunkRecord = Tuple[str, Dict[str, Any], List[float]]
+# (contenido, metadata, embedding, id de un chunk existente que se reutiliza)
+ChunkWrite = Tuple[str, Optional[Dict[str, Any]], Optional[List[float]], Optional[int]]
+
+
+def content_hash(text: str) -> str:
+    """sha256 del contenido (clave de la caché de embeddings y del diff de versiones)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _decode_metadata(value: Any) -> Dict[str, Any]:
+    """asyncpg devuelve JSONB como texto si no hay codec registrado."""
+    if not value:
+        return {}
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return {}
+    return dict(value)
+
+
+def _affected_rows(status: str) -> int:
+    """Parsear "DELETE X" para obtener el count."""
+    try:
+        return int(status.split()[-1]) if status else 0
+    except (ValueError, IndexError):
+        return 0
+
+
+# Cambian en cada ingesta aunque el chunk sea el mismo: no fuerzan un UPDATE
+VOLATILE_METADATA_KEYS = ("ingested_at", "file_path")
+
+
+@dataclass
+class DocumentWriteStats:
+    """Resultado de escribir (o re-ingestar) un documento."""
+    chunk_ids: List[int] = field(default_factory=list)  # en el orden del documento
+    added: int = 0  # chunks nuevos (embebidos e insertados)
+    unchanged: int = 0  # reutilizados de la versión anterior
+    updated: int = 0  # reutilizados con metadata actualizada (p.ej. chunk_index)
+    removed: int = 0  # de la versión anterior que ya no están
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "added": self.added,
+            "unchanged": self.unchanged,
+            "updated": self.updated,
+            "removed": self.removed,
+        }
+
+
+class DocumentChangedError(RuntimeError):
+    """Un chunk reutilizado por la nueva versión ya no está en el documento."""
+
+
+class DocumentSnapshot:
+    """
+    Hashes de los chunks actuales de un documento (RAGCollection.snapshot),
+    leídos antes de embeber la nueva versión. Solo se retiene hash -> ids.
+    """
+
+    def __init__(self, existing: Dict[str, List[int]]):
+        self._existing = existing
+
+    def match(self, text: str) -> Optional[int]:
+        """
+        id de un chunk actual con el mismo contenido (que se reutiliza, así
+        que no vuelve a casar), o None si el chunk es nuevo y hay que embeberlo.
+        """
+        ids = self._existing.get(content_hash(text))
+        return ids.pop(0) if ids else None
+
+
+# Metadata de un chunk reutilizado al publicar: la nueva, salvo las claves
+# volátiles, que conservan el valor actual del chunk
+_MERGED_METADATA = "s.metadata || jsonb_strip_nulls(jsonb_build_object({}))".format(
+    ", ".join(f"'{key}', c.metadata->'{key}'" for key in VOLATILE_METADATA_KEYS)
+)
+
+
+class DocumentWriter:
+    """
+    Escritura de una versión de documento (RAGCollection.open_document).
+
+    Los lotes son ChunkWrite: (texto, metadata, embedding, id_existente).
+    Cada lote se carga con COPY en rag_chunk_staging, marcado con el
+    ingest_id de la escritura, en su propia sentencia: no se retiene ni
+    conexión ni transacción entre lotes y las búsquedas no ven nada hasta
+    que open_document publica la versión. Los chunks reutilizados
+    (id_existente) se registran sin contenido ni embedding.
+    """
+
+    def __init__(self, collection: "RAGCollection", document_id: Optional[str]):
+        self.collection = collection
+        self.document_id = document_id
+        self.ingest_id = uuid.uuid4()
+        self.stats = DocumentWriteStats()
+
+    async def write(self, batch: Sequence[ChunkWrite]) -> List[int]:
+        """Cargar un lote en staging. Devuelve los ids en el orden del lote."""
+        if not batch:
+            return []
+        new_count = sum(1 for _, _, _, existing_id in batch if existing_id is None)
+        async with self.collection.storage.acquire() as conn:
+            new_ids = iter(await self.collection._reserve_ids(conn, new_count))
+            ids: List[int] = []
+            records = []
+            for text, metadata, embedding, existing_id in batch:
+                reused = existing_id is not None
+                chunk_id = existing_id if reused else next(new_ids)
+                ids.append(chunk_id)
+                records.append((
+                    self.ingest_id,
+                    chunk_id,
+                    reused,
+                    None if reused else text,
+                    json.dumps(metadata or {}),
+                    None if reused else embedding,
+                    content_hash(text),
+                ))
+            await conn.copy_records_to_table(
+                "rag_chunk_staging",
+                columns=["ingest_id", "id", "reused", "content", "metadata", "embedding", "content_hash"],
+                records=records,
+            )
+
+        self.stats.chunk_ids.extend(ids)
+        self.stats.unchanged += len(batch) - new_count
+        return ids
+
+    async def publish(self, conn: asyncpg.Connection, replace: bool) -> DocumentWriteStats:
+        """
+        Dentro de la transacción de publicación: insertar los chunks nuevos,
+        actualizar la metadata de los reutilizados que cambie y, con replace,
+        borrar los de la versión anterior que no se han reutilizado.
+        """
+        name, document_id = self.collection.name, self.document_id
+        if replace:
+            missing = await conn.fetchval("""
+                SELECT COUNT(*) FROM rag_chunk_staging s
+                WHERE s.ingest_id = $1 AND s.reused AND NOT EXISTS (
+                    SELECT 1 FROM rag_chunks c
+                    WHERE c.id = s.id AND c.collection = $2 AND c.document_id = $3
+                )
+            """, self.ingest_id, name, document_id)
+            if missing:
+                raise DocumentChangedError(
+                    f"El documento '{document_id}' ha cambiado durante la ingesta "
+                    f"({missing} chunks reutilizados ya no existen)"
+                )
+            self.stats.removed = _affected_rows(await conn.execute("""
+                DELETE FROM rag_chunks c
+                WHERE c.collection = $2 AND c.document_id = $3 AND NOT EXISTS (
+                    SELECT 1 FROM rag_chunk_staging s
+                    WHERE s.ingest_id = $1 AND s.reused AND s.id = c.id
+                )
+            """, self.ingest_id, name, document_id))
+        self.stats.updated = _affected_rows(await conn.execute(f"""
+            UPDATE rag_chunks c
+            SET metadata = {_MERGED_METADATA}, content_hash = s.content_hash
+            FROM rag_chunk_staging s
+            WHERE s.ingest_id = $1 AND s.reused AND c.id = s.id
+              AND (c.content_hash IS NULL OR c.metadata IS DISTINCT FROM {_MERGED_METADATA})
+        """, self.ingest_id))
+        self.stats.added = _affected_rows(await conn.execute("""
+            INSERT INTO rag_chunks (id, collection, document_id, content, metadata, embedding, content_hash)
+            SELECT id, $2, $3, content, metadata, embedding, content_hash
+            FROM rag_chunk_staging
+            WHERE ingest_id = $1 AND NOT reused
+        """, self.ingest_id, name, document_id))
+        await conn.execute("DELETE FROM rag_chunk_staging WHERE ingest_id = $1", self.ingest_id)
+        return self.stats
+
+    async def discard(self) -> None:
+        """Borrar lo cargado en staging (escritura abortada)."""
+        async with self.collection.storage.acquire() as conn:
+            await conn.execute("DELETE FROM rag_chunk_staging WHERE ingest_id = $1", self.ingest_id)
+
+
+class RAGCollection:
+    """Handle de una colección sobre el almacenamiento compartido."""
+
+    def __init__(self, storage: "RAGStorage", name: str):
+        self.storage = storage
+        self.name = name
+
+    async def add_chunks(
+        self,
+        texts: List[str],
+        metadatas: List[Dict],
+        embeddings: List[List[float]],
+        document_id: Optional[str] = None,
+    ) -> List[int]:
+        """Insertar chunks ya embebidos. Devuelve los ids en el orden de entrada."""
+        async def _single_batch():
+            yield list(zip(texts, metadatas, embeddings))
+
+        return await self.add_chunk_batches(_single_batch(), document_id=document_id)
+
+    async def add_chunk_batches(
+        self,
+        batches: AsyncIterable[Sequence[ChunkRecord]],
+        document_id: Optional[str] = None,
+    ) -> List[int]:
+        """
+        Cargar lotes (texto, metadata, embedding) con COPY binario y
+        publicarlos juntos (open_document). Los lotes se consumen según
+        llegan, así que el llamador puede generarlos (y embeberlos) de forma
+        incremental.
+
+        Returns:
+            ids de los chunks en el orden de entrada.
+        """
+        async with self.open_document(document_id) as writer:
+            async for batch in batches:
+                await writer.write([(text, metadata, embedding, None) for text, metadata, embedding in batch])
+        return writer.stats.chunk_ids
+
+    async def snapshot(self, document_id: str) -> DocumentSnapshot:
+        """Hashes de los chunks actuales del documento (lectura corta, sin transacción)."""
+        await self.storage.ensure_schema()
+        async with self.storage.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT
+                    id,
+                    COALESCE(content_hash, encode(sha256(convert_to(content, 'UTF8')), 'hex')) AS digest
+                FROM rag_chunks
+                WHERE collection = $1 AND document_id = $2
+                ORDER BY id
+            """, self.name, document_id)
+        existing: Dict[str, List[int]] = {}
+        for row in rows:
+            existing.setdefault(row["digest"], []).append(row["id"])
+        return DocumentSnapshot(existing)
+
+    @asynccontextmanager
+    async def open_document(
+        self,
+        document_id: Optional[str],
+        replace: bool = False,
+    ) -> AsyncIterator["DocumentWriter"]:
+        """
+        Escritura de una versión de documento.
+
+        Los lotes de writer.write van a staging según llegan; al salir sin
+        error se publican en una transacción corta (y se incrementa la
+        versión de la colección). Con replace (requiere document_id) la
+        escritura es la nueva versión del documento: se bloquea el documento
+        y se borran los chunks que la nueva versión no ha reutilizado. Las
+        búsquedas ven la versión anterior hasta el commit.
+
+        Si hay un error, lo cargado en staging se descarta.
+        """
+        replace = replace and document_id is not None
+        await self.storage.ensure_schema()
+        writer = DocumentWriter(self, document_id)
+        try:
+            yield writer
+            async with self.storage.acquire() as conn:
+                async with conn.transaction():
+                    if replace:
+                        # Re-ingestas concurrentes del mismo documento se serializan
+                        await conn.execute(
+                            "SELECT pg_advisory_xact_lock(hashtext($1))",
+                            f"rag_document:{self.name}:{document_id}",
+                        )
+                    stats = await writer.publish(conn, replace)
+                    if stats.added or stats.updated or stats.removed:
+                        await self.storage.bump_generation(conn, self.name)
+        except BaseException:
+            try:
+                await writer.discard()
+            except Exception as e:
+                # Las filas huérfanas se purgan en ensure_schema
+                logger.warning("No se pudo descartar el staging de la ingesta", error=str(e))
+            raise
+        if stats.added:
+            self.storage.index.note_inserted(stats.added)
+
+    @staticmethod
+    async def _reserve_ids(conn: asyncpg.Connection, count: int) -> List[int]:
+        """COPY no tiene RETURNING: los ids de los chunks nuevos se reservan antes."""
+        if not count:
+            return []
+        rows = await conn.fetch(
+            "SELECT nextval(pg_get_serial_sequence('rag_chunks', 'id')) AS id "
+            "FROM generate_series(1, $1)",
+            count,
+        )
+        return sorted(row["id"] for row in rows)
+
+    async def search(
+        self,
+        query_embedding: List[float],
+        top_k: int = 5,
+        filter_metadata: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Búsqueda por similitud coseno (1 - distancia coseno), vía el índice
+        ANN si está activo. `filter_metadata` (DSL de rag/filters.py) se
+        aplica dentro de la consulta.
+        """
+        await self.storage.ensure_schema()
+        async with self.storage.acquire() as conn:
+            async with conn.transaction():
+                plan = await self.storage.index.prepare_search(conn, top_k, filter_metadata)
+                rows = await conn.fetch(plan.sql, *plan.args(query_embedding, self.name, top_k))
+        return [
+            {
+                "id": row["id"],
+                "content": row["content"],
+                "metadata": _decode_metadata(row["metadata"]),
+                "score": float(row["score"]),
+            }
+            for row in rows
+        ]
+
+    async def lexical_search(
+        self,
+        query: str,
+        limit: int = 5,
+        filter_metadata: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Búsqueda léxica (full-text) sobre content_tsv.
+
+        Cualquier término de la query puede casar (OR) y se ordena por
+        ts_rank_cd; `all_terms` indica si el chunk contiene todos los términos.
+        El diccionario 'simple' no aplica stemming, así que códigos de
+        transacción, referencias y siglas casan de forma exacta.
+        """
+        compiled = compile_metadata_filter(filter_metadata, first_param=4)
+        await self.storage.ensure_schema()
+        if not self.storage.lexical_enabled:
+            # hybrid_search sigue solo con la vía vectorial
+            raise RuntimeError(
+                "Búsqueda léxica no disponible: falta rag_chunks.content_tsv "
+                "(database/init/14-rag-hybrid-search.sql)"
+            )
+        async with self.storage.acquire() as conn:
+            rows = await conn.fetch(f"""
+                WITH q AS (
+                    SELECT
+                        replace(plainto_tsquery('{TS_CONFIG}', $1)::text, ' & ', ' | ')::tsquery AS any_terms,
+                        plainto_tsquery('{TS_CONFIG}', $1) AS all_terms,
+                        cardinality(tsvector_to_array(to_tsvector('{TS_CONFIG}', $1))) AS term_count
+                )
+                SELECT
+                    c.id,
+                    c.content,
+                    c.metadata,
+                    ts_rank_cd(c.content_tsv, q.any_terms, 32) AS rank,
+                    c.content_tsv @@ q.all_terms AS all_terms,
+                    q.term_count
+                FROM rag_chunks c, q
+                WHERE c.collection = $2 AND c.content_tsv @@ q.any_terms{compiled.clause()}
+                ORDER BY rank DESC, c.id
+                LIMIT $3
+            """, query, self.name, limit, *compiled.args)
+        return [
+            {
+                "id": row["id"],
+                "content": row["content"],
+                "metadata": _decode_metadata(row["metadata"]),
+                "score": float(row["rank"]),
+                "all_terms": row["all_terms"],
+                "term_count": row["term_count"],
+            }
+            for row in rows
+        ]
+
+    async def delete_by_document(self, document_id: str) -> int:
+        await self.storage.ensure_schema()
+        async with self.storage.acquire() as conn:
+            async with conn.transaction():
+                result = await conn.execute("""
+                    DELETE FROM rag_chunks
+                    WHERE collection = $1 AND document_id = $2
+                """, self.name, document_id)
+                if _affected_rows(result):
+                    await self.storage.bump_generation(conn, self.name)
+        return _affected_rows(result)
+
+    async def delete_all(self) -> int:
+        await self.storage.ensure_schema()
+        async with self.storage.acquire() as conn:
+            async with conn.transaction():
+                result = await conn.execute("""
+                    DELETE FROM rag_chunks WHERE collection = $1
+                """, self.name)
+                if _affected_rows(result):
+                    await self.storage.bump_generation(conn, self.name)
+        return _affected_rows(result)
+
+    async def stats(self) -> Dict[str, Any]:
+        await self.storage.ensure_schema()
+        async with self.storage.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT
+                    COUNT(*) as total_chunks,
+                    COUNT(DISTINCT document_id) as total_documents,
+                    MIN(created_at) as oldest_chunk,
+                    MAX(created_at) as newest_chunk
+                FROM rag_chunks
+                WHERE collection = $1
+            """, self.name)
+        return {
+            "collection": self.name,
+            "total_chunks": row["total_chunks"],
+            "total_documents": row["total_documents"],
+            "oldest_chunk": row["oldest_chunk"].isoformat() if row["oldest_chunk"] else None,
+            "newest_chunk": row["newest_chunk"].isoformat() if row["newest_chunk"] else None,
+        }
+
+
+class RAGStorage:
+    """Servicio de almacenamiento RAG compartido por todo el proceso."""
+
+    def __init__(self):
+        self._schema_ready = False
+        self._lock = asyncio.Lock()
+        self._collections: Dict[str, RAGCollection] = {}
+        self.index = IndexManager(self)
+        # content_tsv presente (lo decide ensure_schema)
+        self.lexical_enabled = False
+        self._gin_task: Optional[asyncio.Task] = None
+        # Codec binario de `vector` en todas las conexiones del pool principal
+        get_db().add_connection_initializer(register_vector_codec)
+
+    async def pool(self) -> asyncpg.Pool:
+        """Pool de la BD principal (se conecta si aún no lo está, p.ej. en scripts)."""
+        db = get_db()
+        if db._pool is None:
+            await db.connect()
+        return db.pool
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[asyncpg.Connection]:
+        pool = await self.pool()
+        async with pool.acquire() as conn:
+            yield conn
+
+    def collection(self, name: str) -> RAGCollection:
+        handle = self._collections.get(name)
+        if handle is None:
+            handle = self._collections[name] = RAGCollection(self, name)
+        return handle
+
+    async def generation(self, name: str) -> int:
+        """Versión de la colección (invalida la caché de resultados en todas las réplicas)."""
+        await self.ensure_schema()
+        async with self.acquire() as conn:
+            version = await conn.fetchval(
+                "SELECT version FROM rag_collection_versions WHERE collection = $1", name
+            )
+        return version or 0
+
+    @staticmethod
+    async def bump_generation(conn: asyncpg.Connection, name: str) -> int:
+        """Llamado dentro de la transacción de cada escritura en la colección."""
+        return await conn.fetchval("""
+            INSERT INTO rag_collection_versions (collection, version) VALUES ($1, 1)
+            ON CONFLICT (collection) DO UPDATE
+            SET version = rag_collection_versions.version + 1, updated_at = NOW()
+            RETURNING version
+        """, name)
+
+    async def ensure_schema(self) -> None:
+        """Crear extensión, tabla e índices (una vez por proceso)."""
+        if self._schema_ready:
+            return
+        async with self._lock:
+            if self._schema_ready:
+                return
+            async with self.acquire() as conn:
+                await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+                # En una tabla nueva las columnas generadas no cuestan nada
+                await conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS rag_chunks (
+                        id SERIAL PRIMARY KEY,
+                        collection VARCHAR(255) NOT NULL,
+                        document_id VARCHAR(255),
+                        content TEXT NOT NULL,
+                        metadata JSONB DEFAULT '{{}}',
+                        embedding vector(4096),
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        content_hash CHAR(64),
+                        content_tsv tsvector
+                            GENERATED ALWAYS AS (to_tsvector('{TS_CONFIG}', content)) STORED
+                    )
+                """)
+                # Hash del contenido para re-ingestas incrementales (NULL en filas antiguas)
+                await conn.execute("""
+                    ALTER TABLE rag_chunks ADD COLUMN IF NOT EXISTS content_hash CHAR(64)
+                """)
+                await conn.execute("""
+                    CREATE INDEX IF NOT EXISTS rag_chunks_collection_idx
+                    ON rag_chunks (collection)
+                """)
+                await conn.execute("""
+                    CREATE INDEX IF NOT EXISTS rag_chunks_collection_document_idx
+                    ON rag_chunks (collection, document_id)
+                """)
+                # Búsqueda léxica (híbrida): añadir content_tsv a una tabla
+                # existente la reescribe entera con ACCESS EXCLUSIVE, así que
+                # no se hace en el arranque (database/init/14-rag-hybrid-search.sql)
+                self.lexical_enabled = bool(await conn.fetchval("""
+                    SELECT 1 FROM pg_attribute
+                    WHERE attrelid = 'rag_chunks'::regclass
+                      AND attname = 'content_tsv' AND NOT attisdropped
+                """))
+                if not self.lexical_enabled:
+                    logger.warning(
+                        "rag_chunks sin content_tsv: búsqueda léxica desactivada "
+                        "hasta aplicar database/init/14-rag-hybrid-search.sql"
+                    )
+                # Caché de embeddings por contenido (rag/embedding_cache.py)
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS rag_embedding_cache (
+                        model VARCHAR(255) NOT NULL,
+                        content_hash CHAR(64) NOT NULL,
+                        embedding REAL[] NOT NULL,
+                        created_at TIMESTAMPTZ DEFAULT NOW(),
+                        PRIMARY KEY (model, content_hash)
+                    )
+                """)
+                # Versiones de documento en curso de escritura (DocumentWriter).
+                # UNLOGGED: es transitoria y se reescribe en rag_chunks al publicar
+                await conn.execute("""
+                    CREATE UNLOGGED TABLE IF NOT EXISTS rag_chunk_staging (
+                        ingest_id UUID NOT NULL,
+                        id INTEGER NOT NULL,
+                        reused BOOLEAN NOT NULL DEFAULT FALSE,
+                        content TEXT,
+                        metadata JSONB,
+                        embedding vector(4096),
+                        content_hash CHAR(64) NOT NULL,
+                        created_at TIMESTAMPTZ DEFAULT NOW()
+                    )
+                """)
+                await conn.execute("""
+                    CREATE INDEX IF NOT EXISTS rag_chunk_staging_ingest_idx
+                    ON rag_chunk_staging (ingest_id)
+                """)
+                # Restos de ingestas interrumpidas (caída del proceso)
+                await conn.execute("""
+                    DELETE FROM rag_chunk_staging WHERE created_at < NOW() - INTERVAL '1 day'
+                """)
+                # Versión por colección (rag/search_cache.py)
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS rag_collection_versions (
+                        collection VARCHAR(255) PRIMARY KEY,
+                        version BIGINT NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMPTZ DEFAULT NOW()
+                    )
+                """)
+                # Estado del índice ANN (rag/index_manager.py)
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS rag_index_state (
+                        index_name VARCHAR(255) PRIMARY KEY,
+                        spec JSONB NOT NULL,
+                        rows_at_build BIGINT DEFAULT 0,
+                        lists INTEGER,
+                        built_at TIMESTAMPTZ,
+                        last_error TEXT
+                    )
+                """)
+            # Las conexiones abiertas antes de existir la extensión no tienen
+            # el codec: se renuevan al devolverse al pool
+            await (await self.pool()).expire_connections()
+            self._schema_ready = True
+            logger.info("Tabla rag_chunks verificada/creada")
+        # Índice ANN: se activa si ya existe y se construye/revisa en segundo plano
+        await self.index.load()
+        self.index.schedule()
+        if self._gin_task is None:
+            self._gin_task = asyncio.create_task(self._ensure_gin_indexes())
+
+    async def stop(self) -> None:
+        """Cancelar las tareas de índices en segundo plano (al apagar, antes de cerrar el pool)."""
+        await self.index.stop()
+        if self._gin_task is not None:
+            self._gin_task.cancel()
+            try:
+                await self._gin_task
+            except asyncio.CancelledError:
+                pass
+            self._gin_task = None
+
+    async def _ensure_gin_indexes(self) -> None:
+        """
+        Índices GIN (full-text y metadata) con CREATE INDEX CONCURRENTLY, en
+        segundo plano y fuera de transacción: no bloquean las escrituras.
+        Un build interrumpido deja el índice inválido; se borra y se repite.
+        """
+        indexes = {"rag_chunks_metadata_idx": "USING GIN (metadata jsonb_path_ops)"}
+        if self.lexical_enabled:
+            indexes["rag_chunks_content_tsv_idx"] = "USING GIN (content_tsv)"
+        try:
+            async with self.acquire() as conn:
+                # Una sola réplica construye a la vez
+                if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", "rag_chunks_gin"):
+                    return
+                try:
+                    for name, definition in indexes.items():
+                        valid = await conn.fetchval("""
+                            SELECT i.indisvalid
+                            FROM pg_index i
+                            JOIN pg_class c ON c.oid = i.indexrelid
+                            WHERE c.relname = $1
+                        """, name)
+                        if valid:
+                            continue
+                        if valid is False:
+                            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                        logger.info("Construyendo índice RAG", index=name)
+                        await conn.execute(
+                            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON rag_chunks {definition}",
+                            timeout=get_rag_config().index_build_timeout,
+                        )
+                finally:
+                    await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", "rag_chunks_gin")
+        except Exception as e:
+            logger.warning(f"No se pudieron crear los índices GIN de rag_chunks: {e}")
+
+    async def list_collections(self) -> List[Dict[str, Any]]:
+        await self.ensure_schema()
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT
+                    collection,
+                    COUNT(*) as total_chunks,
+                    COUNT(DISTINCT document_id) as total_documents
+                FROM rag_chunks
+                GROUP BY collection
+                ORDER BY collection
+            """)
+        return [
+            {
+                "name": row["collection"],
+                "total_chunks": row["total_chunks"],
+                "total_documents": row["total_documents"],
+            }
+            for row in rows
+        ]
+
+
+rag_storage = RAGStorage()
@@ -2,17 +2,20 @@
 Vector Store con pgvector
 """
 
-from typing import List, Optional, Dict, Any
-import asyncpg
+import asyncio
+from array import array
+from typing import Any, AsyncIterable, Callable, Dict, List, Optional, Tuple
 import structlog
 from dataclasses import dataclass
 
 from .embeddings import OllamaEmbeddings
 from .config import get_rag_config
-from src.config import get_settings
+from .storage import ChunkWrite, DocumentWriteStats, rag_storage
+from .embedding_cache import embedding_cache
+from .filters import compile_metadata_filter
+from .search_cache import search_cache
 
 logger = structlog.get_logger()
-settings = get_settings()
 
 
 @dataclass
@@ -22,10 +25,15 @@ class SearchResult:
     metadata: Dict[str, Any]
     score: float
     chunk_id: int
+    vector_score: Optional[float] = None  # similitud coseno
+    lexical_score: Optional[float] = None  # ts_rank_cd normalizado
+
+
+SEARCH_MODES = ("vector", "lexical", "hybrid")
 
 
 class RAGVectorStore:
-    """Vector store usando pgvector directamente"""
+    """Vector store usando pgvector (embeddings + almacenamiento compartido)"""
     
     def __init__(
         self,
@@ -41,99 +49,129 @@ class RAGVectorStore:
             model=embedding_model or config.embedding_model
         )
         
-        self._pool: Optional[asyncpg.Pool] = None
-    
-    async def _get_pool(self) -> asyncpg.Pool:
-        """Obtener o crear pool de conexiones"""
-        if self._pool is None:
-            self._pool = await asyncpg.create_pool(
-                settings.database_url.replace("+psycopg2", ""),
-                min_size=1,
-                max_size=10
-            )
-        return self._pool
+        # Handle ligero: el pool y el esquema son compartidos por el proceso
+        self.store = rag_storage.collection(collection)
     
     async def ensure_table(self):
-        """Asegurar que la tabla de vectores existe"""
-        pool = await self._get_pool()
-        
-        async with pool.acquire() as conn:
-            # Crear extensión pgvector si no existe
-            await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
-            
-            # Crear tabla para chunks
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS rag_chunks (
-                    id SERIAL PRIMARY KEY,
-                    collection VARCHAR(255) NOT NULL,
-                    document_id VARCHAR(255),
-                    content TEXT NOT NULL,
-                    metadata JSONB DEFAULT '{}',
-                    embedding vector(4096),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Crear índice IVFFlat para búsqueda (soporta hasta 16000 dims)
-            # Nota: HNSW solo soporta 2000 dims, IVFFlat soporta más
-            try:
-                # Primero verificar si hay datos para crear el índice
-                count = await conn.fetchval("SELECT COUNT(*) FROM rag_chunks")
-                if count > 0:
-                    await conn.execute("""
-                        CREATE INDEX IF NOT EXISTS rag_chunks_embedding_idx 
-                        ON rag_chunks 
-                        USING ivfflat (embedding vector_cosine_ops)
-                        WITH (lists = 100)
-                    """)
-            except Exception as e:
-                # Ignorar error si el índice ya existe o no hay suficientes filas
-                logger.warning(f"No se pudo crear índice ivfflat: {e}")
-            
-            # Índice para filtrar por colección
-            await conn.execute("""
-                CREATE INDEX IF NOT EXISTS rag_chunks_collection_idx 
-                ON rag_chunks (collection)
-            """)
-            
-            logger.info("Tabla rag_chunks verificada/creada")
+        """Asegurar que la tabla de vectores existe (solo la primera vez por proceso)"""
+        await rag_storage.ensure_schema()
     
     async def add_documents(
         self,
         texts: List[str],
         metadatas: Optional[List[Dict]] = None,
-        document_id: str = None
+        document_id: str = None,
+        replace: bool = False
     ) -> List[int]:
-        """Añadir documentos al vector store"""
-        await self.ensure_table()
-        
+        """
+        Añadir documentos al vector store. Con replace=True los chunks son
+        la nueva versión del documento (ver add_document_stream).
+        """
         if metadatas is None:
             metadatas = [{}] * len(texts)
         
-        # Generar embeddings
         logger.info(f"Generando embeddings para {len(texts)} chunks...")
-        embeddings = await self.embeddings.aembed_documents(texts)
-        
-        pool = await self._get_pool()
-        chunk_ids = []
-        
-        async with pool.acquire() as conn:
-            for text, metadata, embedding in zip(texts, metadatas, embeddings):
-                # Serializar metadata a JSON string
-                import json
-                metadata_json = json.dumps(metadata) if metadata else '{}'
-                
-                # Insertar chunk
-                chunk_id = await conn.fetchval("""
-                    INSERT INTO rag_chunks (collection, document_id, content, metadata, embedding)
-                    VALUES ($1, $2, $3, $4::jsonb, $5)
-                    RETURNING id
-                """, self.collection, document_id, text, metadata_json, str(embedding))
-                
-                chunk_ids.append(chunk_id)
-        
-        logger.info(f"Añadidos {len(chunk_ids)} chunks a colección '{self.collection}'")
-        return chunk_ids
+        
+        async def _chunks():
+            for item in zip(texts, metadatas):
+                yield item
+        
+        stats = await self.add_document_stream(_chunks(), document_id=document_id, replace=replace)
+        
+        logger.info(f"Añadidos {stats.added} chunks a colección '{self.collection}'", **stats.to_dict())
+        return stats.chunk_ids
+    
+    async def add_document_stream(
+        self,
+        chunks: AsyncIterable[Tuple[str, Dict]],
+        document_id: str = None,
+        on_progress: Optional[Callable[[str, int], None]] = None,
+        replace: bool = False
+    ) -> DocumentWriteStats:
+        """
+        Embeber y escribir chunks (texto, metadata) según llegan.
+        
+        Dos etapas concurrentes unidas por una cola acotada
+        (RAGConfig.ingest_write_queue lotes de RAGConfig.write_batch_size):
+        mientras se escribe un lote se embebe el siguiente. Ninguna etapa
+        retiene una conexión mientras espera a la otra (la caché de
+        embeddings usa el pool por su cuenta). Cada lote se carga en staging
+        en cuanto está embebido y el documento se publica al final en una
+        transacción corta (RAGCollection.open_document), así que la memoria
+        no crece con el documento: solo hash -> id de la versión anterior y
+        los ids escritos.
+        
+        Con replace=True (re-ingesta de document_id) solo se embeben y
+        cargan los chunks cuyo contenido no existía ya en el documento; los
+        que sobran de la versión anterior se borran al publicar. Si otra
+        re-ingesta ha borrado entretanto un chunk reutilizado, se aborta con
+        DocumentChangedError. Una versión nueva sin ningún chunk se rechaza
+        (ValueError) en lugar de vaciar el documento.
+        
+        on_progress(etapa, n) se llama con ("embedded", n), ("unchanged", n)
+        y ("written", n) por cada lote.
+        """
+        config = get_rag_config()
+        batch_size = max(1, config.write_batch_size)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, config.ingest_write_queue))
+        replace = replace and document_id is not None
+        
+        def _notify(stage: str, count: int) -> None:
+            if on_progress is not None and count:
+                on_progress(stage, count)
+        
+        async def _embed(batch: List[ChunkWrite]) -> List[ChunkWrite]:
+            pending = [i for i, (_, _, _, existing_id) in enumerate(batch) if existing_id is None]
+            if pending:
+                # Reutilizando los embeddings ya calculados para el mismo texto
+                embeddings = await embedding_cache.embed_documents(
+                    self.embeddings, [batch[i][0] for i in pending]
+                )
+                for i, embedding in zip(pending, embeddings):
+                    text, metadata, _, _ = batch[i]
+                    batch[i] = (text, metadata, array("f", embedding), None)
+            _notify("embedded", len(pending))
+            _notify("unchanged", len(batch) - len(pending))
+            return batch
+        
+        async def _embed_stage():
+            try:
+                snapshot = await self.store.snapshot(document_id) if replace else None
+                batch: List[ChunkWrite] = []
+                async for text, metadata in chunks:
+                    existing_id = snapshot.match(text) if snapshot is not None else None
+                    batch.append((text, metadata, None, existing_id))
+                    if len(batch) >= batch_size:
+                        await queue.put(await _embed(batch))
+                        batch = []
+                if batch:
+                    await queue.put(await _embed(batch))
+                await queue.put(None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # El escritor la relanza: el staging se descarta
+                await queue.put(e)
+        
+        async with self.store.open_document(document_id, replace=replace) as writer:
+            embed_task = asyncio.create_task(_embed_stage())
+            try:
+                while True:
+                    batch = await queue.get()
+                    if batch is None:
+                        break
+                    if isinstance(batch, Exception):
+                        raise batch
+                    await writer.write(batch)
+                    _notify("written", len(batch))
+                if replace and not writer.stats.chunk_ids:
+                    raise ValueError("El documento está vacío o no se pudo extraer texto")
+            finally:
+                if not embed_task.done():
+                    embed_task.cancel()
+                await asyncio.gather(embed_task, return_exceptions=True)
+        
+        return writer.stats
     
     async def search(
         self,
@@ -141,92 +179,210 @@ class RAGVectorStore:
         top_k: int = 5,
         filter_metadata: Optional[Dict] = None
     ) -> List[SearchResult]:
-        """Buscar documentos similares"""
-        await self.ensure_table()
-        
+        """Buscar documentos similares (filter_metadata: DSL de rag/filters.py)"""
         # Generar embedding de la query
-        query_embedding = await self.embeddings.aembed_query(query)
-        
-        pool = await self._get_pool()
-        
-        async with pool.acquire() as conn:
-            # Búsqueda por similitud coseno
-            # 1 - distancia coseno = similitud coseno
-            results = await conn.fetch("""
-                SELECT 
-                    id,
-                    content,
-                    metadata,
-                    1 - (embedding <=> $1::vector) as score
-                FROM rag_chunks
-                WHERE collection = $2
-                ORDER BY embedding <=> $1::vector
-                LIMIT $3
-            """, str(query_embedding), self.collection, top_k)
+        query_embedding = await embedding_cache.embed_query(self.embeddings, query)
+        
+        rows = await self.store.search(query_embedding, top_k=top_k, filter_metadata=filter_metadata)
         
         return [
             SearchResult(
                 content=row["content"],
-                metadata=row["metadata"] or {},
-                score=float(row["score"]),
-                chunk_id=row["id"]
+                metadata=row["metadata"],
+                score=row["score"],
+                chunk_id=row["id"],
+                vector_score=row["score"]
             )
-            for row in results
+            for row in rows
         ]
     
-    async def delete_by_document(self, document_id: str) -> int:
-        """Eliminar chunks de un documento"""
-        pool = await self._get_pool()
+    async def lexical_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_metadata: Optional[Dict] = None
+    ) -> List[SearchResult]:
+        """Buscar por coincidencia de términos (full-text)"""
+        rows = await self.store.lexical_search(query, limit=top_k, filter_metadata=filter_metadata)
+        return [self._lexical_result(row) for row in rows]
+    
+    @staticmethod
+    def _lexical_result(row: Dict[str, Any]) -> SearchResult:
+        return SearchResult(
+            content=row["content"],
+            metadata=row["metadata"],
+            score=row["score"],
+            chunk_id=row["id"],
+            lexical_score=row["score"]
+        )
+    
+    async def hybrid_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_metadata: Optional[Dict] = None
+    ) -> List[SearchResult]:
+        """
+        Búsqueda léxica y vectorial en paralelo, fusionadas con Reciprocal
+        Rank Fusion (pesos por colección en RAGConfig).
+        
+        Si la vía léxica ya es concluyente (query corta con suficientes
+        chunks que contienen todos sus términos) se cancela la vectorial,
+        que es la cara: embedding de la query + búsqueda ANN.
+        """
+        config = get_rag_config()
+        candidates = top_k * max(1, config.hybrid_candidates_factor)
         
-        async with pool.acquire() as conn:
-            result = await conn.execute("""
-                DELETE FROM rag_chunks
-                WHERE collection = $1 AND document_id = $2
-            """, self.collection, document_id)
+        lexical_task = asyncio.create_task(
+            self.store.lexical_search(query, limit=candidates, filter_metadata=filter_metadata)
+        )
+        vector_task = asyncio.create_task(
+            self.search(query, top_k=candidates, filter_metadata=filter_metadata)
+        )
+        try:
+            try:
+                lexical_rows = await lexical_task
+            except Exception as e:
+                logger.warning(f"Búsqueda léxica fallida, solo vectorial: {e}")
+                lexical_rows = []
             
-            # Parsear "DELETE X" para obtener el count
-            count = int(result.split()[-1]) if result else 0
-            logger.info(f"Eliminados {count} chunks del documento {document_id}")
-            return count
+            if self._lexical_is_conclusive(lexical_rows, top_k, config):
+                logger.info(
+                    "Búsqueda híbrida resuelta por la vía léxica",
+                    collection=self.collection,
+                    hits=len(lexical_rows)
+                )
+                return [self._lexical_result(row) for row in lexical_rows[:top_k]]
+            
+            try:
+                vector_results = await vector_task
+            except Exception as e:
+                if not lexical_rows:
+                    raise
+                logger.warning(f"Búsqueda vectorial fallida, solo léxica: {e}")
+                vector_results = []
+        finally:
+            if not vector_task.done():
+                vector_task.cancel()
+                await asyncio.gather(vector_task, return_exceptions=True)
+        
+        lexical_weight, vector_weight = config.hybrid_weights(self.collection)
+        return self._fuse(
+            [self._lexical_result(row) for row in lexical_rows],
+            vector_results,
+            lexical_weight,
+            vector_weight,
+            config.rrf_k,
+            top_k
+        )
+    
+    @staticmethod
+    def _lexical_is_conclusive(rows: List[Dict[str, Any]], top_k: int, config) -> bool:
+        if not rows or config.lexical_short_circuit_max_terms <= 0:
+            return False
+        if rows[0]["term_count"] > config.lexical_short_circuit_max_terms:
+            return False
+        full_matches = sum(1 for row in rows if row["all_terms"])
+        return full_matches >= min(top_k, config.lexical_short_circuit_min_hits)
+    
+    @staticmethod
+    def _fuse(
+        lexical: List[SearchResult],
+        vector: List[SearchResult],
+        lexical_weight: float,
+        vector_weight: float,
+        k: int,
+        top_k: int
+    ) -> List[SearchResult]:
+        """Reciprocal Rank Fusion: score = sum(w / (k + rank)), normalizado a [0, 1]"""
+        fused: Dict[int, SearchResult] = {}
+        scores: Dict[int, float] = {}
+        for results, weight in ((lexical, lexical_weight), (vector, vector_weight)):
+            for rank, result in enumerate(results, start=1):
+                scores[result.chunk_id] = scores.get(result.chunk_id, 0.0) + weight / (k + rank)
+                existing = fused.get(result.chunk_id)
+                if existing is None:
+                    fused[result.chunk_id] = result
+                else:
+                    existing.vector_score = existing.vector_score if result.vector_score is None else result.vector_score
+                    existing.lexical_score = existing.lexical_score if result.lexical_score is None else result.lexical_score
+        
+        # Máximo posible: primero en ambas listas
+        best = (lexical_weight + vector_weight) / (k + 1) or 1.0
+        ranked = sorted(fused.values(), key=lambda r: scores[r.chunk_id], reverse=True)[:top_k]
+        for result in ranked:
+            result.score = scores[result.chunk_id] / best
+        return ranked
+    
+    async def retrieve(
+        self,
+        query: str,
+        top_k: int = 5,
+        mode: Optional[str] = None,
+        filter_metadata: Optional[Dict] = None
+    ) -> List[SearchResult]:
+        """
+        Búsqueda en el modo indicado (por defecto RAGConfig.search_mode),
+        servida desde la caché de resultados mientras la colección no cambie.
+        """
+        config = get_rag_config()
+        mode = mode or config.search_mode
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Modo de búsqueda no soportado: {mode}. Opciones: {', '.join(SEARCH_MODES)}")
+        # Validar el filtro antes de embeber la query (FilterError)
+        compile_metadata_filter(filter_metadata, first_param=1)
+        
+        key = None
+        if config.search_cache_ttl > 0:
+            # Generación leída antes de buscar (ver rag/search_cache.py)
+            key = search_cache.make_key(
+                self.collection,
+                await rag_storage.generation(self.collection),
+                self.embeddings.model,
+                mode,
+                query,
+                top_k,
+                filter_metadata
+            )
+            cached = search_cache.get(key)
+            if cached is not None:
+                return cached
+        
+        if mode == "hybrid":
+            results = await self.hybrid_search(query, top_k=top_k, filter_metadata=filter_metadata)
+        elif mode == "lexical":
+            results = await self.lexical_search(query, top_k=top_k, filter_metadata=filter_metadata)
+        else:
+            results = await self.search(query, top_k=top_k, filter_metadata=filter_metadata)
+        
+        if key is not None:
+            search_cache.set(key, results, ttl=config.search_cache_ttl)
+        return results
+    
+    async def delete_by_document(self, document_id: str) -> int:
+        """Eliminar chunks de un documento"""
+        count = await self.store.delete_by_document(document_id)
+        logger.info(f"Eliminados {count} chunks del documento {document_id}")
+        return count
     
     async def delete_collection(self) -> int:
         """Eliminar toda una colección"""
-        pool = await self._get_pool()
-        
-        async with pool.acquire() as conn:
-            result = await conn.execute("""
-                DELETE FROM rag_chunks WHERE collection = $1
-            """, self.collection)
-            
-            count = int(result.split()[-1]) if result else 0
-            logger.info(f"Eliminada colección '{self.collection}' ({count} chunks)")
-            return count
+        count = await self.store.delete_all()
+        logger.info(f"Eliminada colección '{self.collection}' ({count} chunks)")
+        return count
     
     async def get_stats(self) -> Dict[str, Any]:
         """Obtener estadísticas de la colección"""
-        pool = await self._get_pool()
-        
-        async with pool.acquire() as conn:
-            stats = await conn.fetchrow("""
-                SELECT 
-                    COUNT(*) as total_chunks,
-                    COUNT(DISTINCT document_id) as total_documents,
-                    MIN(created_at) as oldest_chunk,
-                    MAX(created_at) as newest_chunk
-                FROM rag_chunks
-                WHERE collection = $1
-            """, self.collection)
-        
-        return {
-            "collection": self.collection,
-            "total_chunks": stats["total_chunks"],
-            "total_documents": stats["total_documents"],
-            "oldest_chunk": stats["oldest_chunk"].isoformat() if stats["oldest_chunk"] else None,
-            "newest_chunk": stats["newest_chunk"].isoformat() if stats["newest_chunk"] else None
-        }
+        return await self.store.stats()
+    
+    async def get_collection_stats(self) -> Dict[str, Any]:
+        """Alias de get_stats (usado por la tool rag_get_collection_stats)"""
+        return await self.get_stats()
+    
+    async def list_collections(self) -> List[str]:
+        """Nombres de las colecciones existentes"""
+        return [c["name"] for c in await rag_storage.list_collections()]
     
     async def close(self):
-        """Cerrar conexiones"""
-        if self._pool:
-            await self._pool.close()
-            self._pool = None
+        """El pool es compartido: no hay conexiones propias que cerrar"""
+        return None
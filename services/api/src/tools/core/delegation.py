@@ -181,8 +181,12 @@ async def delegate(
         )
 
         from src.engine.chains.adaptive.prompts import _date_context
-        system_content = subagent.system_prompt + (subagent.get_skills_for_prompt() or "") + _date_context()
-        messages: list[dict] = [{"role": "system", "content": system_content}]
+        system_content = subagent.system_prompt + (subagent.get_skills_for_prompt() or "")
+        # Prefijo estable (cacheable) + fecha en un mensaje aparte
+        messages: list[dict] = [
+            {"role": "system", "content": system_content},
+            {"role": "system", "content": _date_context().strip()},
+        ]
         if _session_id:
             memory = subagent._load_memory(
                 _session_id,
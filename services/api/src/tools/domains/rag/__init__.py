@@ -17,19 +17,36 @@ async def rag_search(
     query: str,
     collection: str = "default",
     top_k: int = 5,
-    min_score: float = 0.5
+    min_score: float = 0.5,
+    mode: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    source: Optional[str] = None,
+    file_type: Optional[List[str]] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Busca información relevante en documentos indexados usando RAG.
     
-    Esta herramienta realiza búsqueda semántica en el knowledge base,
-    recuperando los chunks de documentos más relevantes para la query.
+    Busca por similitud semántica en el knowledge base (y, con mode
+    "hybrid" o "lexical", también por términos), recuperando los chunks de
+    documentos más relevantes para la query.
     
     Args:
         query: Pregunta o consulta de búsqueda
         collection: Colección de documentos a buscar (default: "default")
         top_k: Número máximo de resultados (default: 5)
-        min_score: Score mínimo de similitud (0.0-1.0, default: 0.5)
+        min_score: Similitud vectorial mínima (0.0-1.0, default: 0.5). En modo
+            "hybrid" o "lexical" los chunks que casan por términos se devuelven
+            aunque su similitud sea menor; su `score` es el de la fusión RRF
+            (ranking, no similitud) y no se compara con min_score
+        mode: "vector", "hybrid" o "lexical" (default: configuración RAG, vector)
+        filters: Filtro de metadata, p.ej. {"department": "legal"} o
+            {"file_type": {"$in": ["pdf", "docx"]}} (ver src/rag/filters.py)
+        source: Limitar a un documento fuente (metadata.source)
+        file_type: Limitar a estos tipos de fichero ("pdf", ".xlsx"...)
+        date_from: Fecha de ingesta mínima (ISO-8601, inclusiva)
+        date_to: Fecha de ingesta máxima (ISO-8601, exclusiva)
     
     Returns:
         Dict con:
@@ -43,6 +60,8 @@ async def rag_search(
         >>> await rag_search("¿Qué es la transformación digital?")
         >>> await rag_search("Política de privacidad", collection="legal", top_k=3)
         >>> await rag_search("API endpoints", collection="docs", min_score=0.7)
+        >>> await rag_search("ERR_CONN_RESET", mode="lexical")
+        >>> await rag_search("vacaciones", collection="rrhh", file_type=["pdf"], date_from="2024-01-01")
     """
     
     logger.info(
@@ -50,19 +69,30 @@ async def rag_search(
         query=query[:100],
         collection=collection,
         top_k=top_k,
-        min_score=min_score
+        min_score=min_score,
+        mode=mode
     )
     
     try:
         from src.rag.searcher import RAGSearcher
+        from src.rag.filters import build_metadata_filter
         
         searcher = RAGSearcher(collection=collection)
+        metadata_filter = build_metadata_filter(
+            filters,
+            source=source,
+            file_type=[file_type] if isinstance(file_type, str) else file_type,
+            date_from=date_from,
+            date_to=date_to
+        )
         
         # Realizar búsqueda
         results = await searcher.search(
             query=query,
             top_k=top_k,
-            min_score=min_score
+            min_score=min_score,
+            mode=mode,
+            filters=metadata_filter
         )
         
         if not results:
@@ -312,13 +342,19 @@ Casos de uso:
 - Verificar hechos basándose en documentos oficiales
 - Recuperar contexto relevante para análisis
 
-La búsqueda usa embeddings y similitud de coseno para encontrar los chunks más relevantes.
+Por defecto la búsqueda es semántica (similitud de embeddings). Con mode="hybrid" combina
+además la coincidencia de términos (útil para identificadores, códigos de error o nombres
+propios) y fusiona ambos rankings; mode="lexical" busca solo por términos.
 
 Args:
     query: Pregunta o consulta de búsqueda
     collection: Colección de documentos (default: "default")
     top_k: Número de resultados (default: 5)
-    min_score: Score mínimo de relevancia 0.0-1.0 (default: 0.5)
+    min_score: Similitud semántica mínima 0.0-1.0 (default: 0.5); en hybrid/lexical no descarta
+        los fragmentos que coinciden por términos
+    mode: vector | hybrid | lexical (default: vector)
+    source / file_type / date_from / date_to: acotar por documento, tipo de fichero o fecha de ingesta
+    filters: filtro de metadata libre, p.ej. {"department": "legal"} o {"chunk_index": {"$lte": 2}}
 
 Returns:
     Documentos relevantes con su contenido, metadatos (fuente, autor, etc.) y score de relevancia.
@@ -345,10 +381,37 @@ Returns:
                 },
                 "min_score": {
                     "type": "number",
-                    "description": "Score mínimo de similitud (0.0-1.0)",
+                    "description": "Similitud semántica mínima (0.0-1.0); en hybrid/lexical no descarta coincidencias por términos",
                     "default": 0.5,
                     "minimum": 0.0,
                     "maximum": 1.0
+                },
+                "mode": {
+                    "type": "string",
+                    "description": "Tipo de búsqueda: vector (solo semántica), hybrid (semántica + términos) o lexical (solo términos exactos)",
+                    "enum": ["vector", "hybrid", "lexical"],
+                    "default": "vector"
+                },
+                "source": {
+                    "type": "string",
+                    "description": "Buscar solo en este documento fuente (nombre de fichero, metadata.source)"
+                },
+                "file_type": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Buscar solo en estos tipos de fichero, p.ej. [\"pdf\", \"docx\"]"
+                },
+                "date_from": {
+                    "type": "string",
+                    "description": "Fecha de ingesta mínima, ISO-8601 (inclusiva), p.ej. 2024-01-01"
+                },
+                "date_to": {
+                    "type": "string",
+                    "description": "Fecha de ingesta máxima, ISO-8601 (exclusiva)"
+                },
+                "filters": {
+                    "type": "object",
+                    "description": "Filtro de metadata: {clave: valor}, {clave: [v1, v2]} o {clave: {\"$gte\": x, \"$lt\": y}}. Las claves se combinan con AND."
                 }
             },
             "required": ["query"]
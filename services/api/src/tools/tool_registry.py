@@ -65,10 +65,14 @@ class ToolRegistry:
     def __init__(self):
         self.tools: Dict[str, ToolDefinition] = {}
         self._core_registered = False
+        # Schemas para el LLM por selección de tools. Se reutilizan entre
+        # llamadas para que el prefijo del prompt sea byte a byte idéntico.
+        self._schema_cache: Dict[Any, List[Dict[str, Any]]] = {}
     
     def register(self, tool: ToolDefinition) -> None:
         """Registra una herramienta"""
         self.tools[tool.id] = tool
+        self._schema_cache.clear()
         logger.debug(f"Tool registrada: {tool.id}")
     
     def register_core_tool(
@@ -135,12 +139,14 @@ class ToolRegistry:
                 if not tool:
                     continue
                 props = tool.parameters.get("properties", {})
-                if "agent" in props:
+                if "agent" in props and props["agent"].get("enum") != ids:
                     props["agent"]["enum"] = ids
+                    self._schema_cache.clear()
                 tasks_items = (props.get("tasks", {}).get("items", {})
                                .get("properties", {}).get("agent"))
-                if tasks_items:
+                if tasks_items and tasks_items.get("enum") != ids:
                     tasks_items["enum"] = ids
+                    self._schema_cache.clear()
         except Exception:
             pass
 
@@ -156,12 +162,19 @@ class ToolRegistry:
         """
         self._refresh_delegation_enums()
 
+        cache_key = tuple(tool_ids) if tool_ids else None
+        cached = self._schema_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
         if tool_ids:
             tools = [self.tools[tid] for tid in tool_ids if tid in self.tools]
         else:
             tools = list(self.tools.values())
         
-        return [tool.to_function_schema() for tool in tools]
+        schemas = [tool.to_function_schema() for tool in tools]
+        self._schema_cache[cache_key] = schemas
+        return list(schemas)
 
     # IDs de tools para el Adaptive Agent (sin consult_team_member)
     ADAPTIVE_TOOL_IDS = [
@@ -0,0 +1,157 @@
+"""
+Tests del coalescing de chat completions (openai_compat/coalescing.py)
+"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src.openai_compat import coalescing
+from src.openai_compat.coalescing import ChatCoalescer
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    values = SimpleNamespace(
+        chat_coalescing_enabled=True,
+        chat_coalescing_completed_ttl=30.0,
+        chat_coalescing_orphan_grace=10.0,
+    )
+    monkeypatch.setattr(coalescing, "get_settings", lambda: values)
+    return values
+
+
+class CountingProducer:
+    """Factory de generadores SSE que cuenta cuántas ejecuciones se lanzan."""
+
+    def __init__(self, chunks, delay: float = 0.0):
+        self.chunks = chunks
+        self.delay = delay
+        self.runs = 0
+
+    def __call__(self):
+        self.runs += 1
+        return self._generate()
+
+    async def _generate(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(self.delay)
+            yield chunk
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+OK_CHUNKS = ['data: {"choices": [{"delta": {"content": "hola"}}]}\n\n', "data: [DONE]\n\n"]
+ERROR_CHUNKS = [
+    'data: {"choices": [{"delta": {"content": "parcial"}}]}\n\n',
+    f"data: {json.dumps({'error': {'message': 'boom', 'type': 'internal_error'}})}\n\n",
+    "data: [DONE]\n\n",
+]
+
+
+class TestStreamCoalescing:
+    """Tests de ChatCoalescer.stream"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_streams_share_one_execution(self):
+        coalescer = ChatCoalescer()
+        producer = CountingProducer(OK_CHUNKS, delay=0.01)
+
+        results = await asyncio.gather(
+            _collect(coalescer.stream("k", producer)),
+            _collect(coalescer.stream("k", producer)),
+        )
+
+        assert producer.runs == 1
+        assert results[0] == results[1] == OK_CHUNKS
+
+    @pytest.mark.asyncio
+    async def test_completed_stream_is_replayed_to_retries(self):
+        coalescer = ChatCoalescer()
+        producer = CountingProducer(OK_CHUNKS)
+
+        await _collect(coalescer.stream("k", producer))
+        await asyncio.sleep(0)
+        replay = await _collect(coalescer.stream("k", producer))
+
+        assert producer.runs == 1
+        assert replay == OK_CHUNKS
+
+    @pytest.mark.asyncio
+    async def test_error_chunk_is_not_replayed(self):
+        coalescer = ChatCoalescer()
+        failing = CountingProducer(ERROR_CHUNKS)
+
+        first = await _collect(coalescer.stream("k", failing))
+        await asyncio.sleep(0)
+        retry = CountingProducer(OK_CHUNKS)
+        second = await _collect(coalescer.stream("k", retry))
+
+        assert first == ERROR_CHUNKS
+        assert retry.runs == 1
+        assert second == OK_CHUNKS
+
+    @pytest.mark.asyncio
+    async def test_completed_window_disabled(self, settings):
+        settings.chat_coalescing_completed_ttl = 0
+        coalescer = ChatCoalescer()
+        producer = CountingProducer(OK_CHUNKS)
+
+        await _collect(coalescer.stream("k", producer))
+        await asyncio.sleep(0)
+        await _collect(coalescer.stream("k", producer))
+
+        assert producer.runs == 2
+
+    def test_error_chunk_detection(self):
+        assert coalescing._is_error_chunk(ERROR_CHUNKS[1])
+        assert not coalescing._is_error_chunk(OK_CHUNKS[0])
+        assert not coalescing._is_error_chunk('data: {"choices": [{"delta": {"content": "\\"error\\""}}]}\n\n')
+
+
+class TestRunCoalescing:
+    """Tests de ChatCoalescer.run (sin streaming)"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_runs_share_result(self):
+        coalescer = ChatCoalescer()
+        calls = 0
+
+        async def factory():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"answer": 42}
+
+        results = await asyncio.gather(coalescer.run("k", factory), coalescer.run("k", factory))
+
+        assert calls == 1
+        assert results == [{"answer": 42}, {"answer": 42}]
+
+    @pytest.mark.asyncio
+    async def test_failed_run_is_not_cached(self):
+        coalescer = ChatCoalescer()
+
+        async def failing():
+            raise RuntimeError("boom")
+
+        async def working():
+            return "ok"
+
+        with pytest.raises(RuntimeError):
+            await coalescer.run("k", failing)
+        assert await coalescer.run("k", working) == "ok"
+
+    @pytest.mark.asyncio
+    async def test_no_key_runs_directly(self):
+        coalescer = ChatCoalescer()
+        producer = CountingProducer(OK_CHUNKS)
+
+        await _collect(coalescer.stream(None, producer))
+        await _collect(coalescer.stream(None, producer))
+
+        assert producer.runs == 2
@@ -0,0 +1,134 @@
+"""
+Tests del ContextManager (adaptive/context.py): presupuesto y compactación
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src.engine.chains.adaptive import context as context_module
+from src.engine.chains.adaptive.context import COMPACTED_MARKER, ContextManager
+from src.engine.chains.token_counter import token_counter
+
+
+BIG = "dato " * 2000
+
+
+def _conversation():
+    return [
+        {"role": "system", "content": "Eres un agente. " + BIG},
+        {"role": "user", "content": "Analiza las ventas. " + BIG},
+        {"role": "assistant", "content": None, "tool_calls": [{"id": "1", "function": {"name": "bi_sales"}}]},
+        {"role": "tool", "tool_call_id": "1", "name": "bi_sales", "content": "ventas " + BIG},
+        {"role": "assistant", "content": None, "tool_calls": [{"id": "2", "function": {"name": "web_fetch"}}]},
+        {"role": "tool", "tool_call_id": "2", "name": "web_fetch", "content": "pagina " + BIG},
+        {"role": "assistant", "content": "Sigo con el informe."},
+        {"role": "tool", "tool_call_id": "3", "name": "read_file", "content": "reciente " + BIG},
+    ]
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    values = SimpleNamespace(context_token_budget=None)
+    monkeypatch.setattr(context_module, "get_settings", lambda: values)
+    return values
+
+
+class TestContextManagerFit:
+    """Tests de ContextManager.fit"""
+
+    def test_default_budget_is_a_fraction_of_the_model_window(self):
+        assert ContextManager(model="gpt-4o").budget == int(128_000 * 0.75)
+        assert ContextManager(model="unknown-model").budget is None
+
+    def test_zero_budget_disables_compaction(self, settings):
+        manager = ContextManager(model="gpt-4o", budget=0)
+        messages = _conversation()
+
+        assert manager.budget is None
+        assert manager.fit(messages) is None
+        assert messages == _conversation()
+
+        settings.context_token_budget = 0
+        assert ContextManager(model="gpt-4o").budget is None
+        assert ContextManager(model="gpt-4o", budget=8_000).budget == 8_000
+
+    def test_budget_is_capped_by_the_model_window(self, settings):
+        settings.context_token_budget = 10_000_000
+        assert ContextManager(model="qwen2.5:7b").budget == int(32_768 * 0.75)
+        assert ContextManager(model="unknown-model", budget=5_000).budget == 5_000
+
+    def test_old_tool_outputs_are_compacted_and_pinned_messages_kept(self):
+        messages = _conversation()
+        original = _conversation()
+        manager = ContextManager(model="gpt-4o", budget=8_000, keep_recent=2)
+
+        decision = manager.fit(messages)
+
+        assert decision is not None
+        assert [c["index"] for c in decision["compacted"]] == [3, 5]
+        assert messages[3]["content"].startswith(COMPACTED_MARKER)
+        assert messages[5]["content"].startswith(COMPACTED_MARKER)
+        # System prompt, primer mensaje del usuario y últimos turnos intactos
+        for index in (0, 1, 2, 4, 6, 7):
+            assert messages[index] == original[index]
+        assert decision["tokens_before"] == token_counter.count_messages(original, "gpt-4o")
+        assert decision["tokens_after"] < decision["tokens_before"]
+        assert all(c["tokens_after"] < c["tokens_before"] for c in decision["compacted"])
+
+    def test_stops_once_within_budget_and_never_recompacts(self):
+        messages = _conversation()
+        manager = ContextManager(model="gpt-4o", keep_recent=2)
+        manager.budget = manager.count(messages) - 100
+
+        decision = manager.fit(messages)
+
+        assert [c["index"] for c in decision["compacted"]] == [3]
+        assert not messages[5]["content"].startswith(COMPACTED_MARKER)
+        manager.budget = 1
+        assert [c["index"] for c in manager.fit(messages)["compacted"]] == [5]
+
+    def test_nothing_to_compact_returns_none(self):
+        messages = _conversation()[:3]
+        manager = ContextManager(model="gpt-4o", budget=10)
+
+        assert manager.fit(messages) is None
+
+
+class TestContextCompactionEvent:
+    """El executor emite context_compaction antes de llamar al LLM"""
+
+    @pytest.mark.asyncio
+    async def test_force_finish_emits_context_compaction(self, monkeypatch):
+        from src.engine.chains.adaptive import executor as executor_module
+        from src.engine.chains.adaptive.events import StreamEmitter
+        from src.engine.chains.adaptive.executor import AdaptiveExecutor
+
+        sent = []
+
+        async def fake_call_with_tools(endpoints, messages, **kwargs):
+            sent.append([dict(m) for m in messages])
+            finish = SimpleNamespace(function={"name": "finish", "arguments": json.dumps({"answer": "listo"})})
+            return SimpleNamespace(content=None, tool_calls=[finish])
+
+        monkeypatch.setattr(executor_module.llm_router, "call_with_tools", fake_call_with_tools)
+
+        executor = AdaptiveExecutor.__new__(AdaptiveExecutor)
+        executor.iteration = 2
+        executor.tool_results = []
+        executor.final_answer = None
+        executor.endpoints = ["primary"]
+        executor.prompt_cache_key = None
+        executor.stream_emitter = StreamEmitter("exec-1")
+        executor.context_manager = ContextManager(model="gpt-4o", budget=8_000, keep_recent=2)
+
+        events = [event async for event in executor.force_finish(_conversation(), tools=[])]
+
+        compaction = [e for e in events if e.event_type == "context_compaction"]
+        assert len(compaction) == 1
+        assert compaction[0].node_id == "context_2"
+        assert [c["index"] for c in compaction[0].data["compacted"]] == [3, 5]
+        # El LLM recibe ya la lista compactada
+        assert sent[0][3]["content"].startswith(COMPACTED_MARKER)
+        assert executor.final_answer == "listo"
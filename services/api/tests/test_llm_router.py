@@ -0,0 +1,203 @@
+"""
+Tests del LLMRouter (failover, circuit breaker y hedging)
+"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src.engine.chains import llm_router as router_module
+from src.engine.chains.llm_router import HEDGE_MIN_SAMPLES, LLMEndpoint, LLMRouter, resolve_chain_endpoints
+from src.engine.chains.llm_utils import LLMConfigError, LLMProviderError
+
+
+PRIMARY = LLMEndpoint("openai", "http://primary", "model-a")
+BACKUP = LLMEndpoint("openai", "http://backup", "model-b")
+THIRD = LLMEndpoint("openai", "http://third", "model-c")
+
+
+class FakeEndpoints:
+    """call(endpoint) programable: latencia y error por endpoint."""
+
+    def __init__(self, delays=None, errors=None):
+        self.delays = delays or {}
+        self.errors = errors or {}
+        self.calls = []
+
+    async def __call__(self, endpoint: LLMEndpoint):
+        self.calls.append(endpoint)
+        await asyncio.sleep(self.delays.get(endpoint, 0))
+        if endpoint in self.errors:
+            raise self.errors[endpoint]
+        return f"ok:{endpoint.model}"
+
+
+def _with_latency_history(router: LLMRouter, endpoint: LLMEndpoint, latency_ms: float) -> None:
+    """Histórico suficiente para que el router haga hedge sobre `endpoint`."""
+    for _ in range(HEDGE_MIN_SAMPLES):
+        router.health(endpoint).record_success(latency_ms)
+
+
+class TestLLMRouterCall:
+    """Tests de LLMRouter.call"""
+
+    @pytest.mark.asyncio
+    async def test_failover_to_backup_without_history(self):
+        router = LLMRouter()
+        fake = FakeEndpoints(errors={PRIMARY: LLMProviderError("boom", status_code=503)})
+
+        result = await router.call([PRIMARY, BACKUP], fake, hedge_percentile=0.95)
+
+        assert result == "ok:model-b"
+        assert fake.calls == [PRIMARY, BACKUP]
+        assert router.failovers == 1
+
+    @pytest.mark.asyncio
+    async def test_fast_failure_before_hedge_delay_still_fails_over(self):
+        router = LLMRouter()
+        _with_latency_history(router, PRIMARY, latency_ms=200)
+        fake = FakeEndpoints(errors={PRIMARY: LLMProviderError("connection refused")})
+
+        result = await router.call([PRIMARY, BACKUP], fake, hedge_percentile=0.95)
+
+        assert result == "ok:model-b"
+        assert fake.calls == [PRIMARY, BACKUP]
+        assert router.hedges == 0
+        assert router.failovers == 1
+
+    @pytest.mark.asyncio
+    async def test_slow_primary_is_hedged_and_backup_wins(self):
+        router = LLMRouter()
+        _with_latency_history(router, PRIMARY, latency_ms=10)
+        fake = FakeEndpoints(delays={PRIMARY: 1.0})
+
+        result = await router.call([PRIMARY, BACKUP], fake, hedge_percentile=0.95)
+
+        assert result == "ok:model-b"
+        assert router.hedges == 1
+        assert router.hedge_wins == 1
+
+    @pytest.mark.asyncio
+    async def test_hedged_pair_failing_moves_to_next_endpoint(self):
+        router = LLMRouter()
+        _with_latency_history(router, PRIMARY, latency_ms=10)
+        fake = FakeEndpoints(
+            delays={PRIMARY: 0.05},
+            errors={
+                PRIMARY: LLMProviderError("timeout", status_code=504),
+                BACKUP: LLMProviderError("overloaded", status_code=529),
+            },
+        )
+
+        result = await router.call([PRIMARY, BACKUP, THIRD], fake, hedge_percentile=0.95)
+
+        assert result == "ok:model-c"
+        assert fake.calls == [PRIMARY, BACKUP, THIRD]
+
+    @pytest.mark.asyncio
+    async def test_non_retryable_error_is_raised_without_failover(self):
+        router = LLMRouter()
+        fake = FakeEndpoints(errors={PRIMARY: LLMProviderError("bad request", status_code=400)})
+
+        with pytest.raises(LLMProviderError):
+            await router.call([PRIMARY, BACKUP], fake)
+
+        assert fake.calls == [PRIMARY]
+        assert router.health(PRIMARY).total_failures == 0
+
+    @pytest.mark.asyncio
+    async def test_missing_api_key_fails_over(self):
+        router = LLMRouter()
+        fake = FakeEndpoints(errors={PRIMARY: LLMConfigError("API key requerida para openai")})
+
+        assert await router.call([PRIMARY, BACKUP], fake) == "ok:model-b"
+        assert fake.calls == [PRIMARY, BACKUP]
+
+    @pytest.mark.asyncio
+    async def test_other_value_errors_do_not_fail_over(self):
+        router = LLMRouter()
+        error = json.JSONDecodeError("Expecting value", "", 0)
+        fake = FakeEndpoints(errors={PRIMARY: error})
+
+        with pytest.raises(json.JSONDecodeError):
+            await router.call([PRIMARY, BACKUP], fake)
+
+        assert fake.calls == [PRIMARY]
+        assert router.health(PRIMARY).total_failures == 0
+
+    @pytest.mark.asyncio
+    async def test_open_circuit_moves_endpoint_to_the_end(self):
+        router = LLMRouter()
+        for _ in range(5):
+            router.health(PRIMARY).record_failure("down")
+        fake = FakeEndpoints()
+
+        result = await router.call([PRIMARY, BACKUP], fake)
+
+        assert router.health(PRIMARY).state == "open"
+        assert result == "ok:model-b"
+        assert fake.calls == [BACKUP]
+
+
+class TestResolveChainEndpoints:
+    """Fallbacks de ChainConfig.llm_fallbacks"""
+
+    @pytest.fixture
+    def providers(self, monkeypatch):
+        from src.db.repositories.llm_providers import LLMProviderRepository
+
+        rows = {
+            "local-2": SimpleNamespace(name="local-2", type="ollama", base_url="http://ollama-2", default_model="qwen3", api_key=None, is_active=True),
+            "cloud": SimpleNamespace(name="cloud", type="openai", base_url="https://api.openai.com/v1", default_model="gpt-4o", api_key="sk", is_active=True),
+            "gemini": SimpleNamespace(name="gemini", type="gemini", base_url="https://gemini", default_model="gemini-2.0-flash", api_key="k", is_active=True),
+        }
+
+        async def get_by_name(name):
+            return rows.get(name)
+
+        monkeypatch.setattr(LLMProviderRepository, "get_by_name", staticmethod(get_by_name))
+        return rows
+
+    @pytest.mark.asyncio
+    async def test_fallbacks_of_another_provider_family_are_rejected(self, providers):
+        primary = LLMEndpoint("ollama", "http://ollama", "qwen3")
+
+        endpoints = await resolve_chain_endpoints(
+            primary,
+            [{"provider_name": "cloud"}, {"provider_name": "gemini"}, {"provider_name": "local-2"}],
+        )
+
+        assert [e.provider_type for e in endpoints] == ["ollama", "ollama"]
+        assert endpoints[1].llm_url == "http://ollama-2"
+
+    @pytest.mark.asyncio
+    async def test_failover_mid_tool_loop_keeps_the_history_format(self, providers, monkeypatch):
+        primary = LLMEndpoint("ollama", "http://ollama", "qwen3")
+        endpoints = await resolve_chain_endpoints(
+            primary, [{"provider_name": "cloud"}, {"provider_name": "local-2"}]
+        )
+        # Segundo turno del bucle: historial de tools en formato Ollama
+        messages = [
+            {"role": "user", "content": "Ventas de marzo"},
+            {"role": "tool", "content": json.dumps({"total": 10})},
+        ]
+        sent = []
+
+        async def fake_call_llm_with_tools(**kwargs):
+            sent.append((kwargs["provider_type"], kwargs["llm_url"], kwargs["messages"]))
+            if kwargs["llm_url"] == primary.llm_url:
+                raise LLMProviderError("overloaded", status_code=503)
+            return SimpleNamespace(content="ok", tool_calls=[])
+
+        monkeypatch.setattr(router_module, "call_llm_with_tools", fake_call_llm_with_tools)
+
+        response = await LLMRouter().call_with_tools(endpoints, messages, tools=[])
+
+        assert response.content == "ok"
+        assert [(provider, url) for provider, url, _ in sent] == [
+            ("ollama", "http://ollama"),
+            ("ollama", "http://ollama-2"),
+        ]
+        assert sent[1][2] is messages
@@ -0,0 +1,66 @@
+"""
+Tests de los mensajes system en las llamadas LLM sin tools (llm_utils)
+"""
+
+import pytest
+
+from src.engine.chains import llm_utils
+
+
+MESSAGES = [
+    {"role": "system", "content": "Eres un agente de BI."},
+    {"role": "system", "content": "Fecha actual: 2025-03-01"},
+    {"role": "user", "content": "Hola"},
+]
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeClient:
+    def __init__(self, data):
+        self.data = data
+        self.payloads = []
+
+    async def post(self, url, headers=None, json=None):
+        self.payloads.append(json)
+        return FakeResponse(self.data)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = FakeClient({
+        "content": [{"text": "ok"}],
+        "candidates": [{"content": {"parts": [{"text": "ok"}]}}],
+    })
+    monkeypatch.setattr(llm_utils, "get_llm_client", lambda *args, **kwargs: fake)
+    return fake
+
+
+class TestSystemParts:
+    """Todas las partes system llegan al proveedor, en orden"""
+
+    @pytest.mark.asyncio
+    async def test_anthropic_joins_every_system_message(self, client):
+        await llm_utils._call_anthropic("claude-3-5-sonnet", MESSAGES, 0.0, None, "key")
+
+        payload = client.payloads[0]
+        assert payload["system"] == "Eres un agente de BI.\n\nFecha actual: 2025-03-01"
+        assert payload["messages"] == [{"role": "user", "content": "Hola"}]
+
+    @pytest.mark.asyncio
+    async def test_gemini_joins_every_system_message(self, client):
+        await llm_utils._call_gemini("https://gemini", "gemini-2.0-flash", MESSAGES, 0.0, None, "key")
+
+        payload = client.payloads[0]
+        assert payload["systemInstruction"] == {
+            "parts": [{"text": "Eres un agente de BI.\n\nFecha actual: 2025-03-01"}]
+        }
+        assert [c["role"] for c in payload["contents"]] == ["user"]
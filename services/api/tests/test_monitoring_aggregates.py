@@ -0,0 +1,71 @@
+"""
+Tests del coste diario en memoria (monitoring/aggregates.py)
+"""
+
+from datetime import date
+
+import pytest
+
+from src.monitoring import aggregates
+from src.monitoring.aggregates import DailyCost
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Día UTC y reloj monotónico controlados por el test."""
+    state = {"day": date(2025, 3, 1), "now": 1000.0}
+    monkeypatch.setattr(DailyCost, "_today", staticmethod(lambda: state["day"]))
+    monkeypatch.setattr(aggregates.time, "monotonic", lambda: state["now"])
+    return state
+
+
+class TestDailyCost:
+    """Tests de DailyCost.seed"""
+
+    def test_seed_replaces_the_total_instead_of_adding(self, clock):
+        cost = DailyCost()
+        cost.add(2.0)  # ya volcado a BD: el total de BD lo incluye
+        cost.seed(5.0, cost.begin_seed())
+
+        assert cost.today_usd == 5.0
+
+        cost.seed(7.5, cost.begin_seed())
+        assert cost.today_usd == 7.5
+
+    def test_costs_recorded_while_seeding_are_kept(self, clock):
+        cost = DailyCost()
+        mark = cost.begin_seed()
+        cost.add(1.5)  # registrado mientras corre la consulta
+        cost.seed(10.0, mark)
+        cost.add(0.5)
+
+        assert cost.today_usd == 12.0
+
+    def test_day_rollover_resets_and_requires_a_new_seed(self, clock):
+        cost = DailyCost()
+        cost.seed(10.0, cost.begin_seed())
+        assert not cost.needs_seed()
+
+        clock["day"] = date(2025, 3, 2)
+
+        assert cost.needs_seed()
+        assert cost.today_usd == 0.0
+        cost.seed(3.0, cost.begin_seed())
+        assert cost.today_usd == 3.0
+
+    def test_seed_started_the_previous_day_is_ignored(self, clock):
+        cost = DailyCost()
+        mark = cost.begin_seed()
+        clock["day"] = date(2025, 3, 2)
+        cost.add(1.0)
+        cost.seed(50.0, mark)
+
+        assert cost.today_usd == 1.0
+        assert not cost.seeded
+
+    def test_seed_expires(self, clock):
+        cost = DailyCost()
+        cost.seed(1.0, cost.begin_seed())
+        clock["now"] += aggregates.SEED_MAX_AGE_SECONDS + 1
+
+        assert cost.needs_seed()
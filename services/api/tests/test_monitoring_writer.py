@@ -0,0 +1,119 @@
+"""
+Tests del volcado en lote de monitorización (monitoring/writer.py)
+"""
+
+import asyncio
+
+import asyncpg
+import pytest
+
+from src.monitoring import writer as writer_module
+from src.monitoring.models import ApiMetric, ExecutionTrace
+from src.monitoring.repository import API_METRIC_COLUMNS, EXECUTION_TRACE_COLUMNS, MonitoringRepository
+from src.monitoring.writer import MonitoringWriter
+
+
+def _record(n: int) -> tuple:
+    return (n,)
+
+
+@pytest.fixture
+def copies(monkeypatch):
+    """COPY controlado por el test: cada llamada espera a `release`."""
+    state = {"written": [], "started": asyncio.Event(), "release": asyncio.Event()}
+
+    async def copy_records(table, columns, records, rollups=None):
+        state["started"].set()
+        await state["release"].wait()
+        state["written"].extend(records)
+        return len(records)
+
+    monkeypatch.setattr(writer_module.MonitoringRepository, "copy_records", staticmethod(copy_records))
+    return state
+
+
+def _writer() -> MonitoringWriter:
+    writer = MonitoringWriter()
+    writer.flush_rows = 2
+    writer._metrics.rollup = lambda batch: []
+    return writer
+
+
+class TestMonitoringWriterStop:
+    """stop() no pierde el lote que se está volcando"""
+
+    @pytest.mark.asyncio
+    async def test_stop_waits_for_the_flush_in_progress(self, copies):
+        writer = _writer()
+        for n in range(3):
+            writer._push(writer._metrics, _record(n))
+
+        await asyncio.wait_for(copies["started"].wait(), timeout=1)
+        stopping = asyncio.create_task(writer.stop())
+        await asyncio.sleep(0)
+        copies["release"].set()
+        await stopping
+
+        assert sorted(copies["written"]) == [(0,), (1,), (2,)]
+        assert writer._metrics.dropped == 0
+        assert not writer.running
+
+    @pytest.mark.asyncio
+    async def test_cancelled_copy_restores_its_batch(self, copies):
+        writer = _writer()
+        buffer = writer._metrics
+        buffer.push(_record(0))
+        buffer.push(_record(1))
+
+        flushing = asyncio.create_task(writer.flush())
+        await asyncio.wait_for(copies["started"].wait(), timeout=1)
+        flushing.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flushing
+
+        assert list(buffer.rows) == [(0,), (1,)]
+        assert buffer.dropped == 0
+
+
+class TestMonitoringWriterBadRows:
+    """Una fila que viola una restricción no bloquea el resto del buffer"""
+
+    @pytest.mark.asyncio
+    async def test_only_the_invalid_row_is_dropped(self, monkeypatch):
+        written = []
+
+        async def copy_records(table, columns, records, rollups=None):
+            if (3,) in records:
+                raise asyncpg.StringDataRightTruncationError("value too long for type character varying(255)")
+            written.extend(records)
+            return len(records)
+
+        monkeypatch.setattr(writer_module.MonitoringRepository, "copy_records", staticmethod(copy_records))
+        writer = _writer()
+        writer.flush_rows = 8
+        buffer = writer._metrics
+        for n in range(6):
+            buffer.push(_record(n))
+
+        assert await writer.flush()
+
+        assert sorted(written) == [(0,), (1,), (2,), (4,), (5,)]
+        assert buffer.dropped == 1
+        assert buffer.written == 5
+        assert not buffer.rows
+
+    def test_records_are_clipped_to_the_column_widths(self):
+        metric = ApiMetric(
+            endpoint="/workspace/files/" + "a" * 400,
+            method="GET",
+            status_code=200,
+            latency_ms=1.0,
+        )
+        trace = ExecutionTrace(execution_id="e1", chain_id="c", event_type="tool_call", node_id="n" * 150, model="m" * 150)
+
+        metric_row = dict(zip(API_METRIC_COLUMNS, MonitoringRepository.metric_record(metric)))
+        trace_row = dict(zip(EXECUTION_TRACE_COLUMNS, MonitoringRepository.trace_record(trace)))
+
+        assert len(metric_row["endpoint"]) == 255
+        assert len(trace_row["node_id"]) == 100
+        assert len(trace_row["model"]) == 100
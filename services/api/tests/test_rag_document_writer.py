@@ -0,0 +1,367 @@
+"""
+Tests de DocumentWriter (escritura e re-ingesta de documentos RAG)
+"""
+
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import pytest
+
+from src.rag import vectorstore as vectorstore_module
+from src.rag.config import RAGConfig
+from src.rag.storage import (
+    DocumentChangedError,
+    DocumentSnapshot,
+    DocumentWriteStats,
+    DocumentWriter,
+    RAGCollection,
+    RAGStorage,
+    content_hash,
+)
+from src.rag.vectorstore import RAGVectorStore
+
+
+class StubConnection:
+    """Conexión asyncpg mínima: secuencia de ids y COPY a staging en memoria."""
+
+    def __init__(self, next_id: int = 100):
+        self.next_id = next_id
+        self.copied = []
+        self.copy_columns = None
+
+    async def fetch(self, query, count):
+        assert "nextval" in query
+        rows = [{"id": self.next_id + i} for i in range(count)]
+        self.next_id += count
+        return rows
+
+    async def copy_records_to_table(self, table, columns, records):
+        assert table == "rag_chunk_staging"
+        self.copy_columns = list(columns)
+        self.copied.extend(records)
+
+    def staged(self):
+        return [dict(zip(self.copy_columns, record)) for record in self.copied]
+
+
+class VersionedConnection(StubConnection):
+    """
+    StubConnection con transacciones, rag_collection_versions y el resultado
+    de cada sentencia de publicación.
+    """
+
+    def __init__(self, added: int = 0, updated: int = 0, removed: int = 0, missing: int = 0, deleted: int = 0):
+        super().__init__()
+        self.rows = {"added": added, "updated": updated, "removed": removed, "deleted": deleted}
+        self.missing = missing
+        self.in_transaction = False
+        self.bumps = []
+        self.executed = []
+        self.discarded = 0
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.in_transaction = True
+        try:
+            yield
+        finally:
+            self.in_transaction = False
+
+    async def execute(self, query, *args):
+        query = " ".join(query.split())
+        self.executed.append((query, self.in_transaction))
+        if query.startswith("DELETE FROM rag_chunk_staging WHERE ingest_id"):
+            if not self.in_transaction:
+                self.discarded += 1
+            return "DELETE 0"
+        if query.startswith("INSERT INTO rag_chunks"):
+            return f"INSERT 0 {self.rows['added']}"
+        if query.startswith("UPDATE rag_chunks"):
+            return f"UPDATE {self.rows['updated']}"
+        if query.startswith("DELETE FROM rag_chunks c"):
+            return f"DELETE {self.rows['removed']}"
+        if query.startswith("DELETE FROM rag_chunks"):
+            return f"DELETE {self.rows['deleted']}"
+        return "SELECT 1"
+
+    async def fetchval(self, query, *args):
+        if "rag_chunk_staging" in query:
+            return self.missing
+        assert "rag_collection_versions" in query
+        self.bumps.append((args[0], self.in_transaction))
+        return len(self.bumps)
+
+    def ran(self, prefix: str) -> bool:
+        return any(query.startswith(prefix) for query, _ in self.executed)
+
+
+class StubStorage:
+    """RAGStorage mínimo sobre una única conexión."""
+
+    bump_generation = staticmethod(RAGStorage.bump_generation)
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.inserted = 0
+        self.index = type("Index", (), {"note_inserted": lambda _, rows: self._note(rows)})()
+
+    def _note(self, rows):
+        self.inserted += rows
+
+    async def ensure_schema(self):
+        pass
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+def _writer(conn):
+    collection = RAGCollection(StubStorage(conn), name="docs")
+    return DocumentWriter(collection, "doc-1")
+
+
+class TestDocumentWriter:
+    """Tests de DocumentWriter.write (carga en staging)"""
+
+    @pytest.mark.asyncio
+    async def test_new_chunks_are_staged_with_reserved_ids_and_content_hash(self):
+        conn = StubConnection()
+        writer = _writer(conn)
+
+        ids = await writer.write([
+            ("uno", {"chunk_index": 0}, [0.1, 0.2], None),
+            ("dos", {"chunk_index": 1}, [0.3, 0.4], None),
+        ])
+
+        assert ids == [100, 101]
+        rows = conn.staged()
+        assert [row["id"] for row in rows] == [100, 101]
+        assert [row["content_hash"] for row in rows] == [content_hash("uno"), content_hash("dos")]
+        assert all(row["ingest_id"] == writer.ingest_id and not row["reused"] for row in rows)
+        assert [row["embedding"] for row in rows] == [[0.1, 0.2], [0.3, 0.4]]
+        assert json.loads(rows[1]["metadata"]) == {"chunk_index": 1}
+        assert writer.stats.chunk_ids == [100, 101]
+
+    @pytest.mark.asyncio
+    async def test_reused_chunks_keep_ids_and_order_without_content(self):
+        conn = StubConnection(next_id=500)
+        writer = _writer(conn)
+
+        ids = await writer.write([
+            ("nuevo", {"chunk_index": 0}, [0.1], None),
+            ("igual", {"chunk_index": 1}, None, 7),
+            ("movido", {"chunk_index": 2}, None, 8),
+        ])
+
+        assert ids == [500, 7, 8]
+        reused = [row for row in conn.staged() if row["reused"]]
+        assert [row["id"] for row in reused] == [7, 8]
+        assert all(row["content"] is None and row["embedding"] is None for row in reused)
+        assert json.loads(reused[1]["metadata"]) == {"chunk_index": 2}
+        assert reused[1]["content_hash"] == content_hash("movido")
+        assert writer.stats.unchanged == 2
+
+    @pytest.mark.asyncio
+    async def test_empty_batch_does_not_touch_the_database(self):
+        conn = StubConnection()
+        writer = _writer(conn)
+
+        assert await writer.write([]) == []
+        assert conn.copied == [] and conn.copy_columns is None
+
+
+class TestDocumentSnapshot:
+    """Tests del diff de re-ingesta (DocumentSnapshot)"""
+
+    def test_match_reuses_each_existing_chunk_once(self):
+        snapshot = DocumentSnapshot({content_hash("texto"): [3, 5]})
+
+        assert snapshot.match("texto") == 3
+        assert snapshot.match("texto") == 5
+        assert snapshot.match("texto") is None
+
+    def test_match_is_by_content(self):
+        snapshot = DocumentSnapshot({content_hash("texto"): [3]})
+
+        assert snapshot.match("otro texto") is None
+        assert snapshot.match("texto") == 3
+
+
+class TestPublishDocument:
+    """open_document publica lo cargado en staging en una transacción corta"""
+
+    @pytest.mark.asyncio
+    async def test_publish_bumps_version_inside_the_transaction(self):
+        conn = VersionedConnection(added=1)
+        storage = StubStorage(conn)
+        collection = RAGCollection(storage, "docs")
+
+        async with collection.open_document("doc-1") as writer:
+            await writer.write([("uno", {"chunk_index": 0}, [0.1], None)])
+            assert conn.executed == []
+
+        assert conn.bumps == [("docs", True)]
+        assert all(in_transaction for _, in_transaction in conn.executed)
+        assert conn.ran("INSERT INTO rag_chunks")
+        assert conn.ran("DELETE FROM rag_chunk_staging")
+        assert not conn.ran("DELETE FROM rag_chunks c")
+        assert writer.stats.added == 1
+        assert storage.inserted == 1
+
+    @pytest.mark.asyncio
+    async def test_unchanged_document_does_not_bump(self):
+        conn = VersionedConnection()
+        collection = RAGCollection(StubStorage(conn), "docs")
+
+        async with collection.open_document("doc-1", replace=True) as writer:
+            await writer.write([("igual", {}, None, 7)])
+
+        assert conn.bumps == []
+        assert writer.stats.to_dict() == {"added": 0, "unchanged": 1, "updated": 0, "removed": 0}
+
+    @pytest.mark.asyncio
+    async def test_replace_locks_the_document_and_removes_unmatched_chunks(self):
+        conn = VersionedConnection(updated=1, removed=2)
+        collection = RAGCollection(StubStorage(conn), "docs")
+
+        async with collection.open_document("doc-1", replace=True) as writer:
+            await writer.write([("igual", {"chunk_index": 3}, None, 3)])
+
+        assert conn.ran("SELECT pg_advisory_xact_lock")
+        assert conn.ran("DELETE FROM rag_chunks c")
+        assert writer.stats.to_dict() == {"added": 0, "unchanged": 1, "updated": 1, "removed": 2}
+        assert conn.bumps == [("docs", True)]
+
+    @pytest.mark.asyncio
+    async def test_replace_rejects_a_reused_chunk_removed_meanwhile(self):
+        conn = VersionedConnection(added=1, missing=1)
+        collection = RAGCollection(StubStorage(conn), "docs")
+
+        with pytest.raises(DocumentChangedError):
+            async with collection.open_document("doc-1", replace=True) as writer:
+                await writer.write([("igual", {}, None, 3), ("nuevo", {}, [0.1], None)])
+
+        assert not conn.ran("INSERT INTO rag_chunks")
+        assert conn.bumps == []
+        assert conn.discarded == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_write_discards_the_staged_batches(self):
+        conn = VersionedConnection(added=1)
+        collection = RAGCollection(StubStorage(conn), "docs")
+
+        with pytest.raises(RuntimeError):
+            async with collection.open_document("doc-1") as writer:
+                await writer.write([("uno", {}, [0.1], None)])
+                raise RuntimeError("fallo del embedding")
+
+        assert conn.discarded == 1
+        assert not conn.ran("INSERT INTO rag_chunks")
+        assert conn.bumps == []
+
+    @pytest.mark.asyncio
+    async def test_delete_bumps_only_when_rows_are_removed(self):
+        conn = VersionedConnection(deleted=3)
+        collection = RAGCollection(StubStorage(conn), "docs")
+
+        assert await collection.delete_by_document("doc-1") == 3
+        conn.rows["deleted"] = 0
+        assert await collection.delete_all() == 0
+
+        assert conn.bumps == [("docs", True)]
+
+
+class StreamingStore:
+    """RAGCollection mínima para add_document_stream: registra cada lote escrito."""
+
+    def __init__(self, existing=None):
+        self.existing = existing or {}
+        self.batches = []
+        self.published = False
+
+    async def snapshot(self, document_id):
+        return DocumentSnapshot({content_hash(text): [chunk_id] for text, chunk_id in self.existing.items()})
+
+    @asynccontextmanager
+    async def open_document(self, document_id, replace=False):
+        store = self
+
+        class Writer:
+            stats = DocumentWriteStats()
+
+            async def write(self, batch):
+                store.batches.append(list(batch))
+                self.stats.chunk_ids.extend(existing or 0 for _, _, _, existing in batch)
+
+        yield Writer()
+        self.published = True
+
+
+class TestDocumentStream:
+    """add_document_stream escribe cada lote según se embebe"""
+
+    @pytest.fixture
+    def vectorstore(self, monkeypatch):
+        async def embed_documents(embeddings, texts):
+            return [[float(len(text))] for text in texts]
+
+        monkeypatch.setattr(vectorstore_module.embedding_cache, "embed_documents", embed_documents)
+        monkeypatch.setattr(
+            vectorstore_module, "get_rag_config", lambda: RAGConfig(write_batch_size=2, ingest_write_queue=1)
+        )
+        store = RAGVectorStore.__new__(RAGVectorStore)
+        store.collection = "docs"
+        store.embeddings = None
+        return store
+
+    @pytest.mark.asyncio
+    async def test_batches_are_written_before_the_stream_ends(self, vectorstore):
+        vectorstore.store = StreamingStore()
+        written_before_end = asyncio.Event()
+
+        async def chunks():
+            for n in range(6):
+                yield f"chunk {n}", {"chunk_index": n}
+            await asyncio.sleep(0.01)
+            if vectorstore.store.batches:
+                written_before_end.set()
+
+        stats = await vectorstore.add_document_stream(chunks(), document_id="doc-1")
+
+        assert written_before_end.is_set()
+        assert [len(batch) for batch in vectorstore.store.batches] == [2, 2, 2]
+        assert vectorstore.store.published
+        assert len(stats.chunk_ids) == 6
+
+    @pytest.mark.asyncio
+    async def test_replace_embeds_only_new_chunks(self, vectorstore):
+        vectorstore.store = StreamingStore(existing={"igual": 7})
+        progress = []
+
+        async def chunks():
+            yield "igual", {"chunk_index": 0}
+            yield "nuevo", {"chunk_index": 1}
+
+        await vectorstore.add_document_stream(
+            chunks(), document_id="doc-1", replace=True, on_progress=lambda *event: progress.append(event)
+        )
+
+        [batch] = vectorstore.store.batches
+        assert batch[0] == ("igual", {"chunk_index": 0}, None, 7)
+        assert batch[1][0] == "nuevo" and list(batch[1][2]) == [5.0] and batch[1][3] is None
+        assert progress == [("embedded", 1), ("unchanged", 1), ("written", 2)]
+
+    @pytest.mark.asyncio
+    async def test_empty_new_version_is_rejected(self, vectorstore):
+        vectorstore.store = StreamingStore(existing={"viejo": 3})
+
+        async def chunks():
+            return
+            yield
+
+        with pytest.raises(ValueError):
+            await vectorstore.add_document_stream(chunks(), document_id="doc-1", replace=True)
+
+        assert not vectorstore.store.published
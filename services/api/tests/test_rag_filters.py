@@ -0,0 +1,107 @@
+"""
+Tests del DSL de filtros de metadata RAG (rag/filters.py)
+"""
+
+import json
+
+import pytest
+
+from src.rag.filters import (
+    MAX_IN_VALUES,
+    FilterError,
+    build_metadata_filter,
+    compile_metadata_filter,
+)
+
+
+class TestCompileMetadataFilter:
+    """Tests de compile_metadata_filter"""
+
+    def test_empty_filter(self):
+        compiled = compile_metadata_filter(None, first_param=4)
+        assert not compiled
+        assert compiled.clause() == ""
+        assert compiled.args == []
+
+    def test_equalities_become_one_containment(self):
+        compiled = compile_metadata_filter(
+            {"source": "manual.pdf", "department": {"$eq": "legal"}}, first_param=4
+        )
+        assert compiled.sql == "metadata @> $4::jsonb"
+        assert json.loads(compiled.args[0]) == {"source": "manual.pdf", "department": "legal"}
+        assert compiled.clause() == " AND metadata @> $4::jsonb"
+
+    def test_in_list_is_or_of_containments_and_normalizes_file_type(self):
+        compiled = compile_metadata_filter({"file_type": ["PDF", ".docx", "pdf"]}, first_param=2)
+        assert compiled.sql == "(metadata @> $2::jsonb OR metadata @> $3::jsonb)"
+        assert [json.loads(a) for a in compiled.args] == [{"file_type": ".pdf"}, {"file_type": ".docx"}]
+
+    def test_single_value_in_is_an_equality(self):
+        compiled = compile_metadata_filter({"file_type": {"$in": ["pdf"]}}, first_param=1)
+        assert compiled.sql == "metadata @> $1::jsonb"
+        assert json.loads(compiled.args[0]) == {"file_type": ".pdf"}
+
+    def test_date_range_compares_iso_strings(self):
+        compiled = compile_metadata_filter(
+            {"ingested_at": {"$gte": "2024-01-01", "$lt": "2024-07-01"}}, first_param=5
+        )
+        assert compiled.sql == (
+            "metadata->>$5::text >= $6::text AND metadata->>$7::text < $8::text"
+        )
+        assert compiled.args == ["ingested_at", "2024-01-01", "ingested_at", "2024-07-01"]
+
+    def test_numeric_range_only_matches_numbers(self):
+        compiled = compile_metadata_filter({"chunk_index": {"$lte": 3}}, first_param=1)
+        assert "jsonb_typeof(metadata->$1::text) = 'number'" in compiled.sql
+        assert compiled.sql.endswith("<= $2::float8")
+        assert compiled.args == ["chunk_index", 3.0]
+
+    def test_equalities_come_first_and_params_are_sequential(self):
+        compiled = compile_metadata_filter(
+            {"chunk_index": {"$gt": 0}, "source": "a.pdf"}, first_param=3
+        )
+        assert compiled.sql.startswith("metadata @> $5::jsonb AND ")
+        assert len(compiled.args) == 3
+
+    def test_values_are_never_interpolated(self):
+        compiled = compile_metadata_filter({"source": "x'; DROP TABLE rag_chunks; --"}, first_param=1)
+        assert "DROP" not in compiled.sql
+
+    @pytest.mark.parametrize("filters", [
+        ["source"],
+        {"": "x"},
+        {"k" * 200: "x"},
+        {"source": {}},
+        {"source": {"$regex": "a.*"}},
+        {"source": {"$in": []}},
+        {"source": {"$in": list(range(MAX_IN_VALUES + 1))}},
+        {"source": {"nested": True}},
+        {"tags": {"$eq": ["a"]}},
+        {"ingested_at": {"$gte": "not-a-date"}},
+        {"chunk_index": {"$gt": True}},
+    ])
+    def test_invalid_filters_raise(self, filters):
+        with pytest.raises(FilterError):
+            compile_metadata_filter(filters, first_param=1)
+
+
+class TestBuildMetadataFilter:
+    """Tests de build_metadata_filter"""
+
+    def test_no_filter(self):
+        assert build_metadata_filter() is None
+
+    def test_shortcuts_are_merged(self):
+        combined = build_metadata_filter(
+            {"ingested_at": {"$gt": "2023-01-01"}, "department": "legal"},
+            source="manual.pdf",
+            file_type=["pdf"],
+            date_from="2024-01-01",
+            date_to="2024-02-01",
+        )
+        assert combined == {
+            "department": "legal",
+            "source": "manual.pdf",
+            "file_type": {"$in": ["pdf"]},
+            "ingested_at": {"$gt": "2023-01-01", "$gte": "2024-01-01", "$lt": "2024-02-01"},
+        }
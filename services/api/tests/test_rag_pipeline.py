@@ -0,0 +1,134 @@
+"""
+Tests del troceado y la extracción en streaming (rag/pipeline.py, rag/extractors.py)
+"""
+
+import queue
+import threading
+
+import pytest
+
+from src.rag import extractors
+from src.rag.extractors import pump_segments
+from src.rag.pipeline import StreamingSplitter
+
+
+class ParagraphSplitter:
+    """Splitter determinista: un chunk por párrafo."""
+
+    def split_text(self, text):
+        return [part for part in text.split("\n\n") if part.strip()]
+
+
+def _write(tmp_path, text: str) -> str:
+    path = tmp_path / "doc.txt"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+class TestStreamingSplitter:
+    """Troceado incremental de segmentos"""
+
+    def test_last_chunk_is_carried_until_flush(self):
+        splitter = StreamingSplitter(ParagraphSplitter())
+
+        assert splitter.feed("a\n\nb\n\nc", {"page": 1}) == [("a", {"page": 1}), ("b", {"page": 1})]
+        assert splitter.flush() == [("c", {"page": 1})]
+        assert splitter.flush() == []
+
+    def test_carry_joins_the_next_segment_and_keeps_its_metadata(self):
+        splitter = StreamingSplitter(ParagraphSplitter())
+
+        splitter.feed("a\n\nb", {"page": 1})
+        chunks = splitter.feed("c\n\nd", {"page": 2})
+
+        # "b" empieza en la página 1 aunque se emita al llegar la 2
+        assert chunks == [("b", {"page": 1}), ("c", {"page": 2})]
+        assert splitter.flush() == [("d", {"page": 2})]
+
+    def test_blank_segments_are_ignored(self):
+        splitter = StreamingSplitter(ParagraphSplitter())
+
+        assert splitter.feed("   \n", {"page": 1}) == []
+        assert splitter.feed("a", {"page": 2}) == []
+        assert splitter.feed("", {"page": 3}) == []
+        assert splitter.flush() == [("a", {"page": 2})]
+
+
+class TestTextExtractor:
+    """Texto plano por bloques (extractors._text)"""
+
+    def test_blocks_are_cut_at_line_boundaries(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(extractors, "TEXT_BLOCK_CHARS", 8)
+        lines = [f"línea {n}" for n in range(20)]
+        text = "\n".join(lines)
+
+        segments = [segment for segment, _ in extractors.iter_segments(_write(tmp_path, text), ".txt")]
+
+        assert len(segments) > 1
+        assert "\n".join(segments) == text
+        for segment in segments:
+            assert all(line in lines for line in segment.split("\n"))
+
+    def test_long_line_is_cut_to_bound_memory(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(extractors, "TEXT_BLOCK_CHARS", 8)
+        text = "x" * 100
+
+        segments = [segment for segment, _ in extractors.iter_segments(_write(tmp_path, text), ".txt")]
+
+        assert "".join(segments) == text
+        # Como mucho el arrastre (< 4 bloques) más un bloque leído
+        assert max(len(segment) for segment in segments) < 8 * 5
+
+    def test_trailing_text_without_newline_is_kept(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(extractors, "TEXT_BLOCK_CHARS", 8)
+        text = "primera línea\nfinal"
+
+        segments = [segment for segment, _ in extractors.iter_segments(_write(tmp_path, text), ".txt")]
+
+        assert "\n".join(segments) == text
+        assert segments[-1].endswith("final")
+
+
+class TestPumpSegments:
+    """Publicación de segmentos desde el proceso de extracción"""
+
+    def test_publishes_segments_and_done(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(extractors, "TEXT_BLOCK_CHARS", 8)
+        path = _write(tmp_path, "\n".join(f"línea {n}" for n in range(5)))
+        out: queue.Queue = queue.Queue()
+
+        count = pump_segments(path, ".txt", out, threading.Event())
+
+        messages = [out.get_nowait() for _ in range(out.qsize())]
+        assert [kind for kind, _, _ in messages] == ["segment"] * count + ["done"]
+        assert messages[-1][1] == count
+
+    def test_extraction_errors_are_published(self, tmp_path):
+        out: queue.Queue = queue.Queue()
+
+        assert pump_segments(_write(tmp_path, "x"), ".odt", out, threading.Event()) == 0
+
+        kind, error, _ = out.get_nowait()
+        assert kind == "error"
+        assert isinstance(error, ValueError)
+
+    def test_cancel_stops_a_worker_blocked_on_a_full_queue(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(extractors, "TEXT_BLOCK_CHARS", 8)
+        monkeypatch.setattr(extractors, "PUT_TIMEOUT_SECONDS", 0.01)
+        path = _write(tmp_path, "\n".join(f"línea {n}" for n in range(100)))
+        out: queue.Queue = queue.Queue(maxsize=1)
+        cancel = threading.Event()
+        result = {}
+
+        worker = threading.Thread(
+            target=lambda: result.update(count=pump_segments(path, ".txt", out, cancel))
+        )
+        worker.start()
+        assert out.get(timeout=1)[0] == "segment"
+        cancel.set()
+        worker.join(timeout=2)
+
+        assert not worker.is_alive()
+        assert result["count"] < 100
+        remaining = [out.get_nowait()[0] for _ in range(out.qsize())]
+        assert "done" not in remaining
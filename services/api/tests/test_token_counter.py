@@ -0,0 +1,75 @@
+"""
+Tests del TokenCounter (engine/chains/token_counter.py)
+"""
+
+import pytest
+
+from src.engine.chains.token_counter import TokenCounter, UsageAccumulator
+
+
+class TestTokenCounter:
+    """Tests de TokenCounter"""
+
+    @pytest.mark.parametrize("model,encoding", [
+        ("gpt-4o", "o200k_base"),
+        ("gpt-4o-mini", "o200k_base"),
+        ("openai/gpt-4.1", "o200k_base"),
+        ("o3-mini", "o200k_base"),
+        ("gpt-4-turbo", "cl100k_base"),
+        ("llama3.2", "cl100k_base"),
+    ])
+    def test_model_encoding(self, model, encoding):
+        assert TokenCounter()._encoding_name(model) == encoding
+
+    def test_gpt4o_uses_the_tokenizer_not_the_estimator(self, monkeypatch):
+        tiktoken = pytest.importorskip("tiktoken")
+        # tiktoken < 0.7.0 no conoce o200k_base (requirements.txt)
+        assert "o200k_base" in tiktoken.list_encoding_names()
+        try:
+            tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            pytest.skip(f"BPE o200k_base no descargable: {e}")
+        counter = TokenCounter()
+
+        def _no_estimate(text):
+            raise AssertionError("count_text usó el estimador por caracteres")
+
+        monkeypatch.setattr(counter, "estimate", _no_estimate)
+        tokens = counter.count_text('{"items": [1, 2, 3], "status": "ok"}', model="gpt-4o")
+
+        assert tokens > 0
+        assert "o200k_base" not in counter._failed
+
+    def test_estimator_fallback_without_tokenizer(self, monkeypatch):
+        from src.engine.chains import token_counter as module
+
+        monkeypatch.setattr(module, "tiktoken", None)
+        assert TokenCounter().count_text("x" * 40, model="gpt-4o") == 10
+
+    def test_count_messages_includes_tool_calls_and_overhead(self, monkeypatch):
+        from src.engine.chains import token_counter as module
+
+        monkeypatch.setattr(module, "tiktoken", None)
+        counter = TokenCounter()
+        messages = [
+            {"role": "user", "content": "a" * 8},
+            {"role": "assistant", "content": None, "tool_calls": [{"id": "1"}]},
+        ]
+        expected = (
+            module.TOKENS_REPLY_PRIMING + 2 * module.TOKENS_PER_MESSAGE
+            + 2 + counter.count_text([{"id": "1"}])
+        )
+        assert counter.count_messages(messages) == expected
+
+
+class TestUsageAccumulator:
+    """Tests de UsageAccumulator"""
+
+    def test_accumulates_by_model(self):
+        usage = UsageAccumulator()
+        usage.add("gpt-4o", 100, 20, cached_tokens=50)
+        usage.add("gpt-4o", 10, 5, estimated=True)
+
+        assert usage.total_tokens == 135
+        assert usage.to_dict()["estimated_calls"] == 1
+        assert usage.by_model["gpt-4o"] == {"prompt_tokens": 110, "completion_tokens": 25, "calls": 2}
@@ -0,0 +1,143 @@
+"""
+Tests del dispatcher concurrente de tool calls (adaptive/dispatcher.py)
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.engine.chains.adaptive.dispatcher import (
+    is_concurrent_safe,
+    plan_tool_batches,
+    run_concurrently,
+)
+
+
+def _call(name: str, call_id: str = ""):
+    return SimpleNamespace(id=call_id or name, function={"name": name, "arguments": "{}"})
+
+
+def _names(batches):
+    return [[tc.function["name"] for _, tc in batch] for batch in batches]
+
+
+class TestPlanToolBatches:
+    """Tests de plan_tool_batches"""
+
+    def test_consecutive_safe_tools_share_a_batch(self):
+        calls = [_call("web_search"), _call("web_fetch"), _call("bi_sales")]
+        assert _names(plan_tool_batches(calls)) == [["web_search", "web_fetch", "bi_sales"]]
+
+    def test_side_effect_tools_run_alone_and_in_order(self):
+        calls = [
+            _call("read_file", "1"),
+            _call("rag_search", "2"),
+            _call("write_file", "3"),
+            _call("web_search", "4"),
+            _call("shell", "5"),
+            _call("finish", "6"),
+        ]
+        batches = plan_tool_batches(calls)
+
+        assert _names(batches) == [
+            ["read_file", "rag_search"],
+            ["write_file"],
+            ["web_search"],
+            ["shell"],
+            ["finish"],
+        ]
+        # El orden original de tool_call_id se conserva, con su posición en el turno
+        assert [tc.id for batch in batches for _, tc in batch] == ["1", "2", "3", "4", "5", "6"]
+        assert [index for batch in batches for index, _ in batch] == [0, 1, 2, 3, 4, 5]
+
+    def test_same_tool_in_two_batches_keeps_turn_positions(self):
+        calls = [_call("web_fetch"), _call("web_fetch"), _call("write_file"), _call("web_fetch"), _call("web_fetch")]
+        batches = plan_tool_batches(calls)
+
+        assert [[index for index, _ in batch] for batch in batches] == [[0, 1], [2], [3, 4]]
+
+    def test_empty_and_unknown_tools(self):
+        assert plan_tool_batches([]) == []
+        assert _names(plan_tool_batches([_call("custom_tool"), _call("")])) == [["custom_tool"], [""]]
+
+    def test_concurrent_safe_is_case_insensitive(self):
+        assert is_concurrent_safe("WEB_SEARCH")
+        assert is_concurrent_safe("BI_report")
+        assert not is_concurrent_safe("write_file")
+        assert not is_concurrent_safe("")
+
+
+class TestRunConcurrently:
+    """Tests de run_concurrently"""
+
+    @pytest.mark.asyncio
+    async def test_respects_max_concurrency_and_reports_errors(self):
+        active = 0
+        peak = 0
+        errors = []
+
+        def runner(index: int):
+            async def _gen():
+                nonlocal active, peak
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+                if index == 2:
+                    raise RuntimeError("boom")
+                yield index
+            return _gen
+
+        async def on_error(index, error):
+            errors.append((index, str(error)))
+
+        events = [
+            event async for event in run_concurrently([runner(i) for i in range(4)], 2, on_error)
+        ]
+
+        assert sorted(events) == [0, 1, 3]
+        assert errors == [(2, "boom")]
+        assert peak == 2
+
+
+class TestExecutorToolNodeIds:
+    """node_id únicos cuando la misma tool aparece en varios lotes del turno"""
+
+    @pytest.mark.asyncio
+    async def test_same_tool_in_two_parallel_batches_gets_distinct_node_ids(self):
+        from src.engine.chains.adaptive.executor import AdaptiveExecutor
+        from src.engine.chains.adaptive.events import StreamEmitter
+
+        executor = AdaptiveExecutor.__new__(AdaptiveExecutor)
+        executor.provider_type = "openai"
+        executor.iteration = 3
+        executor.max_parallel_tools = 4
+        executor.execution_complete = False
+        executor.final_answer = None
+        executor._turn_streamed = False
+        node_ids = []
+
+        async def fake_execute_tool(tool_call, messages, available_tool_names=None, call_index=None):
+            node_ids.append(StreamEmitter.tool_node_id(tool_call.function["name"], executor.iteration, call_index))
+            messages.append({"role": "tool", "tool_call_id": tool_call.id, "content": "{}"})
+            if False:
+                yield None
+
+        executor._execute_tool = fake_execute_tool
+        calls = [
+            _call("web_fetch", "a"), _call("web_fetch", "b"),
+            _call("write_file", "c"),
+            _call("web_fetch", "d"), _call("web_fetch", "e"),
+        ]
+        response = SimpleNamespace(content=None, tool_calls=calls)
+        messages = []
+
+        async for _ in executor._process_response(response, messages, tools=[]):
+            pass
+
+        parallel = [node_id for node_id in node_ids if node_id.startswith("tool_web_fetch")]
+        assert sorted(parallel) == [
+            "tool_web_fetch_3_0", "tool_web_fetch_3_1", "tool_web_fetch_3_3", "tool_web_fetch_3_4",
+        ]
+        assert [m["tool_call_id"] for m in messages if m["role"] == "tool"] == ["a", "b", "c", "d", "e"]